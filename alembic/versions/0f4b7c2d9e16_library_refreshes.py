@@ -0,0 +1,55 @@
+"""Library refreshes
+
+Revision ID: 0f4b7c2d9e16
+Revises: 6a1d3e8f0b52
+Create Date: 2026-10-18 18:12:37.540918+00:00
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0f4b7c2d9e16"
+down_revision = "6a1d3e8f0b52"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "libraryrefreshes",
+        sa.Column("library_id", sa.Integer(), nullable=False),
+        sa.Column("last_attempt", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("last_success", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("consecutive_failures", sa.Integer(), nullable=False),
+        sa.Column("last_problem_uri", sa.Unicode(), nullable=True),
+        sa.Column("retry_after", sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["library_id"],
+            ["libraries.id"],
+        ),
+        sa.PrimaryKeyConstraint("library_id"),
+    )
+    op.create_index(
+        op.f("ix_libraryrefreshes_last_success"),
+        "libraryrefreshes",
+        ["last_success"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_libraryrefreshes_retry_after"),
+        "libraryrefreshes",
+        ["retry_after"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f("ix_libraryrefreshes_retry_after"), table_name="libraryrefreshes"
+    )
+    op.drop_index(
+        op.f("ix_libraryrefreshes_last_success"), table_name="libraryrefreshes"
+    )
+    op.drop_table("libraryrefreshes")
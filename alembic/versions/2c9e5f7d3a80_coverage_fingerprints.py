@@ -0,0 +1,38 @@
+"""Coverage fingerprints
+
+Revision ID: 2c9e5f7d3a80
+Revises: 8d2f4b6a1c37
+Create Date: 2026-10-18 15:32:08.914025+00:00
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "2c9e5f7d3a80"
+down_revision = "8d2f4b6a1c37"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "coveragefingerprints",
+        sa.Column("library_id", sa.Integer(), nullable=False),
+        sa.Column("coverage_hash", sa.Unicode(), nullable=False),
+        sa.Column(
+            "eligibility_place_ids", postgresql.ARRAY(sa.Integer()), nullable=False
+        ),
+        sa.Column("focus_place_ids", postgresql.ARRAY(sa.Integer()), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["library_id"],
+            ["libraries.id"],
+        ),
+        sa.PrimaryKeyConstraint("library_id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("coveragefingerprints")
@@ -0,0 +1,43 @@
+"""Delegated patron identifier counts
+
+Revision ID: 3b8f2d6c9a41
+Revises: c57a4d8f1e23
+Create Date: 2026-10-18 09:12:04.311873+00:00
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3b8f2d6c9a41"
+down_revision = "c57a4d8f1e23"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "delegatedpatronidentifiercounts",
+        sa.Column("library_id", sa.Integer(), nullable=False),
+        sa.Column("type", sa.String(length=255), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["library_id"],
+            ["libraries.id"],
+        ),
+        sa.PrimaryKeyConstraint("library_id", "type"),
+    )
+
+    # Start the counts off with the identifiers that already exist.
+    op.execute("""
+        INSERT INTO delegatedpatronidentifiercounts (library_id, type, count)
+        SELECT library_id, type, count(id)
+        FROM delegatedpatronidentifiers
+        WHERE library_id IS NOT NULL AND type IS NOT NULL
+        GROUP BY library_id, type
+        """)
+
+
+def downgrade() -> None:
+    op.drop_table("delegatedpatronidentifiercounts")
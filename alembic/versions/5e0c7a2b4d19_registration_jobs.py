@@ -0,0 +1,66 @@
+"""Registration jobs
+
+Revision ID: 5e0c7a2b4d19
+Revises: 3b8f2d6c9a41
+Create Date: 2026-10-18 11:40:27.502916+00:00
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5e0c7a2b4d19"
+down_revision = "3b8f2d6c9a41"
+branch_labels = None
+depends_on = None
+
+registration_status = sa.Enum(
+    "pending", "running", "succeeded", "failed", name="registration_status"
+)
+
+
+def upgrade() -> None:
+    op.create_table(
+        "registrationjobs",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("token", sa.Unicode(), nullable=False),
+        sa.Column("status", registration_status, nullable=False),
+        sa.Column("authentication_url", sa.Unicode(), nullable=False),
+        sa.Column("contact", sa.Unicode(), nullable=True),
+        sa.Column("library_stage", sa.Unicode(), nullable=True),
+        sa.Column("reset_shared_secret", sa.Boolean(), nullable=False),
+        sa.Column("library_id", sa.Integer(), nullable=True),
+        sa.Column("base_url", sa.Unicode(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("started_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("status_code", sa.Integer(), nullable=True),
+        sa.Column("media_type", sa.Unicode(), nullable=True),
+        sa.Column("response", sa.Unicode(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["library_id"],
+            ["libraries.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("token"),
+    )
+    op.create_index(
+        op.f("ix_registrationjobs_library_id"),
+        "registrationjobs",
+        ["library_id"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_registrationjobs_status"),
+        "registrationjobs",
+        ["status"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_registrationjobs_status"), table_name="registrationjobs")
+    op.drop_index(op.f("ix_registrationjobs_library_id"), table_name="registrationjobs")
+    op.drop_table("registrationjobs")
+    registration_status.drop(op.get_bind(), checkfirst=True)
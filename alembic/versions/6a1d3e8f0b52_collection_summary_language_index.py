@@ -0,0 +1,45 @@
+"""Unique collection summary per library and language
+
+Revision ID: 6a1d3e8f0b52
+Revises: 2c9e5f7d3a80
+Create Date: 2026-10-18 17:04:51.228390+00:00
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "6a1d3e8f0b52"
+down_revision = "2c9e5f7d3a80"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Collection summaries and service areas that were removed from a
+    # library used to be kept around with no library.
+    op.execute("DELETE FROM collectionsummaries WHERE library_id IS NULL")
+    op.execute("DELETE FROM serviceareas WHERE library_id IS NULL")
+
+    # Keep only the most recent summary for each library and language.
+    op.execute("""
+        DELETE FROM collectionsummaries a
+        USING collectionsummaries b
+        WHERE a.library_id = b.library_id
+        AND coalesce(a.language, '') = coalesce(b.language, '')
+        AND a.id < b.id
+        """)
+    op.create_index(
+        "ix_collectionsummaries_library_id_language",
+        "collectionsummaries",
+        ["library_id", sa.text("coalesce(language, '')")],
+        unique=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        "ix_collectionsummaries_library_id_language",
+        table_name="collectionsummaries",
+    )
@@ -0,0 +1,49 @@
+"""Document fingerprints
+
+Revision ID: 8d2f4b6a1c37
+Revises: 5e0c7a2b4d19
+Create Date: 2026-10-18 14:05:51.226704+00:00
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8d2f4b6a1c37"
+down_revision = "5e0c7a2b4d19"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "documentfingerprints",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("library_id", sa.Integer(), nullable=False),
+        sa.Column("kind", sa.Unicode(), nullable=False),
+        sa.Column("url", sa.Unicode(), nullable=False),
+        sa.Column("etag", sa.Unicode(), nullable=True),
+        sa.Column("last_modified", sa.Unicode(), nullable=True),
+        sa.Column("content_hash", sa.Unicode(), nullable=True),
+        sa.Column("checked_at", sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["library_id"],
+            ["libraries.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("library_id", "kind"),
+    )
+    op.create_index(
+        op.f("ix_documentfingerprints_library_id"),
+        "documentfingerprints",
+        ["library_id"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f("ix_documentfingerprints_library_id"), table_name="documentfingerprints"
+    )
+    op.drop_table("documentfingerprints")
@@ -29,10 +29,11 @@ from palace.registry.util.app_server import (
     returns_json_or_response_or_problem_detail,
     returns_problem_detail,
 )
-from palace.registry.util.flask_util import deprecated
+from palace.registry.util.flask_util import RegistryJSONProvider, deprecated
 from palace.registry.util.xray import PalaceXrayUtils
 
 app = Flask(__name__)
+app.json = RegistryJSONProvider(app)
 babel = Babel(app)
 
 route_links = RouteLinkRegistry()
@@ -113,6 +114,12 @@ def register():
     return app.library_registry.registry_controller.register()
 
 
+@app.route("/register/jobs/<token>")
+@returns_problem_detail
+def registration_job(token):
+    return app.library_registry.registry_controller.registration_job(token)
+
+
 @app.route("/search")
 @route_links.register(rel="search", type=OPENSEARCH_MEDIA_TYPE, production_only=True)
 @uses_location
@@ -159,6 +166,19 @@ def libraries_crawlable():
     return app.library_registry.registry_controller.libraries_opds_crawlable()
 
 
+@app.route("/libraries/changes")
+@compressible
+@returns_problem_detail
+def libraries_changes():
+    return app.library_registry.registry_controller.libraries_changes()
+
+
+@app.route("/libraries/export.ndjson")
+@returns_problem_detail
+def libraries_export():
+    return app.library_registry.registry_controller.libraries_export()
+
+
 @app.route("/admin/log_in", methods=["POST"])
 @returns_problem_detail
 def log_in():
@@ -290,6 +310,15 @@ def adobe_vendor_id_accountinfo():
         return Response("", 404)
 
 
+@app.route("/AdobeAuth/Provision", methods=["POST"])
+@returns_json_or_response_or_problem_detail
+def adobe_vendor_id_provision():
+    if app.library_registry.adobe_vendor_id:
+        return app.library_registry.adobe_vendor_id.provision_handler()
+    else:
+        return Response("", 404)
+
+
 @app.route("/AdobeAuth/Status")
 @returns_problem_detail
 def adobe_vendor_id_status():
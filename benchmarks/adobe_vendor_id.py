@@ -0,0 +1,151 @@
+"""Measure how many Adobe Vendor ID requests one core can handle.
+
+Each SignIn (standard and authData) and AccountInfo document goes
+through AdobeVendorIDRequestHandler, with lookups that answer at once,
+so the numbers only cover parsing the request and rendering the
+response. The 'generic' path is how requests used to be handled: a new
+lxml parser and uncompiled XPath for every request, and responses
+rendered from the %-format templates.
+
+No database is needed.
+
+    python benchmarks/adobe_vendor_id.py --requests 20000 --repeat 5
+"""
+
+import argparse
+import timeit
+
+import palace.registry.adobe.adobe_xml_templates as t
+from palace.registry.adobe.adobe_vendor_id import (
+    AdobeAccountInfoRequestParser,
+    AdobeSignInRequestParser,
+    AdobeVendorIDRequestHandler,
+)
+from palace.registry.util.string_helpers import base64
+
+USER = "urn:uuid:00000000-0000-0000-0000-000000000001"
+LABEL = "Delegated account ID " + USER
+
+SIGN_IN = (
+    t.SIGN_IN_REQUEST_TEMPLATE % dict(username="barcode", password="pin")
+).encode("utf8")
+AUTHDATA_SIGN_IN = (
+    t.AUTHDATA_SIGN_IN_REQUEST_TEMPLATE
+    % dict(authdata=base64.b64encode("LIBRARY|1234567890|patron|signature"))
+).encode("utf8")
+ACCOUNT_INFO = (t.ACCOUNT_INFO_REQUEST_TEMPLATE % dict(uuid=USER)).encode("utf8")
+
+
+def standard_lookup(data):
+    return USER, LABEL
+
+
+def authdata_lookup(authdata):
+    return USER, LABEL
+
+
+def urn_to_label(urn):
+    return LABEL
+
+
+class GenericParserMixin:
+    """Parse requests with the generic XMLParser methods."""
+
+    def process(self, data):
+        requests = list(
+            self.process_all(data.decode("utf8"), self.REQUEST_XPATH, self.NAMESPACES)
+        )
+        return requests[0] if requests else None
+
+    def _add(self, d, tag, key, namespaces, transform=None):
+        v = self._xpath1(tag, "adept:" + key, namespaces)
+        if v is not None:
+            v = v.text
+            if v is not None:
+                v = v.strip()
+                if callable(transform):
+                    v = transform(v)
+        d[key] = v
+
+
+class GenericSignInRequestParser(GenericParserMixin, AdobeSignInRequestParser):
+    pass
+
+
+class GenericAccountInfoRequestParser(
+    GenericParserMixin, AdobeAccountInfoRequestParser
+):
+    pass
+
+
+class FormatTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def render(self, **values):
+        return self.template % values
+
+
+class GenericRequestHandler(AdobeVendorIDRequestHandler):
+    SIGN_IN_REQUEST_PARSER = GenericSignInRequestParser
+    ACCOUNT_INFO_REQUEST_PARSER = GenericAccountInfoRequestParser
+
+    SIGN_IN_RESPONSE_TEMPLATE = FormatTemplate(t.SIGN_IN_RESPONSE_TEMPLATE)
+    ACCOUNT_INFO_RESPONSE_TEMPLATE = FormatTemplate(t.ACCOUNT_INFO_RESPONSE_TEMPLATE)
+    ERROR_RESPONSE_TEMPLATE = FormatTemplate(t.ERROR_RESPONSE_TEMPLATE)
+
+
+def workloads(handler):
+    return [
+        (
+            "SignIn (standard)",
+            lambda: handler.handle_signin_request(
+                SIGN_IN, standard_lookup, authdata_lookup
+            ),
+        ),
+        (
+            "SignIn (authData)",
+            lambda: handler.handle_signin_request(
+                AUTHDATA_SIGN_IN, standard_lookup, authdata_lookup
+            ),
+        ),
+        (
+            "AccountInfo",
+            lambda: handler.handle_accountinfo_request(ACCOUNT_INFO, urn_to_label),
+        ),
+    ]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parsed = parser.parse_args(args)
+
+    generic = workloads(GenericRequestHandler("1045"))
+    fast = workloads(AdobeVendorIDRequestHandler("1045"))
+
+    # Both paths must produce the same documents.
+    for (name, slow), (_, quick) in zip(generic, fast):
+        assert slow() == quick(), name
+
+    print(
+        f"Requests per second on one core, {parsed.requests} requests, "
+        f"best of {parsed.repeat}:"
+    )
+    for (name, slow), (_, quick) in zip(generic, fast):
+        before = rate(slow, parsed.requests, parsed.repeat)
+        after = rate(quick, parsed.requests, parsed.repeat)
+        print(
+            f"  {name:<20} generic {before:10,.0f}/s  "
+            f"fast {after:10,.0f}/s  ({after / before:.2f}x)"
+        )
+
+
+def rate(handle, requests, repeat):
+    best = min(timeit.repeat(handle, number=requests, repeat=repeat))
+    return requests / best
+
+
+if __name__ == "__main__":
+    main()
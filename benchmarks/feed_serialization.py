@@ -0,0 +1,129 @@
+"""Compare the time it takes to render a large library feed as JSON.
+
+The 'stdlib' path is how feeds used to be rendered: every entry's
+timestamps were formatted with strftime() while the entry was built, and
+the finished catalog went through json.dumps(). The other paths leave
+timestamps as datetimes and hand the catalog to one of the serializers in
+palace.registry.util.json_serializer.
+
+No database is needed; the libraries are transient Library objects.
+
+    python benchmarks/feed_serialization.py --libraries 5000 --repeat 5
+"""
+
+import argparse
+import datetime
+import json
+import sys
+import timeit
+
+# Importing the model package configures every mapper.
+import palace.registry.sqlalchemy.model  # noqa: F401
+from palace.registry.opds import OPDSCatalog
+from palace.registry.sqlalchemy.model.library import Library
+from palace.registry.util import json_serializer
+from palace.registry.util.json_serializer import JSONSerializer, OrjsonSerializer
+
+
+def make_libraries(count):
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+    return [
+        Library(
+            id=i,
+            name=f"Library {i}",
+            description=f"Public library number {i}.",
+            internal_urn=f"urn:uuid:00000000-0000-0000-0000-{i:012d}",
+            authentication_url=f"https://library{i}.example.org/authentication",
+            opds_url=f"https://library{i}.example.org/",
+            web_url=f"https://www.library{i}.example.org/",
+            logo_url=f"https://logos.example.org/{i}.png",
+            timestamp=start + datetime.timedelta(minutes=i),
+        )
+        for i in range(count)
+    ]
+
+
+def url_for(route, uuid, **kwargs):
+    return f"https://registry.example.org/library/{uuid}/{route}"
+
+
+def build_catalog(libraries):
+    return {
+        "metadata": {"title": "Libraries"},
+        "catalogs": [
+            OPDSCatalog.library_catalog(library, url_for=url_for)
+            for library in libraries
+        ],
+    }
+
+
+def format_timestamps(catalog):
+    for entry in catalog["catalogs"]:
+        metadata = entry["metadata"]
+        metadata["modified"] = metadata["updated"] = metadata["modified"].strftime(
+            OPDSCatalog.TIME_FORMAT
+        )
+    return catalog
+
+
+def render_stdlib(libraries):
+    return json.dumps(format_timestamps(build_catalog(libraries))).encode("utf8")
+
+
+def render_with(serializer):
+    def render(libraries):
+        return serializer.dumps(build_catalog(libraries))
+
+    return render
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--libraries", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parsed = parser.parse_args(args)
+
+    libraries = make_libraries(parsed.libraries)
+    paths = [
+        ("stdlib (strftime per entry)", render_stdlib),
+        ("JSONSerializer", render_with(JSONSerializer())),
+    ]
+    if json_serializer.orjson is not None:
+        paths.append(("OrjsonSerializer", render_with(OrjsonSerializer())))
+    else:
+        print("orjson is not installed; skipping OrjsonSerializer.", file=sys.stderr)
+
+    # All paths must produce the same document.
+    expected = json.loads(render_stdlib(libraries))
+    for name, render in paths:
+        assert json.loads(render(libraries)) == expected, name
+
+    print(f"Rendering a feed of {parsed.libraries} libraries, best of {parsed.repeat}:")
+    report(paths, lambda render: render(libraries), parsed.repeat)
+
+    # Leave out the cost of building the entries. The stdlib path gets a
+    # catalog whose timestamps were already formatted, as they used to be.
+    catalog = build_catalog(libraries)
+    formatted_catalog = format_timestamps(build_catalog(libraries))
+    serialize_paths = [
+        ("stdlib (strftime per entry)", lambda: json.dumps(formatted_catalog)),
+        ("JSONSerializer", lambda: JSONSerializer().dumps(catalog)),
+    ]
+    if json_serializer.orjson is not None:
+        serialize_paths.append(
+            ("OrjsonSerializer", lambda: OrjsonSerializer().dumps(catalog))
+        )
+    print("Serialization only:")
+    report(serialize_paths, lambda serialize: serialize(), parsed.repeat)
+
+
+def report(paths, run, repeat):
+    baseline = None
+    for name, path in paths:
+        best = min(timeit.repeat(lambda: run(path), number=1, repeat=repeat))
+        baseline = baseline or best
+        print(f"  {name:<30} {best * 1000:8.1f} ms  ({baseline / best:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
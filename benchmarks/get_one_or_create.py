@@ -0,0 +1,123 @@
+"""Compare get_one_or_create() and get_one_or_insert() under concurrent load.
+
+Several threads, each with its own database session, find or create
+Resources whose hrefs are picked at random from a small pool, so some
+calls create a row, some find one, and some race another thread to
+create the same row. Every call is committed, as it would be at the end
+of a request.
+
+This needs a PostgreSQL database; by default the test database is used.
+The Resources it creates are deleted afterwards.
+
+    python benchmarks/get_one_or_create.py --threads 8 --calls 500 --hrefs 200
+"""
+
+import argparse
+import random
+import threading
+import time
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Importing the model package configures every mapper.
+import palace.registry.sqlalchemy.model  # noqa: F401
+from palace.registry.config import Configuration
+from palace.registry.sqlalchemy.model.resource import Resource
+from palace.registry.sqlalchemy.session import SessionManager
+from palace.registry.sqlalchemy.util import get_one_or_create, get_one_or_insert
+
+
+class StatementCounter:
+    """Count the statements sent to the database, including SAVEPOINTs."""
+
+    def __init__(self, engine):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+
+    def before_cursor_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+def run(engine, helper, threads, calls, hrefs):
+    barrier = threading.Barrier(threads)
+    created = []
+    errors = []
+
+    def work(seed):
+        rng = random.Random(seed)
+        _db = Session(bind=engine)
+        barrier.wait()
+        try:
+            for _ in range(calls):
+                resource, is_new = helper(_db, Resource, href=rng.choice(hrefs))
+                _db.commit()
+                if is_new:
+                    created.append(resource.id)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            _db.close()
+
+    workers = [threading.Thread(target=work, args=(seed,)) for seed in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start, len(created), errors
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--database-url",
+        help="Defaults to the test database URL from the environment.",
+    )
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--calls", type=int, default=500, help="Calls per thread.")
+    parser.add_argument("--hrefs", type=int, default=200)
+    parsed = parser.parse_args(args)
+
+    url = parsed.database_url or Configuration.database_url(test=True)
+    engine, connection = SessionManager.initialize(url)
+    connection.close()
+    engine.pool.dispose()
+    counter = StatementCounter(engine)
+
+    total = parsed.threads * parsed.calls
+    print(
+        f"{parsed.threads} threads x {parsed.calls} calls, "
+        f"{parsed.hrefs} distinct hrefs (each should be created once):"
+    )
+    for name, helper in (
+        ("get_one_or_create", get_one_or_create),
+        ("get_one_or_insert", get_one_or_insert),
+    ):
+        prefix = f"https://benchmark.example.org/{uuid.uuid4()}/"
+        hrefs = [f"{prefix}{i}" for i in range(parsed.hrefs)]
+        counter.count = 0
+        elapsed, created, errors = run(
+            engine, helper, parsed.threads, parsed.calls, hrefs
+        )
+        statements = counter.count
+        print(
+            f"  {name:<18} {elapsed:7.2f} s  {total / elapsed:8.0f} calls/s  "
+            f"{statements / total:5.2f} statements/call  "
+            f"{created} created  {len(errors)} errors"
+        )
+        for error in errors[:3]:
+            print(f"    {error!r}")
+
+        with Session(bind=engine) as _db:
+            _db.query(Resource).filter(Resource.href.startswith(prefix)).delete(
+                synchronize_session=False
+            )
+            _db.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,24 @@
+import logging
 import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
 
-import requests
 from flask import Response, request
+from flask_babel import lazy_gettext as _
+from lxml import etree
 
 import palace.registry.adobe.adobe_xml_templates as t
+from palace.registry.problem_details import AUTHENTICATION_FAILURE, INVALID_INPUT
 from palace.registry.sqlalchemy.model.delegated_patron_identifier import (
+    DelegatedPatronIdentifier,
     ShortClientTokenDecoder,
+    ShortClientTokenRejected,
 )
+from palace.registry.sqlalchemy.model.library import Library
+from palace.registry.sqlalchemy.util import get_one
+from palace.registry.util.http_client import HTTPClient
 from palace.registry.util.string_helpers import base64
 from palace.registry.util.xmlparser import XMLParser
 
@@ -17,59 +29,167 @@ class AdobeVendorIDController:
     portions of the Adobe Vendor ID protocol.
     """
 
-    def __init__(self, _db, vendor_id, node_value, delegates=None):
+    def __init__(self, _db, vendor_id, node_value, delegates=None, local_first=False):
         """Constructor.
 
         :param delegates: A list of URLs or AdobeVendorIDClient objects. If this Vendor ID
                           server cannot validate an incoming login, it will delegate to each
                           of these other servers in turn.
+        :param local_first: If True, short client tokens are checked locally before
+                          the delegates are asked about them.
         """
         if not delegates:
             delegates = []
 
         self._db = _db
         self.request_handler = AdobeVendorIDRequestHandler(vendor_id)
-        self.model = AdobeVendorIDModel(self._db, node_value, delegates)
+        self.model = AdobeVendorIDModel(
+            self._db, node_value, delegates, local_first=local_first
+        )
 
     def signin_handler(self):
-        """Process an incoming signInRequest document."""
-        __transaction = self._db.begin_nested()
+        """Process an incoming signInRequest document.
+
+        Any DelegatedPatronIdentifier created along the way is committed
+        with the rest of the request. No SAVEPOINT is needed, so a patron
+        whose identifier is already known is signed in without using the
+        database at all.
+        """
         output = self.request_handler.handle_signin_request(
-            request.data.decode("utf8"),
+            request.data,
             self.model.standard_lookup,
             self.model.authdata_lookup,
         )
-        __transaction.commit()
 
         return Response(output, 200, {"Content-Type": "application/xml"})
 
     def userinfo_handler(self):
         """Process an incoming userInfoRequest document."""
         output = self.request_handler.handle_accountinfo_request(
-            request.data.decode("utf8"), self.model.urn_to_label
+            request.data, self.model.urn_to_label
         )
         return Response(output, 200, {"Content-Type": "application/xml"})
 
     def status_handler(self):
         return Response("UP", 200, {"Content-Type": "text/plain"})
 
+    # The most patrons that can be provisioned in one request.
+    MAX_PROVISION_BATCH = 10000
+
+    def provision_handler(self):
+        """Give Adobe account IDs to many of a library's patrons at once.
+
+        This is for a circulation manager that's migrating its patrons,
+        and would otherwise have to sign each of them in with a short
+        client token. The library authenticates with its shared secret,
+        as a bearer token, and sends a JSON document like
+        {"patron_identifiers": ["alias1", "alias2"]}. The response maps
+        each patron identifier to the patron's Adobe account ID.
+        """
+        library = self._authenticated_library()
+        if not isinstance(library, Library):
+            return library
+
+        document = request.get_json(silent=True)
+        patron_identifiers = None
+        if isinstance(document, dict):
+            patron_identifiers = document.get("patron_identifiers")
+        if not isinstance(patron_identifiers, list) or not all(
+            isinstance(p, str) and 0 < len(p) <= 255 for p in patron_identifiers
+        ):
+            return INVALID_INPUT.detailed(
+                _("Expected a list of patron identifiers, up to 255 characters each.")
+            )
+        if len(patron_identifiers) > self.MAX_PROVISION_BATCH:
+            return INVALID_INPUT.detailed(
+                _(
+                    "No more than %(max)d patrons can be provisioned at once.",
+                    max=self.MAX_PROVISION_BATCH,
+                )
+            )
+
+        account_ids = self.model.provision(library.id, patron_identifiers)
+        return dict(account_ids=account_ids)
+
+    def _authenticated_library(self):
+        """Find the library whose shared secret was sent as a bearer token."""
+        auth_header = request.headers.get("Authorization")
+        shared_secret = None
+        if auth_header and auth_header.lower().startswith("bearer "):
+            shared_secret = auth_header.split(" ", 1)[1].strip()
+        if not shared_secret:
+            return AUTHENTICATION_FAILURE.detailed(_("No shared secret was provided."))
+        library = get_one(self._db, Library, shared_secret=shared_secret)
+        if not library:
+            return AUTHENTICATION_FAILURE.detailed(
+                _("Provided shared secret is invalid")
+            )
+        return library
+
 
 class AdobeRequestParser(XMLParser):
+    """Parse the small XML documents sent to the Vendor ID service.
+
+    These arrive on every Adobe sign-in, so each thread keeps one
+    parser and compiled XPath expressions to use for every request,
+    instead of setting them up again each time. The parser doesn't
+    resolve entities, load DTDs or go out to the network.
+    """
 
     NAMESPACES = {"adept": "http://ns.adobe.com/adept"}
 
+    # lxml parsers and XPath objects mustn't be used by more than one
+    # thread at once, so each thread gets its own.
+    _local = threading.local()
+
+    @classmethod
+    def _parser(cls) -> etree.XMLParser:
+        parser = getattr(cls._local, "parser", None)
+        if parser is None:
+            parser = cls._local.parser = etree.XMLParser(
+                resolve_entities=False,
+                load_dtd=False,
+                no_network=True,
+                huge_tree=False,
+            )
+        return parser
+
+    @classmethod
+    def _compiled(cls, expression) -> etree.XPath:
+        """A compiled XPath expression that uses this class's namespaces."""
+        compiled = getattr(cls._local, "compiled", None)
+        if compiled is None:
+            compiled = cls._local.compiled = {}
+        key = (cls, expression)
+        xpath = compiled.get(key)
+        if xpath is None:
+            xpath = compiled[key] = etree.XPath(expression, namespaces=cls.NAMESPACES)
+        return xpath
+
+    @classmethod
+    def parse(cls, data):
+        """Parse a document given as bytes or a string."""
+        if isinstance(data, str):
+            try:
+                return etree.fromstring(data, cls._parser())
+            except ValueError:
+                # A string with an encoding declaration has to be parsed
+                # as bytes.
+                data = data.encode("utf8")
+        return etree.fromstring(data, cls._parser())
+
     def process(self, data):
-        requests = list(self.process_all(data, self.REQUEST_XPATH, self.NAMESPACES))
+        requests = self._compiled(self.REQUEST_XPATH)(self.parse(data))
 
         if not requests:
             return None
 
-        return requests[
-            0
-        ]  # Return only the first request tag, even if there are multiple
+        # Return only the first request tag, even if there are multiple
+        return self.process_one(requests[0], self.NAMESPACES)
 
     def _add(self, d, tag, key, namespaces, transform=None):
-        v = self._xpath1(tag, "adept:" + key, namespaces)
+        values = self._compiled("adept:" + key)(tag)
+        v = values[0] if values else None
 
         if v is not None:
             v = v.text
@@ -124,15 +244,18 @@ class AdobeVendorIDRequestHandler:
     AUTHENTICATION_FAILURE = "Incorrect barcode or PIN."
     URN_LOOKUP_FAILURE = "Could not identify patron from '%s'."
 
-    SIGN_IN_RESPONSE_TEMPLATE = t.SIGN_IN_RESPONSE_TEMPLATE
-    ACCOUNT_INFO_RESPONSE_TEMPLATE = t.ACCOUNT_INFO_RESPONSE_TEMPLATE
-    ERROR_RESPONSE_TEMPLATE = t.ERROR_RESPONSE_TEMPLATE
+    SIGN_IN_REQUEST_PARSER = AdobeSignInRequestParser
+    ACCOUNT_INFO_REQUEST_PARSER = AdobeAccountInfoRequestParser
+
+    SIGN_IN_RESPONSE_TEMPLATE = t.SIGN_IN_RESPONSE
+    ACCOUNT_INFO_RESPONSE_TEMPLATE = t.ACCOUNT_INFO_RESPONSE
+    ERROR_RESPONSE_TEMPLATE = t.ERROR_RESPONSE
 
     def __init__(self, vendor_id):
         self.vendor_id = vendor_id
 
     def handle_signin_request(self, data, standard_lookup, authdata_lookup):
-        parser = AdobeSignInRequestParser()
+        parser = self.SIGN_IN_REQUEST_PARSER()
 
         try:
             data = parser.process(data)
@@ -160,10 +283,10 @@ class AdobeVendorIDRequestHandler:
         if user_id is None:
             return self.error_document(self.AUTH_ERROR_TYPE, failure)
         else:
-            return self.SIGN_IN_RESPONSE_TEMPLATE % {"user": user_id, "label": label}
+            return self.SIGN_IN_RESPONSE_TEMPLATE.render(user=user_id, label=label)
 
     def handle_accountinfo_request(self, data, urn_to_label):
-        parser = AdobeAccountInfoRequestParser()
+        parser = self.ACCOUNT_INFO_REQUEST_PARSER()
         label = None
 
         try:
@@ -184,24 +307,22 @@ class AdobeVendorIDRequestHandler:
             return self.error_document(self.ACCOUNT_INFO_ERROR_TYPE, str(e))
 
         if label:
-            return self.ACCOUNT_INFO_RESPONSE_TEMPLATE % dict(label=label)
+            return self.ACCOUNT_INFO_RESPONSE_TEMPLATE.render(label=label)
         else:
             return self.error_document(
                 self.ACCOUNT_INFO_ERROR_TYPE, self.URN_LOOKUP_FAILURE % data["user"]
             )
 
     def error_document(self, type, message):
-        return self.ERROR_RESPONSE_TEMPLATE % {
-            "vendor_id": self.vendor_id,
-            "type": type,
-            "message": message,
-        }
+        return self.ERROR_RESPONSE_TEMPLATE.render(
+            vendor_id=self.vendor_id, type=type, message=message
+        )
 
 
 class AdobeVendorIDModel:
     """Implement Adobe Vendor ID within the library registry's database model"""
 
-    def __init__(self, _db, node_value, delegates):
+    def __init__(self, _db, node_value, delegates, local_first=False):
         self._db = _db
         delegate_objs = []
 
@@ -211,8 +332,13 @@ class AdobeVendorIDModel:
             else:
                 delegate_objs.append(i)
 
+        # All the delegates are asked at once, and the first answer is
+        # used, so to everything else they look like a single delegate.
+        self.delegates = AdobeVendorIDDelegates(delegate_objs)
         self.short_client_token_decoder = ShortClientTokenDecoder(
-            node_value, delegate_objs
+            node_value,
+            [self.delegates] if delegate_objs else [],
+            local_first=local_first,
         )
 
     def standard_lookup(self, authorization_data):
@@ -225,16 +351,17 @@ class AdobeVendorIDModel:
         password = authorization_data.get("password")
 
         try:
-            delegated_patron_identifier = (
-                self.short_client_token_decoder.decode_two_part(
-                    self._db, username, password
-                )
+            account_id = self.short_client_token_decoder.account_id_two_part(
+                self._db, username, password
             )
+        except ShortClientTokenRejected:
+            # The delegates have already been asked about this token.
+            return None, None
         except ValueError:
-            delegated_patron_identifier = None
+            account_id = None
 
-        if delegated_patron_identifier:
-            return self.account_id_and_label(delegated_patron_identifier)
+        if account_id:
+            return account_id, self.urn_to_label(account_id)
         else:
             for delegate in self.short_client_token_decoder.delegates:
                 try:
@@ -255,14 +382,15 @@ class AdobeVendorIDModel:
         if necessary.
         """
         try:
-            delegated_patron_identifier = self.short_client_token_decoder.decode(
-                self._db, authdata
-            )
+            account_id = self.short_client_token_decoder.account_id(self._db, authdata)
+        except ShortClientTokenRejected:
+            # The delegates have already been asked about this token.
+            return None, None
         except ValueError:
-            delegated_patron_identifier = None
+            account_id = None
 
-        if delegated_patron_identifier:
-            return self.account_id_and_label(delegated_patron_identifier)
+        if account_id:
+            return account_id, self.urn_to_label(account_id)
         else:
             for delegate in self.short_client_token_decoder.delegates:
                 try:
@@ -276,6 +404,25 @@ class AdobeVendorIDModel:
             None,
         )  # Neither this server nor the delegates were able to do anything.
 
+    def provision(self, library_id, patron_identifiers):
+        """Find or create the Adobe account IDs for many of a library's
+        patrons.
+
+        Unlike a sign-in, this doesn't ask the delegates anything: there's
+        no short client token to pass on to them. Patrons who already
+        have account IDs keep them.
+
+        :return: A dictionary mapping each patron identifier to an Adobe
+            account ID.
+        """
+        return DelegatedPatronIdentifier.provision(
+            self._db,
+            library_id,
+            patron_identifiers,
+            DelegatedPatronIdentifier.ADOBE_ACCOUNT_ID,
+            self.short_client_token_decoder.uuid,
+        )
+
     def account_id_and_label(self, delegated_patron_identifier):
         """Turn a DelegatedPatronIdentifier into a 2-tuple of (account id, label)"""
         if not delegated_patron_identifier:
@@ -297,6 +444,225 @@ class VendorIDServerException(Exception):
     """The Vendor ID service is not working properly."""
 
 
+@dataclass
+class DelegateHealth:
+    """How a Vendor ID delegate has been doing, and whether it's
+    working well enough to be asked anything.
+
+    After `failure_threshold` failures in a row, the delegate isn't asked
+    anything for `cool_down` seconds. After that it's asked again, and
+    one more failure means another cool-down.
+    """
+
+    failure_threshold: int = 5
+    cool_down: float = 60
+    clock: object = field(default=time.monotonic, repr=False)
+
+    requests: int = 0
+    # Answers, including "I don't know that patron".
+    successes: int = 0
+    # Errors, timeouts, and answers that weren't understood.
+    failures: int = 0
+    # Requests that weren't made because the delegate was cooling down.
+    skipped: int = 0
+    total_latency: float = 0
+
+    consecutive_failures: int = 0
+    available_after: float | None = None
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    @property
+    def average_latency(self) -> float:
+        return self.total_latency / self.requests if self.requests else 0
+
+    def available(self) -> bool:
+        """Should this delegate be asked anything right now?"""
+        with self._lock:
+            if self.available_after is None or self.clock() >= self.available_after:
+                return True
+            self.skipped += 1
+            return False
+
+    def record(self, latency, failed) -> bool:
+        """Record the outcome of a request.
+
+        :return: True if the delegate was just taken out of service, or
+            put back in service.
+        """
+        with self._lock:
+            self.requests += 1
+            self.total_latency += latency
+            if not failed:
+                self.successes += 1
+                self.consecutive_failures = 0
+                recovered = self.available_after is not None
+                self.available_after = None
+                return recovered
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self.available_after = self.clock() + self.cool_down
+                return True
+            return False
+
+    def as_dict(self) -> dict:
+        return dict(
+            requests=self.requests,
+            successes=self.successes,
+            failures=self.failures,
+            skipped=self.skipped,
+            average_latency=self.average_latency,
+            available=self.available_after is None
+            or self.clock() >= self.available_after,
+        )
+
+
+class AdobeVendorIDDelegates:
+    """Ask a number of Vendor ID delegates to sign a patron in, all at
+    once, and use the first answer.
+
+    Delegates that don't answer within their timeout are left behind,
+    and a delegate that keeps failing is not asked anything for a while
+    (see DelegateHealth), so one dead delegate doesn't slow down every
+    sign-in.
+    """
+
+    log = logging.getLogger("Adobe Vendor ID delegates")
+
+    def __init__(
+        self,
+        delegates,
+        failure_threshold=DelegateHealth.failure_threshold,
+        cool_down=DelegateHealth.cool_down,
+        clock=time.monotonic,
+    ):
+        """Constructor.
+
+        :param delegates: A list of AdobeVendorIDClient objects.
+        """
+        self.delegates = list(delegates)
+        self.health = [
+            DelegateHealth(failure_threshold, cool_down, clock)
+            for delegate in self.delegates
+        ]
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._outstanding = set()
+        self._outstanding_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.delegates)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max(4 * len(self.delegates), 1),
+                    thread_name_prefix="vendor-id-delegate",
+                )
+            return self._executor
+
+    def sign_in_standard(self, username, password):
+        """Sign in with a username and password.
+
+        :return: A 3-tuple (account identifier, label, content) from the
+            first delegate to accept the credentials.
+        :raise VendorIDAuthenticationError: If no delegate accepts them.
+        """
+        return self._first_answer("sign_in_standard", username, password)
+
+    def sign_in_authdata(self, authdata):
+        """Sign in with authdata. See sign_in_standard."""
+        return self._first_answer("sign_in_authdata", authdata)
+
+    def wait(self, timeout=None):
+        """Wait for requests that are still running to finish, even
+        though their answers are no longer needed.
+        """
+        with self._outstanding_lock:
+            outstanding = set(self._outstanding)
+        wait(outstanding, timeout=timeout)
+
+    def _first_answer(self, method, *args):
+        futures = {}
+        timeout = 0
+        for delegate, health in zip(self.delegates, self.health):
+            if not health.available():
+                continue
+            future = self.executor.submit(self._ask, delegate, health, method, *args)
+            with self._outstanding_lock:
+                self._outstanding.add(future)
+            future.add_done_callback(self._finished)
+            futures[future] = delegate
+            timeout = max(
+                timeout,
+                getattr(delegate, "timeout", None) or AdobeVendorIDClient.TIMEOUT,
+            )
+
+        deadline = time.monotonic() + timeout
+        pending = set(futures)
+        while pending:
+            done, pending = wait(
+                pending,
+                timeout=max(deadline - time.monotonic(), 0),
+                return_when=FIRST_COMPLETED,
+            )
+            if not done:
+                self.log.warning(
+                    "Gave up waiting for %d Adobe Vendor ID delegate(s).",
+                    len(pending),
+                )
+                break
+            for future in done:
+                if future.exception() is None:
+                    result = future.result()
+                    if result and result[0]:
+                        return result
+        raise VendorIDAuthenticationError("No delegate accepted the credentials.")
+
+    def _ask(self, delegate, health, method, *args):
+        start = time.monotonic()
+        failed = True
+        try:
+            result = getattr(delegate, method)(*args)
+            failed = False
+            return result
+        except VendorIDAuthenticationError:
+            # The delegate is working; it just doesn't know this patron.
+            failed = False
+            raise
+        finally:
+            if health.record(time.monotonic() - start, failed):
+                self._log_health(delegate, health)
+
+    def _log_health(self, delegate, health):
+        """Log a delegate being taken out of service or put back, along
+        with how it's been doing.
+        """
+        name = getattr(delegate, "base_url", repr(delegate))
+        stats = health.as_dict()
+        if stats["available"]:
+            self.log.info(
+                "Adobe Vendor ID delegate %s is answering again: %r", name, stats
+            )
+        else:
+            self.log.warning(
+                "Adobe Vendor ID delegate %s failed %d times in a row; not "
+                "asking it anything for %d seconds: %r",
+                name,
+                health.consecutive_failures,
+                health.cool_down,
+                stats,
+            )
+
+    def _finished(self, future):
+        with self._outstanding_lock:
+            self._outstanding.discard(future)
+
+
 class AdobeVendorIDClient:
     """
     A client library for the Adobe Vendor ID protocol.
@@ -325,15 +691,22 @@ class AdobeVendorIDClient:
     LABEL_RE = re.compile("<label>([^<]+)</label>")
     ERROR_RE = re.compile('<error [^<]+ data="([^<]+)"')
 
-    def __init__(self, base_url):
+    # Seconds to wait for the server to connect or send data.
+    TIMEOUT = 5
+
+    def __init__(
+        self, base_url, http_client: HTTPClient | None = None, timeout=TIMEOUT
+    ):
         self.base_url = base_url
+        self.http_client = http_client or HTTPClient.shared()
+        self.timeout = timeout
         self.signin_url = base_url + "SignIn"
         self.accountinfo_url = base_url + "AccountInfo"
         self.status_url = base_url + "Status"
 
     def status(self):
         """Is the server up and running?"""
-        response = requests.get(self.status_url)
+        response = self.http_client.get(self.status_url, timeout=self.timeout)
         content = response.text
         self.handle_error(response.status_code, content)
         if content == "UP":
@@ -346,19 +719,25 @@ class AdobeVendorIDClient:
         :param: If signin is successful, a 2-tuple (account identifier, label).
         """
         body = self.SIGNIN_AUTHDATA_BODY % base64.encodestring(authdata)
-        response = requests.post(self.signin_url, data=body)
+        response = self.http_client.post(
+            self.signin_url, data=body, timeout=self.timeout
+        )
         return self._process_sign_in_result(response)
 
     def sign_in_standard(self, username, password):
         """Attempt to sign in using username and password."""
         body = self.SIGNIN_STANDARD_BODY % (username, password)
-        response = requests.post(self.signin_url, data=body)
+        response = self.http_client.post(
+            self.signin_url, data=body, timeout=self.timeout
+        )
         return self._process_sign_in_result(response)
 
     def user_info(self, urn):
         """Turn a user identifier into a label."""
         body = self.USER_INFO_BODY % urn
-        response = requests.post(self.accountinfo_url, data=body)
+        response = self.http_client.post(
+            self.accountinfo_url, data=body, timeout=self.timeout
+        )
         content = response.text
         self.handle_error(response.status_code, content)
         label = self.extract_label(content)
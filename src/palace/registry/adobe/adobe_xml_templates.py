@@ -1,3 +1,5 @@
+import re
+
 ACCOUNT_INFO_REQUEST_TEMPLATE = """<accountInfoRequest method="standard" xmlns="http://ns.adobe.com/adept">
 <user>%(uuid)s</user>
 </accountInfoRequest >"""
@@ -21,3 +23,33 @@ SIGN_IN_RESPONSE_TEMPLATE = """<signInResponse xmlns="http://ns.adobe.com/adept"
     <user>%(user)s</user>
     <label>%(label)s</label>
 </signInResponse>"""
+
+
+class ResponseTemplate:
+    """One of the response templates above, split up ahead of time.
+
+    Rendering joins the fixed pieces of the template with the
+    XML-escaped values, instead of interpreting the format string
+    for every response.
+    """
+
+    PLACEHOLDER = re.compile(r"%\((\w+)\)s")
+    ESCAPES = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"})
+
+    def __init__(self, template):
+        self.template = template
+        pieces = self.PLACEHOLDER.split(template)
+        self.fragments = pieces[0::2]
+        self.names = pieces[1::2]
+
+    def render(self, **values):
+        output = [self.fragments[0]]
+        for name, fragment in zip(self.names, self.fragments[1:]):
+            output.append(str(values[name]).translate(self.ESCAPES))
+            output.append(fragment)
+        return "".join(output)
+
+
+ACCOUNT_INFO_RESPONSE = ResponseTemplate(ACCOUNT_INFO_RESPONSE_TEMPLATE)
+ERROR_RESPONSE = ResponseTemplate(ERROR_RESPONSE_TEMPLATE)
+SIGN_IN_RESPONSE = ResponseTemplate(SIGN_IN_RESPONSE_TEMPLATE)
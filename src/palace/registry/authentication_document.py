@@ -2,16 +2,23 @@ import json
 from collections import defaultdict
 
 from flask_babel import lazy_gettext as _
+from sqlalchemy import tuple_
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import MultipleResultsFound
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm.session import Session
 
+from palace.registry.config import Configuration
 from palace.registry.problem_details import INVALID_INTEGRATION_DOCUMENT
-from palace.registry.sqlalchemy.model.audience import Audience
-from palace.registry.sqlalchemy.model.collection_summary import CollectionSummary
+from palace.registry.sqlalchemy.model.audience import Audience, libraries_audiences
+from palace.registry.sqlalchemy.model.collection_summary import (
+    COLLECTION_SUMMARY_LANGUAGE_KEY,
+    CollectionSummary,
+)
+from palace.registry.sqlalchemy.model.configuration_setting import ConfigurationSetting
+from palace.registry.sqlalchemy.model.coverage_fingerprint import CoverageFingerprint
 from palace.registry.sqlalchemy.model.place import Place
 from palace.registry.sqlalchemy.model.service_area import ServiceArea
-from palace.registry.sqlalchemy.util import get_one_or_create
 
 
 class AuthenticationDocument:
@@ -62,7 +69,14 @@ class AuthenticationDocument:
         focus_area,
         links,
         place_class=Place,
+        library=None,
     ):
+        """Constructor.
+
+        :param library: The Library this document belongs to, if known.
+            If the library's coverage areas haven't changed since they
+            were last resolved, they won't be resolved again.
+        """
         self.id = id
         self.title = title
         self.authentication = authentication
@@ -71,9 +85,24 @@ class AuthenticationDocument:
         self.collection_size = collection_size
         self.public_key = public_key
         self.audiences = audiences or [self.PUBLIC_AUDIENCE]
-        self.service_area, self.focus_area = self.parse_service_and_focus_area(
-            _db, service_area, focus_area, place_class
-        )
+        self.coverage_hash = None
+        self.cached_coverage = None
+        if library is not None:
+            self.coverage_hash = self.hash_coverage(_db, service_area, focus_area)
+            fingerprint = library.coverage_fingerprint
+            if (
+                fingerprint
+                and fingerprint.coverage_hash == self.coverage_hash
+                and fingerprint.places_exist(_db)
+            ):
+                self.cached_coverage = fingerprint
+        if self.cached_coverage:
+            # update_service_areas() will use the places found last time.
+            self.service_area = self.focus_area = None
+        else:
+            self.service_area, self.focus_area = self.parse_service_and_focus_area(
+                _db, service_area, focus_area, place_class
+            )
         self.links = links
         self.website = self.extract_link(rel="alternate", require_type="text/html")
         self.online_registration = self.has_link(rel="register")
@@ -137,6 +166,16 @@ class AuthenticationDocument:
                 return True
         return False
 
+    @classmethod
+    def hash_coverage(cls, _db, service_area, focus_area):
+        """Hash a pair of coverage objects with the setting that affects
+        how they're resolved.
+        """
+        default_nation = ConfigurationSetting.sitewide(
+            _db, Configuration.DEFAULT_NATION_ABBREVIATION
+        ).value
+        return CoverageFingerprint.hash(service_area, focus_area, default_nation)
+
     @classmethod
     def parse_service_and_focus_area(
         cls, _db, service_area, focus_area, place_class=Place
@@ -281,12 +320,12 @@ class AuthenticationDocument:
         return good_enough
 
     @classmethod
-    def from_string(cls, _db, s, place_class=Place):
+    def from_string(cls, _db, s, place_class=Place, library=None):
         data = json.loads(s)
-        return cls.from_dict(_db, data, place_class)
+        return cls.from_dict(_db, data, place_class, library=library)
 
     @classmethod
-    def from_dict(cls, _db, data, place_class=Place):
+    def from_dict(cls, _db, data, place_class=Place, library=None):
         return AuthenticationDocument(
             _db,
             id=data.get("id", None),
@@ -301,6 +340,7 @@ class AuthenticationDocument:
             focus_area=data.get("focus_area"),
             links=data.get("links", []),
             place_class=place_class,
+            library=library,
         )
 
     def update_library(self, library):
@@ -349,18 +389,74 @@ class AuthenticationDocument:
                 filtered_audiences.add(Audience.OTHER)
         audiences = filtered_audiences
 
-        audience_objs = []
         _db = Session.object_session(library)
-        for audience in audiences:
-            audience_obj = Audience.lookup(_db, audience)
-            audience_objs.append(audience_obj)
-        library.audiences = audience_objs
+        self._replace_audiences(library, Audience.lookup_all(_db, audiences))
+
+    @classmethod
+    def _replace_audiences(cls, library, audiences):
+        """Make `audiences` the library's only Audiences, with at most
+        one INSERT and one DELETE.
+        """
+        current = set(library.audiences)
+        current_ids = {audience.id for audience in current}
+        wanted = {audience.id for audience in audiences}
+        if wanted == current_ids:
+            return
+        _db = Session.object_session(library)
+        _db.flush()
+        table = libraries_audiences
+        new = sorted(wanted - current_ids)
+        if new:
+            _db.execute(
+                insert(table)
+                .values(
+                    [
+                        dict(library_id=library.id, audience_id=audience_id)
+                        for audience_id in new
+                    ]
+                )
+                .on_conflict_do_nothing(
+                    index_elements=[table.c.library_id, table.c.audience_id]
+                )
+            )
+        _db.execute(
+            table.delete().where(
+                table.c.library_id == library.id, table.c.audience_id.not_in(wanted)
+            )
+        )
+        _db.expire(library, ["audiences"])
+        for audience in current.union(audiences):
+            _db.expire(audience, ["libraries"])
 
     def update_service_areas(self, library):
         """Update a library's ServiceAreas based on the contents of this
         document.
         """
-        return self.set_service_areas(library, self.service_area, self.focus_area)
+        if self.cached_coverage:
+            return self._set_service_area_ids(
+                library, self.cached_coverage.place_ids_by_type
+            )
+        problem = self.set_service_areas(library, self.service_area, self.focus_area)
+        if not problem and self.coverage_hash:
+            CoverageFingerprint.record(library, self.coverage_hash)
+        return problem
+
+    @classmethod
+    def _set_service_area_ids(cls, library, place_ids_by_type):
+        """Give a library ServiceAreas for places that have already been
+        looked up.
+
+        :param place_ids_by_type: A dictionary mapping ServiceArea types
+            to lists of Place IDs.
+        """
+        cls._replace_service_areas(
+            library,
+            {
+                (place_id, type)
+                for type, place_ids in place_ids_by_type.items()
+                for place_id in place_ids
+            },
+        )
 
     @classmethod
     def set_service_areas(cls, library, service_area, focus_area):
@@ -406,7 +502,7 @@ class AuthenticationDocument:
 
         # Delete any ServiceAreas associated with the given library
         # which are not mentioned in the list we just gathered.
-        library.service_areas = service_areas
+        cls._replace_service_areas(library, set(service_areas))
 
     @classmethod
     def _update_service_areas(cls, library, areas, type, service_areas):
@@ -417,13 +513,12 @@ class AuthenticationDocument:
         :param areas: A list [place_objs, unknown, ambiguous]
             of the sort returned by `parse_coverage()`.
         :param type: A value to use for `ServiceAreas.type`.
-        :param service_areas: All ServiceAreas that became associated
-            with the Library will be inserted into this list.
+        :param service_areas: A (Place ID, type) 2-tuple for each
+            ServiceArea the Library should have will be added to this list.
 
         :return: A ProblemDetailDocument if any of the service areas could
             not be transformed into Place objects. Otherwise, None.
         """
-        _db = Session.object_session(library)
         places, unknown, ambiguous = areas
         if unknown or ambiguous:
             msgs = []
@@ -447,11 +542,47 @@ class AuthenticationDocument:
                 )
             return INVALID_INTEGRATION_DOCUMENT.detailed(" ".join(msgs))
 
-        for place in places:
-            service_area, is_new = get_one_or_create(
-                _db, ServiceArea, library_id=library.id, place_id=place.id, type=type
+        service_areas.extend((place.id, type) for place in places)
+
+    @classmethod
+    def _replace_service_areas(cls, library, wanted):
+        """Make the library's ServiceAreas be exactly `wanted`, a set of
+        (Place ID, type) 2-tuples.
+
+        Only the rows that need to change are touched: one INSERT for
+        new ServiceAreas and one DELETE for the ones that were removed.
+        """
+        current = {(x.place_id, x.type): x for x in library.service_areas}
+        if wanted == set(current):
+            # The library already has exactly these ServiceAreas.
+            return
+        _db = Session.object_session(library)
+        _db.flush()
+        table = ServiceArea.__table__
+        new = sorted(wanted - set(current))
+        if new:
+            _db.execute(
+                insert(table)
+                .values(
+                    [
+                        dict(library_id=library.id, place_id=place_id, type=type)
+                        for place_id, type in new
+                    ]
+                )
+                .on_conflict_do_nothing(
+                    index_elements=[table.c.library_id, table.c.place_id, table.c.type]
+                )
+            )
+        delete = table.delete().where(table.c.library_id == library.id)
+        if wanted:
+            delete = delete.where(
+                tuple_(table.c.place_id, table.c.type).not_in(sorted(wanted))
             )
-            service_areas.append(service_area)
+        _db.execute(delete)
+        for key, service_area in current.items():
+            if key not in wanted:
+                _db.expunge(service_area)
+        _db.expire(library, ["service_areas"])
 
     def update_collection_size(self, library):
         return self._update_collection_size(library, self.collection_size)
@@ -471,22 +602,72 @@ class AuthenticationDocument:
                 )
             )
 
-        new_collections = set()
+        new_sizes = {}
         unknown_size = 0
         try:
             for language, size in list(sizes.items()):
-                summary = CollectionSummary.set(library, language, size)
-                if summary.language is None:
-                    unknown_size += summary.size
-                new_collections.add(summary)
-            if unknown_size:
-                # We found one or more collections in languages we
-                # didn't recognize. Set the total size of this collection
-                # as the size of a collection with unknown language.
-                new_collections.add(CollectionSummary.set(library, None, unknown_size))
+                language, size = CollectionSummary.normalize(language, size)
+                if language is None:
+                    unknown_size += size
+                new_sizes[language] = size
         except ValueError as e:
             return INVALID_INTEGRATION_DOCUMENT.detailed(str(e))
+        if unknown_size:
+            # We found one or more collections in languages we
+            # didn't recognize. Set the total size of this collection
+            # as the size of a collection with unknown language.
+            new_sizes[None] = unknown_size
 
         # Destroy any CollectionSummaries representing collections
         # no longer associated with this library.
-        library.collections = list(new_collections)
+        self._replace_collections(library, new_sizes)
+
+    @classmethod
+    def _replace_collections(cls, library, sizes):
+        """Make the library's CollectionSummaries be exactly `sizes`, a
+        dictionary mapping language codes (or None) to collection sizes.
+
+        New and resized collections are written with one upsert, and
+        collections that went away are removed with one DELETE.
+        """
+        current = {x.language: x for x in library.collections}
+        changed = [
+            (language, size)
+            for language, size in sizes.items()
+            if language not in current or current[language].size != size
+        ]
+        if not changed and set(current) == set(sizes):
+            return
+        _db = Session.object_session(library)
+        _db.flush()
+        table = CollectionSummary.__table__
+        if changed:
+            statement = insert(table).values(
+                [
+                    dict(library_id=library.id, language=language, size=size)
+                    for language, size in changed
+                ]
+            )
+            _db.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[
+                        table.c.library_id,
+                        COLLECTION_SUMMARY_LANGUAGE_KEY,
+                    ],
+                    set_=dict(size=statement.excluded.size),
+                )
+            )
+        delete = table.delete().where(table.c.library_id == library.id)
+        if sizes:
+            delete = delete.where(
+                COLLECTION_SUMMARY_LANGUAGE_KEY.not_in(
+                    [language or "" for language in sizes]
+                )
+            )
+        _db.execute(delete)
+        for language, summary in current.items():
+            if language not in sizes:
+                _db.expunge(summary)
+            elif summary.size != sizes[language]:
+                _db.expire(summary)
+        _db.expire(library, ["collections"])
@@ -91,6 +91,10 @@ class Configuration:
     ADOBE_VENDOR_ID_NODE_VALUE = "node_value"
     ADOBE_VENDOR_ID_DELEGATE_URL = "delegate_url"
 
+    # If this is set, short client tokens are checked locally before any
+    # delegates are asked about them, rather than after.
+    ADOBE_VENDOR_ID_LOCAL_FIRST = "local_first"
+
     # The URL to the document containing the terms of service for
     # library registration
     REGISTRATION_TERMS_OF_SERVICE_URL = "registration_terms_of_service_url"
@@ -123,6 +127,11 @@ class Configuration:
     # Default page size for crawlable paginated feeds.
     CRAWLABLE_PAGE_SIZE = "crawlable_page_size"
 
+    # How many registrations requested with 'Prefer: respond-async' each
+    # web server process may run at once. If this is 0, they're only run
+    # by bin/registration_jobs.
+    REGISTRATION_WORKERS = "registration_workers"
+
     # The name of the sitewide secret used for admin login.
     SECRET_KEY = "secret_key"
 
@@ -179,6 +188,22 @@ class Configuration:
             delegates,
         )
 
+    @classmethod
+    def vendor_id_local_first(cls, _db):
+        """Should short client tokens be checked locally before the Adobe
+        Vendor ID delegates are asked about them?
+        """
+        from palace.registry.sqlalchemy.model.external_integration import (
+            ExternalIntegration,
+        )
+
+        integration = ExternalIntegration.lookup(
+            _db, ExternalIntegration.ADOBE_VENDOR_ID, ExternalIntegration.DRM_GOAL
+        )
+        if not integration:
+            return False
+        return bool(integration.setting(cls.ADOBE_VENDOR_ID_LOCAL_FIRST).bool_value)
+
     @classmethod
     def aws_config(cls) -> AWSConfig:
         """Return the AWS configurations setup in the environment"""
@@ -9,7 +9,7 @@ from Crypto.Cipher import PKCS1_OAEP
 from Crypto.PublicKey import RSA
 from flask import Response, redirect, render_template_string, request, session, url_for
 from flask_babel import lazy_gettext as _
-from sqlalchemy.orm import defaultload, joinedload
+from sqlalchemy.orm import Session, joinedload
 
 from palace.registry.admin.config import Configuration as AdminClientConfig
 from palace.registry.admin.templates import admin as admin_template
@@ -21,8 +21,10 @@ from palace.registry.config import (
     Configuration,
 )
 from palace.registry.emailer import Emailer
+from palace.registry.export import NDJSON_MEDIA_TYPE, LibraryExporter, gzip_chunks
+from palace.registry.library_listing import AdminLibraryListing, email_from_href
 from palace.registry.opds import Annotator, AvailabilityFacet, OPDSCatalog, OrderFacet
-from palace.registry.pagination import Pagination
+from palace.registry.pagination import KeysetPagination, Pagination
 from palace.registry.problem_details import (
     AUTHENTICATION_FAILURE,
     INTEGRATION_ERROR,
@@ -31,19 +33,28 @@ from palace.registry.problem_details import (
     INVALID_INPUT,
     LIBRARY_NOT_FOUND,
     NO_AUTH_URL,
+    REGISTRATION_JOB_NOT_FOUND,
     UNABLE_TO_NOTIFY,
 )
 from palace.registry.registrar import LibraryRegistrar
+from palace.registry.registration_jobs import (
+    RESPOND_ASYNC,
+    RegistrationRequest,
+    RegistrationWorkerPool,
+    prefers_async,
+)
 from palace.registry.route_links import RouteLinkRegistry
 from palace.registry.sqlalchemy.model.admin import Admin
 from palace.registry.sqlalchemy.model.configuration_setting import ConfigurationSetting
 from palace.registry.sqlalchemy.model.hyperlink import Hyperlink
 from palace.registry.sqlalchemy.model.library import Library
 from palace.registry.sqlalchemy.model.place import Place
+from palace.registry.sqlalchemy.model.registration_job import RegistrationJob
 from palace.registry.sqlalchemy.model.resource import Resource, Validation
 from palace.registry.sqlalchemy.model.service_area import ServiceArea
 from palace.registry.sqlalchemy.session import production_session
-from palace.registry.sqlalchemy.util import get_one, get_one_or_create
+from palace.registry.sqlalchemy.util import create, get_one, get_one_or_create
+from palace.registry.util import json_serializer
 from palace.registry.util.app_server import (
     ApplicationVersionController,
     catalog_response,
@@ -90,7 +101,11 @@ class LibraryRegistry:
         vendor_id, node_value, delegates = Configuration.vendor_id(self._db)
         if vendor_id:
             self.adobe_vendor_id = AdobeVendorIDController(
-                self._db, vendor_id, node_value, delegates
+                self._db,
+                vendor_id,
+                node_value,
+                delegates,
+                local_first=Configuration.vendor_id_local_first(self._db),
             )
         else:
             self.adobe_vendor_id = None
@@ -164,6 +179,9 @@ class LibraryRegistryController(BaseController):
    <Url type="application/atom+xml;profile=opds-catalog" template="%(url_template)s"/>
  </OpenSearchDescription>"""
 
+    # Seconds a client should wait before asking about a registration job.
+    REGISTRATION_RETRY_AFTER = 5
+
     def __init__(self, app, emailer_class=Emailer):
         super().__init__(app)
         self.annotator = LibraryRegistryAnnotator(app)
@@ -178,6 +196,33 @@ class LibraryRegistryController(BaseController):
             )
         self.emailer = emailer
 
+        workers = ConfigurationSetting.sitewide(
+            self._db, Configuration.REGISTRATION_WORKERS
+        ).int_value
+        if workers is None:
+            workers = RegistrationWorkerPool.DEFAULT_WORKERS
+        # Registration jobs get sessions of their own, bound to the same
+        # engine. Look it up here, on the thread that owns self._db.
+        self.engine = self._db.get_bind().engine
+        self.registration_workers = RegistrationWorkerPool(
+            self.run_registration_job,
+            max_workers=workers,
+            session_factory=self.worker_session,
+        )
+
+        # The Executor a LibraryRegistrar uses to fetch the documents
+        # linked from an authentication document. If this is None, it
+        # uses its shared thread pool.
+        self.registrar_executor = None
+
+    def worker_session(self):
+        """Create a database session for a registration job.
+
+        A job runs on a worker thread, so it can't share the session used
+        to handle requests.
+        """
+        return Session(bind=self.engine)
+
     def nearby(self, location, live=True):
         qu = Library.nearby(self._db, location, production=live)
         qu = qu.limit(5)
@@ -232,52 +277,43 @@ class LibraryRegistryController(BaseController):
             return Response(body, 200, headers)
 
     def libraries(self, live=True):
-        # Return a specific set of information about all libraries in production;
-        # this generates the library list in the admin interface.
-        # If :param live is set to False, libraries in testing will also be shown.
-        result = []
-        alphabetical = self._db.query(Library).order_by(Library.name)
-
-        # Load all the ORM objects we'll need for these libraries in a single query.
-        alphabetical = alphabetical.options(
-            joinedload(Library.hyperlinks),
-            joinedload("hyperlinks", "resource"),
-            joinedload("hyperlinks", "resource", "validation"),
-            joinedload(Library.service_areas),
-            joinedload("service_areas", "place"),
-            joinedload("service_areas", "place", "parent"),
-            joinedload(Library.settings),
-        )
-
-        # Avoid transferring large fields that we won't end up using.
-        alphabetical = alphabetical.options(
-            defaultload("service_areas").defaultload("place").defer("geometry")
-        )
-        alphabetical = alphabetical.options(
-            defaultload("service_areas")
-            .defaultload("place")
-            .defaultload("parent")
-            .defer("geometry")
-        )
-
-        if live:
-            alphabetical = alphabetical.filter(
-                Library.registry_stage == Library.PRODUCTION_STAGE
-            )
+        """Return a specific set of information about libraries; this
+        generates the library list in the admin interface.
 
-        libraries = list(alphabetical)
+        Supports ``?q=`` to search by library name or short name, and
+        ``?order=``. Every matching library is returned unless ``?offset=``
+        or ``?size=`` asks for a single page, in which case the response
+        also says where the page falls in the full list.
 
-        # Run a single database query to get patron counts for all
-        # relevant libraries, rather than calculating this one library
-        # at a time.
-        patron_counts = Library.patron_counts_by_library(self._db, libraries)
-
-        for library in alphabetical:
-            uuid = library.internal_urn.split("uuid:")[1]
-            patron_count = patron_counts.get(library.id, 0)
-            result += [self.library_details(uuid, library, patron_count)]
+        :param live: If False, libraries in testing will also be shown.
+        """
+        search = order = pagination = None
+        if flask.has_request_context():
+            args = flask.request.args
+            search = args.get("q") or None
+            order_str = args.get("order")
+            if order_str:
+                try:
+                    order = OrderFacet(order_str)
+                except ValueError:
+                    return INVALID_INPUT.detailed(
+                        f"I don't know how to order libraries by '{order_str}'", 400
+                    )
+            if "offset" in args or "size" in args:
+                pagination = Pagination.from_request(flask.request)
 
-        data = dict(libraries=result)
+        listing = AdminLibraryListing(
+            self._db, live=live, search=search, order=order, pagination=pagination
+        )
+        libraries, has_next = listing.details()
+        data = dict(libraries=libraries)
+        if pagination:
+            data["pagination"] = dict(
+                offset=pagination.offset,
+                size=pagination.size,
+                total=listing.count(),
+                has_next=has_next,
+            )
         return data
 
     @staticmethod
@@ -371,6 +407,11 @@ class LibraryRegistryController(BaseController):
             order=order,
             availability=availability,
             default_order=default_order,
+            availability_counts=(
+                Library.availability_counts(self._db)
+                if default_order is not None
+                else None
+            ),
         )
         b = time.time()
         self.log.info("Built library catalog in %.2fsec" % (b - a))
@@ -402,8 +443,14 @@ class LibraryRegistryController(BaseController):
         )
 
         # Parse pagination from request, supplying total count for last/progress links.
+        # Counts for every availability facet come from a single cached query.
+        availability_counts = Library.availability_counts(self._db)
         pagination = Pagination.from_request(
-            flask.request, _db=self._db, total_count=query.count()
+            flask.request,
+            _db=self._db,
+            total_count=Library.availability_count(
+                self._db, availability, counts=availability_counts
+            ),
         )
 
         # Eager load relationships (prevent N+1 queries).
@@ -432,10 +479,154 @@ class LibraryRegistryController(BaseController):
             has_next_page=has_next,
             order=order,
             availability=availability,
+            availability_counts=availability_counts,
         )
 
         return catalog_response(catalog)
 
+    def libraries_changes(self) -> Response | ProblemDetail:
+        """Return the libraries that changed after a given time, in OPDS format.
+
+        Query parameters:
+          - since: An ISO 8601 timestamp, or a cursor taken from a previous
+            page's links. If omitted, the feed starts at the beginning.
+          - availability: Comma-separated availability filter (default: production).
+          - size: Page size.
+
+        Entries are in the order they were last modified. A library that
+        changed but is no longer covered by the availability filter (for
+        instance, because it was cancelled) is represented by a tombstone,
+        so clients keeping a local copy know to drop it. Libraries deleted
+        outright do not show up.
+
+        Every page has a resume link that picks up after its last entry; a
+        page that isn't the last also has a next link to the same place.
+        A page reached through one of those links starts with any entries
+        that may have been committed after the link was made, even though
+        they come before it (see KeysetPagination). Clients may see an
+        entry more than once.
+
+        :return: Flask Response with OPDS 2.0 JSON catalog.
+        """
+        result = self._parse_feed_params()
+        if isinstance(result, ProblemDetail):
+            return result
+        ignore, availability = result
+        try:
+            pagination = KeysetPagination.from_request(flask.request, _db=self._db)
+        except ValueError:
+            return INVALID_INPUT.detailed(
+                _(
+                    "'since' must be an ISO 8601 timestamp or a cursor from a previous page: %(since)s",
+                    since=flask.request.args.get("since"),
+                ),
+                400,
+            )
+
+        available = Library._availability_restriction(availability).label("available")
+        query = self._db.query(Library, available).options(
+            *self._hyperlink_load_options()
+        )
+        page = pagination.modify_query(query, Library.timestamp, Library.id)
+        new_rows, has_next = pagination.page_loaded(page.all())
+        rows = new_rows
+        reread = pagination.reread_query(query, Library.timestamp, Library.id)
+        if reread is not None:
+            # Changes that may have been committed after the client's
+            # cursor was issued come first.
+            new_ids = {library.id for library, ignore in new_rows}
+            rows = [row for row in reread if row[0].id not in new_ids] + new_rows
+        libraries = [library for library, ignore in rows]
+        tombstones = {library.id for library, is_available in rows if not is_available}
+
+        catalog = OPDSCatalog(
+            self._db,
+            "Library changes",
+            flask.request.url,
+            libraries,
+            annotator=self.annotator,
+            live=AvailabilityFacet.is_live(availability),
+            tombstones=tombstones,
+        )
+
+        # Link to the rest of the feed, starting after the last new entry
+        # on this page.
+        if new_rows:
+            last, ignore = new_rows[-1]
+            since = pagination.next_cursor(last.timestamp, last.id)
+        else:
+            since = pagination.next_cursor() or flask.request.args.get("since")
+        args = flask.request.args.to_dict()
+        if since:
+            args["since"] = since
+        resume_url = self.app.url_for("libraries_changes", **args)
+        OPDSCatalog.add_link_to_catalog(
+            catalog.catalog,
+            rel=OPDSCatalog.PALACE_RESUME_REL,
+            href=resume_url,
+            type=OPDSCatalog.OPDS_TYPE,
+        )
+        if has_next:
+            OPDSCatalog.add_link_to_catalog(
+                catalog.catalog, rel="next", href=resume_url, type=OPDSCatalog.OPDS_TYPE
+            )
+
+        return catalog_response(catalog, cache_for=None)
+
+    def libraries_export(self) -> Response | ProblemDetail:
+        """Stream every library as newline-delimited JSON, one OPDS catalog
+        entry per line.
+
+        Query parameters:
+          - order: Sort order (default: natural). See OrderFacet.
+          - availability: Comma-separated availability filter (default: all).
+          - include: Comma-separated optional parts of each entry:
+            service_areas, collection_summaries.
+
+        The response body is gzipped if the client accepts it.
+
+        :return: A streaming Flask Response.
+        """
+        result = self._parse_feed_params(default_order=OrderFacet.NATURAL)
+        if isinstance(result, ProblemDetail):
+            return result
+        order, availability = result
+        if "availability" not in flask.request.args:
+            availability = frozenset({AvailabilityFacet.ALL})
+
+        include_str = flask.request.args.get("include")
+        include = set(include_str.split(",")) if include_str else set()
+        unknown = include - set(LibraryExporter.INCLUDABLE)
+        if unknown:
+            return INVALID_INPUT.detailed(
+                _(
+                    "I don't know how to include %(parts)s in an export.",
+                    parts=", ".join(sorted(unknown)),
+                ),
+                400,
+            )
+
+        exporter = LibraryExporter(
+            self._db,
+            availability=availability,
+            order=order,
+            include_service_areas=LibraryExporter.SERVICE_AREAS in include,
+            include_collection_summaries=(
+                LibraryExporter.COLLECTION_SUMMARIES in include
+            ),
+        )
+        body = exporter.lines(self.app.url_for)
+        headers = {"Vary": "Accept-Encoding"}
+        if flask.request.accept_encodings["gzip"]:
+            body = gzip_chunks(body)
+            headers["Content-Encoding"] = "gzip"
+        return Response(
+            flask.stream_with_context(body),
+            200,
+            headers,
+            mimetype=NDJSON_MEDIA_TYPE,
+        )
+
     def library_details(self, uuid, library=None, patron_count=None):
         """Return complete information about one specific library.
 
@@ -555,11 +746,8 @@ class LibraryRegistryController(BaseController):
         return place.human_friendly_name or "Everywhere"
 
     def _get_email(self, hyperlink):
-        if hyperlink and hyperlink.resource and hyperlink.resource.href:
-            try:
-                return hyperlink.resource.href.split("mailto:")[1]
-            except IndexError:
-                return None
+        if hyperlink and hyperlink.resource:
+            return email_from_href(hyperlink.resource.href)
 
     def _validated_at(self, hyperlink):
         validated_at = "Not validated"
@@ -707,7 +895,7 @@ class LibraryRegistryController(BaseController):
     def catalog_response(self, document, status=200):
         """Serve an OPDS 2.0 catalog."""
         if not isinstance(document, (bytes, str)):
-            document = json.dumps(document)
+            document = json_serializer.dumps(document)
         headers = {"Content-Type": OPDS_CATALOG_REGISTRATION_MEDIA_TYPE}
         return Response(document, status, headers=headers)
 
@@ -716,6 +904,20 @@ class LibraryRegistryController(BaseController):
             document = self.registration_document
             return self.catalog_response(document)
 
+        registration = self._registration_request()
+        if isinstance(registration, ProblemDetail):
+            return registration
+
+        if prefers_async(request.headers):
+            return self._accept_registration(registration, do_get)
+        return self._register(registration, do_get)
+
+    def _registration_request(self):
+        """Find out what the client is asking for in a registration request.
+
+        :return: A RegistrationRequest, or a ProblemDetail if the request
+            is invalid.
+        """
         auth_url = request.form.get("url")
         self.log.info("Got request to register %s", auth_url)
         if not auth_url:
@@ -753,12 +955,8 @@ class LibraryRegistryController(BaseController):
         if isinstance(integration_contact_email, ProblemDetail):
             return integration_contact_email
 
-        # Registration is a complex multi-step process. Start a subtransaction
-        # so we can back out of the whole thing if any part of it fails.
-        __transaction = self._db.begin_nested()
-
-        library = None
-        elevated_permissions = False
+        library_id = None
+        reset_shared_secret = False
         if shared_secret:
             # Look up a library by the provided shared secret. This
             # will let us handle the case where the library has
@@ -767,13 +965,52 @@ class LibraryRegistryController(BaseController):
             # same.
             library = get_one(self._db, Library, shared_secret=shared_secret)
             if not library:
-                __transaction.rollback()
                 return AUTHENTICATION_FAILURE.detailed(
                     _("Provided shared secret is invalid")
                 )
 
             # This gives the requestor an elevated level of permissions.
-            elevated_permissions = True
+            # If you have elevated permissions you may ask for the
+            # shared secret to be reset.
+            library_id = library.id
+            reset_shared_secret = bool(request.form.get("reset_shared_secret", False))
+
+        return RegistrationRequest(
+            authentication_url=auth_url,
+            contact=integration_contact_email,
+            library_stage=library_stage,
+            library_id=library_id,
+            reset_shared_secret=reset_shared_secret,
+        )
+
+    def _register(
+        self, registration, do_get=HTTP.debuggable_get, _db=None, url_for=None
+    ):
+        """Register a library, or update its registration.
+
+        :param registration: A RegistrationRequest.
+        :param _db: Use this database session instead of the controller's.
+        :param url_for: Use this function to build URLs instead of the
+            controller's, which needs a request context.
+        :return: A Response containing the library's OPDS catalog entry,
+            or a ProblemDetail.
+        """
+        _db = _db or self._db
+        url_for = url_for or self.app.url_for
+        auth_url = registration.authentication_url
+        integration_contact_email = registration.contact
+        library_stage = registration.library_stage
+
+        # Registration is a complex multi-step process. Start a subtransaction
+        # so we can back out of the whole thing if any part of it fails.
+        __transaction = _db.begin_nested()
+
+        library = None
+        if registration.elevated_permissions:
+            library = get_one(_db, Library, id=registration.library_id)
+        # The library might have gone away since the request was made.
+        elevated_permissions = library is not None
+        if elevated_permissions:
             library_is_new = False
 
             if library.authentication_url != auth_url:
@@ -790,10 +1027,12 @@ class LibraryRegistryController(BaseController):
             # Either this is a library at a known authentication URL
             # or it's a brand new library.
             library, library_is_new = get_one_or_create(
-                self._db, Library, authentication_url=auth_url
+                _db, Library, authentication_url=auth_url
             )
 
-        registrar = LibraryRegistrar(self._db, do_get=do_get)
+        registrar = LibraryRegistrar(
+            _db, do_get=do_get, executor=self.registrar_executor
+        )
         result = registrar.register(library, library_stage)
         if isinstance(result, ProblemDetail):
             __transaction.rollback()
@@ -828,12 +1067,8 @@ class LibraryRegistryController(BaseController):
                 (Hyperlink.INTEGRATION_CONTACT_REL, [integration_contact_email])
             )
 
-        reset_shared_secret = False
+        reset_shared_secret = registration.reset_shared_secret
         if elevated_permissions:
-            # If you have elevated permissions you may ask for the
-            # shared secret to be reset.
-            reset_shared_secret = request.form.get("reset_shared_secret", False)
-
             if library.opds_url != opds_url:
                 # The library's OPDS URL has changed, e.g. moved from
                 # HTTP to HTTPS. Since we have elevated permissions,
@@ -849,7 +1084,7 @@ class LibraryRegistryController(BaseController):
                 # can confirm that the address works, or to inform
                 # them a new library is using their address.
                 try:
-                    hyperlink.notify(self.emailer, self.app.url_for)
+                    hyperlink.notify(self.emailer, url_for)
                 except SMTPException as exc:
                     self.log.error("EMAIL_SEND_PROBLEM, SMTPException:", exc_info=exc)
                     # We were unable to send the email due to an SMTP error
@@ -868,7 +1103,7 @@ class LibraryRegistryController(BaseController):
         # Create an OPDS 2 catalog containing all available
         # information about the library.
         catalog = OPDSCatalog.library_catalog(
-            library, include_private_information=True, url_for=self.app.url_for
+            library, include_private_information=True, url_for=url_for
         )
 
         # Annotate the catalog with some information specific to
@@ -881,7 +1116,7 @@ class LibraryRegistryController(BaseController):
             if not library.short_name:
 
                 def dupe_check(candidate):
-                    return Library.for_short_name(self._db, candidate) is not None
+                    return Library.for_short_name(_db, candidate) is not None
 
                 library.short_name = Library.random_short_name(dupe_check)
 
@@ -900,6 +1135,102 @@ class LibraryRegistryController(BaseController):
             status_code = 200
         return self.catalog_response(catalog, status_code)
 
+    def _accept_registration(self, registration, do_get=HTTP.debuggable_get):
+        """Save a registration request as a job to be run in the background.
+
+        :return: A 202 response pointing to the job's status.
+        """
+        base_url = request.url_root
+        job, ignore = create(
+            self._db, RegistrationJob, base_url=base_url, **registration.job_fields()
+        )
+        # The job must be in the database before a worker goes looking for it.
+        self._db.commit()
+        self.registration_workers.submit(
+            flask.current_app._get_current_object(), job.id, base_url, do_get=do_get
+        )
+        response = self.registration_job_response(job)
+        response.headers["Location"] = response.headers["Content-Location"]
+        response.headers["Preference-Applied"] = RESPOND_ASYNC
+        return response
+
+    def run_registration_job(
+        self, job_id, do_get=HTTP.debuggable_get, _db=None, url_for=None
+    ):
+        """Carry out a registration request that was saved as a job.
+
+        :param _db: The job's own database session. Everything the job
+            does is committed in this session. By default, the
+            controller's session is used.
+        :param url_for: A function that builds URLs relative to the URL
+            the registration request was sent to. By default, URLs are
+            built for the current request.
+        :return: The finished RegistrationJob, or None if the job was
+            already taken by another worker.
+        """
+        _db = _db or self._db
+        if not RegistrationJob.claim(_db, job_id):
+            return None
+        _db.commit()
+        job = get_one(_db, RegistrationJob, id=job_id)
+
+        try:
+            result = self._register(
+                RegistrationRequest.from_job(job), do_get, _db=_db, url_for=url_for
+            )
+        except Exception as e:
+            self.log.error("Registration job %s failed.", job_id, exc_info=e)
+            _db.rollback()
+            job = get_one(_db, RegistrationJob, id=job_id)
+            result = INTEGRATION_ERROR.detailed(
+                _("The registration could not be completed.")
+            )
+
+        if isinstance(result, ProblemDetail):
+            body, status_code, headers = result.response
+            media_type = headers["Content-Type"]
+        else:
+            body = result.get_data(as_text=True)
+            status_code = result.status_code
+            media_type = result.headers["Content-Type"]
+        job.finish(status_code, media_type, body)
+        _db.commit()
+        return job
+
+    def registration_job(self, token):
+        """Report on a registration job.
+
+        :return: The response to the registration request, if the job is
+            done, or a 202 response describing the job if it isn't.
+        """
+        job = get_one(self._db, RegistrationJob, token=token)
+        if not job:
+            return REGISTRATION_JOB_NOT_FOUND
+        if job.finished:
+            return Response(
+                job.response, job.status_code, {"Content-Type": job.media_type}
+            )
+        return self.registration_job_response(job)
+
+    def registration_job_response(self, job):
+        """A 202 response describing an unfinished registration job."""
+        url = self.app.url_for("registration_job", token=job.token)
+        document = dict(
+            status=job.status,
+            authentication_url=job.authentication_url,
+            created=job.created_at,
+            started=job.started_at,
+            links=[dict(rel="self", href=url, type="application/json")],
+        )
+        headers = {
+            "Content-Location": url,
+            # Registration usually takes a few seconds.
+            "Retry-After": str(self.REGISTRATION_RETRY_AFTER),
+        }
+        return Response(
+            json_serializer.dumps(document), 202, headers, mimetype="application/json"
+        )
+
 
 class StaticFileController(BaseController):
     def static_file(self, filename):
@@ -1001,7 +1332,7 @@ class CoverageController(BaseController):
 
     def geojson_response(self, document):
         if isinstance(document, dict):
-            document = json.dumps(document)
+            document = json_serializer.dumps(document)
         headers = {"Content-Type": "application/geo+json"}
         return Response(document, 200, headers=headers)
 
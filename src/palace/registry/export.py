@@ -0,0 +1,144 @@
+"""Stream the entire registry as newline-delimited JSON."""
+
+from __future__ import annotations
+
+import zlib
+from collections.abc import Callable, Iterable, Iterator
+
+from sqlalchemy.orm import joinedload, selectinload
+
+from palace.registry.config import Configuration
+from palace.registry.opds import AvailabilityFacet, OPDSCatalog, OrderFacet
+from palace.registry.sqlalchemy.model.configuration_setting import ConfigurationSetting
+from palace.registry.sqlalchemy.model.hyperlink import Hyperlink
+from palace.registry.sqlalchemy.model.library import Library
+from palace.registry.sqlalchemy.model.resource import Resource
+from palace.registry.sqlalchemy.model.service_area import ServiceArea
+from palace.registry.util import json_serializer
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+class LibraryExporter:
+    """Build one OPDS catalog entry per library, for every library in the registry.
+
+    Libraries are read through a server-side cursor, a batch at a time, and
+    each entry is handed off as soon as it's built. Nothing holds on to
+    libraries that have already been exported, so memory use doesn't grow
+    with the size of the registry.
+    """
+
+    # Optional parts of an entry, as named in the ?include= query parameter
+    # and on the command line.
+    SERVICE_AREAS = "service_areas"
+    COLLECTION_SUMMARIES = "collection_summaries"
+    INCLUDABLE = (SERVICE_AREAS, COLLECTION_SUMMARIES)
+
+    # The metadata key under which collection summaries are exported.
+    COLLECTION_SUMMARIES_KEY = "collection_summaries"
+
+    # How many libraries to fetch from the cursor at a time.
+    BATCH_SIZE = 500
+
+    def __init__(
+        self,
+        _db,
+        availability: frozenset[AvailabilityFacet] = frozenset({AvailabilityFacet.ALL}),
+        order: OrderFacet = OrderFacet.NATURAL,
+        include_service_areas: bool = False,
+        include_collection_summaries: bool = False,
+        batch_size: int | None = None,
+    ):
+        """Constructor.
+
+        :param availability: Export only libraries matching these
+            AvailabilityFacet values.
+        :param order: The order in which to export libraries.
+        :param include_service_areas: If True, each entry describes the
+            library's service area, as OPDSCatalog.library_catalog does
+            when include_service_area is set.
+        :param include_collection_summaries: If True, each entry lists
+            the size of the library's collection in each language.
+        :param batch_size: Number of libraries to fetch from the cursor at a time.
+        """
+        self._db = _db
+        self.availability = availability
+        self.order = order
+        self.include_service_areas = include_service_areas
+        self.include_collection_summaries = include_collection_summaries
+        self.batch_size = batch_size or self.BATCH_SIZE
+
+    def query(self):
+        """Find the libraries to export.
+
+        Related objects are loaded with separate SELECT ... IN queries for
+        each batch, since joined collection loading can't be combined with
+        a server-side cursor.
+        """
+        options = [
+            selectinload(Library.settings),
+            selectinload(Library.hyperlinks)
+            .joinedload(Hyperlink.resource)
+            .joinedload(Resource.validation),
+        ]
+        if self.include_service_areas:
+            options.append(
+                selectinload(Library.service_areas).joinedload(ServiceArea.place)
+            )
+        if self.include_collection_summaries:
+            options.append(selectinload(Library.collections))
+
+        return (
+            self._db.query(Library)
+            .filter(Library._availability_restriction(self.availability))
+            .order_by(*self.order.sort_order_expressions)
+            .options(*options)
+            .execution_options(stream_results=True)
+            .yield_per(self.batch_size)
+        )
+
+    def entries(self, url_for: Callable[..., str]) -> Iterator[dict]:
+        """Yield an OPDS catalog entry for each library.
+
+        :param url_for: Callable that resolves an endpoint name and kwargs to a URL.
+        """
+        web_client_uri_template = ConfigurationSetting.sitewide(
+            self._db, Configuration.WEB_CLIENT_URL
+        ).value
+        for library in self.query():
+            entry = OPDSCatalog.library_catalog(
+                library,
+                url_for=url_for,
+                web_client_uri_template=web_client_uri_template,
+                include_service_area=self.include_service_areas,
+            )
+            if self.include_collection_summaries:
+                entry["metadata"][self.COLLECTION_SUMMARIES_KEY] = [
+                    dict(language=summary.language, size=summary.size)
+                    for summary in sorted(
+                        library.collections, key=lambda s: s.language or ""
+                    )
+                ]
+            yield entry
+
+    def lines(self, url_for: Callable[..., str]) -> Iterator[bytes]:
+        """Yield each entry as a single line of UTF-8 encoded JSON, newline included."""
+        for entry in self.entries(url_for):
+            yield json_serializer.dumps(entry) + b"\n"
+
+
+def gzip_chunks(chunks: Iterable[str | bytes]) -> Iterator[bytes]:
+    """Gzip a stream of chunks without holding the whole stream in memory.
+
+    :param chunks: Strings (encoded as UTF-8) or bytes.
+    :yield: Pieces of a single gzip stream.
+    """
+    # wbits=31 selects the gzip container rather than a bare zlib stream.
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf8")
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,285 @@
+"""Build the library list shown in the admin interface."""
+
+from __future__ import annotations
+
+from collections import defaultdict
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import aliased
+
+from palace.registry.opds import OrderFacet
+from palace.registry.pagination import Pagination
+from palace.registry.sqlalchemy.model.configuration_setting import ConfigurationSetting
+from palace.registry.sqlalchemy.model.hyperlink import Hyperlink
+from palace.registry.sqlalchemy.model.library import Library
+from palace.registry.sqlalchemy.model.place import Place
+from palace.registry.sqlalchemy.model.resource import Resource, Validation
+from palace.registry.sqlalchemy.model.service_area import ServiceArea
+
+NOT_VALIDATED = "Not validated"
+
+
+def email_from_href(href: str | None) -> str | None:
+    """Extract the email address from a mailto: URI."""
+    if not href:
+        return None
+    try:
+        return href.split("mailto:")[1]
+    except IndexError:
+        return None
+
+
+class AdminLibraryListing:
+    """The details of a page of libraries, as shown in the admin interface.
+
+    The admin interface wants a dozen fields from five tables for every
+    library. Rather than hydrate Library objects along with their
+    hyperlinks, settings and service areas, each kind of information is
+    fetched with its own column-only query for the libraries on the page,
+    and the results are stitched together in Python. The output is the
+    same as LibraryRegistryController.library_details.
+    """
+
+    # The hyperlinks whose email address and validation state are shown.
+    HYPERLINK_RELS = (
+        Hyperlink.INTEGRATION_CONTACT_REL,
+        Hyperlink.HELP_REL,
+        Hyperlink.COPYRIGHT_DESIGNATED_AGENT_REL,
+    )
+
+    # The columns of Library that make it into the details.
+    LIBRARY_COLUMNS = (
+        Library.id,
+        Library.name,
+        Library.short_name,
+        Library.description,
+        Library.timestamp,
+        Library.internal_urn,
+        Library.online_registration,
+        Library.authentication_url,
+        Library.opds_url,
+        Library.web_url,
+        Library._library_stage.label("library_stage"),
+        Library.registry_stage,
+    )
+
+    def __init__(
+        self,
+        _db,
+        live: bool = True,
+        search: str | None = None,
+        order: OrderFacet | None = None,
+        pagination: Pagination | None = None,
+    ):
+        """Constructor.
+
+        :param live: If True, only libraries the registry has put in
+            production are listed.
+        :param search: If present, only libraries whose name or short name
+            contains this string (ignoring case) are listed.
+        :param order: The order in which to list libraries. By default
+            they're sorted by name.
+        :param pagination: If present, only this page of libraries is
+            listed. Otherwise every matching library is.
+        """
+        self._db = _db
+        self.live = live
+        self.search = search
+        self.order = order
+        self.pagination = pagination
+
+    def _filtered(self, query):
+        if self.live:
+            query = query.where(Library.registry_stage == Library.PRODUCTION_STAGE)
+        if self.search:
+            search = self.search.lower()
+            query = query.where(
+                or_(
+                    func.lower(Library.name).contains(search, autoescape=True),
+                    func.lower(Library.short_name).contains(search, autoescape=True),
+                )
+            )
+        return query
+
+    def query(self):
+        """Find the libraries on this page, as rows of LIBRARY_COLUMNS."""
+        query = self._filtered(select(self.LIBRARY_COLUMNS))
+        if self.order is None:
+            query = query.order_by(Library.name, Library.id)
+        else:
+            query = query.order_by(*self.order.sort_order_expressions)
+        if self.pagination:
+            query = self.pagination.modify_query(query)
+        return query
+
+    def count(self) -> int:
+        """Count the libraries on every page."""
+        query = self._filtered(select(func.count(Library.id)))
+        return self._db.execute(query).scalar()
+
+    def details(self) -> tuple[list[dict], bool]:
+        """Build the details for each library on this page.
+
+        :return: A list of dicts, one per library, and a boolean that's
+            True if there's another page after this one.
+        """
+        rows = self._db.execute(self.query()).all()
+        has_next = False
+        if self.pagination:
+            rows, has_next = self.pagination.page_loaded(rows)
+        if not rows:
+            return [], has_next
+
+        library_ids = [row.id for row in rows]
+        production_ids = [
+            row.id
+            for row in rows
+            if row.library_stage == Library.PRODUCTION_STAGE
+            and row.registry_stage == Library.PRODUCTION_STAGE
+        ]
+        hyperlinks = self.hyperlinks(library_ids)
+        pls_ids = self.pls_ids(library_ids)
+        areas = self.areas(library_ids)
+        patron_counts = Library.patron_counts_by_library_id(self._db, production_ids)
+
+        result = [
+            self.library_details(
+                row,
+                hyperlinks.get(row.id, {}),
+                pls_ids.get(row.id),
+                patron_counts.get(row.id, 0),
+                areas.get(row.id),
+            )
+            for row in rows
+        ]
+        return result, has_next
+
+    def hyperlinks(self, library_ids) -> dict[int, dict[str, tuple]]:
+        """Find the interesting hyperlinks for the given libraries.
+
+        :return: A dict mapping library ID to a dict mapping each rel
+            to an (href, validated_at) 2-tuple.
+        """
+        query = (
+            select(
+                [
+                    Hyperlink.library_id,
+                    Hyperlink.rel,
+                    Resource.href,
+                    Resource.validation_id,
+                    Validation.started_at,
+                ]
+            )
+            .select_from(Hyperlink)
+            .outerjoin(Resource, Hyperlink.resource_id == Resource.id)
+            .outerjoin(Validation, Resource.validation_id == Validation.id)
+            .where(Hyperlink.library_id.in_(library_ids))
+            .where(Hyperlink.rel.in_(self.HYPERLINK_RELS))
+            .order_by(Hyperlink.id)
+        )
+        hyperlinks = defaultdict(dict)
+        for library_id, rel, href, validation_id, started_at in self._db.execute(query):
+            validated_at = started_at if validation_id is not None else NOT_VALIDATED
+            hyperlinks[library_id][rel] = (href, validated_at)
+        return hyperlinks
+
+    def pls_ids(self, library_ids) -> dict[int, str]:
+        """Find the PLS IDs of the given libraries."""
+        query = select(
+            [ConfigurationSetting.library_id, ConfigurationSetting._value]
+        ).where(
+            ConfigurationSetting.library_id.in_(library_ids),
+            ConfigurationSetting.key == Library.PLS_ID,
+            ConfigurationSetting.external_integration_id.is_(None),
+        )
+        return dict(self._db.execute(query).all())
+
+    def areas(self, library_ids) -> dict[int, dict[str, list[str]]]:
+        """Find the names of the places in each library's focus and service areas."""
+        parent = aliased(Place)
+        query = (
+            select(
+                [
+                    ServiceArea.library_id,
+                    ServiceArea.type,
+                    Place.type,
+                    Place.external_name,
+                    parent.type,
+                    func.coalesce(parent.abbreviated_name, parent.external_name),
+                ]
+            )
+            .select_from(ServiceArea)
+            .join(Place, ServiceArea.place_id == Place.id)
+            .outerjoin(parent, Place.parent_id == parent.id)
+            .where(ServiceArea.library_id.in_(library_ids))
+            .order_by(ServiceArea.id)
+        )
+        areas = defaultdict(lambda: dict(focus=[], service=[]))
+        keys = {ServiceArea.FOCUS: "focus", ServiceArea.ELIGIBILITY: "service"}
+        for (
+            library_id,
+            area_type,
+            place_type,
+            external_name,
+            parent_type,
+            parent_name,
+        ) in self._db.execute(query):
+            key = keys.get(area_type)
+            if key is None:
+                continue
+            name = Place.format_human_friendly_name(
+                place_type, external_name, parent_type, parent_name
+            )
+            areas[library_id][key].append(name or "Everywhere")
+        return areas
+
+    @classmethod
+    def library_details(cls, row, hyperlinks, pls_id, patron_count, areas) -> dict:
+        """Put together the details of one library.
+
+        :param row: A row of LIBRARY_COLUMNS.
+        :param hyperlinks: A dict mapping rel to (href, validated_at).
+        :param pls_id: The library's PLS ID, if any.
+        :param patron_count: The library's patron count.
+        :param areas: The library's focus and service area names, if any.
+        """
+        contact, help, copyright = (
+            hyperlinks.get(rel, (None, NOT_VALIDATED)) for rel in cls.HYPERLINK_RELS
+        )
+        help_email = email_from_href(help[0])
+        # If we don't have a help email, we might have a help uri.
+        help_url = None if help_email else help[0] or None
+
+        basic_info = dict(
+            name=row.name,
+            short_name=row.short_name,
+            description=row.description,
+            timestamp=row.timestamp,
+            internal_urn=row.internal_urn,
+            online_registration=str(row.online_registration),
+            pls_id=pls_id,
+            number_of_patrons=str(patron_count),
+        )
+        urls_and_contact = dict(
+            contact_email=email_from_href(contact[0]),
+            contact_validated=contact[1],
+            help_email=help_email,
+            help_validated=help[1],
+            copyright_email=email_from_href(copyright[0]),
+            copyright_validated=copyright[1],
+            authentication_url=row.authentication_url,
+            opds_url=row.opds_url,
+            web_url=row.web_url,
+            help_url=help_url,
+        )
+        stages = dict(
+            library_stage=row.library_stage,
+            registry_stage=row.registry_stage,
+        )
+        return dict(
+            uuid=row.internal_urn.split("uuid:")[1],
+            basic_info=basic_info,
+            urls_and_contact=urls_and_contact,
+            areas=areas or dict(focus=[], service=[]),
+            stages=stages,
+        )
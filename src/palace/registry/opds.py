@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import json
 from enum import StrEnum
 from typing import ClassVar
 from urllib.parse import quote, urlencode, urlparse, urlunparse
@@ -11,11 +10,13 @@ from sqlalchemy.orm import Query
 
 from palace.registry.authentication_document import AuthenticationDocument
 from palace.registry.config import Configuration
+from palace.registry.route_links import URLTemplateCache
 from palace.registry.sqlalchemy.constants import LibraryType
 from palace.registry.sqlalchemy.model.configuration_setting import ConfigurationSetting
 from palace.registry.sqlalchemy.model.hyperlink import Hyperlink
 from palace.registry.sqlalchemy.model.library import Library
 from palace.registry.sqlalchemy.model.resource import Validation
+from palace.registry.util import json_serializer
 from palace.registry.util.http import NormalizedMediaType
 
 
@@ -156,7 +157,7 @@ class OPDSCatalog:
     have the same semantics as in the overall OPDS 2 Catalog spec.
     """
 
-    TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+    TIME_FORMAT = json_serializer.TIME_FORMAT
 
     OPDS_TYPE = "application/opds+json"
     OPDS_1_TYPE = "application/atom+xml;profile=opds-catalog;kind=acquisition"
@@ -172,6 +173,10 @@ class OPDSCatalog:
     _NORMALIZED_OPDS2_TYPE = NormalizedMediaType(OPDS_TYPE)
     _NORMALIZED_OPDS1_TYPE = NormalizedMediaType(OPDS_1_TYPE)
 
+    # Templates for the per-library eligibility and focus links, so that
+    # a large feed doesn't go through url_for twice for every library.
+    _url_templates = URLTemplateCache()
+
     # Together the following properties allow a client to fully introspect
     # the feed's facet capabilities from a single page — all available facets,
     # their query parameters and values, defaults, and groupings — without any
@@ -179,6 +184,11 @@ class OPDSCatalog:
 
     # A general use property marking the current entity as the default within a group.
     PALACE_PROPERTIES_DEFAULT = "http://palaceproject.io/terms/properties/default"
+    # Marks a library entry as a tombstone: the library has been removed from the
+    # feed it was previously part of, e.g. because it was cancelled.
+    PALACE_PROPERTIES_REMOVED = "http://palaceproject.io/terms/properties/removed"
+    # Link to the URL a client should use to look for changes later on.
+    PALACE_RESUME_REL = "http://palaceproject.io/terms/rel/resume"
 
     # Type URI identifying a sort-order facet group.
     SORT_FACET_TYPE = "http://palaceproject.io/terms/rel/sort"
@@ -192,13 +202,6 @@ class OPDSCatalog:
     # Facet link property: logical group name linking related sort variants (e.g. asc/desc).
     FACET_GROUP_PROPERTY = "http://palaceproject.io/terms/facet/group"
 
-    @classmethod
-    def _strftime(cls, date):
-        """
-        Format a date the way Atom likes it (RFC3339?)
-        """
-        return date.strftime(cls.TIME_FORMAT)
-
     @classmethod
     def add_link_to_catalog(cls, catalog, children=None, **kwargs):
         link = dict(**kwargs)
@@ -223,6 +226,8 @@ class OPDSCatalog:
         order: OrderFacet | None = None,
         availability: frozenset[AvailabilityFacet] | None = None,
         default_order: OrderFacet | None = None,
+        availability_counts: dict[AvailabilityFacet, int] | None = None,
+        tombstones: set[int] | None = None,
     ):
         """Turn a list of libraries into a catalog.
 
@@ -235,6 +240,11 @@ class OPDSCatalog:
             Controls which facet link gets ``rel="self"`` and ``PALACE_PROPERTIES_DEFAULT``.
             Paginated feeds (``pagination`` is not None) always include facets and fall back
             to MODIFIED when this is omitted.
+        :param availability_counts: Number of libraries under each availability
+            facet (optional). When present, each availability facet link carries
+            its count as ``numberOfItems``.
+        :param tombstones: IDs of libraries in ``libraries`` that should be
+            represented by a tombstone (see `tombstone`) rather than a full entry.
         """
         if not annotator:
             annotator = Annotator()
@@ -258,6 +268,9 @@ class OPDSCatalog:
         for library in libraries:
             if not isinstance(library, Row):
                 library = (library,)
+            if tombstones and library[0].id in tombstones:
+                self.catalog["catalogs"].append(self.tombstone(library[0]))
+                continue
             self.catalog["catalogs"].append(
                 self.library_catalog(
                     *library,
@@ -277,7 +290,11 @@ class OPDSCatalog:
         # Paginated feeds fall back to MODIFIED when default_order is omitted.
         if pagination or default_order is not None:
             self._add_facets(
-                url, order, availability, default_order or OrderFacet.MODIFIED
+                url,
+                order,
+                availability,
+                default_order or OrderFacet.MODIFIED,
+                availability_counts,
             )
 
         annotator.annotate_catalog(self, live=live)
@@ -383,6 +400,7 @@ class OPDSCatalog:
         order: OrderFacet | None,
         availability: frozenset[AvailabilityFacet] | None,
         default_order: OrderFacet = OrderFacet.MODIFIED,
+        availability_counts: dict[AvailabilityFacet, int] | None = None,
     ):
         """Add OPDS 2.0 facet groups (sort and availability) to the catalog.
 
@@ -393,6 +411,8 @@ class OPDSCatalog:
         :param availability: Resolved availability filter, or None if not specified.
         :param default_order: Sort order active when ``order`` is None.
             Also marks which sort link carries ``PALACE_PROPERTIES_DEFAULT``.
+        :param availability_counts: Number of libraries under each availability
+            facet, added to the availability links as ``numberOfItems``.
         """
         parsed = urlparse(base_url)
 
@@ -444,6 +464,8 @@ class OPDSCatalog:
             properties = {self.FACET_VALUE_PROPERTY: facet.value}
             if facet == AvailabilityFacet.PRODUCTION:
                 properties[self.PALACE_PROPERTIES_DEFAULT] = True
+            if availability_counts is not None and facet in availability_counts:
+                properties["numberOfItems"] = availability_counts[facet]
             link = {
                 "href": avail_link_url(facet),
                 "title": facet.label,
@@ -504,7 +526,9 @@ class OPDSCatalog:
         """
         url_for = url_for or flask.url_for
 
-        modified = cls._strftime(library.timestamp)
+        # Timestamps are left as datetimes; the serializer formats them
+        # according to TIME_FORMAT.
+        modified = library.timestamp
         metadata = dict(
             id=library.internal_urn,
             title=library.name,
@@ -573,7 +597,9 @@ class OPDSCatalog:
             (cls.ELIGIBILITY_REL, "library_eligibility"),
             (cls.FOCUS_REL, "library_focus"),
         ):
-            url = url_for(route, uuid=library.internal_urn, _external=True)
+            url = cls._url_templates.url_for(
+                url_for, route, "uuid", library.internal_urn, _external=True
+            )
             cls.add_link_to_catalog(
                 catalog, rel=rel, href=url, type="application/geo+json"
             )
@@ -598,6 +624,21 @@ class OPDSCatalog:
             )
         return catalog
 
+    @classmethod
+    def tombstone(cls, library):
+        """Create a minimal OPDS catalog saying that a library is no longer
+        part of a feed.
+        """
+        modified = library.timestamp
+        metadata = {
+            "id": library.internal_urn,
+            "title": library.name,
+            "modified": modified,
+            "updated": modified,
+            cls.PALACE_PROPERTIES_REMOVED: True,
+        }
+        return dict(metadata=metadata)
+
     @classmethod
     def _hyperlink_args(cls, hyperlink):
         """Turn a Hyperlink into a dictionary of arguments that can
@@ -629,8 +670,11 @@ class OPDSCatalog:
             args["properties"] = properties
         return args
 
+    def __bytes__(self):
+        return json_serializer.dumps(self.catalog)
+
     def __str__(self):
         if self.catalog is None:
             return None
 
-        return json.dumps(self.catalog)
+        return bytes(self).decode("utf8")
@@ -2,15 +2,18 @@
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+import datetime
+from dataclasses import dataclass, field
 
 import flask
+from sqlalchemy import tuple_
 from sqlalchemy.orm import Session
 
 from palace.registry.config import Configuration
 from palace.registry.sqlalchemy.model.configuration_setting import (
     ConfigurationSetting,
 )
+from palace.registry.util.datetime_helpers import utc_now
 
 
 @dataclass(frozen=True)
@@ -122,3 +125,183 @@ class Pagination:
 
     def __repr__(self):
         return f"Pagination(offset={self.offset}, size={self.size}, total_count={self.total_count})"
+
+
+@dataclass(frozen=True)
+class KeysetPagination:
+    """Keyset pagination over a (timestamp, id) pair, for feeds of changes.
+
+    Each page picks up after the last item of the previous page, so a
+    page costs the same no matter how deep into the feed it is. An item
+    modified while a client is paging through the feed reappears further
+    on.
+
+    An item's timestamp is set when it's written to the database, which
+    may be a while before the change is committed and becomes visible.
+    So a change can show up with a timestamp earlier than a cursor a
+    client already has. To make up for that, a cursor also records when
+    it was issued, and resuming from it reads again the items at or
+    before the cursor that were modified in the SAFETY_WINDOW before
+    that time (see reread_query()). Clients may see those items twice;
+    they won't miss them, unless a change takes longer than
+    SAFETY_WINDOW to commit.
+    """
+
+    # Separates the parts of a cursor.
+    CURSOR_SEPARATOR = ","
+
+    # The longest a change is expected to take between being written to
+    # the database and being committed.
+    SAFETY_WINDOW = datetime.timedelta(minutes=10)
+
+    #: Only items modified after this time are included.
+    since: datetime.datetime | None = None
+    #: Among items modified exactly at `since`, only those with a greater ID
+    #: are included. If this is None, all items modified at `since` are excluded.
+    after_id: int | None = None
+    size: int = Pagination.DEFAULT_SIZE
+    #: When the cursor this page resumes from was issued, if known.
+    issued_at: datetime.datetime | None = None
+    #: When this page was requested; cursors for the following page are
+    #: issued at this time.
+    requested_at: datetime.datetime = field(default_factory=utc_now)
+
+    @classmethod
+    def from_request(
+        cls, request: flask.Request, *, _db: Session = None
+    ) -> KeysetPagination:
+        """Parse ``?since=`` and ``?size=`` from a Flask request.
+
+        ``since`` is either an ISO 8601 timestamp or a cursor produced by
+        `cursor()`. The page size is validated the same way as for offset
+        pagination.
+
+        :raise ValueError: If ``since`` can't be parsed.
+        """
+        size = Pagination.from_request(request, _db=_db).size
+        since, after_id, issued_at = cls.parse_since(request.args.get("since"))
+        return cls(since=since, after_id=after_id, size=size, issued_at=issued_at)
+
+    @classmethod
+    def parse_since(
+        cls, value: str | None
+    ) -> tuple[datetime.datetime | None, int | None, datetime.datetime | None]:
+        """Turn a timestamp or cursor into a (timestamp, ID, issued at)
+        3-tuple.
+
+        A timestamp without a time zone is assumed to be in UTC.
+
+        :raise ValueError: If the value can't be parsed.
+        """
+        if not value:
+            return None, None, None
+        parts = value.split(cls.CURSOR_SEPARATOR)
+        if len(parts) > 3:
+            raise ValueError(f"Not a timestamp or cursor: {value}")
+        since = cls._parse_timestamp(parts[0])
+        after_id = int(parts[1]) if len(parts) > 1 else None
+        issued_at = cls._parse_timestamp(parts[2]) if len(parts) > 2 else None
+        return since, after_id, issued_at
+
+    @classmethod
+    def _parse_timestamp(cls, value: str) -> datetime.datetime:
+        timestamp = datetime.datetime.fromisoformat(value)
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=datetime.UTC)
+        return timestamp
+
+    @classmethod
+    def _format_timestamp(cls, timestamp: datetime.datetime) -> str:
+        timestamp = timestamp.astimezone(datetime.UTC).replace(tzinfo=None)
+        return f"{timestamp.isoformat()}Z"
+
+    @classmethod
+    def cursor(
+        cls,
+        timestamp: datetime.datetime,
+        id: int,
+        issued_at: datetime.datetime | None = None,
+    ) -> str:
+        """A value for ``?since=`` that resumes the feed after the given item.
+
+        :param issued_at: When the page the item is on was requested.
+        """
+        parts = [cls._format_timestamp(timestamp), str(id)]
+        if issued_at is not None:
+            parts.append(cls._format_timestamp(issued_at))
+        return cls.CURSOR_SEPARATOR.join(parts)
+
+    def modify_query(self, query, timestamp_column, id_column):
+        """Restrict a query to this page.
+
+        Items with no modification time can't be placed in the feed, or
+        resumed after, so they're left out.
+
+        :param timestamp_column: The column holding each item's modification time.
+        :param id_column: A unique column used to break ties between items
+            with the same timestamp.
+        :return: Modified query, ordered by (timestamp, id), with one extra
+            row to detect a next page.
+        """
+        query = query.filter(timestamp_column.isnot(None))
+        if self.since is not None:
+            if self.after_id is None:
+                query = query.filter(timestamp_column > self.since)
+            else:
+                query = query.filter(
+                    tuple_(timestamp_column, id_column) > (self.since, self.after_id)
+                )
+        return query.order_by(timestamp_column, id_column).limit(self.size + 1)
+
+    def reread_query(self, query, timestamp_column, id_column):
+        """Find the items at or before this page's cursor that may have
+        been committed after the cursor was issued.
+
+        These are the items modified in the SAFETY_WINDOW before the
+        cursor was issued. A cursor issued longer ago than that is
+        assumed to have been issued at the time it points to.
+
+        :return: Modified query, ordered by (timestamp, id), or None if
+            there's nothing to read again.
+        """
+        if self.since is None or self.after_id is None:
+            # Only cursors from this feed are read behind.
+            return None
+        floor = (self.issued_at or self.since) - self.SAFETY_WINDOW
+        if floor >= self.since:
+            return None
+        return query.filter(
+            timestamp_column > floor,
+            tuple_(timestamp_column, id_column) <= (self.since, self.after_id),
+        ).order_by(timestamp_column, id_column)
+
+    def next_cursor(self, last_timestamp=None, last_id=None) -> str | None:
+        """A cursor for the page after this one.
+
+        :param last_timestamp: The timestamp of the last new item on this
+            page, if there was one.
+        :param last_id: The ID of that item.
+        :return: A cursor, or None if the next page starts where this one
+            did.
+        """
+        if last_id is not None:
+            return self.cursor(last_timestamp, last_id, self.requested_at)
+        if self.after_id is not None:
+            # Nothing new, but the window to read again has moved on.
+            return self.cursor(self.since, self.after_id, self.requested_at)
+        return None
+
+    def page_loaded(self, results: list) -> tuple[list, bool]:
+        """Process query results to determine if there's a next page.
+
+        :return: Tuple of (trimmed_results, has_next_page).
+        """
+        if len(results) > self.size:
+            return results[: self.size], True
+        return results, False
+
+    def __repr__(self):
+        return (
+            f"KeysetPagination(since={self.since}, after_id={self.after_id}, "
+            f"size={self.size}, issued_at={self.issued_at})"
+        )
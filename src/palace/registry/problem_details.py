@@ -68,6 +68,12 @@ LIBRARY_NOT_FOUND = pd(
     title=lgt("The library does not exist in this registry."),
 )
 
+REGISTRATION_JOB_NOT_FOUND = pd(
+    "http://librarysimplified.org/terms/problem/registration-job-not-found",
+    404,
+    title=lgt("The registration job does not exist in this registry."),
+)
+
 INVALID_CREDENTIALS = pd(
     "http://librarysimplified.org/terms/problem/invalid-credentials",
     401,
@@ -3,13 +3,15 @@ from __future__ import annotations
 import json
 import logging
 import re
-from io import BytesIO
+import threading
+from collections.abc import Callable
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
 from typing import TYPE_CHECKING
 from urllib.parse import urljoin
 
 import feedparser
 from flask_babel import lazy_gettext as _
-from PIL import Image
 
 from palace.registry.authentication_document import AuthenticationDocument
 from palace.registry.opds import OPDSCatalog
@@ -21,8 +23,9 @@ from palace.registry.problem_details import (
     LIBRARY_ALREADY_IN_PRODUCTION,
     TIMEOUT,
 )
+from palace.registry.sqlalchemy.model.document_fingerprint import DocumentFingerprint
 from palace.registry.sqlalchemy.model.hyperlink import Hyperlink
-from palace.registry.util.file_storage import LibraryLogoStore
+from palace.registry.util.file_storage import InvalidImage, LibraryLogoStore
 from palace.registry.util.http import HTTP, RequestTimedOut
 from palace.registry.util.problem_detail import ProblemDetail
 
@@ -38,11 +41,38 @@ class VerifyLinkRegexes:
 class LibraryRegistrar:
     """Encapsulates the logic of the library registration process."""
 
-    def __init__(self, _db, do_get=HTTP.debuggable_get):
+    # Once the authentication document is in hand, the documents and
+    # images it links to are fetched at the same time, by threads from a
+    # pool shared by every LibraryRegistrar in the process.
+    FETCH_WORKERS = 8
+
+    # Logo images larger than this many bytes are rejected.
+    MAX_LOGO_SIZE = 5 * 1024 * 1024
+    _shared_executor: Executor | None = None
+    _shared_executor_lock = threading.Lock()
+
+    def __init__(
+        self, _db, do_get=HTTP.debuggable_get, executor: Executor | None = None
+    ):
+        """Constructor.
+
+        :param executor: Fetch linked documents with this Executor
+            instead of the shared thread pool.
+        """
         self._db = _db
         self.do_get = do_get
+        self.executor = executor or self.shared_executor()
         self.log = logging.getLogger("Library registrar")
 
+    @classmethod
+    def shared_executor(cls) -> Executor:
+        with cls._shared_executor_lock:
+            if cls._shared_executor is None:
+                cls._shared_executor = ThreadPoolExecutor(
+                    cls.FETCH_WORKERS, thread_name_prefix="registrar-fetch"
+                )
+            return cls._shared_executor
+
     def reregister(self, library):
         """Re-register the given Library by fetching its authentication
         document and updating its record appropriately.
@@ -56,7 +86,29 @@ class LibraryRegistrar:
 
         :return: A ProblemDetail if there's a problem. Otherwise, None.
         """
-        result = self.register(library, library.library_stage)
+        auth_response = None
+        auth_fingerprint = DocumentFingerprint.for_library(
+            library,
+            DocumentFingerprint.AUTHENTICATION_DOCUMENT,
+            library.authentication_url,
+        )
+        opds_fingerprint = DocumentFingerprint.for_library(
+            library, DocumentFingerprint.OPDS_ROOT
+        )
+        if auth_fingerprint and opds_fingerprint:
+            # We've seen this library's documents before, so we only
+            # need to do the work of registration if they've changed.
+            auth_response = self._fetch_authentication_document(
+                library.authentication_url, auth_fingerprint
+            )
+            if isinstance(auth_response, ProblemDetail):
+                return auth_response
+            if auth_fingerprint.unchanged(auth_response):
+                return self._recheck_opds_root(library, opds_fingerprint)
+
+        result = self.register(
+            library, library.library_stage, auth_response=auth_response
+        )
         if isinstance(result, ProblemDetail):
             return result
 
@@ -70,12 +122,40 @@ class LibraryRegistrar:
         # by register() -- only the controller uses that stuff.
         return None
 
-    def register(self, library: Library, library_stage):
+    def _recheck_opds_root(self, library, fingerprint):
+        """Make sure a library's OPDS root feed still links to its
+        authentication document, which hasn't changed since the last
+        time it was registered.
+
+        The library's record was brought up to date with the
+        authentication document at that time, so this is the only
+        thing that might need to be checked again.
+
+        :return: A ProblemDetail if there's a problem. Otherwise, None.
+        """
+        auth_url = library.authentication_url
+        opds_url = fingerprint.url
+        opds_response = self._fetch_opds_root(auth_url, opds_url, fingerprint)
+        if isinstance(opds_response, ProblemDetail):
+            return opds_response
+        if fingerprint.unchanged(opds_response):
+            return None
+        problem = self._check_opds_root(auth_url, opds_url, opds_response)
+        if problem:
+            return problem
+        DocumentFingerprint.record(
+            library, DocumentFingerprint.OPDS_ROOT, opds_url, opds_response
+        )
+        return None
+
+    def register(self, library: Library, library_stage, auth_response=None):
         """Register the given Library with this registry, if possible.
 
         :param library: A Library to register or re-register.
         :param library_stage: The library administrator's proposed value for
             Library.library_stage.
+        :param auth_response: The response to a request for the library's
+            authentication document, if one has already been made.
 
         :return: A ProblemDetail if there's a problem. Otherwise, a 2-tuple
             (auth_document, new_hyperlinks).
@@ -88,18 +168,13 @@ class LibraryRegistrar:
         hyperlinks_to_create = []
 
         auth_url = library.authentication_url
-        auth_response = self._make_request(
-            auth_url,
-            auth_url,
-            _("No Authentication For OPDS document present at %(url)s", url=auth_url),
-            _("Timeout retrieving auth document %(url)s", url=auth_url),
-            _("Error retrieving auth document %(url)s", url=auth_url),
-        )
+        if auth_response is None:
+            auth_response = self._fetch_authentication_document(auth_url)
         if isinstance(auth_response, ProblemDetail):
             return auth_response
         try:
             auth_document = AuthenticationDocument.from_string(
-                self._db, auth_response.content
+                self._db, auth_response.content, library=library
             )
         except Exception as e:
             self.log.error(
@@ -151,49 +226,30 @@ class LibraryRegistrar:
                 return uris
             hyperlinks_to_create.append((rel, uris))
 
+        # Fetch the root OPDS feed and the logo image at the same time.
+        # Nothing is done with either until both have arrived.
+        fetches: list[Callable] = [partial(self._fetch_opds_root, auth_url, opds_url)]
+        if not auth_document.logo and auth_document.logo_link:
+            image_url = auth_document.logo_link.get("href")
+            if image_url:
+                fetches.append(
+                    partial(
+                        self._fetch_logo,
+                        auth_url,
+                        urljoin(opds_url, image_url),
+                        image_url,
+                    )
+                )
+        opds_response, *logo_image = self._fetch_all(fetches)
+
         # Cross-check the opds_url to make sure it links back to the
         # authentication document.
-        opds_response = self._make_request(
-            auth_url,
-            opds_url,
-            _("No OPDS root document present at %(url)s", url=opds_url),
-            _("Timeout retrieving OPDS root document at %(url)s", url=opds_url),
-            _("Error retrieving OPDS root document at %(url)s", url=opds_url),
-            allow_401=True,
-        )
         if isinstance(opds_response, ProblemDetail):
             return opds_response
 
-        content_type = opds_response.headers.get("Content-Type")
-        failure_detail = None
-        if opds_response.status_code == 401:
-            # This is only acceptable if the server returned a copy of
-            # the Authentication For OPDS document we just got.
-            if content_type != AuthenticationDocument.MEDIA_TYPE:
-                failure_detail = _(
-                    "401 response at %(url)s did not yield an Authentication For OPDS document",
-                    url=opds_url,
-                )
-            elif not self.opds_response_links_to_auth_document(opds_response, auth_url):
-                failure_detail = _(
-                    "Authentication For OPDS document guarding %(opds_url)s does not match the one at %(auth_url)s",
-                    opds_url=opds_url,
-                    auth_url=auth_url,
-                )
-        elif not OPDSCatalog.is_opds_type(content_type):
-            failure_detail = _(
-                f"Supposed root document at {opds_url} does not appear to be an OPDS document (content_type={content_type!r}).",
-            )
-        elif not self.opds_response_links_to_auth_document(opds_response, auth_url):
-            failure_detail = _(
-                "OPDS root document at %(opds_url)s does not link back to authentication document %(auth_url)s",
-                opds_url=opds_url,
-                auth_url=auth_url,
-            )
-
-        if failure_detail:
-            self.log.error("Registration of %s failed: %s", auth_url, failure_detail)
-            return INVALID_INTEGRATION_DOCUMENT.detailed(failure_detail)
+        problem = self._check_opds_root(auth_url, opds_url, opds_response)
+        if problem:
+            return problem
 
         auth_url = auth_response.url
 
@@ -212,42 +268,38 @@ class LibraryRegistrar:
 
         if auth_document.logo:
             # Write this data to the storage
-            logo_url = LibraryLogoStore.write_from_b64(library, auth_document.logo)
-            if logo_url:
-                library.logo_url = logo_url
-            else:
-                return INVALID_INTEGRATION_DOCUMENT.detailed(
-                    _("Could upload the logo image to the file storage")
-                )
-        elif auth_document.logo_link:
-            url = auth_document.logo_link.get("href")
-            if url:
-                url = urljoin(opds_url, url)
-            logo_response = self.do_get(url, stream=True)
             try:
-                image = Image.open(logo_response.raw)
-            except Exception:
-                image_url = auth_document.logo_link.get("href")
+                logo_url = LibraryLogoStore.write_from_b64(library, auth_document.logo)
+            except InvalidImage:
                 self.log.error(
-                    "Registration of %s failed: could not read logo image %s",
+                    "Registration of %s failed: could not read embedded logo image",
                     auth_url,
-                    image_url,
                 )
                 return INVALID_INTEGRATION_DOCUMENT.detailed(
-                    _("Could not read logo image %(image_url)s", image_url=image_url)
+                    _("Could not read the logo image in the authentication document")
                 )
-            # Convert to PNG.
-            buffer = BytesIO()
-            image.save(buffer, format="PNG")
+            if logo_url:
+                library.logo_url = logo_url
+            else:
+                return INVALID_INTEGRATION_DOCUMENT.detailed(
+                    _("Could upload the logo image to the file storage")
+                )
+        elif logo_image:
+            [image_data] = logo_image
+            if isinstance(image_data, ProblemDetail):
+                return image_data
 
-            # Upload to the file store
-            logo_url = LibraryLogoStore.write(library, buffer)
+            # Scale the image down, convert it to PNG, and upload it to
+            # the file store, unless that's already been done.
+            try:
+                logo_url = LibraryLogoStore.write_image(library, image_data)
+            except InvalidImage:
+                return self._unreadable_logo(auth_url, image_url)
             if not logo_url:
                 return INVALID_INTEGRATION_DOCUMENT.detailed(
                     _("Could upload the logo image to the file storage")
                 )
             library.logo_url = logo_url
-            buffer.seek(0)
 
         problem = auth_document.update_library(library)
         if problem:
@@ -261,20 +313,188 @@ class LibraryRegistrar:
             )
             return problem
 
+        # Remember these versions of the library's documents, so that
+        # we can tell when they change.
+        DocumentFingerprint.record(
+            library,
+            DocumentFingerprint.AUTHENTICATION_DOCUMENT,
+            library.authentication_url,
+            auth_response,
+        )
+        DocumentFingerprint.record(
+            library, DocumentFingerprint.OPDS_ROOT, opds_url, opds_response
+        )
+
         return auth_document, hyperlinks_to_create
 
+    def _fetch_authentication_document(self, auth_url, fingerprint=None):
+        return self._make_request(
+            auth_url,
+            auth_url,
+            _("No Authentication For OPDS document present at %(url)s", url=auth_url),
+            _("Timeout retrieving auth document %(url)s", url=auth_url),
+            _("Error retrieving auth document %(url)s", url=auth_url),
+            fingerprint=fingerprint,
+        )
+
+    def _fetch_opds_root(self, auth_url, opds_url, fingerprint=None):
+        return self._make_request(
+            auth_url,
+            opds_url,
+            _("No OPDS root document present at %(url)s", url=opds_url),
+            _("Timeout retrieving OPDS root document at %(url)s", url=opds_url),
+            _("Error retrieving OPDS root document at %(url)s", url=opds_url),
+            allow_401=True,
+            fingerprint=fingerprint,
+        )
+
+    def _check_opds_root(self, auth_url, opds_url, opds_response):
+        """Make sure the response to a request for a library's OPDS root
+        feed links back to its authentication document.
+
+        :return: A ProblemDetail if there's a problem. Otherwise, None.
+        """
+        content_type = opds_response.headers.get("Content-Type")
+        failure_detail = None
+        if opds_response.status_code == 401:
+            # This is only acceptable if the server returned a copy of
+            # the Authentication For OPDS document we just got.
+            if content_type != AuthenticationDocument.MEDIA_TYPE:
+                failure_detail = _(
+                    "401 response at %(url)s did not yield an Authentication For OPDS document",
+                    url=opds_url,
+                )
+            elif not self.opds_response_links_to_auth_document(opds_response, auth_url):
+                failure_detail = _(
+                    "Authentication For OPDS document guarding %(opds_url)s does not match the one at %(auth_url)s",
+                    opds_url=opds_url,
+                    auth_url=auth_url,
+                )
+        elif not OPDSCatalog.is_opds_type(content_type):
+            failure_detail = _(
+                f"Supposed root document at {opds_url} does not appear to be an OPDS document (content_type={content_type!r}).",
+            )
+        elif not self.opds_response_links_to_auth_document(opds_response, auth_url):
+            failure_detail = _(
+                "OPDS root document at %(opds_url)s does not link back to authentication document %(auth_url)s",
+                opds_url=opds_url,
+                auth_url=auth_url,
+            )
+
+        if failure_detail:
+            self.log.error("Registration of %s failed: %s", auth_url, failure_detail)
+            return INVALID_INTEGRATION_DOCUMENT.detailed(failure_detail)
+        return None
+
+    def _fetch_all(self, fetches: list[Callable]) -> list:
+        """Make several independent calls at once.
+
+        :param fetches: A list of functions that take no arguments.
+        :return: The return values of the calls, in the same order.
+        """
+        if len(fetches) == 1:
+            # There's nothing to be gained by handing the call to another thread.
+            return [fetches[0]()]
+        futures = [self.executor.submit(fetch) for fetch in fetches]
+        return [future.result() for future in futures]
+
+    def _fetch_logo(self, registration_url, url, image_url):
+        """Download a library's logo image.
+
+        :param url: The absolute URL to the image.
+        :param image_url: The URL to the image as given in the
+            authentication document.
+        :return: The image as a bytestring, or a ProblemDetail.
+        """
+        logo_response = self.do_get(url, stream=True)
+        if (
+            isinstance(logo_response, ProblemDetail)
+            or logo_response.status_code // 100 != 2
+        ):
+            return self._unreadable_logo(registration_url, image_url)
+        try:
+            length = logo_response.headers.get("Content-Length")
+            if length and length.isdigit() and int(length) > self.MAX_LOGO_SIZE:
+                data = None
+            else:
+                data = self._read_at_most(logo_response.raw, self.MAX_LOGO_SIZE)
+        except Exception:
+            return self._unreadable_logo(registration_url, image_url)
+        finally:
+            close = getattr(logo_response, "close", None)
+            if close:
+                close()
+        if data is None:
+            self.log.error(
+                "Registration of %s failed: logo image %s is too large",
+                registration_url,
+                image_url,
+            )
+            return INVALID_INTEGRATION_DOCUMENT.detailed(
+                _(
+                    "Logo image %(image_url)s is larger than %(limit)d bytes",
+                    image_url=image_url,
+                    limit=self.MAX_LOGO_SIZE,
+                )
+            )
+        return data
+
+    @classmethod
+    def _read_at_most(cls, stream, limit, chunk_size=64 * 1024):
+        """Read a stream, giving up if it goes on too long.
+
+        :return: The contents of the stream, or None if it's longer than
+            `limit` bytes.
+        """
+        chunks = []
+        size = 0
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                return b"".join(chunks)
+            size += len(chunk)
+            if size > limit:
+                return None
+            chunks.append(chunk)
+
+    def _unreadable_logo(self, registration_url, image_url):
+        self.log.error(
+            "Registration of %s failed: could not read logo image %s",
+            registration_url,
+            image_url,
+        )
+        return INVALID_INTEGRATION_DOCUMENT.detailed(
+            _("Could not read logo image %(image_url)s", image_url=image_url)
+        )
+
     def _make_request(
-        self, registration_url, url, on_404, on_timeout, on_exception, allow_401=False
+        self,
+        registration_url,
+        url,
+        on_404,
+        on_timeout,
+        on_exception,
+        allow_401=False,
+        fingerprint=None,
     ):
+        """Retrieve one of a library's documents.
+
+        :param fingerprint: A DocumentFingerprint for the last version
+            of the document we saw. If it has validators, the server is
+            asked to send the document only if it's changed.
+        """
         allowed_codes = ["2xx", "3xx", 404]
         if allow_401:
             allowed_codes.append(401)
+        headers = {"Cache-Control": "no-cache"}
+        if fingerprint is not None and fingerprint.url == url:
+            headers.update(fingerprint.conditional_headers())
         try:
             response = self.do_get(
                 url,
                 allowed_response_codes=allowed_codes,
                 timeout=30,
-                headers={"Cache-Control": "no-cache"},
+                headers=headers,
             )
             # We only allowed 404 above so that we could return a more
             # specific problem detail document if it happened.
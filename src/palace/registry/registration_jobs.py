@@ -0,0 +1,172 @@
+"""Run library registrations in the background.
+
+Registering a library means fetching documents and images from the
+library's servers, which can take a long time. A client that sends
+``Prefer: respond-async`` with its registration request gets a 202
+response right away, with a link it can poll for the outcome, and the
+registration itself runs in a RegistrationWorkerPool.
+"""
+
+from __future__ import annotations
+
+import logging
+import urllib.parse
+from collections.abc import Callable
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+
+from palace.registry.sqlalchemy.model.registration_job import RegistrationJob
+
+# The preference (RFC 7240) a client sends to ask for asynchronous processing.
+RESPOND_ASYNC = "respond-async"
+
+
+def prefers_async(headers) -> bool:
+    """Does this request include ``Prefer: respond-async``?"""
+    for header in headers.getlist("Prefer"):
+        for preference in header.split(","):
+            if preference.split(";", 1)[0].strip().lower() == RESPOND_ASYNC:
+                return True
+    return False
+
+
+def url_builder(flask_app, base_url: str) -> Callable[..., str]:
+    """A url_for function that builds absolute URLs for `flask_app` as
+    though a request had been sent to `base_url`.
+
+    Unlike flask.url_for, this doesn't need a request context.
+    """
+    parts = urllib.parse.urlsplit(base_url)
+    adapter = flask_app.url_map.bind(
+        parts.netloc,
+        script_name=parts.path or "/",
+        url_scheme=parts.scheme or "http",
+    )
+
+    def url_for(endpoint, **values):
+        # Options like _external are for flask.url_for; these URLs are
+        # always absolute.
+        values = {k: v for k, v in values.items() if not k.startswith("_")}
+        return adapter.build(endpoint, values, force_external=True)
+
+    return url_for
+
+
+@dataclass(frozen=True)
+class RegistrationRequest:
+    """Everything registration needs to know about a request to register."""
+
+    authentication_url: str
+    contact: str | None = None
+    library_stage: str | None = None
+
+    # If the request was authenticated with a library's shared secret,
+    # the ID of that library.
+    library_id: int | None = None
+
+    reset_shared_secret: bool = False
+
+    @property
+    def elevated_permissions(self) -> bool:
+        """Did the requestor prove they speak for an existing library?"""
+        return self.library_id is not None
+
+    def job_fields(self) -> dict:
+        """The fields of a RegistrationJob that will carry out this request."""
+        return dict(
+            authentication_url=self.authentication_url,
+            contact=self.contact,
+            library_stage=self.library_stage,
+            library_id=self.library_id,
+            reset_shared_secret=self.reset_shared_secret,
+        )
+
+    @classmethod
+    def from_job(cls, job: RegistrationJob) -> RegistrationRequest:
+        return cls(
+            authentication_url=job.authentication_url,
+            contact=job.contact,
+            library_stage=job.library_stage,
+            library_id=job.library_id,
+            reset_shared_secret=job.reset_shared_secret,
+        )
+
+
+class RegistrationWorkerPool:
+    """A pool of threads that run registration jobs.
+
+    Each job gets a database session of its own from `session_factory`,
+    since a Session can't be shared between threads. The job runs in an
+    application context rather than a request context, so nothing tears
+    down or commits the session used to handle requests. Links are built
+    with a url_for function bound to the URL the registration request
+    was sent to.
+    """
+
+    DEFAULT_WORKERS = 4
+
+    def __init__(
+        self,
+        run_job: Callable[..., object],
+        max_workers: int = DEFAULT_WORKERS,
+        executor: Executor | None = None,
+        session_factory: Callable[[], object] | None = None,
+    ):
+        """Constructor.
+
+        :param run_job: Called with a job ID, the job's database session
+            (`_db`), a `url_for` function, and any keyword arguments
+            passed into submit(), to run a job.
+        :param max_workers: Number of jobs to run at once. If this is zero,
+            jobs aren't run in this process at all; it's up to
+            RunRegistrationJobsScript to run them.
+        :param executor: Run jobs with this Executor instead of a new
+            thread pool.
+        :param session_factory: Creates a database session for each job.
+            If this is None, `_db` is None and the job uses whatever
+            session it has.
+        """
+        self.log = logging.getLogger("Registration worker pool")
+        self.run_job = run_job
+        self.session_factory = session_factory
+        self.max_workers = max_workers
+        self._executor = executor
+
+    @property
+    def executor(self) -> Executor | None:
+        # Threads aren't started until there's a job for them.
+        if self._executor is None and self.max_workers > 0:
+            self._executor = ThreadPoolExecutor(
+                self.max_workers, thread_name_prefix="registration"
+            )
+        return self._executor
+
+    def submit(self, flask_app, job_id: int, base_url: str, **kwargs) -> bool:
+        """Arrange for a job to be run.
+
+        :param flask_app: The Flask application the job belongs to.
+        :param base_url: The URL the registration request was sent to.
+        :return: True if the job will be run by this pool.
+        """
+        executor = self.executor
+        if executor is None:
+            return False
+        executor.submit(self.run, flask_app, job_id, base_url, **kwargs)
+        return True
+
+    def run(self, flask_app, job_id: int, base_url: str, **kwargs):
+        """Run a job with a database session of its own."""
+        _db = self.session_factory() if self.session_factory else None
+        try:
+            with flask_app.app_context():
+                url_for = url_builder(flask_app, base_url)
+                return self.run_job(job_id, _db=_db, url_for=url_for, **kwargs)
+        except Exception as e:
+            self.log.error("Registration job %s crashed.", job_id, exc_info=e)
+        finally:
+            if _db is not None:
+                _db.close()
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
@@ -1,6 +1,64 @@
 import re
-from collections.abc import Callable, Iterator
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable, Iterator
 from typing import Any, TypedDict
+from urllib.parse import quote
+
+import flask
+
+# Characters werkzeug leaves unquoted when it builds a URL path segment.
+_PATH_SAFE = "!$&'()*+,/:;=@"
+
+
+def url_cache_scope(url_for: Callable[..., str]) -> Hashable | None:
+    """Return a key under which URLs built by `url_for` may be cached.
+
+    A URL depends on the function that built it and on the scheme and host
+    of the current request, so those make up the key. Outside of a request
+    context, or when `url_for` can't be hashed, nothing is cached and None
+    is returned.
+    """
+    if not flask.has_request_context():
+        return None
+    scope = (url_for, flask.request.url_root)
+    try:
+        hash(scope)
+    except TypeError:
+        return None
+    return scope
+
+
+class ScopedURLCache:
+    """Cached URLs, grouped by url_cache_scope().
+
+    The scope includes the host the client asked for, which the client
+    controls, so only the most recently used few scopes are kept. Within
+    a scope there's one entry per route and set of url_for arguments
+    used by the code, so each scope stays small.
+    """
+
+    MAX_SCOPES = 8
+
+    def __init__(self, max_scopes: int = MAX_SCOPES):
+        self.max_scopes = max_scopes
+        self._scopes: OrderedDict[Hashable, dict[Hashable, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def for_scope(self, scope: Hashable) -> dict[Hashable, Any]:
+        """The cached URLs for `scope`."""
+        with self._lock:
+            urls = self._scopes.get(scope)
+            if urls is None:
+                urls = self._scopes[scope] = {}
+                while len(self._scopes) > self.max_scopes:
+                    self._scopes.popitem(last=False)
+            else:
+                self._scopes.move_to_end(scope)
+            return urls
+
+    def __len__(self):
+        return len(self._scopes)
 
 
 class _LinkEntry(TypedDict):
@@ -15,6 +73,8 @@ class RouteLinkRegistry:
 
     def __init__(self):
         self._entries: list[_LinkEntry] = []
+        # Resolved hrefs, by url_cache_scope() and entry position.
+        self._hrefs = ScopedURLCache()
 
     def register(
         self,
@@ -57,16 +117,73 @@ class RouteLinkRegistry:
         :param production_only: Filters links registered with a non-None `production_only` value,
             including only those whose registered value matches this parameter.
         """
-        for entry in self._entries:
+        scope = url_cache_scope(url_for)
+        hrefs = self._hrefs.for_scope(scope) if scope else None
+        for position, entry in enumerate(self._entries):
             if (
                 entry["production_only"] is not None
                 and entry["production_only"] != production_only
             ):
                 continue
-            href = url_for(entry["endpoint"], **entry["url_kwargs"])
             link_attrs = entry["link_attrs"]
-            if link_attrs.get("templated"):
-                # Flask percent-encodes URLs. We need to undo that for `{` and `}` in templated links.
-                href = re.sub(r"%7[Bb]", "{", href)
-                href = re.sub(r"%7[Dd]", "}", href)
+            href = hrefs.get(position) if hrefs is not None else None
+            if href is None:
+                href = url_for(entry["endpoint"], **entry["url_kwargs"])
+                if link_attrs.get("templated"):
+                    # Flask percent-encodes URLs. We need to undo that for `{` and `}` in templated links.
+                    href = re.sub(r"%7[Bb]", "{", href)
+                    href = re.sub(r"%7[Dd]", "}", href)
+                if hrefs is not None:
+                    hrefs[position] = href
             yield {"href": href, **link_attrs}
+
+
+class URLTemplateCache:
+    """Build URLs for routes that take a single path variable.
+
+    The first URL built for a route (within a url_cache_scope()) is built
+    by url_for with a placeholder in place of the variable. Later URLs for
+    the same route are made by splicing the quoted value into that
+    template, which is much cheaper than going through werkzeug again.
+    """
+
+    PLACEHOLDER = "URLTEMPLATEPLACEHOLDER"
+
+    def __init__(self):
+        # Each template is a 2-tuple (prefix, suffix), or None if url_for
+        # didn't produce a URL that could be turned into a template.
+        self._templates = ScopedURLCache()
+
+    def url_for(
+        self,
+        url_for: Callable[..., str],
+        endpoint: str,
+        variable: str,
+        value: str,
+        **kwargs: Any,
+    ) -> str:
+        """Build the URL for `endpoint` with `variable` set to `value`.
+
+        :param url_for: Callable that resolves an endpoint name and kwargs to a URL.
+        :param kwargs: Additional keyword arguments passed to url_for.
+        """
+        scope = url_cache_scope(url_for)
+        if not scope:
+            return url_for(endpoint, **{variable: value}, **kwargs)
+
+        templates = self._templates.for_scope(scope)
+        key = (endpoint, variable, tuple(sorted(kwargs.items())))
+        if key in templates:
+            template = templates[key]
+        else:
+            href = url_for(endpoint, **{variable: self.PLACEHOLDER}, **kwargs)
+            template = None
+            if href.count(self.PLACEHOLDER) == 1:
+                prefix, suffix = href.split(self.PLACEHOLDER)
+                template = (prefix, suffix)
+            templates[key] = template
+
+        if template is None:
+            return url_for(endpoint, **{variable: value}, **kwargs)
+        prefix, suffix = template
+        return prefix + quote(value, safe=_PATH_SAFE) + suffix
@@ -3,23 +3,43 @@ import json
 import logging
 import os
 import sys
-
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import flask
 from alembic.util import CommandError
+from sqlalchemy import inspect
+from sqlalchemy.orm import Query, Session
 
 from palace.registry import db_migration
 from palace.registry.adobe.adobe_vendor_id import AdobeVendorIDClient
 from palace.registry.authentication_document import AuthenticationDocument
 from palace.registry.config import Configuration
 from palace.registry.emailer import Emailer, EmailTemplate
+from palace.registry.export import LibraryExporter, gzip_chunks
 from palace.registry.geometry_loader import GeometryLoader
+from palace.registry.opds import AvailabilityFacet, OrderFacet
+from palace.registry.problem_details import INTEGRATION_ERROR
 from palace.registry.registrar import LibraryRegistrar
+from palace.registry.registration_jobs import RegistrationWorkerPool
 from palace.registry.sqlalchemy.model.configuration_setting import ConfigurationSetting
+from palace.registry.sqlalchemy.model.coverage_fingerprint import CoverageFingerprint
+from palace.registry.sqlalchemy.model.delegated_patron_identifier import (
+    DelegatedPatronIdentifierCount,
+)
 from palace.registry.sqlalchemy.model.external_integration import ExternalIntegration
 from palace.registry.sqlalchemy.model.library import Library, LibraryAlias
+from palace.registry.sqlalchemy.model.library_refresh import LibraryRefresh
 from palace.registry.sqlalchemy.model.place import Place
+from palace.registry.sqlalchemy.model.registration_job import RegistrationJob
 from palace.registry.sqlalchemy.model.service_area import ServiceArea
 from palace.registry.sqlalchemy.session import production_session
 from palace.registry.sqlalchemy.util import get_one, get_one_or_create
+from palace.registry.util.http_client import HTTPClient
 from palace.registry.util.problem_detail import ProblemDetail
 
 
@@ -57,6 +77,55 @@ class Script:
             lines = []
         return lines
 
+    # How many objects batched() loads and commits at a time.
+    BATCH_SIZE = 100
+
+    def batched(self, query, batch_size=None):
+        """Iterate over the objects found by a query, committing and
+        expunging them from the session a batch at a time.
+
+        Iterating over a query in one long-lived session keeps every
+        object it loads, and every object those objects load, in the
+        session's identity map until the script ends. This keeps only one
+        batch's worth at a time, so memory use stays flat however many
+        objects there are.
+
+        The primary keys are found first, in the query's order, so that
+        committing between batches doesn't disturb the iteration. Objects
+        that were already in the session before a batch was loaded are
+        left there.
+
+        :param query: A Query for a model with a single-column primary
+            key. Anything else is iterated over as is.
+        """
+        if not isinstance(query, Query):
+            yield from query
+            return
+        batch_size = batch_size or self.BATCH_SIZE
+        model = query.column_descriptions[0]["entity"]
+        [primary_key] = inspect(model).primary_key
+        ids = [id for [id] in query.with_entities(primary_key).yield_per(1000)]
+        _db = query.session
+        for start in range(0, len(ids), batch_size):
+            batch_ids = ids[start : start + batch_size]
+            already_loaded = set(_db.identity_map.keys())
+            by_id = {
+                getattr(obj, primary_key.key): obj
+                for obj in _db.query(model)
+                .filter(primary_key.in_(batch_ids))
+                .yield_per(batch_size)
+            }
+            for id in batch_ids:
+                if id in by_id:
+                    yield by_id[id]
+            by_id.clear()
+            _db.commit()
+            for key in list(_db.identity_map.keys()):
+                if key not in already_loaded:
+                    obj = _db.identity_map.get(key)
+                    if obj is not None:
+                        _db.expunge(obj)
+
     def __init__(self, _db=None):
         """Basic constructor.
 
@@ -66,6 +135,10 @@ class Script:
         if _db:
             self._session = _db
 
+    def worker_session(self):
+        """Create a database session for a worker thread."""
+        return Session(bind=self._db.get_bind().engine)
+
     def run(self):
         try:
             self.do_run()
@@ -139,6 +212,8 @@ class LoadPlacesScript(Script):
             a += 1
             if not a % 1000:
                 self._db.commit()
+        # Coverage areas may resolve differently now.
+        CoverageFingerprint.clear(self._db)
         self._db.commit()
 
 
@@ -172,6 +247,128 @@ class SearchLibraryScript(Script):
             stdout.write("\n")
 
 
+class ReconcilePatronCountsScript(Script):
+    """Recalculate the stored count of each library's delegated patron
+    identifiers from the identifiers themselves, and fix any that are wrong.
+    """
+
+    @classmethod
+    def arg_parser(cls):
+        parser = super().arg_parser()
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report wrong counts without fixing them.",
+        )
+        return parser
+
+    def run(self, cmd_args=None, stdout=sys.stdout):
+        parsed = self.parse_command_line(self._db, cmd_args)
+        changes = DelegatedPatronIdentifierCount.reconcile(
+            self._db, fix=not parsed.dry_run
+        )
+        for library_id, identifier_type, old, new in changes:
+            stdout.write(f"Library {library_id}, {identifier_type}: {old} -> {new}\n")
+        self._db.commit()
+        stdout.write(f"{len(changes)} count(s) were wrong.\n")
+        return changes
+
+
+class ExportLibrariesScript(Script):
+    """Write every library in the registry as newline-delimited JSON, one
+    OPDS catalog entry per line, the way /libraries/export.ndjson does.
+    """
+
+    @classmethod
+    def arg_parser(cls):
+        parser = super().arg_parser()
+        parser.add_argument(
+            "--output",
+            help="File to write to. By default, the export goes to standard output.",
+        )
+        parser.add_argument(
+            "--gzip", action="store_true", help="Gzip the output as it's written."
+        )
+        parser.add_argument(
+            "--availability",
+            default=AvailabilityFacet.ALL.value,
+            help="Comma-separated availability filter: production, hidden or all.",
+        )
+        parser.add_argument(
+            "--order",
+            default=OrderFacet.NATURAL.value,
+            choices=[facet.value for facet in OrderFacet],
+            help="Order in which to export libraries.",
+        )
+        parser.add_argument(
+            "--include",
+            nargs="*",
+            default=[],
+            choices=LibraryExporter.INCLUDABLE,
+            help="Optional parts of each entry to include.",
+        )
+        parser.add_argument(
+            "--base-url",
+            help="Public URL of the registry, used to build links to its own endpoints. "
+            "By default, the site-wide base_url setting is used.",
+        )
+        return parser
+
+    def __init__(self, _db=None, app=None):
+        """Constructor.
+
+        :param app: The Flask application whose routes are used to build
+            links to the registry's own endpoints.
+        """
+        super().__init__(_db)
+        self.app = app
+
+    def run(self, cmd_args=None, output=None):
+        parsed = self.parse_command_line(self._db, cmd_args)
+        availability = frozenset(
+            AvailabilityFacet(value.strip()) for value in parsed.availability.split(",")
+        )
+        exporter = LibraryExporter(
+            self._db,
+            availability=availability,
+            order=OrderFacet(parsed.order),
+            include_service_areas=LibraryExporter.SERVICE_AREAS in parsed.include,
+            include_collection_summaries=(
+                LibraryExporter.COLLECTION_SUMMARIES in parsed.include
+            ),
+        )
+        base_url = (
+            parsed.base_url
+            or ConfigurationSetting.sitewide(self._db, Configuration.BASE_URL).value
+        )
+
+        if output is None and parsed.output:
+            with open(parsed.output, "wb") as output:
+                return self.export(exporter, base_url, output, parsed.gzip)
+        return self.export(exporter, base_url, output or sys.stdout.buffer, parsed.gzip)
+
+    def export(self, exporter, base_url, output, compress=False):
+        """Write an export to a binary stream.
+
+        :return: The number of libraries exported.
+        """
+        count = 0
+
+        def lines():
+            nonlocal count
+            for line in exporter.lines(flask.url_for):
+                count += 1
+                yield line
+
+        chunks = gzip_chunks(lines()) if compress else lines()
+        with self.app.test_request_context("/", base_url=base_url):
+            for chunk in chunks:
+                output.write(chunk)
+        output.flush()
+        self.log.info("Exported %d libraries.", count)
+        return count
+
+
 class AddLibraryScript(Script):
     @classmethod
     def arg_parser(cls):
@@ -299,6 +496,53 @@ class SetCoverageAreaScript(LibraryScript):
             logging.info("%s: %r", area.type, area.place)
 
 
+class HostConcurrencyLimiter:
+    """Keep track of how many things are happening at once on each host,
+    and make callers wait if there are too many.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._semaphores: dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def host(url) -> str:
+        return (urlparse(url or "").hostname or "").lower()
+
+    @contextmanager
+    def hold(self, url):
+        """Wait until there's room for one more thing to happen on the
+        host of `url`, and take up that room until the block ends.
+        """
+        host = self.host(url)
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = self._semaphores[host] = threading.BoundedSemaphore(
+                    self.limit
+                )
+        with semaphore:
+            yield
+
+    @classmethod
+    def interleave(cls, items, url_for):
+        """Reorder `items` so that items on the same host are spread out,
+        taking one from each host in turn.
+
+        Otherwise a run of items on one host would have every worker but
+        a few waiting on that host.
+        """
+        by_host = defaultdict(list)
+        for item in items:
+            by_host[cls.host(url_for(item))].append(item)
+        queues = list(by_host.values())
+        interleaved = []
+        for i in range(max((len(queue) for queue in queues), default=0)):
+            interleaved.extend(queue[i] for queue in queues if i < len(queue))
+        return interleaved
+
+
 class RegistrationRefreshScript(LibraryScript):
     """Refresh our view of every library in the system based on their current
     authentication document.
@@ -306,31 +550,294 @@ class RegistrationRefreshScript(LibraryScript):
 
     REQUIRES_SINGLE_LIBRARY = False
 
+    # By default, only this many libraries on any one host are refreshed
+    # at once.
+    DEFAULT_PER_HOST_LIMIT = 2
+
+    # Used to decide when the time budget has been used up; tests can
+    # replace it.
+    clock = staticmethod(time.monotonic)
+
+    @classmethod
+    def arg_parser(cls):
+        parser = super().arg_parser()
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="Number of libraries to refresh at once.",
+        )
+        parser.add_argument(
+            "--per-host-limit",
+            type=int,
+            default=cls.DEFAULT_PER_HOST_LIMIT,
+            help=(
+                "Number of libraries whose authentication documents are on "
+                "the same host to refresh at once, when --concurrency is "
+                "more than 1."
+            ),
+        )
+        parser.add_argument(
+            "--budget",
+            type=float,
+            metavar="SECONDS",
+            help=(
+                "Refresh the libraries that have gone longest without a "
+                "successful refresh first, skip libraries that are backing "
+                "off after repeated failures, and stop starting new "
+                "refreshes after this many seconds."
+            ),
+        )
+        return parser
+
     def run(self, cmd_args=None):
+        """Refresh the libraries.
+
+        :return: A 2-tuple (number of successes, number of failures).
+        """
         parsed = self.parse_command_line(self._db, cmd_args)
-        registrar = self.registrar
-        for library in self.libraries(parsed.library):
-            result = registrar.reregister(library)
-            if isinstance(result, ProblemDetail):
-                self.log.error(
-                    "FAILURE %s (%s) uri=%s, title=%s, detail=%s, debug=%s",
-                    library.name,
-                    library.authentication_url,
-                    result.uri,
-                    result.title,
-                    result.detail,
-                    result.debug_message,
-                )
-            else:
-                self.log.info(
-                    "SUCCESS %s (%s)", library.name, library.authentication_url
-                )
+        deadline = None
+        if parsed.budget is not None and not parsed.library:
+            libraries = self.libraries_by_staleness()
+            deadline = self.clock() + parsed.budget
+        else:
+            libraries = self.libraries(parsed.library)
+        if parsed.concurrency > 1:
+            succeeded, failed = self.refresh_concurrently(
+                libraries,
+                parsed.concurrency,
+                max(parsed.per_host_limit, 1),
+                deadline=deadline,
+            )
+        else:
+            succeeded = failed = 0
+            registrar = self.registrar
+            for library in self.batched(libraries):
+                if self.out_of_time(deadline):
+                    break
+                result = registrar.reregister(library)
+                if self.report(library, result):
+                    succeeded += 1
+                else:
+                    # Don't keep any changes a failed refresh made.
+                    self._db.rollback()
+                    failed += 1
+                self.record(library, result)
                 self._db.commit()
+        self.log.info(
+            "Refreshed %d libraries: %d succeeded, %d failed.",
+            succeeded + failed,
+            succeeded,
+            failed,
+        )
+        self.log.info(
+            "HTTP: %(requests)d requests over %(connections)d new connections "
+            "(%(reused)d reused a connection).",
+            HTTPClient.shared().stats.as_dict(),
+        )
+        return succeeded, failed
+
+    def libraries_by_staleness(self):
+        """Find the libraries to refresh when working within a time budget,
+        in the order they should be refreshed.
+        """
+        return LibraryRefresh.stalest_first(self.all_libraries)
+
+    def out_of_time(self, deadline):
+        """Has the time budget been used up?"""
+        if deadline is None or self.clock() < deadline:
+            return False
+        self.log.info("Time budget used up; not refreshing any more libraries.")
+        return True
+
+    def report(self, library, result):
+        """Log the outcome of refreshing a library.
+
+        :return: True if the library was refreshed successfully.
+        """
+        if isinstance(result, ProblemDetail):
+            self.log.error(
+                "FAILURE %s (%s) uri=%s, title=%s, detail=%s, debug=%s",
+                library.name,
+                library.authentication_url,
+                result.uri,
+                result.title,
+                result.detail,
+                result.debug_message,
+            )
+            return False
+        self.log.info("SUCCESS %s (%s)", library.name, library.authentication_url)
+        return True
+
+    def record(self, library, result):
+        """Update the library's LibraryRefresh with the outcome of
+        refreshing it.
+        """
+        problem_uri = result.uri if isinstance(result, ProblemDetail) else None
+        return LibraryRefresh.record(library, problem_uri)
+
+    def refresh_concurrently(
+        self, libraries, concurrency, per_host_limit, deadline=None
+    ):
+        """Refresh libraries in a pool of worker threads.
+
+        Each worker thread has its own database session and commits after
+        each library. The documents a library links to are fetched by a
+        thread pool of the same size, so the registrar's pool, which is
+        shared with the rest of the process, doesn't hold the workers back.
+
+        :param deadline: If the clock passes this time, libraries that
+            haven't been started yet are skipped.
+        :return: A 2-tuple (number of successes, number of failures).
+        """
+        if isinstance(libraries, Query):
+            # Only the IDs and URLs are needed here; each worker loads
+            # its own copy of the library.
+            libraries = libraries.with_entities(Library.id, Library.authentication_url)
+            items = [tuple(row) for row in libraries]
+        else:
+            items = [(library.id, library.authentication_url) for library in libraries]
+        work = HostConcurrencyLimiter.interleave(items, url_for=lambda item: item[1])
+        # Don't hold a transaction open while the workers run.
+        self._db.commit()
+
+        limiter = HostConcurrencyLimiter(per_host_limit)
+        local = threading.local()
+        sessions = []
+        sessions_lock = threading.Lock()
+        stopped = threading.Event()
+
+        def refresh(library_id, authentication_url):
+            _db = getattr(local, "session", None)
+            if _db is None:
+                _db = local.session = self.worker_session()
+                with sessions_lock:
+                    sessions.append(_db)
+            with limiter.hold(authentication_url):
+                if stopped.is_set():
+                    return None
+                if self.out_of_time(deadline):
+                    stopped.set()
+                    return None
+                return self.refresh_one(_db, library_id, executor=fetch_pool)
+
+        with (
+            ThreadPoolExecutor(
+                concurrency, thread_name_prefix="refresh-fetch"
+            ) as fetch_pool,
+            ThreadPoolExecutor(concurrency, thread_name_prefix="refresh") as pool,
+        ):
+            results = list(pool.map(lambda item: refresh(*item), work))
+        for _db in sessions:
+            _db.close()
+        succeeded = results.count(True)
+        return succeeded, results.count(False)
+
+    def refresh_one(self, _db, library_id, executor=None):
+        """Refresh one library in a worker's session.
+
+        If the refresh fails, any changes it made are rolled back, but
+        the failure is still recorded.
+
+        :param executor: The Executor the registrar should use to fetch
+            linked documents.
+
+        :return: True if the library was refreshed successfully.
+        """
+        library = None
+        try:
+            library = _db.get(Library, library_id)
+            if library is None:
+                return False
+            result = self.registrar_for(_db, executor).reregister(library)
+            success = self.report(library, result)
+        except Exception as e:
+            self.log.error("Crashed refreshing library %s.", library_id, exc_info=e)
+            result = INTEGRATION_ERROR
+            success = False
+        try:
+            if not success:
+                _db.rollback()
+            if library is not None:
+                self.record(library, result)
+            _db.commit()
+        except Exception as e:
+            self.log.error(
+                "Could not record refresh of library %s.", library_id, exc_info=e
+            )
+            _db.rollback()
+        return success
 
     @property
     def registrar(self):
         """Overridable method to create a LibraryRegistrar."""
-        return LibraryRegistrar(self._db)
+        return self.registrar_for(self._db)
+
+    def registrar_for(self, _db, executor=None):
+        """Create a LibraryRegistrar that uses the given database session.
+
+        :param executor: See LibraryRegistrar.
+        """
+        return LibraryRegistrar(_db, executor=executor)
+
+
+class RunRegistrationJobsScript(Script):
+    """Run the registration jobs that no web server process is running.
+
+    These are jobs accepted while the web servers' own workers were turned
+    off (see Configuration.REGISTRATION_WORKERS), and jobs abandoned when
+    a web server process stopped partway through one.
+    """
+
+    @classmethod
+    def arg_parser(cls):
+        parser = super().arg_parser()
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of jobs to run at once.",
+        )
+        return parser
+
+    def __init__(self, _db=None, app=None):
+        """Constructor.
+
+        :param app: The Flask application whose LibraryRegistryController
+            runs the jobs.
+        """
+        super().__init__(_db)
+        self.app = app
+
+    def run(self, cmd_args=None):
+        parsed = self.parse_command_line(self._db, cmd_args)
+        controller = self.app.library_registry.registry_controller
+        default_base_url = ConfigurationSetting.sitewide(
+            self._db, Configuration.BASE_URL
+        ).value
+        jobs = (
+            self._db.query(RegistrationJob.id, RegistrationJob.base_url)
+            .filter(RegistrationJob.claimable())
+            .order_by(RegistrationJob.created_at, RegistrationJob.id)
+            .all()
+        )
+        self._db.commit()
+
+        workers = max(parsed.workers, 1)
+        pool = RegistrationWorkerPool(
+            controller.run_registration_job,
+            max_workers=workers,
+            session_factory=self.worker_session,
+        )
+        for job_id, base_url in jobs:
+            base_url = base_url or default_base_url
+            if workers == 1:
+                pool.run(self.app, job_id, base_url)
+            else:
+                pool.submit(self.app, job_id, base_url)
+        pool.shutdown(wait=True)
+        self.log.info("Ran %d registration job(s).", len(jobs))
+        return len(jobs)
 
 
 class AdobeVendorIDAcceptanceTestScript(Script):
@@ -606,6 +1113,14 @@ class ConfigureVendorIDScript(Script):
             default=[],
             help="Delegate Adobe IDs to this URL if no local answer found",
         )
+        parser.add_argument(
+            "--local-first",
+            action="store_true",
+            help=(
+                "Check short client tokens locally before asking the "
+                "delegates, instead of after."
+            ),
+        )
         return parser
 
     def do_run(self, _db=None, cmd_args=None, output=sys.stdout):
@@ -637,6 +1152,9 @@ class ConfigureVendorIDScript(Script):
         integration.setting(Configuration.ADOBE_VENDOR_ID_DELEGATE_URL).value = (
             json.dumps(delegates)
         )
+        integration.setting(c.ADOBE_VENDOR_ID_LOCAL_FIRST).value = (
+            "true" if parsed.local_first else None
+        )
         _db.commit()
 
 
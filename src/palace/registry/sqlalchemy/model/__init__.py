@@ -10,10 +10,14 @@ import palace.registry.sqlalchemy.model.audience
 import palace.registry.sqlalchemy.model.base
 import palace.registry.sqlalchemy.model.collection_summary
 import palace.registry.sqlalchemy.model.configuration_setting
+import palace.registry.sqlalchemy.model.coverage_fingerprint
 import palace.registry.sqlalchemy.model.delegated_patron_identifier
+import palace.registry.sqlalchemy.model.document_fingerprint
 import palace.registry.sqlalchemy.model.external_integration
 import palace.registry.sqlalchemy.model.hyperlink
 import palace.registry.sqlalchemy.model.library
+import palace.registry.sqlalchemy.model.library_refresh
 import palace.registry.sqlalchemy.model.place
+import palace.registry.sqlalchemy.model.registration_job
 import palace.registry.sqlalchemy.model.resource
 import palace.registry.sqlalchemy.model.service_area
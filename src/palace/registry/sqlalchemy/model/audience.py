@@ -7,7 +7,7 @@ from sqlalchemy import Column, ForeignKey, Integer, Table, Unicode, UniqueConstr
 from sqlalchemy.orm import relationship
 
 from palace.registry.sqlalchemy.model.base import Base
-from palace.registry.sqlalchemy.util import get_one_or_create
+from palace.registry.sqlalchemy.util import get_one_or_insert
 
 
 class Audience(Base):
@@ -53,9 +53,23 @@ class Audience(Base):
     def lookup(cls, _db, name):
         if name not in cls.KNOWN_AUDIENCES:
             raise ValueError(_("Unknown audience: %(name)s", name=name))
-        audience, is_new = get_one_or_create(_db, Audience, name=name)
+        audience, is_new = get_one_or_insert(_db, Audience, name=name)
         return audience
 
+    @classmethod
+    def lookup_all(cls, _db, names):
+        """Look up several Audiences with one query, creating any that
+        don't exist yet.
+        """
+        names = set(names)
+        for name in names:
+            if name not in cls.KNOWN_AUDIENCES:
+                raise ValueError(_("Unknown audience: %(name)s", name=name))
+        audiences = _db.query(Audience).filter(Audience.name.in_(names)).all()
+        missing = names - {audience.name for audience in audiences}
+        audiences.extend(cls.lookup(_db, name) for name in sorted(missing))
+        return audiences
+
 
 # Join table for many-to-many relationship between libraries and audiences
 libraries_audiences = Table(
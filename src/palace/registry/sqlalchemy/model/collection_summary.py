@@ -3,8 +3,9 @@
 from __future__ import annotations
 
 from flask_babel import lazy_gettext as _
-from sqlalchemy import Column, ForeignKey, Index, Integer, Unicode
+from sqlalchemy import Column, ForeignKey, Index, Integer, Unicode, func
 from sqlalchemy.orm.session import Session
+from sqlalchemy.sql.expression import literal_column
 
 from palace.registry.sqlalchemy.model.base import Base
 from palace.registry.sqlalchemy.util import get_one_or_create
@@ -33,7 +34,21 @@ class CollectionSummary(Base):
         :return: An up-to-date CollectionSummary.
         """
         _db = Session.object_session(library)
+        language_code, size = cls.normalize(language, size)
+        summary, is_new = get_one_or_create(
+            _db, CollectionSummary, library=library, language=language_code
+        )
+        summary.size = size
+        return summary
 
+    @classmethod
+    def normalize(cls, language, size):
+        """Check a collection's language and size.
+
+        :return: A 2-tuple (language code, size). The language code may be
+            None.
+        :raise ValueError: If the size isn't a number or is negative.
+        """
         size = int(size)
         if size < 0:
             raise ValueError(_("Collection size cannot be negative."))
@@ -43,12 +58,7 @@ class CollectionSummary(Base):
         # case where the library specifies its collection size but
         # doesn't mention any languages.
         language_code = LanguageCodes.string_to_alpha_3(language)
-
-        summary, is_new = get_one_or_create(
-            _db, CollectionSummary, library=library, language=language_code
-        )
-        summary.size = size
-        return summary
+        return language_code, size
 
 
 Index(
@@ -56,3 +66,16 @@ Index(
     CollectionSummary.language,
     CollectionSummary.size,
 )
+
+
+# A library has at most one CollectionSummary per language, including
+# the unknown language.
+COLLECTION_SUMMARY_LANGUAGE_KEY = func.coalesce(
+    CollectionSummary.language, literal_column("''")
+)
+Index(
+    "ix_collectionsummaries_library_id_language",
+    CollectionSummary.library_id,
+    COLLECTION_SUMMARY_LANGUAGE_KEY,
+    unique=True,
+)
@@ -0,0 +1,109 @@
+"""CoverageFingerprint model for remembering how a library's coverage
+areas were resolved into places.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+
+from sqlalchemy import Column, ForeignKey, Integer, Unicode
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import backref, relationship
+
+from palace.registry.sqlalchemy.model.base import Base
+from palace.registry.sqlalchemy.model.place import Place
+from palace.registry.sqlalchemy.model.service_area import ServiceArea
+
+
+class CoverageFingerprint(Base):
+    """The coverage areas (`service_area` and `focus_area`) a library's
+    authentication document gave the last time they were resolved, and
+    the places they were resolved into.
+
+    Resolving coverage areas means looking up every place named, so
+    if a library's coverage areas haven't changed, the places found
+    last time are used instead.
+
+    Loading places can change what coverage areas resolve into, so all
+    fingerprints are cleared when that happens; see clear().
+    """
+
+    __tablename__ = "coveragefingerprints"
+
+    library_id = Column(Integer, ForeignKey("libraries.id"), primary_key=True)
+    library = relationship(
+        "Library",
+        backref=backref(
+            "coverage_fingerprint", uselist=False, cascade="all, delete-orphan"
+        ),
+    )
+
+    # A hash of the coverage areas; see hash().
+    coverage_hash = Column(Unicode, nullable=False)
+
+    # The IDs of the places the coverage areas were resolved into.
+    eligibility_place_ids = Column(ARRAY(Integer), nullable=False, default=list)
+    focus_place_ids = Column(ARRAY(Integer), nullable=False, default=list)
+
+    @classmethod
+    def hash(cls, service_area, focus_area, default_nation=None) -> str:
+        """A hash of a pair of coverage areas that doesn't depend on
+        how their JSON was formatted.
+
+        :param default_nation: The abbreviation of the nation that a
+            coverage area is assumed to be in if it doesn't name one.
+            This only matters if one of the areas isn't a dictionary.
+        """
+        coverage = dict(service_area=service_area, focus_area=focus_area)
+        if any(area and not isinstance(area, dict) for area in coverage.values()):
+            coverage["default_nation"] = default_nation
+        canonical = json.dumps(coverage, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf8")).hexdigest()
+
+    @property
+    def place_ids_by_type(self) -> dict[str, list[int]]:
+        return {
+            ServiceArea.ELIGIBILITY: list(self.eligibility_place_ids or []),
+            ServiceArea.FOCUS: list(self.focus_place_ids or []),
+        }
+
+    def places_exist(self, _db) -> bool:
+        """Do all of the places found last time still exist?"""
+        place_ids = set(self.eligibility_place_ids or []) | set(
+            self.focus_place_ids or []
+        )
+        if not place_ids:
+            return True
+        found = _db.query(Place.id).filter(Place.id.in_(place_ids)).count()
+        return found == len(place_ids)
+
+    @classmethod
+    def clear(cls, _db):
+        """Forget how every library's coverage areas were resolved, so
+        they're resolved again the next time each library registers.
+        """
+        return _db.query(cls).delete()
+
+    @classmethod
+    def record(cls, library, coverage_hash) -> CoverageFingerprint:
+        """Remember that a library's current ServiceAreas came from
+        coverage areas with the given hash.
+        """
+        fingerprint = library.coverage_fingerprint
+        if fingerprint is None:
+            fingerprint = library.coverage_fingerprint = cls()
+        fingerprint.coverage_hash = coverage_hash
+        areas = sorted(library.service_areas, key=lambda x: x.place_id)
+        fingerprint.eligibility_place_ids = [
+            x.place_id for x in areas if x.type == ServiceArea.ELIGIBILITY
+        ]
+        fingerprint.focus_place_ids = [
+            x.place_id for x in areas if x.type == ServiceArea.FOCUS
+        ]
+        return fingerprint
+
+    def __repr__(self):
+        return "<CoverageFingerprint library={} hash={}>".format(
+            self.library_id, self.coverage_hash
+        )
@@ -1,17 +1,18 @@
-"""DelegatedPatronIdentifier and ShortClientTokenDecoder models."""
+"""DelegatedPatronIdentifier, DelegatedPatronIdentifierCount and ShortClientTokenDecoder models."""
 
 from __future__ import annotations
 
 import datetime
+import threading
+import time
 import uuid
+from collections import OrderedDict
 
-from sqlalchemy import Column, ForeignKey, Integer, String, UniqueConstraint
+from sqlalchemy import Column, ForeignKey, Integer, String, UniqueConstraint, func
+from sqlalchemy.dialects.postgresql import insert
 
 from palace.registry.sqlalchemy.model.base import Base
-from palace.registry.sqlalchemy.util import (
-    get_one,
-    get_one_or_create as base_get_one_or_create,
-)
+from palace.registry.sqlalchemy.util import get_one_or_insert
 from palace.registry.util.datetime_helpers import utc_now
 from palace.registry.util.short_client_token import ShortClientTokenTool
 
@@ -52,7 +53,8 @@ class DelegatedPatronIdentifier(Base):
         """Look up the delegated identifier for the given patron. If there is
         none, create one.
 
-        :param library: The Library in charge of the patron's record.
+        :param library: The Library in charge of the patron's record,
+         or its ID.
 
         :param patron_identifier: An identifier used by that library
          to distinguish between this patron and others. This should be
@@ -74,13 +76,25 @@ class DelegatedPatronIdentifier(Base):
         :return: A 2-tuple (DelegatedPatronIdentifier, is_new)
 
         """
+        create_method_kwargs = None
+        if isinstance(identifier_or_identifier_factory, str):
+            # Insert the delegated identifier along with the rest of the
+            # row, rather than setting it afterwards.
+            create_method_kwargs = dict(
+                delegated_identifier=identifier_or_identifier_factory
+            )
 
-        identifier, is_new = base_get_one_or_create(
+        if isinstance(library, int):
+            library_criteria = dict(library_id=library)
+        else:
+            library_criteria = dict(library=library)
+        identifier, is_new = get_one_or_insert(
             _db,
             DelegatedPatronIdentifier,
-            library=library,
             patron_identifier=patron_identifier,
             type=identifier_type,
+            create_method_kwargs=create_method_kwargs,
+            **library_criteria,
         )
         if is_new:
             if callable(identifier_or_identifier_factory):
@@ -92,8 +106,394 @@ class DelegatedPatronIdentifier(Base):
                 # this is the delegated identifier.
                 delegated_identifier = identifier_or_identifier_factory
             identifier.delegated_identifier = delegated_identifier
+            if identifier.library_id is not None and identifier_type is not None:
+                DelegatedPatronIdentifierCount.increment(
+                    _db, identifier.library_id, identifier_type
+                )
         return identifier, is_new
 
+    @classmethod
+    def delegated_identifier_for(
+        cls,
+        _db,
+        library_id,
+        patron_identifier,
+        identifier_type,
+        identifier_or_identifier_factory,
+        cache=None,
+    ):
+        """Find the delegated identifier for the given patron, creating a
+        DelegatedPatronIdentifier if necessary.
+
+        This is what an Adobe sign-in needs. The same patrons sign in
+        again and again, so the answer usually comes from a
+        DelegatedIdentifierCache without a trip to the database.
+
+        :param cache: A DelegatedIdentifierCache. By default, the cache
+            for this process is used.
+        :return: The delegated identifier, as a string.
+        """
+        cache = cache or DelegatedIdentifierCache.shared()
+        key = (library_id, identifier_type, patron_identifier)
+        delegated_identifier = cache.get(key)
+        if delegated_identifier is not None:
+            return delegated_identifier
+        identifier, is_new = cls.get_one_or_create(
+            _db,
+            library_id,
+            patron_identifier,
+            identifier_type,
+            identifier_or_identifier_factory,
+        )
+        # A new identifier isn't remembered until it's seen again, when
+        # it's sure to have been committed. If the transaction that
+        # created it were rolled back, the cache would hand out an
+        # identifier that isn't stored anywhere.
+        if not is_new and identifier.delegated_identifier is not None:
+            cache.put(key, identifier.delegated_identifier)
+        return identifier.delegated_identifier
+
+    @classmethod
+    def provision(
+        cls,
+        _db,
+        library_id,
+        patron_identifiers,
+        identifier_type,
+        identifier_factory,
+        batch_size=1000,
+    ):
+        """Find or create the delegated identifiers for many of a
+        library's patrons at once.
+
+        Each batch of patrons takes one INSERT ... ON CONFLICT DO NOTHING,
+        which creates every missing identifier, and one SELECT for the
+        identifiers that already existed. The library's
+        DelegatedPatronIdentifierCount goes up by the number created.
+
+        :param patron_identifiers: The library's identifiers for its
+            patrons. Duplicates are ignored.
+        :param identifier_factory: A function that creates a new
+            delegated identifier.
+        :return: A dictionary mapping each patron identifier to its
+            delegated identifier.
+        """
+        table = cls.__table__
+        patron_identifiers = list(dict.fromkeys(patron_identifiers))
+        found = {}
+        created = 0
+        for start in range(0, len(patron_identifiers), batch_size):
+            batch = patron_identifiers[start : start + batch_size]
+            statement = (
+                insert(table)
+                .values(
+                    [
+                        dict(
+                            type=identifier_type,
+                            library_id=library_id,
+                            patron_identifier=patron_identifier,
+                            delegated_identifier=identifier_factory(),
+                        )
+                        for patron_identifier in batch
+                    ]
+                )
+                .on_conflict_do_nothing(
+                    index_elements=[
+                        table.c.type,
+                        table.c.library_id,
+                        table.c.patron_identifier,
+                    ]
+                )
+                .returning(table.c.patron_identifier, table.c.delegated_identifier)
+            )
+            new = dict(_db.execute(statement).all())
+            created += len(new)
+            found.update(new)
+
+            existing = [p for p in batch if p not in new]
+            if existing:
+                found.update(
+                    _db.query(cls.patron_identifier, cls.delegated_identifier).filter(
+                        cls.type == identifier_type,
+                        cls.library_id == library_id,
+                        cls.patron_identifier.in_(existing),
+                    )
+                )
+        if created:
+            DelegatedPatronIdentifierCount.increment(
+                _db, library_id, identifier_type, by=created
+            )
+        return {p: found.get(p) for p in patron_identifiers}
+
+
+class DelegatedIdentifierCache:
+    """Remember the delegated identifiers of the patrons who signed in
+    most recently.
+
+    A patron's delegated identifier never changes once it's been
+    created, so nothing ever needs to be forgotten except to save space.
+    """
+
+    MAX_SIZE = 100000
+
+    _shared: DelegatedIdentifierCache | None = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_size=MAX_SIZE):
+        self.max_size = max_size
+        self._identifiers: OrderedDict[tuple, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls) -> DelegatedIdentifierCache:
+        """The cache for this process."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def get(self, key) -> str | None:
+        with self._lock:
+            delegated_identifier = self._identifiers.get(key)
+            if delegated_identifier is not None:
+                self._identifiers.move_to_end(key)
+            return delegated_identifier
+
+    def put(self, key, delegated_identifier):
+        with self._lock:
+            self._identifiers[key] = delegated_identifier
+            self._identifiers.move_to_end(key)
+            while len(self._identifiers) > self.max_size:
+                self._identifiers.popitem(last=False)
+
+    def __len__(self):
+        return len(self._identifiers)
+
+
+class DelegatedPatronIdentifierCount(Base):
+    """The number of DelegatedPatronIdentifiers of a given type that a
+    library has.
+
+    Counting the identifiers themselves gets slower as patrons sign up,
+    so the count is kept up to date as identifiers are created, in the
+    same transaction. ReconcilePatronCountsScript recalculates the counts
+    from scratch in case they ever drift.
+    """
+
+    __tablename__ = "delegatedpatronidentifiercounts"
+    library_id = Column(Integer, ForeignKey("libraries.id"), primary_key=True)
+    type = Column(String(255), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+    @classmethod
+    def increment(cls, _db, library_id, identifier_type, by=1):
+        """Add to a library's count of identifiers of the given type.
+
+        This is a single INSERT ... ON CONFLICT DO UPDATE, so concurrent
+        increments for the same library don't lose updates.
+        """
+        statement = insert(cls).values(
+            library_id=library_id, type=identifier_type, count=by
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[cls.library_id, cls.type],
+            set_=dict(count=cls.count + statement.excluded.count),
+        )
+        _db.execute(statement)
+
+    @classmethod
+    def counts(cls, _db, library_ids, identifier_type):
+        """Look up the counts for a number of libraries at once.
+
+        :return: A dictionary mapping library IDs to counts. Libraries with
+            no identifiers of this type are left out.
+        """
+        if not library_ids:
+            return {}
+        rows = _db.query(cls.library_id, cls.count).filter(
+            cls.library_id.in_(library_ids), cls.type == identifier_type
+        )
+        return {library_id: count for library_id, count in rows if count}
+
+    @classmethod
+    def reconcile(cls, _db, fix=True):
+        """Recalculate every count from the identifiers themselves.
+
+        :param fix: If False, wrong counts are only reported, not fixed.
+        :return: A list of (library_id, type, old count, new count)
+            4-tuples, one for each count that was wrong.
+        """
+        actual = {
+            (library_id, identifier_type): count
+            for library_id, identifier_type, count in _db.query(
+                DelegatedPatronIdentifier.library_id,
+                DelegatedPatronIdentifier.type,
+                func.count(DelegatedPatronIdentifier.id),
+            )
+            .filter(
+                DelegatedPatronIdentifier.library_id.isnot(None),
+                DelegatedPatronIdentifier.type.isnot(None),
+            )
+            .group_by(
+                DelegatedPatronIdentifier.library_id, DelegatedPatronIdentifier.type
+            )
+        }
+        stored = {
+            (library_id, identifier_type): count
+            for library_id, identifier_type, count in _db.query(
+                cls.library_id, cls.type, cls.count
+            )
+        }
+
+        changes = []
+        for key in sorted(actual.keys() | stored.keys(), key=repr):
+            old, new = stored.get(key, 0), actual.get(key, 0)
+            if old != new:
+                changes.append(key + (old, new))
+        if changes and fix:
+            statement = insert(cls).values(
+                [
+                    dict(library_id=library_id, type=identifier_type, count=new)
+                    for library_id, identifier_type, old, new in changes
+                ]
+            )
+            statement = statement.on_conflict_do_update(
+                index_elements=[cls.library_id, cls.type],
+                set_=dict(count=statement.excluded.count),
+            )
+            _db.execute(statement)
+        return changes
+
+
+class LibraryKeyCache:
+    """Remember, for a while, the ID of the library with each short name
+    and the key for checking the signatures on its short client tokens.
+
+    Every Adobe sign-in with a short client token needs these, and they
+    hardly ever change. When a library's short name or shared secret is
+    changed in this process, its entries are forgotten right away;
+    changes made by other processes are picked up once the entries
+    expire.
+    """
+
+    DEFAULT_TTL = 300
+
+    _shared: LibraryKeyCache | None = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, ttl: float = DEFAULT_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        # short name -> (library ID, prepared key, expiration time)
+        self._entries: dict[str, tuple[int, object, float]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls) -> LibraryKeyCache:
+        """The cache for this process."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def lookup(self, _db, short_name) -> tuple[int, object] | None:
+        """Find the library with the given short name.
+
+        :return: A 2-tuple (library ID, prepared HMAC key), or None if
+            there is no such library. The key is None if the library
+            has no shared secret.
+        """
+        now = self.clock()
+        with self._lock:
+            cached = self._entries.get(short_name)
+        if cached and cached[2] > now:
+            return cached[0], cached[1]
+
+        from palace.registry.sqlalchemy.model.library import Library
+
+        row = (
+            _db.query(Library.id, Library.shared_secret)
+            .filter(Library.short_name == short_name)
+            .one_or_none()
+        )
+        if row is None:
+            return None
+        library_id, secret = row
+        key = None
+        if secret is not None:
+            key = ShortClientTokenTool.signer.prepare_key(secret)
+        if self.ttl > 0:
+            with self._lock:
+                self._entries[short_name] = (library_id, key, now + self.ttl)
+        return library_id, key
+
+    def invalidate(self, short_name=None, library_id=None):
+        """Forget the entry for a short name, and any entry for a
+        library ID.
+        """
+        with self._lock:
+            if short_name is not None:
+                self._entries.pop(short_name, None)
+            if library_id is not None:
+                for name, (cached_id, _, _) in list(self._entries.items()):
+                    if cached_id == library_id:
+                        del self._entries[name]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DelegateAnswerCache:
+    """Remember the Adobe IDs that Vendor ID delegates have given out
+    for short client tokens, until the tokens expire.
+    """
+
+    # Answers are never kept longer than this, even for tokens that
+    # expire later.
+    MAX_TTL = 3600
+
+    # If this many answers are remembered, the oldest are forgotten.
+    MAX_SIZE = 10000
+
+    def __init__(self, max_ttl: float = MAX_TTL, max_size=MAX_SIZE, clock=time.time):
+        self.max_ttl = max_ttl
+        self.max_size = max_size
+        self.clock = clock
+        # key -> (account ID, expiration time)
+        self._answers: dict[tuple[str, str], tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key) -> str | None:
+        now = self.clock()
+        with self._lock:
+            cached = self._answers.get(key)
+            if cached and cached[1] <= now:
+                del self._answers[key]
+                cached = None
+        return cached[0] if cached else None
+
+    def remember(self, key, account_id, expires: datetime.datetime):
+        """Remember a delegate's answer until the token expires."""
+        now = self.clock()
+        until = min(expires.timestamp(), now + self.max_ttl)
+        if until <= now:
+            return
+        with self._lock:
+            if len(self._answers) >= self.max_size:
+                for old_key, (_, old_until) in list(self._answers.items()):
+                    if old_until <= now:
+                        del self._answers[old_key]
+                while len(self._answers) >= self.max_size:
+                    del self._answers[next(iter(self._answers))]
+            self._answers[key] = (account_id, until)
+
+
+class ShortClientTokenRejected(ValueError):
+    """A short client token was not accepted by this registry or by any
+    of its delegates.
+    """
+
 
 class ShortClientTokenDecoder(ShortClientTokenTool):
     """Turn a short client token into a DelegatedPatronIdentifier.
@@ -112,7 +512,23 @@ class ShortClientTokenDecoder(ShortClientTokenTool):
         value = "urn:uuid:0" + u[1:]
         return value
 
-    def __init__(self, node_value, delegates):
+    def __init__(
+        self,
+        node_value,
+        delegates,
+        library_keys=None,
+        local_first=False,
+        delegate_answers=None,
+    ):
+        """Constructor.
+
+        :param library_keys: A LibraryKeyCache. By default, the cache
+            for this process is used.
+        :param local_first: If True, tokens are checked locally, and the
+            delegates are only asked about tokens that fail the check.
+            Otherwise the delegates are asked first.
+        :param delegate_answers: A DelegateAnswerCache.
+        """
         super().__init__()
         if isinstance(node_value, str):
             # The node value may be stored in hex form (that's how
@@ -123,6 +539,9 @@ class ShortClientTokenDecoder(ShortClientTokenTool):
                 node_value = int(node_value)
         self.node_value = node_value
         self.delegates = delegates
+        self.library_keys = library_keys or LibraryKeyCache.shared()
+        self.local_first = local_first
+        self.delegate_answers = delegate_answers or DelegateAnswerCache()
 
     def decode(self, _db, token):
         """Decode a short client token.
@@ -131,21 +550,70 @@ class ShortClientTokenDecoder(ShortClientTokenTool):
 
         :raise ValueError: When the token is not valid for any reason.
         """
+        return self.decode_two_part(_db, *self._split_two_part(token))
+
+    def decode_two_part(self, _db, username, password):
+        """Decode a short client token that has already been split into
+        two parts.
+
+        :raise ShortClientTokenRejected: If this is a short client token,
+            but neither this registry nor any delegate accepts it.
+        :raise ValueError: If this isn't a short client token at all.
+        """
+        library_id, patron_identifier, account_id = self._check(_db, username, password)
+        (
+            delegated_patron_identifier,
+            is_new,
+        ) = DelegatedPatronIdentifier.get_one_or_create(
+            _db,
+            library_id,
+            patron_identifier,
+            DelegatedPatronIdentifier.ADOBE_ACCOUNT_ID,
+            account_id,
+        )
+        return delegated_patron_identifier
+
+    def account_id(self, _db, token):
+        """Find the Adobe account ID for the patron with a short client
+        token. This is all an Adobe sign-in needs, and it can usually be
+        found without going to the database.
+
+        :return: The delegated identifier, as a string.
+        :raise ValueError: As with decode().
+        """
+        return self.account_id_two_part(_db, *self._split_two_part(token))
+
+    def account_id_two_part(self, _db, username, password):
+        """Find the Adobe account ID for the patron with a short client
+        token that has already been split into two parts.
+        """
+        library_id, patron_identifier, account_id = self._check(_db, username, password)
+        return DelegatedPatronIdentifier.delegated_identifier_for(
+            _db,
+            library_id,
+            patron_identifier,
+            DelegatedPatronIdentifier.ADOBE_ACCOUNT_ID,
+            account_id,
+        )
+
+    def _split_two_part(self, token):
+        """Split a short client token into a username and a password."""
         if not token:
             raise ValueError("Cannot decode an empty token.")
         if "|" not in token:
             raise ValueError(
                 'Supposed client token "%s" does not contain a pipe.' % token
             )
+        return token.rsplit("|", 1)
 
-        username, password = token.rsplit("|", 1)
-        return self.decode_two_part(_db, username, password)
+    def _check(self, _db, username, password):
+        """Make sure a short client token is valid, by checking it
+        ourselves or asking the delegates.
 
-    def decode_two_part(self, _db, username, password):
-        """Decode a short client token that has already been split into
-        two parts.
+        :return: A 3-tuple (library ID, patron identifier, account ID).
+            The account ID may be a function that creates a new one.
         """
-        library = patron_identifier = account_id = None
+        patron_identifier = account_id = None
 
         # No matter how we do this, if we're going to create
         # a DelegatedPatronIdentifier, we need to extract the Library
@@ -155,10 +623,65 @@ class ShortClientTokenDecoder(ShortClientTokenTool):
         # If this username/password is not actually a Short Client
         # Token, this will raise an exception, which gives us a quick
         # way to bail out.
-        library, expires, patron_identifier = self._split_token(_db, username)
+        library_id, key, expires, patron_identifier = self._split_token(_db, username)
+
+        local_error = None
+        if self.local_first:
+            # Check the token ourselves, and only bother the delegates
+            # if we can't.
+            try:
+                patron_identifier, account_id = self._verify(_db, username, password)
+            except ValueError as e:
+                local_error = e
+
+        if not account_id:
+            # See if a delegate can give us an Adobe ID (account_id) for
+            # this patron.
+            account_id = self._ask_delegates(username, password, expires)
+
+        if not account_id:
+            if local_error is None:
+                # The delegates couldn't help us; let's try to do it
+                # ourselves.
+                try:
+                    patron_identifier, account_id = self._verify(
+                        _db, username, password
+                    )
+                except ValueError as e:
+                    local_error = e
+            if local_error is not None:
+                raise ShortClientTokenRejected(str(local_error)) from local_error
+
+        # If we got this far, we have a Library, a patron_identifier,
+        # and an account_id.
+        return library_id, patron_identifier, account_id
+
+    def _verify(self, _db, username, password):
+        """Check the signature on a short client token ourselves.
+
+        :return: A 2-tuple (patron identifier, account ID factory)
+        """
+        try:
+            signature = self.adobe_base64_decode(password)
+        except Exception:
+            raise ValueError("Invalid password: %s" % password)
+        return self._decode(_db, username, signature)
 
-        # First see if a delegate can give us an Adobe ID (account_id)
-        # for this patron.
+    def _ask_delegates(self, username, password, expires):
+        """Ask each delegate in turn for the Adobe ID of the patron with
+        this short client token.
+
+        A delegate's answer is remembered until the token expires, so
+        the delegates aren't asked about the same token twice.
+
+        :return: An Adobe account ID, or None if no delegate knows it.
+        """
+        if not self.delegates:
+            return None
+        cache_key = (username, password)
+        account_id = self.delegate_answers.get(cache_key)
+        if account_id:
+            return account_id
         for delegate in self.delegates:
             try:
                 account_id, label, content = delegate.sign_in_standard(
@@ -166,49 +689,28 @@ class ShortClientTokenDecoder(ShortClientTokenTool):
                 )
             except Exception:
                 # This delegate couldn't help us.
-                pass
+                continue
             if account_id:
                 # We got it -- no need to keep checking delegates.
-                break
-
-        if not account_id:
-            # The delegates couldn't help us; let's try to do it
-            # ourselves.
-            try:
-                signature = self.adobe_base64_decode(password)
-            except Exception:
-                raise ValueError("Invalid password: %s" % password)
-
-            patron_identifier, account_id = self._decode(_db, username, signature)
-
-        # If we got this far, we have a Library, a patron_identifier,
-        # and an account_id.
-        (
-            delegated_patron_identifier,
-            is_new,
-        ) = DelegatedPatronIdentifier.get_one_or_create(
-            _db,
-            library,
-            patron_identifier,
-            DelegatedPatronIdentifier.ADOBE_ACCOUNT_ID,
-            account_id,
-        )
-        return delegated_patron_identifier
+                self.delegate_answers.remember(
+                    cache_key, account_id, self.expiration_datetime(expires)
+                )
+                return account_id
+        return None
 
     def _split_token(self, _db, token):
         """Split the 'username' part of a Short Client Token.
 
-        :return: A 3-tuple (Library, expiration, foreign patron identifier)
+        :return: A 4-tuple (library ID, prepared HMAC key for the
+            library's shared secret, expiration, foreign patron identifier)
         """
         if token.count("|") < 2:
             raise ValueError("Invalid client token: %s" % token)
         library_short_name, expiration, patron_identifier = token.split("|", 2)
         library_short_name = library_short_name.upper()
 
-        # Look up the Library object based on short name.
-        from palace.registry.sqlalchemy.model.library import Library
-
-        library = get_one(_db, Library, short_name=library_short_name)
+        # Look up the library based on short name.
+        library = self.library_keys.lookup(_db, library_short_name)
         if not library:
             raise ValueError(
                 'I don\'t know how to handle tokens from library "%s"'
@@ -218,14 +720,31 @@ class ShortClientTokenDecoder(ShortClientTokenTool):
             expiration = float(expiration)
         except ValueError:
             raise ValueError('Expiration time "%s" is not numeric.' % expiration)
-        return library, expiration, patron_identifier
+        library_id, key = library
+        return library_id, key, expiration, patron_identifier
+
+    @classmethod
+    def expiration_datetime(cls, expiration):
+        """Turn the expiration time from a short client token into a
+        datetime.
+
+        Currently there are two ways of specifying a token's expiration
+        date: as a number of minutes since SCT_EPOCH or as a number of
+        seconds since JWT_EPOCH.
+        """
+        # NOTE: The JWT code needs to be removed by the year 4869 or
+        # this will break.
+        if expiration < 1500000000:
+            # This is a number of minutes since the start of 2017.
+            return cls.SCT_EPOCH + datetime.timedelta(minutes=expiration)
+        # This is a number of seconds since the start of 1970.
+        return cls.JWT_EPOCH + datetime.timedelta(seconds=expiration)
 
     def _decode(self, _db, token, supposed_signature):
         """Make sure a client token is properly formatted, correctly signed,
         and not expired.
         """
-        library, expiration, patron_identifier = self._split_token(_db, token)
-        secret = library.shared_secret
+        library_id, key, expiration, patron_identifier = self._split_token(_db, token)
 
         # We don't police the content of the patron identifier but there
         # has to be _something_ there.
@@ -233,26 +752,14 @@ class ShortClientTokenDecoder(ShortClientTokenTool):
             raise ValueError("Token %s has empty patron identifier." % token)
 
         # Don't bother checking an expired token.
-        #
-        # Currently there are two ways of specifying a token's
-        # expiration date: as a number of minutes since self.SCT_EPOCH
-        # or as a number of seconds since self.JWT_EPOCH.
         now = utc_now()
-
-        # NOTE: The JWT code needs to be removed by the year 4869 or
-        # this will break.
-        if expiration < 1500000000:
-            # This is a number of minutes since the start of 2017.
-            expiration = self.SCT_EPOCH + datetime.timedelta(minutes=expiration)
-        else:
-            # This is a number of seconds since the start of 1970.
-            expiration = self.JWT_EPOCH + datetime.timedelta(seconds=expiration)
-
+        expiration = self.expiration_datetime(expiration)
         if expiration < now:
             raise ValueError(f"Token {token} expired at {expiration} (now is {now}).")
 
         # Sign the token and check against the provided signature.
-        key = self.signer.prepare_key(secret)
+        if key is None:
+            raise ValueError("Invalid signature for %s." % token)
         token_bytes = token.encode("utf8")
         actual_signature = self.signer.sign(token_bytes, key)
 
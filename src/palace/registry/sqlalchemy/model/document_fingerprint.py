@@ -0,0 +1,122 @@
+"""DocumentFingerprint model for noticing when a library's documents change."""
+
+from __future__ import annotations
+
+import hashlib
+
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, Unicode, UniqueConstraint
+from sqlalchemy.orm import backref, relationship
+
+from palace.registry.sqlalchemy.model.base import Base
+from palace.registry.util.datetime_helpers import utc_now
+
+
+class DocumentFingerprint(Base):
+    """What we know about the last version we saw of one of a library's
+    documents: the validators its server sent with it, and a hash of its
+    content.
+
+    This lets us ask the server for the document only if it has changed
+    (with If-None-Match and If-Modified-Since), and notice when it hasn't
+    changed even if the server doesn't support conditional requests.
+    """
+
+    __tablename__ = "documentfingerprints"
+
+    # The kinds of document we keep track of.
+    AUTHENTICATION_DOCUMENT = "authentication-document"
+    OPDS_ROOT = "opds-root"
+
+    id = Column(Integer, primary_key=True)
+    library_id = Column(Integer, ForeignKey("libraries.id"), index=True, nullable=False)
+    library = relationship(
+        "Library",
+        backref=backref("document_fingerprints", cascade="all, delete-orphan"),
+    )
+    kind = Column(Unicode, nullable=False)
+
+    # The URL the document was found at. The validators only apply to
+    # this URL.
+    url = Column(Unicode, nullable=False)
+
+    # The ETag and Last-Modified headers sent along with the document.
+    etag = Column(Unicode)
+    last_modified = Column(Unicode)
+
+    # The SHA-256 hash of the document.
+    content_hash = Column(Unicode)
+
+    # When the document was last found to be unchanged or was updated.
+    checked_at = Column(DateTime(timezone=True), default=utc_now, nullable=False)
+
+    __table_args__ = (UniqueConstraint("library_id", "kind"),)
+
+    @classmethod
+    def for_library(cls, library, kind, url=None) -> DocumentFingerprint | None:
+        """Find the fingerprint for one of a library's documents.
+
+        :param url: Only return the fingerprint if it's for a document
+            at this URL.
+        """
+        for fingerprint in library.document_fingerprints:
+            if fingerprint.kind == kind:
+                if url is not None and fingerprint.url != url:
+                    return None
+                return fingerprint
+        return None
+
+    @classmethod
+    def record(cls, library, kind, url, response) -> DocumentFingerprint:
+        """Remember the version of a document found in an HTTP response."""
+        fingerprint = cls.for_library(library, kind)
+        if fingerprint is None:
+            fingerprint = cls(kind=kind)
+            library.document_fingerprints.append(fingerprint)
+        fingerprint.url = url
+        fingerprint.etag = response.headers.get("ETag")
+        fingerprint.last_modified = response.headers.get("Last-Modified")
+        fingerprint.content_hash = cls.hash(response.content)
+        fingerprint.checked_at = utc_now()
+        return fingerprint
+
+    @classmethod
+    def hash(cls, content) -> str:
+        if isinstance(content, str):
+            content = content.encode("utf8")
+        return hashlib.sha256(content or b"").hexdigest()
+
+    def conditional_headers(self) -> dict[str, str]:
+        """Headers that ask the server to send the document only if it's
+        changed.
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def unchanged(self, response) -> bool:
+        """Does this HTTP response show that the document hasn't changed
+        since this fingerprint was taken?
+
+        If it does, the fingerprint is updated with any new validators.
+        """
+        if response.status_code == 304:
+            unchanged = True
+        else:
+            unchanged = self.content_hash == self.hash(response.content)
+        if unchanged:
+            # A 304 response may have new validators; a 200 response
+            # with the same content may have them too.
+            self.etag = response.headers.get("ETag") or self.etag
+            self.last_modified = (
+                response.headers.get("Last-Modified") or self.last_modified
+            )
+            self.checked_at = utc_now()
+        return unchanged
+
+    def __repr__(self):
+        return "<DocumentFingerprint {} {} etag={} hash={}>".format(
+            self.kind, self.url, self.etag, self.content_hash
+        )
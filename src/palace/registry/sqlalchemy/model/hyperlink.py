@@ -9,7 +9,7 @@ from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm.session import Session
 
 from palace.registry.sqlalchemy.model.base import Base
-from palace.registry.sqlalchemy.util import create, get_one_or_create
+from palace.registry.sqlalchemy.util import create, get_one_or_insert
 
 
 class Hyperlink(Base):
@@ -59,7 +59,7 @@ class Hyperlink(Base):
         from palace.registry.sqlalchemy.model.resource import Resource
 
         _db = Session.object_session(self)
-        resource, is_new = get_one_or_create(_db, Resource, href=url)
+        resource, is_new = get_one_or_insert(_db, Resource, href=url)
         self.resource = resource
 
     def notify(self, emailer, url_for):
@@ -5,6 +5,8 @@ from __future__ import annotations
 import random
 import re
 import string
+import threading
+import time
 import uuid
 from collections import Counter, defaultdict
 
@@ -22,7 +24,9 @@ from sqlalchemy import (
     case,
     cast,
     collate,
+    event,
     func,
+    inspect,
     literal_column,
     or_,
     outerjoin,
@@ -38,7 +42,8 @@ from sqlalchemy.sql.expression import join, select
 
 from palace.registry.sqlalchemy.model.audience import libraries_audiences
 from palace.registry.sqlalchemy.model.base import Base
-from palace.registry.sqlalchemy.util import get_one, get_one_or_create
+from palace.registry.sqlalchemy.model.delegated_patron_identifier import LibraryKeyCache
+from palace.registry.sqlalchemy.util import get_one, get_one_or_insert
 from palace.registry.util import GeometryUtility
 from palace.registry.util.datetime_helpers import utc_now
 from palace.registry.util.language import LanguageCodes
@@ -202,11 +207,31 @@ class Library(Base):
 
     @validates("short_name")
     def validate_short_name(self, key, value):
-        if not value:
-            return value
-        if "|" in value:
+        if value and "|" in value:
             raise ValueError("Short name cannot contain the pipe character.")
-        return value.upper()
+        if value:
+            value = value.upper()
+        self._forget_token_keys()
+        if value:
+            LibraryKeyCache.shared().invalidate(short_name=value)
+        return value
+
+    @validates("shared_secret")
+    def validate_shared_secret(self, key, value):
+        self._forget_token_keys()
+        return value
+
+    def _forget_token_keys(self):
+        """Make sure short client tokens aren't checked against this
+        library's old short name or shared secret.
+        """
+        # Don't load anything from the database just to find out which
+        # entries to forget.
+        state = inspect(self)
+        LibraryKeyCache.shared().invalidate(
+            short_name=state.dict.get("short_name"),
+            library_id=state.identity[0] if state.identity else None,
+        )
 
     @classmethod
     def for_short_name(cls, _db, short_name):
@@ -269,20 +294,11 @@ class Library(Base):
 
     @property
     def number_of_patrons(self):
-        from palace.registry.sqlalchemy.model.delegated_patron_identifier import (
-            DelegatedPatronIdentifier,
-        )
-
         db = Session.object_session(self)
         # This is only meaningful if the library is in production.
         if not self.in_production:
             return 0
-        query = db.query(DelegatedPatronIdentifier).filter(
-            DelegatedPatronIdentifier.type
-            == DelegatedPatronIdentifier.ADOBE_ACCOUNT_ID,
-            DelegatedPatronIdentifier.library_id == self.id,
-        )
-        return query.count()
+        return Library.patron_counts_by_library_id(db, [self.id]).get(self.id, 0)
 
     @staticmethod
     def patron_counts_by_library(_db, libraries):
@@ -293,40 +309,33 @@ class Library(Base):
         :param libraries: A list of Library objects.
         :return: A dictionary mapping library IDs to patron counts.
         """
-        from palace.registry.sqlalchemy.model.delegated_patron_identifier import (
-            DelegatedPatronIdentifier,
-        )
-
         # The concept of 'patron count' only makes sense for
         # production libraries.
         library_ids = [library.id for library in libraries if library.in_production]
+        return Library.patron_counts_by_library_id(_db, library_ids)
 
-        # Run the SQL query.
-        counts = (
-            select(
-                [
-                    DelegatedPatronIdentifier.library_id,
-                    func.count(DelegatedPatronIdentifier.id),
-                ],
-            )
-            .where(
-                and_(
-                    DelegatedPatronIdentifier.type
-                    == DelegatedPatronIdentifier.ADOBE_ACCOUNT_ID,
-                    DelegatedPatronIdentifier.library_id.in_(library_ids),
-                )
-            )
-            .group_by(DelegatedPatronIdentifier.library_id)
-            .select_from(DelegatedPatronIdentifier)
-        )
-        rows = _db.execute(counts)
+    @staticmethod
+    def patron_counts_by_library_id(_db, library_ids):
+        """Determine the number of registered Adobe Account IDs
+        (~patrons) for each of the given library IDs.
 
-        # Convert the results to a dictionary.
-        results = dict()
-        for library_id, count in rows:
-            results[library_id] = count
+        Unlike patron_counts_by_library, this doesn't check whether the
+        libraries are in production; that's up to the caller.
+
+        :param _db: A database connection.
+        :param library_ids: A list of Library IDs.
+        :return: A dictionary mapping library IDs to patron counts.
+        """
+        from palace.registry.sqlalchemy.model.delegated_patron_identifier import (
+            DelegatedPatronIdentifier,
+            DelegatedPatronIdentifierCount,
+        )
 
-        return results
+        # The counts are maintained as identifiers are created, so this
+        # is a lookup rather than a count over every identifier.
+        return DelegatedPatronIdentifierCount.counts(
+            _db, library_ids, DelegatedPatronIdentifier.ADOBE_ACCOUNT_ID
+        )
 
     @property
     def in_production(self):
@@ -494,6 +503,104 @@ class Library(Base):
             )
         return or_(*conditions)
 
+    # How long availability_counts() trusts its cached counts. Changes
+    # made by other processes are only noticed once the counts expire.
+    AVAILABILITY_COUNTS_TTL = 60
+
+    # Bumped by libraries_changed() whenever this process adds or
+    # deletes a library, or changes a library's stage.
+    _change_version = 0
+    _change_version_lock = threading.Lock()
+
+    # The most recent result of availability_counts(), as a 3-tuple
+    # (change version, expiration time, counts).
+    _availability_counts_cache = None
+
+    # The clock used to expire the cached counts.
+    _clock = staticmethod(time.monotonic)
+
+    @classmethod
+    def change_version(cls):
+        """Return a number that changes whenever this process adds or
+        deletes a library, or changes a library's stage.
+
+        This costs nothing to look up. It knows nothing about changes
+        made by other processes.
+        """
+        return cls._change_version
+
+    @classmethod
+    def libraries_changed(cls):
+        """Note that the set of libraries, or their stages, has changed."""
+        with cls._change_version_lock:
+            cls._change_version += 1
+
+    @classmethod
+    def availability_counts(cls, _db):
+        """Count the libraries that fall under each availability facet.
+
+        All three counts come from a single GROUP BY query over the two
+        stage columns. The result is cached, so most feed requests don't
+        have to count anything. The cache is kept per process and checked
+        without going to the database. A change made in this process is
+        seen right away, because change_version() moves. A change made by
+        another process is only seen once the cached counts are
+        AVAILABILITY_COUNTS_TTL seconds old.
+
+        :return: A dictionary mapping each AvailabilityFacet to a count.
+        """
+        from palace.registry.opds import AvailabilityFacet
+
+        # Send any changes to the libraries to the database, so that
+        # they bump the change version before it's checked.
+        _db.flush()
+        version = cls.change_version()
+        now = cls._clock()
+        cached = cls._availability_counts_cache
+        if cached is not None and cached[0] == version and now < cached[1]:
+            return dict(cached[2])
+
+        prod = cls.PRODUCTION_STAGE
+        visible = (prod, cls.TESTING_STAGE)
+        counts = {facet: 0 for facet in AvailabilityFacet}
+        rows = _db.query(
+            cls._library_stage, cls.registry_stage, func.count(cls.id)
+        ).group_by(cls._library_stage, cls.registry_stage)
+        for library_stage, registry_stage, count in rows:
+            if library_stage not in visible or registry_stage not in visible:
+                continue
+            counts[AvailabilityFacet.ALL] += count
+            if library_stage == prod and registry_stage == prod:
+                counts[AvailabilityFacet.PRODUCTION] += count
+            else:
+                counts[AvailabilityFacet.HIDDEN] += count
+
+        cls._availability_counts_cache = (
+            version,
+            now + cls.AVAILABILITY_COUNTS_TTL,
+            counts,
+        )
+        return dict(counts)
+
+    @classmethod
+    def availability_count(
+        cls, _db, availability: frozenset[AvailabilityFacet], counts=None
+    ):
+        """Count the libraries matching _availability_restriction(availability).
+
+        :param availability: A frozenset of AvailabilityFacet values.
+        :param counts: A result of availability_counts() to use instead of
+            looking it up again.
+        :return: An integer.
+        """
+        from palace.registry.opds import AvailabilityFacet
+
+        if counts is None:
+            counts = cls.availability_counts(_db)
+        if AvailabilityFacet.ALL in availability:
+            return counts[AvailabilityFacet.ALL]
+        return sum(counts[facet] for facet in availability)
+
     @classmethod
     def relevant(cls, _db, target, language, audiences=None, production=True):
         """Find libraries that are most relevant for a user.
@@ -1078,7 +1185,7 @@ class Library(Base):
             raise ValueError("No Hyperlink hrefs were specified")
         default_href = hrefs[0]
         _db = Session.object_session(self)
-        hyperlink, is_modified = get_one_or_create(
+        hyperlink, is_modified = get_one_or_insert(
             _db,
             Hyperlink,
             library=self,
@@ -1099,6 +1206,40 @@ class Library(Base):
         return None
 
 
+@event.listens_for(Session, "after_flush")
+def _note_library_changes(session, flush_context):
+    """Bump Library.change_version() when a flush adds or deletes a
+    library, or changes a library's stage.
+    """
+    changed = any(isinstance(obj, Library) for obj in session.new) or any(
+        isinstance(obj, Library) for obj in session.deleted
+    )
+    if not changed:
+        for obj in session.dirty:
+            if isinstance(obj, Library):
+                attrs = inspect(obj).attrs
+                if (
+                    attrs._library_stage.history.has_changes()
+                    or attrs.registry_stage.history.has_changes()
+                ):
+                    changed = True
+                    break
+    if changed:
+        Library.libraries_changed()
+        session.info["libraries_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_soft_rollback")
+def _note_library_transaction_end(session, *args):
+    """Counts taken while a change was in progress may have seen it
+    before it was committed, or may not have seen it rolled back, so
+    they can't be trusted once the transaction ends.
+    """
+    if session.info.pop("libraries_changed", False):
+        Library.libraries_changed()
+
+
 class LibraryAlias(Base):
     """An alternate name for a library."""
 
@@ -0,0 +1,106 @@
+"""LibraryRefresh model for keeping track of how refreshing a library
+has gone.
+"""
+
+from __future__ import annotations
+
+import datetime
+
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, Unicode, or_
+from sqlalchemy.orm import backref, relationship
+
+from palace.registry.sqlalchemy.model.base import Base
+from palace.registry.util.datetime_helpers import utc_now
+
+
+class LibraryRefresh(Base):
+    """When we last tried to refresh a library from its authentication
+    document, when we last succeeded, and how it's been going since.
+
+    A library that keeps failing is tried less and less often, so it
+    doesn't take up time that could be spent on libraries that work.
+    """
+
+    __tablename__ = "libraryrefreshes"
+
+    # After the first failure, wait this long before trying again. The
+    # wait doubles after each further failure, up to MAX_BACKOFF.
+    BASE_BACKOFF = datetime.timedelta(hours=1)
+    MAX_BACKOFF = datetime.timedelta(days=7)
+
+    library_id = Column(Integer, ForeignKey("libraries.id"), primary_key=True)
+    library = relationship(
+        "Library",
+        backref=backref("refresh_record", uselist=False, cascade="all, delete-orphan"),
+    )
+
+    last_attempt = Column(DateTime(timezone=True))
+    last_success = Column(DateTime(timezone=True), index=True)
+    consecutive_failures = Column(Integer, nullable=False, default=0)
+
+    # The URI of the ProblemDetail from the last failure, if the last
+    # attempt failed.
+    last_problem_uri = Column(Unicode)
+
+    # Don't try again until this time.
+    retry_after = Column(DateTime(timezone=True), index=True)
+
+    @classmethod
+    def backoff(cls, failures: int) -> datetime.timedelta:
+        """How long to wait after this many failures in a row."""
+        if failures < 1:
+            return datetime.timedelta(0)
+        # Past this point the wait is MAX_BACKOFF anyway; this keeps
+        # the multiplication from overflowing.
+        failures = min(failures, 32)
+        return min(cls.BASE_BACKOFF * 2 ** (failures - 1), cls.MAX_BACKOFF)
+
+    @classmethod
+    def record(cls, library, problem_uri=None, now=None) -> LibraryRefresh:
+        """Record an attempt to refresh a library.
+
+        :param problem_uri: If the attempt failed, the URI of the
+            ProblemDetail explaining why. None means the attempt
+            succeeded.
+        """
+        now = now or utc_now()
+        refresh = library.refresh_record
+        if refresh is None:
+            refresh = library.refresh_record = cls(consecutive_failures=0)
+        refresh.last_attempt = now
+        if problem_uri is None:
+            refresh.last_success = now
+            refresh.consecutive_failures = 0
+            refresh.last_problem_uri = None
+            refresh.retry_after = None
+        else:
+            refresh.consecutive_failures = (refresh.consecutive_failures or 0) + 1
+            refresh.last_problem_uri = problem_uri
+            refresh.retry_after = now + cls.backoff(refresh.consecutive_failures)
+        return refresh
+
+    @classmethod
+    def stalest_first(cls, query, now=None):
+        """Put a query for Libraries in the order they should be refreshed,
+        leaving out libraries that are waiting to be tried again.
+
+        Libraries that have never been refreshed come first, then the
+        ones whose last successful refresh was longest ago.
+        """
+        from palace.registry.sqlalchemy.model.library import Library
+
+        now = now or utc_now()
+        return (
+            query.outerjoin(cls, cls.library_id == Library.id)
+            .filter(or_(cls.retry_after == None, cls.retry_after <= now))
+            .order_by(
+                cls.last_success.asc().nullsfirst(),
+                cls.last_attempt.asc().nullsfirst(),
+                Library.id,
+            )
+        )
+
+    def __repr__(self):
+        return "<LibraryRefresh library={} last_success={} failures={}>".format(
+            self.library_id, self.last_success, self.consecutive_failures
+        )
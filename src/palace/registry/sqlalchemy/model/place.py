@@ -2,9 +2,6 @@
 
 from __future__ import annotations
 
-import json
-
-import uszipcode
 from geoalchemy2 import Geometry
 from sqlalchemy import Column, ForeignKey, Integer, Unicode, UniqueConstraint, func
 from sqlalchemy.orm import backref, relationship
@@ -14,6 +11,8 @@ from palace.registry.config import Configuration
 from palace.registry.sqlalchemy.constants import LibraryType
 from palace.registry.sqlalchemy.model.base import Base
 from palace.registry.sqlalchemy.util import get_one, get_one_or_create
+from palace.registry.util import json_serializer
+from palace.registry.util.zipcode_index import ZipCodeIndex
 
 
 class Place(Base):
@@ -200,13 +199,13 @@ class Place(Base):
         if len(results) == 1:
             # There's only one item, and it is a valid
             # GeoJSON document on its own.
-            return json.loads(results[0])
+            return json_serializer.loads(results[0])
 
         # We have either more or less than one valid item.
         # In either case, a GeometryCollection is appropriate.
         body = {
             "type": "GeometryCollection",
-            "geometries": [json.loads(x) for x in results],
+            "geometries": [json_serializer.loads(x) for x in results],
         }
         return body
 
@@ -261,23 +260,42 @@ class Place(Base):
         :return: A string, or None if there is no human-friendly name for
            this place.
         """
-        if self.type == self.EVERYWHERE:
+        parent_type = parent_name = None
+        if self.parent:
+            parent_type = self.parent.type
+            parent_name = self.parent.abbreviated_name or self.parent.external_name
+        return self.format_human_friendly_name(
+            self.type, self.external_name, parent_type, parent_name
+        )
+
+    @classmethod
+    def format_human_friendly_name(
+        cls, type, external_name, parent_type=None, parent_name=None
+    ):
+        """Generate a human-friendly name from the raw data about a place,
+        for when there's no Place object to hand.
+
+        :param parent_name: The abbreviated name of the place's parent,
+           or its full name if it has no abbreviation.
+        :return: A string, or None if there is no human-friendly name for
+           this place.
+        """
+        if type == cls.EVERYWHERE:
             # 'everywhere' is not a distinct place with a well-known name.
             return None
-        if self.parent and self.parent.type == self.STATE:
-            parent = self.parent.abbreviated_name or self.parent.external_name
-            if self.type == Place.COUNTY:
+        if parent_type == cls.STATE:
+            if type == cls.COUNTY:
                 # Renfrew County, ON
-                return f"{self.external_name} County, {parent}"
-            elif self.type == Place.CITY:
+                return f"{external_name} County, {parent_name}"
+            elif type == cls.CITY:
                 # Montgomery, AL
-                return f"{self.external_name}, {parent}"
+                return f"{external_name}, {parent_name}"
 
         # All other cases:
         #  93203
         #  Texas
         #  France
-        return self.external_name
+        return external_name
 
     def overlaps_not_counting_border(self, qu):
         """Modifies a filter to find places that have points inside this
@@ -417,30 +435,33 @@ class Place(Base):
             # uszipcodes keeps track of places in terms of their state.
             return None
 
-        search = uszipcode.SearchEngine(
-            db_file_path=f"{Configuration.DATADIR}/simple_db.sqlite"
+        # Find every ZIP code for the city with the given name. If the
+        # name isn't an exact match for one of the state's cities,
+        # there won't be any.
+        zip_codes = ZipCodeIndex.shared().zip_codes(self.abbreviated_name, name)
+        if not zip_codes:
+            return None
+
+        # Look up the Places for all of those ZIP codes at once, using
+        # the same rules as lookup_inside(), and return the one for the
+        # first ZIP code we actually know about.
+        from sqlalchemy.orm import aliased
+        from sqlalchemy.orm.session import Session
+
+        _db = Session.object_session(self)
+        parent = aliased(Place)
+        qu = (
+            _db.query(Place)
+            .join(parent, Place.parent_id == parent.id)
+            .filter(Place.type == Place.POSTAL_CODE)
+            .filter(Place.external_name.in_(zip_codes))
+            .filter(or_(Place.parent_id == self.id, parent.parent_id == self.id))
         )
-        state = self.abbreviated_name
-        uszipcode_matches = []
-        if (
-            state in search.state_to_city_mapper
-            and name in search.state_to_city_mapper[state]
-        ):
-            # The given name is an exact match for one of the
-            # cities. Let's look up every ZIP code for that city.
-            # `returns=None` here means to not limit the number of results.
-            uszipcode_matches = search.by_city_and_state(name, state, returns=None)
-
-        # Look up a Place object for each ZIP code and return the
-        # first one we actually know about.
-        #
-        # Set using_external_source to False to eliminate the
-        # possibility of wasted effort or (I don't think this can
-        # happen) infinite recursion.
-        for match in uszipcode_matches:
-            place = self.lookup_inside(match.zipcode, using_external_source=False)
-            if place:
-                return place
+        places = {place.external_name: place for place in qu}
+        for zip_code in zip_codes:
+            if zip_code in places:
+                return places[zip_code]
+        return None
 
     def served_by(self):
         """Find all Libraries with a ServiceArea whose Place overlaps
@@ -0,0 +1,125 @@
+"""RegistrationJob model for registrations processed in the background."""
+
+from __future__ import annotations
+
+import datetime
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Enum,
+    ForeignKey,
+    Integer,
+    Unicode,
+    and_,
+    or_,
+    update,
+)
+
+from palace.registry.sqlalchemy.model.base import Base
+from palace.registry.sqlalchemy.util import generate_secret
+from palace.registry.util.datetime_helpers import utc_now
+
+
+class RegistrationJob(Base):
+    """A library's request to register, accepted now and processed later.
+
+    The job records everything about the request that registration
+    needs, and once registration is done, the response the library would
+    have gotten if it had waited.
+    """
+
+    __tablename__ = "registrationjobs"
+
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    status_enum = Enum(PENDING, RUNNING, SUCCEEDED, FAILED, name="registration_status")
+
+    # A job that has been running this long is assumed to belong to a
+    # worker that died, and may be picked up by another worker.
+    ABANDONED_AFTER = datetime.timedelta(minutes=10)
+
+    id = Column(Integer, primary_key=True)
+
+    # The job is looked up by this hard-to-guess value, rather than its
+    # ID, when the library asks how it's going.
+    token = Column(Unicode, unique=True, nullable=False, default=generate_secret)
+
+    status = Column(status_enum, index=True, nullable=False, default=PENDING)
+
+    # The registration request itself.
+    authentication_url = Column(Unicode, nullable=False)
+    contact = Column(Unicode)
+    library_stage = Column(Unicode)
+    reset_shared_secret = Column(Boolean, default=False, nullable=False)
+
+    # If the request was authenticated with a library's shared secret,
+    # this is that library.
+    library_id = Column(Integer, ForeignKey("libraries.id"), index=True)
+
+    # The URL the registration request was sent to. Links in the
+    # response are generated relative to this.
+    base_url = Column(Unicode)
+
+    created_at = Column(DateTime(timezone=True), nullable=False, default=utc_now)
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+
+    # The response to the registration request.
+    status_code = Column(Integer)
+    media_type = Column(Unicode)
+    response = Column(Unicode)
+
+    @property
+    def finished(self):
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+    @classmethod
+    def claimable(cls, now=None):
+        """A clause matching jobs a worker may claim: pending jobs and jobs
+        abandoned by some other worker.
+        """
+        now = now or utc_now()
+        return or_(
+            cls.status == cls.PENDING,
+            and_(
+                cls.status == cls.RUNNING,
+                cls.started_at < now - cls.ABANDONED_AFTER,
+            ),
+        )
+
+    @classmethod
+    def claim(cls, _db, job_id):
+        """Try to start work on a job.
+
+        This is a single conditional UPDATE, so if two workers go after
+        the same job, only one of them gets it.
+
+        :return: True if the job is now ours; False if it has been
+            claimed by another worker, is finished, or doesn't exist.
+        """
+        now = utc_now()
+        result = _db.execute(
+            update(cls)
+            .where(cls.id == job_id)
+            .where(cls.claimable(now))
+            .values(status=cls.RUNNING, started_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
+    def finish(self, status_code, media_type, response):
+        """Record the outcome of the registration."""
+        self.status = self.SUCCEEDED if status_code < 400 else self.FAILED
+        self.status_code = status_code
+        self.media_type = media_type
+        self.response = response
+        self.finished_at = utc_now()
+
+    def __repr__(self):
+        return "<RegistrationJob {} {} status={}>".format(
+            self.id, self.authentication_url, self.status
+        )
@@ -2,7 +2,23 @@ from __future__ import annotations
 
 import logging
 
+from sqlalchemy import (
+    Index,
+    UniqueConstraint,
+    and_,
+    false,
+    inspect,
+    select,
+    true,
+    union_all,
+)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError, MultipleResultsFound, NoResultFound
+from sqlalchemy.orm import (
+    ColumnProperty,
+    RelationshipProperty,
+    make_transient_to_detached,
+)
 
 from palace.registry.util.string_helpers import random_string
 
@@ -10,6 +26,7 @@ __all__ = [
     "generate_secret",
     "get_one",
     "get_one_or_create",
+    "get_one_or_insert",
     "create",
     "dump_query",
 ]
@@ -72,6 +89,149 @@ def create(db, model, create_method="", create_method_kwargs=None, **kwargs):
     return created, True
 
 
+def get_one_or_insert(db, model, create_method_kwargs=None, **kwargs):
+    """Find or create a database object, like get_one_or_create(), in a
+    single round trip.
+
+    This runs one statement: an INSERT ... ON CONFLICT DO NOTHING
+    RETURNING for the new row, and a SELECT for the existing row in case
+    the INSERT ran into it. No SAVEPOINT is needed, and the row isn't
+    written to if it already exists.
+
+    This only works on PostgreSQL, and only if `kwargs` gives a value
+    other than None for every column of one of the model's unique
+    constraints. (A NULL never conflicts with anything, so NULLs can't be
+    used to find a row.) Otherwise this falls back to
+    get_one_or_create().
+
+    Unlike get_one_or_create(), a conflict with any other unique
+    constraint raises IntegrityError and leaves the transaction unusable.
+
+    :param kwargs: Values for columns or many-to-one relationships, used
+        both to find the object and to create it.
+    :param create_method_kwargs: Values only used to create the object.
+    :return: A 2-tuple (object, is_new).
+    """
+    # Like a query would, send any pending changes to the database
+    # first. This also gives any related objects their IDs.
+    db.flush()
+    values = _column_values(model, kwargs)
+    target = None
+    if values is not None:
+        target = _conflict_target(model, values)
+    if target is None:
+        return get_one_or_create(
+            db, model, create_method_kwargs=create_method_kwargs, **kwargs
+        )
+    create_values = _column_values(model, create_method_kwargs or {})
+    if create_values is None:
+        raise ValueError(f"Can't insert {model.__name__} with {create_method_kwargs!r}")
+
+    table = model.__table__
+    inserted = (
+        insert(table)
+        .values(**values, **create_values)
+        .on_conflict_do_nothing(index_elements=target)
+        .returning(*table.c)
+        .cte("inserted")
+    )
+    existing = select(*table.c, false().label("is_new")).where(
+        and_(*(table.c[name] == value for name, value in values.items()))
+    )
+    statement = union_all(select(*inserted.c, true().label("is_new")), existing)
+    row = db.execute(statement).mappings().first()
+    if row is None:
+        # The INSERT ran into a row that another transaction committed
+        # after this statement started, so the SELECT couldn't see it.
+        # It can be seen now.
+        return db.query(model).filter_by(**kwargs).one(), False
+    return _instance_from_row(db, model, row, kwargs), row["is_new"]
+
+
+def _column_values(model, kwargs):
+    """Turn keyword arguments naming a model's attributes into a dictionary
+    of column values.
+
+    :return: A dictionary, or None if any of the arguments isn't a column
+        or a simple many-to-one relationship.
+    """
+    mapper = inspect(model)
+    values = {}
+    for key, value in kwargs.items():
+        prop = mapper.attrs.get(key)
+        if prop is None:
+            return None
+        if isinstance(prop, ColumnProperty):
+            values[prop.columns[0].name] = value
+        elif isinstance(prop, RelationshipProperty) and not prop.uselist:
+            related = prop.mapper
+            for local, remote in prop.local_remote_pairs:
+                if local.table is not model.__table__:
+                    return None
+                values[local.name] = (
+                    None
+                    if value is None
+                    else getattr(value, related.get_property_by_column(remote).key)
+                )
+        else:
+            return None
+    return values
+
+
+def _conflict_target(model, values):
+    """Find a unique constraint of a model that `values` fully covers
+    with values other than None.
+
+    :return: A list of column names, or None.
+    """
+    table = model.__table__
+    candidates = [
+        constraint.columns
+        for constraint in table.constraints
+        if isinstance(constraint, UniqueConstraint)
+    ]
+    candidates.extend(
+        index.expressions
+        for index in table.indexes
+        if isinstance(index, Index) and index.unique
+    )
+    candidates.extend([column] for column in table.columns if column.unique)
+    for columns in candidates:
+        names = [getattr(column, "name", None) for column in columns]
+        if all(name is not None and values.get(name) is not None for name in names):
+            return names
+    return None
+
+
+def _instance_from_row(db, model, row, kwargs):
+    """Find the object in the session for a row, or make one from the row
+    without querying the database again.
+
+    :param kwargs: The arguments used to find the row. If any of them
+        are related objects, their collections on the other side of the
+        relationship are expired, so that they'll include a new object.
+    """
+    mapper = inspect(model)
+    identity_key = mapper.identity_key_from_primary_key(
+        [row[column.name] for column in mapper.primary_key]
+    )
+    instance = db.identity_map.get(identity_key)
+    if instance is not None:
+        return instance
+    instance = mapper.class_manager.new_instance()
+    for prop in mapper.column_attrs:
+        column = prop.columns[0]
+        if column.table is model.__table__:
+            setattr(instance, prop.key, row[column.name])
+    make_transient_to_detached(instance)
+    db.add(instance)
+    for key, value in kwargs.items():
+        prop = mapper.attrs[key]
+        if isinstance(prop, RelationshipProperty) and value is not None:
+            db.expire(value, [reverse.key for reverse in prop._reverse_property])
+    return instance
+
+
 def dump_query(query):
     from psycopg2.extensions import adapt as sqlescape
     from sqlalchemy.sql import compiler
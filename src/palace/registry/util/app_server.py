@@ -25,6 +25,8 @@ def catalog_response(catalog, cache_for=OPDSCatalog.CACHE_TIME):
 def _make_response(content, content_type, cache_for):
     if isinstance(content, etree._Element):
         content = etree.tostring(content)
+    elif isinstance(content, OPDSCatalog):
+        content = bytes(content)
     elif not isinstance(content, str):
         content = str(content)
 
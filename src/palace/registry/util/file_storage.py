@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import base64
+import hashlib
 import io
 import re
 from abc import ABC, abstractmethod
@@ -10,6 +11,8 @@ from typing import IO, TYPE_CHECKING
 import boto3
 import botocore
 from botocore.config import Config
+from botocore.exceptions import ClientError
+from PIL import Image, ImageOps
 
 from palace.registry.config import Configuration
 from palace.registry.sqlalchemy.model.library import Library
@@ -57,13 +60,29 @@ class FileStorage(ABC):
         return cls.default_storage
 
     @abstractmethod
-    def write(self, name: str, io: IO) -> FileObject | None:
+    def write(
+        self, name: str, io: IO, content_type=None, metadata=None
+    ) -> FileObject | None:
         """Write a file to the storage
         :param name: Name of the file, with the folder path
         :param io: The data stream to be written
+        :param metadata: A dictionary of strings to store along with the file
         """
         ...
 
+    @abstractmethod
+    def metadata(self, name: str) -> dict[str, str] | None:
+        """Get the metadata stored along with a file, without reading the file
+        :param name: The file name, with the path
+        :return: The metadata, or None if there is no such file
+        """
+        ...
+
+    @abstractmethod
+    def file_object(self, name: str) -> FileObject:
+        """Get the file object for a file in the storage"""
+        ...
+
     @abstractmethod
     def get_link(self, obj: FileObject) -> str:
         """Get a downloadable link for a file object"""
@@ -99,7 +118,7 @@ class S3FileStorage(FileStorage):
         self._bucket_name = config.bucket_name
 
     def write(
-        self, name: str, io: IO, content_type="binary/octet-stream"
+        self, name: str, io: IO, content_type="binary/octet-stream", metadata=None
     ) -> FileObject | None:
         response = self.client.put_object(
             Key=name,
@@ -107,13 +126,24 @@ class S3FileStorage(FileStorage):
             Body=io.read(),
             ACL=self.ACL,
             ContentType=content_type,
+            Metadata=metadata or {},
         )
         if response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 200:
-            return FileObject(
-                key=name, container=self._bucket_name, backend=self.BACKEND
-            )
+            return self.file_object(name)
         return None
 
+    def metadata(self, name: str) -> dict[str, str] | None:
+        try:
+            response = self.client.head_object(Key=name, Bucket=self._bucket_name)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return None
+            raise
+        return response.get("Metadata", {})
+
+    def file_object(self, name: str) -> FileObject:
+        return FileObject(key=name, container=self._bucket_name, backend=self.BACKEND)
+
     def delete(self, name: str) -> bool:
         response = self.client.delete_object(Key=name, Bucket=self._bucket_name)
         return response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 204
@@ -125,9 +155,27 @@ class S3FileStorage(FileStorage):
         )
 
 
+class InvalidImage(Exception):
+    """The data given as a library's logo isn't an image we can read."""
+
+
 class LibraryLogoStore:
     """The library logo store mechanism"""
 
+    # Logos are scaled down to fit in a square this many pixels on a side.
+    THUMBNAIL_SIZE = (300, 300)
+
+    # The metadata key for the hash of the image a stored logo was made from.
+    SOURCE_HASH_KEY = "source-sha256"
+
+    # Change this whenever the way logos are made from source images
+    # changes, so that every library's logo is made again.
+    PIPELINE_VERSION = "1"
+
+    # Logos used to be stored in the format they were given in, so a
+    # library may have an old logo stored with one of these extensions.
+    LEGACY_EXTENSIONS = ("jpg", "jpeg")
+
     @classmethod
     def logo_path(self, library: Library, ext: str) -> str:
         """Get the folder path for a library logo
@@ -145,30 +193,85 @@ class LibraryLogoStore:
         return f"logo/{uuid}.{ext}"
 
     @classmethod
-    def write(cls, library: Library, io: IO, format="image/png") -> str | None:
+    def write(
+        cls, library: Library, io: IO, format="image/png", source_hash=None
+    ) -> str | None:
         """Write the logo to the storage
         :param library: The library
         :param io: The data stream
         :param format: The format of the image
+        :param source_hash: The hash of the image the logo was made from
         """
         ext = format if "/" not in format else format.split("/", 1)[1]
+        metadata = {cls.SOURCE_HASH_KEY: source_hash} if source_hash else None
         obj = FileStorage.storage().write(
-            cls.logo_path(library, ext), io, content_type=format
+            cls.logo_path(library, ext), io, content_type=format, metadata=metadata
         )
         if obj:
             return FileStorage.storage().get_link(obj)
 
+    @classmethod
+    def write_image(cls, library: Library, data: bytes) -> str | None:
+        """Make a logo out of an image and write it to the storage.
+
+        The logo is a PNG scaled down to THUMBNAIL_SIZE. If the logo
+        already in the storage was made from the same image, nothing is
+        done. Otherwise, once the new logo is written, any old logo
+        stored under one of the LEGACY_EXTENSIONS is deleted.
+
+        :param library: The library
+        :param data: The image, in any format PIL can read
+        :return: A link to the logo
+        :raise InvalidImage: If the image can't be read
+        """
+        source_hash = cls.source_hash(data)
+        storage = FileStorage.storage()
+        path = cls.logo_path(library, "png")
+        metadata = storage.metadata(path)
+        if metadata and metadata.get(cls.SOURCE_HASH_KEY) == source_hash:
+            return storage.get_link(storage.file_object(path))
+        link = cls.write(library, cls.thumbnail(data), source_hash=source_hash)
+        if link:
+            for ext in cls.LEGACY_EXTENSIONS:
+                storage.delete(cls.logo_path(library, ext))
+        return link
+
+    @classmethod
+    def source_hash(cls, data: bytes) -> str:
+        return hashlib.sha256(cls.PIPELINE_VERSION.encode("ascii") + data).hexdigest()
+
+    @classmethod
+    def thumbnail(cls, data: bytes) -> io.BytesIO:
+        """Turn an image into a PNG no bigger than THUMBNAIL_SIZE.
+
+        :raise InvalidImage: If the image can't be read
+        """
+        try:
+            image = Image.open(io.BytesIO(data))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail(cls.THUMBNAIL_SIZE)
+            if image.mode not in ("1", "L", "LA", "P", "RGB", "RGBA"):
+                image = image.convert("RGBA")
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+        except Exception as e:
+            raise InvalidImage(str(e)) from e
+        buffer.seek(0)
+        return buffer
+
     @classmethod
     def write_from_b64(cls, library: Library, data: str) -> str | None:
-        """Write a data blob, possibly b64 encoded, to the storage"""
+        """Write a data blob, possibly b64 encoded, to the storage
+
+        :raise InvalidImage: If the data is a b64 encoded image that
+            can't be read
+        """
         format = "binary/octet-stream"  # Unknown binary format by default
 
         # Is this is a b64 encoded data blob?
         match = re.match(r"^data:image/(png|jpg|jpeg);base64,", data[:30])
         if match:
-            format = match.group(1)
-            format = f"image/{format}"
-            data = base64.b64decode(data.split(",", 1)[1])
+            return cls.write_image(library, base64.b64decode(data.split(",", 1)[1]))
         elif type(data) is str:
             # If no match, just encode the data
             data = bytes(data, "utf-8")
@@ -7,9 +7,11 @@ from functools import wraps
 from urllib.parse import urljoin
 
 from flask import Response, make_response, request
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.http import http_date
 
 from palace.registry.util import problem_detail
+from palace.registry.util.json_serializer import make_serializer
 from palace.registry.util.language import languages_from_accept
 
 IPV4_REGEX = re.compile(
@@ -38,6 +40,31 @@ IPV4_REGEX = re.compile(
 )
 
 
+class RegistryJSONProvider(DefaultJSONProvider):
+    """A Flask JSON provider that serializes responses with the registry's
+    fast JSON serializer, while keeping Flask's output conventions (sorted
+    keys, escaped non-ASCII characters, HTTP-date datetimes, a trailing
+    newline) so that flask.jsonify() output doesn't change.
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.serializer = make_serializer(
+            default=self.default,
+            sort_keys=self.sort_keys,
+            ensure_ascii=self.ensure_ascii,
+        )
+
+    def response(self, *args, **kwargs):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            # Flask pretty-prints these, which only the json module can do.
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            self.serializer.dumps(obj) + b"\n", mimetype=self.mimetype
+        )
+
+
 def deprecated(
     *,
     deprecation_date: datetime | None = None,
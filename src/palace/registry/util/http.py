@@ -7,6 +7,7 @@ from dataclasses import dataclass
 import requests
 from flask_babel import lazy_gettext as _
 
+from palace.registry.util.http_client import HTTPClient
 from palace.registry.util.problem_detail import (
     JSON_MEDIA_TYPE as PROBLEM_DETAIL_JSON_MEDIA_TYPE,
     ProblemDetail as pd,
@@ -207,11 +208,11 @@ class HTTP:
 
     @classmethod
     def request_with_timeout(cls, http_method, url, *args, **kwargs):
-        """Call requests.request and turn a timeout into a RequestTimedOut
-        exception.
+        """Make a request over the shared HTTPClient's pooled connections,
+        and turn a timeout into a RequestTimedOut exception.
         """
         return cls._request_with_timeout(
-            url, requests.request, http_method, *args, **kwargs
+            url, HTTPClient.shared().request, http_method, *args, **kwargs
         )
 
     @classmethod
@@ -381,7 +382,7 @@ class HTTP:
         logging.info(
             "Making debuggable %s request to %s: kwargs %r", http_method, url, kwargs
         )
-        make_request_with = make_request_with or requests.request
+        make_request_with = make_request_with or HTTPClient.shared().request
         return cls._request_with_timeout(
             url,
             make_request_with,
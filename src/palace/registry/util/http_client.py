@@ -0,0 +1,336 @@
+"""A pooled, keep-alive HTTP client shared by everything in a process
+that talks to other servers.
+
+`requests.request` sets up a new Session, and so a new TCP connection
+and TLS handshake, for every request. HTTPClient keeps connections open
+between requests, keeping a pool of connections for each host it talks
+to, retries requests that fail before the server has done anything,
+and caches DNS lookups.
+"""
+
+from __future__ import annotations
+
+import ipaddress
+import logging
+import os
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+
+def _environment_value(name, default, convert):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return convert(value)
+    except ValueError:
+        logging.getLogger("HTTP client").warning(
+            "Ignoring invalid value for %s: %r", name, value
+        )
+        return default
+
+
+@dataclass(frozen=True)
+class HTTPClientSettings:
+    """How an HTTPClient manages its connections."""
+
+    # Environment variables that override the defaults.
+    POOL_CONNECTIONS_ENVIRONMENT_VARIABLE = "SIMPLIFIED_HTTP_POOL_CONNECTIONS"
+    POOL_MAXSIZE_ENVIRONMENT_VARIABLE = "SIMPLIFIED_HTTP_POOL_MAXSIZE"
+    RETRIES_ENVIRONMENT_VARIABLE = "SIMPLIFIED_HTTP_RETRIES"
+    BACKOFF_FACTOR_ENVIRONMENT_VARIABLE = "SIMPLIFIED_HTTP_BACKOFF_FACTOR"
+    DNS_CACHE_TTL_ENVIRONMENT_VARIABLE = "SIMPLIFIED_HTTP_DNS_CACHE_TTL"
+
+    # The number of hosts to keep a pool of connections open to.
+    pool_connections: int = 32
+
+    # The number of connections to keep open to any one host.
+    pool_maxsize: int = 8
+
+    # The number of times to retry a request that couldn't connect, or
+    # that got one of `retry_statuses` in response. Requests that time
+    # out while waiting for a response are not retried, and neither are
+    # requests (like POST) that aren't idempotent.
+    retries: int = 2
+    retry_statuses: tuple[int, ...] = (502, 503, 504)
+
+    # Wait this many seconds before the first retry, twice as long
+    # before the second, and so on.
+    backoff_factor: float = 0.5
+
+    # The number of seconds to remember a hostname's address. If this
+    # is 0, addresses are looked up for every new connection.
+    dns_cache_ttl: float = 300
+
+    @classmethod
+    def from_environment(cls) -> HTTPClientSettings:
+        defaults = cls()
+        return cls(
+            pool_connections=_environment_value(
+                cls.POOL_CONNECTIONS_ENVIRONMENT_VARIABLE,
+                defaults.pool_connections,
+                int,
+            ),
+            pool_maxsize=_environment_value(
+                cls.POOL_MAXSIZE_ENVIRONMENT_VARIABLE, defaults.pool_maxsize, int
+            ),
+            retries=_environment_value(
+                cls.RETRIES_ENVIRONMENT_VARIABLE, defaults.retries, int
+            ),
+            backoff_factor=_environment_value(
+                cls.BACKOFF_FACTOR_ENVIRONMENT_VARIABLE,
+                defaults.backoff_factor,
+                float,
+            ),
+            dns_cache_ttl=_environment_value(
+                cls.DNS_CACHE_TTL_ENVIRONMENT_VARIABLE,
+                defaults.dns_cache_ttl,
+                float,
+            ),
+        )
+
+    def retry(self) -> Retry:
+        return Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=0,
+            status=self.retries,
+            other=0,
+            status_forcelist=self.retry_statuses,
+            backoff_factor=self.backoff_factor,
+            # Once the retries run out, hand back the last response, and
+            # let the caller decide what to do about the status code.
+            raise_on_status=False,
+        )
+
+
+class DNSCache:
+    """Remember the addresses hostnames resolve to, for a while."""
+
+    def __init__(self, ttl: float, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._addresses: dict[tuple[str, int], tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host: str, port: int) -> str | None:
+        """Find an address for the given host.
+
+        :return: An IP address, or None if the address can't be looked up
+            (in which case the connection will do its own lookup and
+            report the problem).
+        """
+        if self.ttl <= 0 or self.is_address(host):
+            return None
+        key = (host, port)
+        now = self.clock()
+        with self._lock:
+            cached = self._addresses.get(key)
+        if cached and cached[1] > now:
+            return cached[0]
+        try:
+            [(_, _, _, _, sockaddr), *_] = socket.getaddrinfo(
+                host, port, type=socket.SOCK_STREAM
+            )
+        except (OSError, ValueError):
+            return None
+        address = sockaddr[0]
+        with self._lock:
+            self._addresses[key] = (address, now + self.ttl)
+        return address
+
+    def forget(self, host: str, port: int):
+        with self._lock:
+            self._addresses.pop((host, port), None)
+
+    @staticmethod
+    def is_address(host: str) -> bool:
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        return True
+
+
+@dataclass
+class ConnectionStats:
+    """Counts of requests made and connections opened by an HTTPClient.
+
+    Every request that didn't need a new connection reused one.
+    """
+
+    requests: int = 0
+    connections: int = 0
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    @property
+    def reused(self) -> int:
+        return max(self.requests - self.connections, 0)
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def count_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def as_dict(self) -> dict:
+        return dict(
+            requests=self.requests, connections=self.connections, reused=self.reused
+        )
+
+
+class _ConnectionMixin:
+    """Look up addresses in a DNSCache and count new connections.
+
+    urllib3 connects to `_dns_host` but validates TLS certificates
+    against `host`, so pointing `_dns_host` at a cached address leaves
+    certificate checks alone.
+    """
+
+    dns_cache: DNSCache | None = None
+    stats: ConnectionStats | None = None
+
+    def _new_conn(self):
+        if self.stats is not None:
+            self.stats.count_connection()
+        host = getattr(self, "_dns_host", None)
+        address = None
+        if self.dns_cache is not None and host:
+            address = self.dns_cache.resolve(host, self.port)
+        if address is None:
+            return super()._new_conn()
+        self._dns_host = address
+        try:
+            return super()._new_conn()
+        except Exception:
+            # The address may have changed; look it up again next time.
+            self.dns_cache.forget(host, self.port)
+            raise
+        finally:
+            self._dns_host = host
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """An HTTPAdapter whose connections use a DNSCache and report to a
+    ConnectionStats.
+    """
+
+    def __init__(
+        self,
+        settings: HTTPClientSettings,
+        dns_cache: DNSCache | None,
+        stats: ConnectionStats,
+    ):
+        mixin_attributes = dict(dns_cache=dns_cache, stats=stats)
+        http_connection = type(
+            "HTTPConnection", (_ConnectionMixin, HTTPConnection), mixin_attributes
+        )
+        https_connection = type(
+            "HTTPSConnection", (_ConnectionMixin, HTTPSConnection), mixin_attributes
+        )
+        self.pool_classes_by_scheme = dict(
+            http=type(
+                "HTTPConnectionPool",
+                (HTTPConnectionPool,),
+                dict(ConnectionCls=http_connection),
+            ),
+            https=type(
+                "HTTPSConnectionPool",
+                (HTTPSConnectionPool,),
+                dict(ConnectionCls=https_connection),
+            ),
+        )
+        self.stats = stats
+        super().__init__(
+            pool_connections=settings.pool_connections,
+            pool_maxsize=settings.pool_maxsize,
+            max_retries=settings.retry(),
+        )
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self.pool_classes_by_scheme
+
+    def send(self, request, *args, **kwargs):
+        self.stats.count_request()
+        return super().send(request, *args, **kwargs)
+
+
+class HTTPClient:
+    """Make HTTP requests over pooled, keep-alive connections.
+
+    All threads share one PooledHTTPAdapter, so a connection opened by
+    one thread can be reused by any other; urllib3's connection pools
+    are thread-safe. Each thread still gets its own requests.Session,
+    since a Session isn't, but a Session holds no connections of its
+    own and goes away with its thread. Sessions don't keep cookies, so
+    one server can't change what's sent to another.
+    """
+
+    _shared: HTTPClient | None = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, settings: HTTPClientSettings | None = None):
+        self.settings = settings or HTTPClientSettings()
+        self.dns_cache = (
+            DNSCache(self.settings.dns_cache_ttl)
+            if self.settings.dns_cache_ttl > 0
+            else None
+        )
+        self.stats = ConnectionStats()
+        self.adapter = PooledHTTPAdapter(self.settings, self.dns_cache, self.stats)
+        self._local = threading.local()
+
+    @classmethod
+    def shared(cls) -> HTTPClient:
+        """The HTTPClient for this process, configured from the environment."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(HTTPClientSettings.from_environment())
+            return cls._shared
+
+    @property
+    def session(self) -> requests.Session:
+        """The requests.Session for the current thread."""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = self.new_session()
+        return session
+
+    def new_session(self) -> requests.Session:
+        session = requests.Session()
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        session.mount("http://", self.adapter)
+        session.mount("https://", self.adapter)
+        return session
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        """Make a request; a drop-in replacement for requests.request."""
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, data=None, **kwargs) -> requests.Response:
+        return self.request("POST", url, data=data, **kwargs)
+
+    def close(self):
+        """Close every connection this client has open.
+
+        The client can still be used afterwards; it opens new connections
+        as they're needed.
+        """
+        self.adapter.close()
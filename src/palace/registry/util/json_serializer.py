@@ -0,0 +1,148 @@
+"""Serialize documents (OPDS feeds, GeoJSON, admin data) as JSON.
+
+If orjson is installed it's used to do the work; otherwise the standard
+library's json module is used. Either way, documents come out as UTF-8
+bytes that can go straight into a response.
+"""
+
+from __future__ import annotations
+
+import datetime
+import json
+import re
+from collections.abc import Callable
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The format used for timestamps in OPDS feeds.
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# Characters that json.dumps(ensure_ascii=True) escapes but orjson doesn't.
+# Outside of strings, JSON output is always ASCII.
+NON_ASCII = re.compile("[^\x00-\x7e]")
+
+
+def feed_default(obj: Any) -> Any:
+    """Convert an object the json module can't handle into one it can.
+
+    Datetimes are converted to UTC and formatted the way OPDS feeds expect
+    them. Lazy strings (e.g. from flask_babel) become ordinary strings.
+
+    :raise TypeError: If there's no way to convert the object.
+    """
+    if isinstance(obj, datetime.datetime):
+        if obj.tzinfo is not None and obj.tzinfo is not datetime.UTC:
+            obj = obj.astimezone(datetime.UTC)
+        return obj.strftime(TIME_FORMAT)
+    if isinstance(obj, datetime.date):
+        return obj.isoformat()
+    if hasattr(obj, "__html__"):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def escape_non_ascii(match: re.Match) -> str:
+    """Escape a character the way json.dumps(ensure_ascii=True) does."""
+    code = ord(match.group())
+    if code > 0xFFFF:
+        # Characters outside the Basic Multilingual Plane become a
+        # surrogate pair.
+        code -= 0x10000
+        return "\\u%04x\\u%04x" % (0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF))
+    return "\\u%04x" % code
+
+
+class JSONSerializer:
+    """Serialize documents with the standard library's json module."""
+
+    def __init__(
+        self,
+        default: Callable[[Any], Any] = feed_default,
+        sort_keys: bool = False,
+        ensure_ascii: bool = False,
+    ):
+        """Constructor.
+
+        :param default: Called to convert objects that aren't natively
+            serializable, including all dates and datetimes.
+        :param sort_keys: If True, dictionary keys are output in sorted order.
+        :param ensure_ascii: If True, non-ASCII characters are escaped.
+        """
+        self.default = default
+        self.sort_keys = sort_keys
+        self.ensure_ascii = ensure_ascii
+
+    def dumps(self, obj: Any) -> bytes:
+        """Serialize a document as UTF-8 encoded JSON."""
+        return json.dumps(
+            obj,
+            default=self.default,
+            sort_keys=self.sort_keys,
+            ensure_ascii=self.ensure_ascii,
+            separators=(",", ":"),
+        ).encode("utf8")
+
+    def loads(self, data: str | bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonSerializer(JSONSerializer):
+    """Serialize documents with orjson."""
+
+    def __init__(
+        self,
+        default: Callable[[Any], Any] = feed_default,
+        sort_keys: bool = False,
+        ensure_ascii: bool = False,
+    ):
+        super().__init__(default, sort_keys, ensure_ascii)
+        # orjson has its own opinions about how to format datetimes; have
+        # it pass them to `default` instead.
+        self.options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            self.options |= orjson.OPT_SORT_KEYS
+
+    def dumps(self, obj: Any) -> bytes:
+        data = orjson.dumps(obj, default=self.default, option=self.options)
+        if self.ensure_ascii and not data.isascii():
+            # orjson can't do this itself.
+            data = NON_ASCII.sub(escape_non_ascii, data.decode("utf8")).encode("ascii")
+        return data
+
+    def loads(self, data: str | bytes) -> Any:
+        return orjson.loads(data)
+
+
+def make_serializer(
+    default: Callable[[Any], Any] = feed_default,
+    sort_keys: bool = False,
+    ensure_ascii: bool = False,
+) -> JSONSerializer:
+    """Create the fastest serializer available.
+
+    :param default: See JSONSerializer.
+    :param sort_keys: See JSONSerializer.
+    :param ensure_ascii: See JSONSerializer.
+    """
+    if orjson is not None:
+        return OrjsonSerializer(default, sort_keys, ensure_ascii)
+    return JSONSerializer(default, sort_keys, ensure_ascii)
+
+
+# The serializer used for documents sent out by the registry. Replace it to
+# plug in a different JSON backend.
+serializer = make_serializer()
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize a document with the registry's serializer."""
+    return serializer.dumps(obj)
+
+
+def loads(data: str | bytes) -> Any:
+    """Deserialize a document with the registry's serializer."""
+    return serializer.loads(data)
@@ -0,0 +1,84 @@
+"""An in-memory index of the ZIP codes in each US city, built once per
+process from the uszipcode database.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+from collections import defaultdict
+from pathlib import Path
+
+import uszipcode
+
+from palace.registry.config import Configuration
+
+
+class ZipCodeIndex:
+    """Find the ZIP codes uszipcode knows about for a city in a state.
+
+    Building a uszipcode.SearchEngine opens its SQLite database and
+    loads a mapping of every city in every state, which is far too slow
+    to do every time a city name needs to be looked up. This reads the
+    (state, city) -> ZIP codes mapping out of the same database once and
+    keeps it in memory.
+    """
+
+    # Only standard ZIP codes are used; P.O. box and unique ZIP codes
+    # don't correspond to a geographic area.
+    QUERY = (
+        "SELECT state, major_city, zipcode FROM simple_zipcode"
+        " WHERE zipcode_type = 'STANDARD'"
+        " AND state IS NOT NULL AND major_city IS NOT NULL"
+        " ORDER BY zipcode"
+    )
+
+    _shared: ZipCodeIndex | None = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, zip_codes: dict[tuple[str, str], tuple[str, ...]]):
+        """
+        :param zip_codes: A mapping of (state abbreviation, city name) to
+            the city's ZIP codes.
+        """
+        self._zip_codes = zip_codes
+
+    @classmethod
+    def database_path(cls) -> Path:
+        return Configuration.DATADIR / "simple_db.sqlite"
+
+    @classmethod
+    def shared(cls) -> ZipCodeIndex:
+        """The index for this process, loaded the first time it's needed."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls.from_database(cls.database_path())
+            return cls._shared
+
+    @classmethod
+    def from_database(cls, path: Path | str) -> ZipCodeIndex:
+        """Build an index from a uszipcode 'simple' database.
+
+        If the database isn't there, uszipcode is asked to download it.
+        """
+        if not Path(path).exists():
+            uszipcode.SearchEngine(db_file_path=str(path)).close()
+        zip_codes: dict[tuple[str, str], list[str]] = defaultdict(list)
+        connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            for state, city, zip_code in connection.execute(cls.QUERY):
+                zip_codes[(state.upper(), city)].append(zip_code)
+        finally:
+            connection.close()
+        return cls({key: tuple(value) for key, value in zip_codes.items()})
+
+    def zip_codes(self, state: str | None, city: str) -> tuple[str, ...]:
+        """The ZIP codes for the city with exactly this name in the given
+        state, in numerical order.
+        """
+        if not state:
+            return ()
+        return self._zip_codes.get((state.upper(), city), ())
+
+    def __len__(self):
+        return len(self._zip_codes)
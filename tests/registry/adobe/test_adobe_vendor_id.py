@@ -1,18 +1,27 @@
 import json
+import logging
+import threading
+import time
+from types import SimpleNamespace
 
+import flask
 import pytest
+from flask_babel import Babel
 
 from palace.registry.adobe import adobe_xml_templates as t
 from palace.registry.adobe.adobe_vendor_id import (
     AdobeAccountInfoRequestParser,
     AdobeSignInRequestParser,
     AdobeVendorIDClient,
+    AdobeVendorIDController,
+    AdobeVendorIDDelegates,
     AdobeVendorIDModel,
     AdobeVendorIDRequestHandler,
     VendorIDAuthenticationError,
     VendorIDServerException,
 )
 from palace.registry.config import Configuration
+from palace.registry.problem_details import AUTHENTICATION_FAILURE, INVALID_INPUT
 from palace.registry.sqlalchemy.model.delegated_patron_identifier import (
     DelegatedPatronIdentifier,
 )
@@ -86,6 +95,61 @@ def vendor_id_fixture(db: DatabaseTransactionFixture) -> VendorIDFixture:
     return VendorIDFixture(db)
 
 
+class TestProvisionHandler:
+    def test_provision_handler(self, vendor_id_fixture: VendorIDFixture):
+        db = vendor_id_fixture.db
+        library = db.library()
+        controller = AdobeVendorIDController(
+            db.session, "VENDORID", vendor_id_fixture.NODE_VALUE
+        )
+        app = flask.Flask(__name__)
+        Babel(app)
+
+        def provision(document, secret=library.shared_secret):
+            headers = {"Authorization": f"Bearer {secret}"} if secret else {}
+            with app.test_request_context(
+                "/", method="POST", json=document, headers=headers
+            ):
+                return controller.provision_handler()
+
+        patrons = dict(patron_identifiers=["alias1", "alias2"])
+
+        # The library has to authenticate with its shared secret.
+        for secret in (None, "not the secret"):
+            problem = provision(patrons, secret)
+            assert problem.uri == AUTHENTICATION_FAILURE.uri
+
+        for bad in (
+            ["alias1"],
+            dict(),
+            dict(patron_identifiers="alias1"),
+            dict(patron_identifiers=[""]),
+            dict(patron_identifiers=[1]),
+            dict(patron_identifiers=["x" * 256]),
+        ):
+            problem = provision(bad)
+            assert problem.uri == INVALID_INPUT.uri
+
+        controller.MAX_PROVISION_BATCH = 1
+        problem = provision(patrons)
+        assert problem.uri == INVALID_INPUT.uri
+        assert "No more than 1 patrons" in str(problem.detail)
+        del controller.MAX_PROVISION_BATCH
+
+        result = provision(patrons)
+        account_ids = result["account_ids"]
+        assert list(account_ids) == ["alias1", "alias2"]
+        assert all(a.startswith("urn:uuid:0") for a in account_ids.values())
+        stored = {
+            dpi.patron_identifier: dpi.delegated_identifier
+            for dpi in library.delegated_patron_identifiers
+        }
+        assert stored == account_ids
+
+        # Asking again gives the same answers.
+        assert provision(patrons) == result
+
+
 class TestConfiguration:
     def test_accessor(self, vendor_id_fixture: VendorIDFixture):
         vendor_id_fixture.integration()
@@ -118,6 +182,15 @@ class TestConfiguration:
         assert node_value == 114740953091845
         assert delegates == ["delegate"]
 
+    def test_local_first(self, vendor_id_fixture: VendorIDFixture):
+        m = Configuration.vendor_id_local_first
+        assert m(vendor_id_fixture.db.session) is False
+
+        integration = vendor_id_fixture.integration()
+        assert m(vendor_id_fixture.db.session) is False
+        integration.setting(Configuration.ADOBE_VENDOR_ID_LOCAL_FIRST).value = "true"
+        assert m(vendor_id_fixture.db.session) is True
+
 
 class TestVendorIDRequestParsers:
     username_sign_in_request = t.SIGN_IN_REQUEST_TEMPLATE % {
@@ -156,6 +229,47 @@ class TestVendorIDRequestParsers:
             "user": "urn:uuid:0xxxxxxx-xxxx-1xxx-xxxx-yyyyyyyyyyyy",
         }
 
+    def test_bytes_request(self):
+        parser = AdobeSignInRequestParser()
+        data = parser.process(
+            ('<?xml version="1.0" encoding="utf-8"?>\n' + self.username_sign_in_request)
+            .replace("Vendor username", "Vendor üsername")
+            .encode("utf8")
+        )
+        assert data["username"] == "Vendor üsername"
+
+        # A string with an encoding declaration works too.
+        data = parser.process(
+            '<?xml version="1.0" encoding="utf-8"?>\n' + self.username_sign_in_request
+        )
+        assert data["username"] == "Vendor username"
+
+    def test_parser_is_reused(self):
+        parser = AdobeSignInRequestParser()
+        xml_parser = parser._parser()
+        assert parser.process(self.username_sign_in_request) is not None
+        assert parser.process(self.authdata_sign_in_request) is not None
+        assert AdobeAccountInfoRequestParser()._parser() is xml_parser
+        assert parser._compiled("adept:username") is parser._compiled("adept:username")
+
+        # Every thread gets its own parser.
+        other = []
+        thread = threading.Thread(target=lambda: other.append(parser._parser()))
+        thread.start()
+        thread.join()
+        assert other[0] is not xml_parser
+
+    def test_entities_are_not_expanded(self):
+        doc = """<?xml version="1.0"?>
+<!DOCTYPE signInRequest [<!ENTITY name SYSTEM "file:///etc/passwd">]>
+<signInRequest method="standard" xmlns="http://ns.adobe.com/adept">
+    <username>&name;</username>
+    <password>pass</password>
+</signInRequest>"""
+        data = AdobeSignInRequestParser().process(doc)
+        assert data["username"] is None
+        assert data["password"] == "pass"
+
 
 class TestVendorIDRequestHandler:
     username_sign_in_request = t.SIGN_IN_REQUEST_TEMPLATE
@@ -296,6 +410,20 @@ class TestVendorIDRequestHandler:
         }
         assert result == expected
 
+    def test_response_values_are_escaped(self):
+        handler = self._handler
+        result = handler.handle_accountinfo_request(
+            self.accountinfo_request % dict(uuid="a &amp; &lt;b&gt;"), self._userinfo
+        )
+        assert result == (
+            '<error xmlns="http://ns.adobe.com/adept" data="E_1045_ACCOUNT_INFO'
+            " Could not identify patron from 'a &amp; &lt;b&gt;'.\"/>"
+        )
+
+        doc = self.accountinfo_request % dict(uuid=self.user1_uuid)
+        result = handler.handle_accountinfo_request(doc, lambda uuid: '"Q" & <A>')
+        assert "<label>&quot;Q&quot; &amp; &lt;A&gt;</label>" in result
+
 
 class VendorIDModelFixture:
     def __init__(self, vendor_id_fixture: VendorIDFixture):
@@ -444,6 +572,34 @@ class TestVendorIDModel:
         # with.
         assert library.delegated_patron_identifiers == [delegated]
 
+    def test_rejected_token_is_not_sent_to_delegates_twice(
+        self, vendor_id_model_fixture: VendorIDModelFixture
+    ):
+        library, db = (
+            vendor_id_model_fixture.library,
+            vendor_id_model_fixture.vendor_id_fixture.db,
+        )
+        delegate = MockAdobeVendorIDClient()
+        model = AdobeVendorIDModel(
+            db.session,
+            vendor_id_model_fixture.vendor_id_fixture.NODE_VALUE,
+            [delegate],
+            local_first=True,
+        )
+        assert model.short_client_token_decoder.local_first is True
+
+        # This is a short client token, but its signature is wrong and
+        # the delegate doesn't know about it either.
+        token = ShortClientTokenEncoder().encode(
+            library.short_name, library.shared_secret + "bad", "patron alias"
+        )
+        delegate.enqueue(VendorIDAuthenticationError("Nope"))
+        delegate.enqueue(("adobe_id", "label", "content"))
+        assert model.authdata_lookup(token) == (None, None)
+
+        # The delegate was only asked once.
+        assert delegate.queue == [("adobe_id", "label", "content")]
+
     def test_delegation_authdata_lookup(
         self, vendor_id_model_fixture: VendorIDModelFixture
     ):
@@ -475,17 +631,17 @@ class TestVendorIDModel:
         result = model.authdata_lookup(authdata)
         assert result == ("adobe_id", "Delegated account ID adobe_id")
 
-        # We didn't even get to delegate 2.
-        assert len(delegate2.queue) == 1
+        # Both delegates were asked at once.
+        model.delegates.wait()
+        assert delegate2.queue == []
 
         [delegated] = library.delegated_patron_identifiers
         assert delegated.patron_identifier == "authdatauser"
         assert delegated.delegated_identifier == "adobe_id"
         assert delegated.type == DelegatedPatronIdentifier.ADOBE_ACCOUNT_ID
 
-        # If we try it again, we'll get an error from delegate 1,
-        # since nothing is queued up, and then a queued error from
-        # delegate 2. Then we'll try to decode the token
+        # If we try it again, we'll get errors from both delegates,
+        # since nothing is queued up. Then we'll try to decode the token
         # ourselves, but since it's not a valid Short Client Token,
         # we'll get an error there, and return nothing.
         result = model.authdata_lookup(authdata)
@@ -512,5 +668,119 @@ class TestVendorIDModel:
 
         assert library.delegated_patron_identifiers == [delegated]
 
-        # We didn't get to delegate 2, because delegate 1 had the answer.
-        assert len(delegate2.queue) == 1
+        # Delegate 2 was asked too, but delegate 1's answer was used.
+        model.delegates.wait()
+        assert delegate2.queue == []
+
+
+class TestAdobeVendorIDDelegates:
+    def test_first_answer_wins(self):
+        slow_delegate_may_finish = threading.Event()
+
+        class SlowDelegate:
+            def sign_in_standard(self, username, password):
+                slow_delegate_may_finish.wait(5)
+                return "slow id", "slow label", "content"
+
+        rejecting = MockAdobeVendorIDClient()
+        rejecting.enqueue(VendorIDAuthenticationError("Nope"))
+        fast = MockAdobeVendorIDClient()
+        fast.enqueue(("fast id", "fast label", "content"))
+        broken = MockAdobeVendorIDClient()
+
+        delegates = AdobeVendorIDDelegates([SlowDelegate(), rejecting, fast, broken])
+        start = time.monotonic()
+        result = delegates.sign_in_standard("username", "password")
+        assert result == ("fast id", "fast label", "content")
+
+        # The slow delegate didn't hold things up.
+        assert time.monotonic() - start < 1
+        slow_delegate_may_finish.set()
+        delegates.wait()
+
+        # Every delegate was asked, and the outcomes were counted. Being
+        # told a patron is unknown isn't a failure.
+        stats = [x.as_dict() for x in delegates.health]
+        assert [x["requests"] for x in stats] == [1, 1, 1, 1]
+        assert [x["successes"] for x in stats] == [1, 1, 1, 0]
+        assert [x["failures"] for x in stats] == [0, 0, 0, 1]
+
+        # If nobody knows the patron, that's an authentication error.
+        with pytest.raises(VendorIDAuthenticationError):
+            AdobeVendorIDDelegates([broken]).sign_in_authdata("authdata")
+
+    def test_timeout(self):
+        may_finish = threading.Event()
+
+        class DeadDelegate:
+            timeout = 0.05
+
+            def sign_in_standard(self, username, password):
+                may_finish.wait(5)
+                raise VendorIDServerException("Timed out.")
+
+        delegates = AdobeVendorIDDelegates([DeadDelegate()])
+        start = time.monotonic()
+        with pytest.raises(VendorIDAuthenticationError):
+            delegates.sign_in_standard("username", "password")
+        assert time.monotonic() - start < 1
+        may_finish.set()
+        delegates.wait()
+
+    def test_circuit_breaker(self, caplog):
+        caplog.set_level(logging.INFO)
+        now = [0]
+        broken = MockAdobeVendorIDClient()
+        delegates = AdobeVendorIDDelegates(
+            [broken], failure_threshold=2, cool_down=60, clock=lambda: now[0]
+        )
+
+        def sign_in():
+            with pytest.raises(VendorIDAuthenticationError):
+                delegates.sign_in_standard("username", "password")
+            delegates.wait()
+
+        [health] = delegates.health
+        sign_in()
+        sign_in()
+        assert health.requests == 2
+
+        # After two failures in a row, the delegate gets a rest.
+        sign_in()
+        assert health.requests == 2
+        assert health.skipped == 1
+        assert health.as_dict()["available"] is False
+
+        # Taking it out of service was logged, with its stats.
+        [record] = caplog.records
+        assert record.levelname == "WARNING"
+        assert "failed 2 times in a row" in record.message
+        assert "'failures': 2" in record.message
+        caplog.clear()
+
+        # Once the rest is over, it's asked again. A success puts it
+        # back in business.
+        now[0] = 60
+        broken.enqueue(("id", "label", "content"))
+        assert delegates.sign_in_standard("username", "password")[0] == "id"
+        assert health.requests == 3
+        assert health.consecutive_failures == 0
+        assert health.as_dict()["available"] is True
+        [record] = caplog.records
+        assert record.levelname == "INFO"
+        assert "is answering again" in record.message
+
+
+class TestAdobeVendorIDClient:
+    def test_timeout(self):
+        class MockHTTPClient:
+            def post(self, url, data=None, **kwargs):
+                self.kwargs = kwargs
+                return SimpleNamespace(
+                    status_code=200, text="<user>id</user><label>label</label>"
+                )
+
+        http_client = MockHTTPClient()
+        client = AdobeVendorIDClient("http://server/", http_client, timeout=2)
+        assert client.sign_in_standard("username", "password")[0] == "id"
+        assert http_client.kwargs == dict(timeout=2)
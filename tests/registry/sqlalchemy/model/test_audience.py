@@ -9,3 +9,17 @@ class TestAudience:
         with pytest.raises(ValueError) as exc:
             Audience.lookup(db.session, "no such audience")
         assert "Unknown audience: no such audience" in str(exc.value)
+
+    def test_lookup_all(self, db: DatabaseTransactionFixture):
+        public = Audience.lookup(db.session, Audience.PUBLIC)
+
+        # Audiences that exist are found, and the others are created.
+        audiences = Audience.lookup_all(
+            db.session, [Audience.PUBLIC, Audience.RESEARCH, Audience.PUBLIC]
+        )
+        assert [Audience.PUBLIC, Audience.RESEARCH] == sorted(x.name for x in audiences)
+        assert public in audiences
+
+        with pytest.raises(ValueError) as exc:
+            Audience.lookup_all(db.session, [Audience.PUBLIC, "no such audience"])
+        assert "Unknown audience: no such audience" in str(exc.value)
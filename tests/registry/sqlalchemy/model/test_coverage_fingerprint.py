@@ -0,0 +1,89 @@
+from palace.registry.sqlalchemy.model.coverage_fingerprint import CoverageFingerprint
+from palace.registry.sqlalchemy.model.place import Place
+from palace.registry.sqlalchemy.model.service_area import ServiceArea
+from palace.registry.sqlalchemy.util import create
+from tests.fixtures.database import DatabaseTransactionFixture
+
+
+class TestCoverageFingerprint:
+    def test_hash(self):
+        m = CoverageFingerprint.hash
+        areas = {"US": ["Boston, MA", "Kansas"], "CA": "everywhere"}
+
+        # The hash doesn't depend on the order of keys.
+        reordered = {"CA": "everywhere", "US": ["Boston, MA", "Kansas"]}
+        assert m(areas, None) == m(reordered, None)
+
+        # It does depend on the contents.
+        assert m(areas, None) != m({"US": ["Boston, MA"]}, None)
+        assert m(areas, None) != m(None, areas)
+
+        # The default nation only matters if an area doesn't name a nation.
+        assert m(areas, None, "US") == m(areas, None, "CA")
+        assert m(["Boston, MA"], None, "US") != m(["Boston, MA"], None, "CA")
+        assert m(areas, "Boston, MA", "US") != m(areas, "Boston, MA", "CA")
+
+    def test_record(self, db: DatabaseTransactionFixture):
+        library = db.library()
+        nation = db.place(type=Place.NATION)
+        state1 = db.place(type=Place.STATE, parent=nation)
+        state2 = db.place(type=Place.STATE, parent=nation)
+        for place, type in (
+            (state2, ServiceArea.ELIGIBILITY),
+            (state1, ServiceArea.ELIGIBILITY),
+            (state1, ServiceArea.FOCUS),
+        ):
+            create(
+                db.session,
+                ServiceArea,
+                library=library,
+                place=place,
+                type=type,
+            )
+
+        fingerprint = CoverageFingerprint.record(library, "a hash")
+        db.session.flush()
+        assert library.coverage_fingerprint == fingerprint
+        assert fingerprint.coverage_hash == "a hash"
+        assert fingerprint.eligibility_place_ids == sorted([state1.id, state2.id])
+        assert fingerprint.focus_place_ids == [state1.id]
+        assert fingerprint.place_ids_by_type == {
+            ServiceArea.ELIGIBILITY: sorted([state1.id, state2.id]),
+            ServiceArea.FOCUS: [state1.id],
+        }
+
+        # Recording again updates the same fingerprint.
+        library.service_areas = []
+        assert CoverageFingerprint.record(library, "another hash") == fingerprint
+        assert fingerprint.coverage_hash == "another hash"
+        assert fingerprint.place_ids_by_type == {
+            ServiceArea.ELIGIBILITY: [],
+            ServiceArea.FOCUS: [],
+        }
+
+    def test_places_exist(self, db: DatabaseTransactionFixture):
+        place = db.place(type=Place.NATION)
+        fingerprint = CoverageFingerprint(
+            coverage_hash="a hash", eligibility_place_ids=[place.id]
+        )
+        assert fingerprint.places_exist(db.session) is True
+
+        # A fingerprint that found no places needs no lookup.
+        fingerprint.eligibility_place_ids = []
+        assert fingerprint.places_exist(db.session) is True
+
+        # A place that's gone makes the fingerprint useless.
+        fingerprint.focus_place_ids = [place.id, place.id + 1000]
+        assert fingerprint.places_exist(db.session) is False
+
+    def test_clear(self, db: DatabaseTransactionFixture):
+        library1 = db.library()
+        library2 = db.library()
+        CoverageFingerprint.record(library1, "a hash")
+        CoverageFingerprint.record(library2, "another hash")
+        db.session.flush()
+
+        assert CoverageFingerprint.clear(db.session) == 2
+        db.session.expire_all()
+        assert db.session.query(CoverageFingerprint).count() == 0
+        assert library1.coverage_fingerprint is None
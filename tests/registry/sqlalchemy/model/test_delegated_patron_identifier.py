@@ -1,11 +1,18 @@
 import base64
+import datetime
 
 import pytest
 
 from palace.registry.sqlalchemy.model.delegated_patron_identifier import (
+    DelegateAnswerCache,
+    DelegatedIdentifierCache,
     DelegatedPatronIdentifier,
+    DelegatedPatronIdentifierCount,
+    LibraryKeyCache,
     ShortClientTokenDecoder,
+    ShortClientTokenRejected,
 )
+from palace.registry.sqlalchemy.model.library import Library
 from palace.registry.util.short_client_token import ShortClientTokenEncoder
 from tests.fixtures.database import DatabaseTransactionFixture
 
@@ -124,6 +131,91 @@ def decoder_fixture(db: DatabaseTransactionFixture) -> ShortClientTokenDecoderFi
     return ShortClientTokenDecoderFixture(db)
 
 
+class TestLibraryKeyCache:
+    def test_lookup(self, db: DatabaseTransactionFixture):
+        library = db.library(short_name="CACHED")
+        library.shared_secret = "a secret"
+        db.session.flush()
+
+        now = [0]
+        cache = LibraryKeyCache(ttl=60, clock=lambda: now[0])
+        signer = ShortClientTokenEncoder.signer
+
+        library_id, key = cache.lookup(db.session, "CACHED")
+        assert library_id == library.id
+        assert key == signer.prepare_key("a secret")
+        assert cache.lookup(db.session, "UNKNOWN") is None
+
+        # Until the entry expires, a change made behind the cache's back
+        # isn't noticed.
+        db.session.execute(
+            Library.__table__.update()
+            .where(Library.id == library.id)
+            .values(shared_secret="another secret")
+        )
+        assert cache.lookup(db.session, "CACHED") == (library_id, key)
+        now[0] = 61
+        assert cache.lookup(db.session, "CACHED") == (
+            library_id,
+            signer.prepare_key("another secret"),
+        )
+
+        cache.invalidate(library_id=library_id)
+        assert cache._entries == {}
+
+    def test_changes_invalidate_the_shared_cache(self, db: DatabaseTransactionFixture):
+        cache = LibraryKeyCache.shared()
+        library = db.library(short_name="CHANGING")
+        library.shared_secret = "a secret"
+        db.session.flush()
+        cache.lookup(db.session, "CHANGING")
+        assert "CHANGING" in cache._entries
+
+        # Changing the shared secret forgets the library's key.
+        library.shared_secret = "a new secret"
+        assert "CHANGING" not in cache._entries
+        db.session.flush()
+
+        # So does changing its short name.
+        cache.lookup(db.session, "CHANGING")
+        library.short_name = "changed"
+        assert "CHANGING" not in cache._entries
+        db.session.flush()
+        assert cache.lookup(db.session, "CHANGING") is None
+        assert cache.lookup(db.session, "CHANGED")[0] == library.id
+
+
+class TestDelegateAnswerCache:
+    def test_remember(self):
+        now = [1000.0]
+        cache = DelegateAnswerCache(max_ttl=60, max_size=2, clock=lambda: now[0])
+
+        def at(seconds):
+            return datetime.datetime.fromtimestamp(seconds, tz=datetime.UTC)
+
+        # An answer is remembered until the token expires.
+        cache.remember("a", "id a", at(1030))
+        assert cache.get("a") == "id a"
+        now[0] = 1030
+        assert cache.get("a") is None
+
+        # ...but never longer than max_ttl.
+        cache.remember("b", "id b", at(5000))
+        now[0] = 1089
+        assert cache.get("b") == "id b"
+        now[0] = 1090
+        assert cache.get("b") is None
+
+        # An answer for a token that has already expired isn't kept.
+        cache.remember("c", "id c", at(1000))
+        assert cache.get("c") is None
+
+        # Once max_size answers are remembered, the oldest is forgotten.
+        for key in "def":
+            cache.remember(key, "id " + key, at(2000))
+        assert [cache.get(x) for x in "def"] == [None, "id e", "id f"]
+
+
 class TestShortClientTokenDecoder:
     def test_uuid(self, decoder_fixture: ShortClientTokenDecoderFixture):
         u = decoder_fixture.decoder.uuid()
@@ -161,6 +253,95 @@ class TestShortClientTokenDecoder:
         )
         assert identifier2 == identifier
 
+        # account_id() finds the same delegated identifier.
+        assert (
+            decoder_fixture.decoder.account_id(
+                decoder_fixture.db.session, short_client_token
+            )
+            == identifier.delegated_identifier
+        )
+
+    def test_known_library_keys_come_from_the_cache(
+        self, decoder_fixture: ShortClientTokenDecoderFixture
+    ):
+        class MockCache:
+            looked_up = []
+
+            def lookup(self, _db, short_name):
+                self.looked_up.append(short_name)
+                return (
+                    decoder_fixture.library.id,
+                    ShortClientTokenEncoder.signer.prepare_key("cached secret"),
+                )
+
+        decoder = ShortClientTokenDecoder(
+            decoder_fixture.TEST_NODE_VALUE, [], library_keys=MockCache()
+        )
+        token = decoder_fixture.encoder.encode(
+            "LIBRARY", "cached secret", "Foreign Patron"
+        )
+        identifier = decoder.decode(decoder_fixture.db.session, token)
+        assert identifier.library == decoder_fixture.library
+        assert MockCache.looked_up == ["LIBRARY", "LIBRARY"]
+
+        # The library's actual secret isn't consulted.
+        token = decoder_fixture.encoder.encode(
+            "LIBRARY", decoder_fixture.library.shared_secret, "Foreign Patron"
+        )
+        with pytest.raises(ValueError) as exc:
+            decoder.decode(decoder_fixture.db.session, token)
+        assert "Invalid signature" in str(exc.value)
+
+    def test_local_first(self, decoder_fixture: ShortClientTokenDecoderFixture):
+        class MockDelegate:
+            answers = []
+            calls = 0
+
+            def sign_in_standard(self, username, password):
+                self.calls += 1
+                if not self.answers:
+                    raise Exception("I don't know that patron.")
+                return self.answers.pop(), "label", "content"
+
+        delegate = MockDelegate()
+        decoder = ShortClientTokenDecoder(
+            decoder_fixture.TEST_NODE_VALUE, [delegate], local_first=True
+        )
+        db = decoder_fixture.db
+
+        # A token this registry can check is never sent to a delegate.
+        token = decoder_fixture.encoder.encode(
+            "LIBRARY", decoder_fixture.library.shared_secret, "Local Patron"
+        )
+        identifier = decoder.decode(db.session, token)
+        assert identifier.patron_identifier == "Local Patron"
+        assert identifier.delegated_identifier.startswith("urn:uuid:")
+        assert delegate.calls == 0
+
+        # A token signed with some other secret is sent to the delegate.
+        delegate.answers.append("delegated id")
+        token = decoder_fixture.encoder.encode(
+            "LIBRARY", "some other secret", "Remote Patron"
+        )
+        identifier = decoder.decode(db.session, token)
+        assert identifier.patron_identifier == "Remote Patron"
+        assert identifier.delegated_identifier == "delegated id"
+        assert delegate.calls == 1
+
+        # The delegate's answer is remembered until the token expires.
+        assert decoder.decode(db.session, token) == identifier
+        assert delegate.calls == 1
+
+        # If neither this registry nor the delegate accepts a token,
+        # it's rejected.
+        token = decoder_fixture.encoder.encode(
+            "LIBRARY", "yet another secret", "Unknown Patron"
+        )
+        with pytest.raises(ShortClientTokenRejected) as exc:
+            decoder.decode(db.session, token)
+        assert "Invalid signature" in str(exc.value)
+        assert delegate.calls == 2
+
     def test_short_client_token_lookup_delegated_patron_identifier_failure(
         self, decoder_fixture: ShortClientTokenDecoderFixture
     ):
@@ -298,3 +479,153 @@ class TestDelegatedPatronIdentifier:
         assert identifier.id == identifier2.id
         # id_2() was not called.
         assert identifier2.delegated_identifier == "id1"
+
+        # A delegated identifier given as a string is inserted along
+        # with the rest of the row.
+        identifier3, is_new = DelegatedPatronIdentifier.get_one_or_create(
+            db.session, library.id, "another patron", identifier_type, "id3"
+        )
+        assert is_new is True
+        assert identifier3.library == library
+        assert identifier3.delegated_identifier == "id3"
+
+    def test_delegated_identifier_for(self, db: DatabaseTransactionFixture):
+        library = db.library()
+        adobe = DelegatedPatronIdentifier.ADOBE_ACCOUNT_ID
+        cache = DelegatedIdentifierCache()
+
+        def explode():
+            raise Exception("I should never be called.")
+
+        m = DelegatedPatronIdentifier.delegated_identifier_for
+        assert m(db.session, library.id, "patron", adobe, lambda: "id1", cache) == "id1"
+        [identifier] = library.delegated_patron_identifiers
+
+        # A new identifier isn't cached until it's seen again.
+        assert len(cache) == 0
+        assert m(db.session, library.id, "patron", adobe, explode, cache) == "id1"
+        assert len(cache) == 1
+
+        # From then on, the database isn't consulted.
+        db.session.delete(identifier)
+        db.session.flush()
+        assert m(db.session, library.id, "patron", adobe, explode, cache) == "id1"
+
+    def test_provision(self, db: DatabaseTransactionFixture):
+        library = db.library()
+        other_library = db.library()
+        adobe = DelegatedPatronIdentifier.ADOBE_ACCOUNT_ID
+        DelegatedPatronIdentifier.get_one_or_create(
+            db.session, library, "existing", adobe, "old id"
+        )
+        DelegatedPatronIdentifier.get_one_or_create(
+            db.session, other_library, "patron 1", adobe, "other library's id"
+        )
+
+        ids = iter(["id%d" % i for i in range(10)])
+        result = DelegatedPatronIdentifier.provision(
+            db.session,
+            library.id,
+            ["patron 1", "existing", "patron 2", "patron 1", "patron 3"],
+            adobe,
+            lambda: next(ids),
+            batch_size=2,
+        )
+
+        # Patrons who already had identifiers keep them; everyone else
+        # gets a new one. Duplicates are ignored.
+        assert list(result.keys()) == ["patron 1", "existing", "patron 2", "patron 3"]
+        assert result["existing"] == "old id"
+        assert len({result["patron 1"], result["patron 2"], result["patron 3"]}) == 3
+        db.session.expire_all()
+        stored = {
+            dpi.patron_identifier: dpi.delegated_identifier
+            for dpi in library.delegated_patron_identifiers
+        }
+        assert stored == result
+
+        # The library's count only went up by the number of new
+        # identifiers.
+        assert DelegatedPatronIdentifierCount.counts(
+            db.session, [library.id, other_library.id], adobe
+        ) == {library.id: 4, other_library.id: 1}
+
+        # Provisioning the same patrons again changes nothing.
+        assert (
+            DelegatedPatronIdentifier.provision(
+                db.session, library.id, list(result), adobe, lambda: next(ids)
+            )
+            == result
+        )
+        assert DelegatedPatronIdentifierCount.counts(
+            db.session, [library.id], adobe
+        ) == {library.id: 4}
+
+
+class TestDelegatedIdentifierCache:
+    def test_least_recently_used_is_forgotten(self):
+        cache = DelegatedIdentifierCache(max_size=2)
+        cache.put("a", "id a")
+        cache.put("b", "id b")
+        assert cache.get("a") == "id a"
+        cache.put("c", "id c")
+        assert cache.get("b") is None
+        assert cache.get("a") == "id a"
+        assert cache.get("c") == "id c"
+        assert len(cache) == 2
+
+
+class TestDelegatedPatronIdentifierCount:
+    def test_maintained_by_get_one_or_create(self, db: DatabaseTransactionFixture):
+        library = db.library()
+        adobe = DelegatedPatronIdentifier.ADOBE_ACCOUNT_ID
+
+        def counts():
+            return DelegatedPatronIdentifierCount.counts(
+                db.session, [library.id], adobe
+            )
+
+        assert counts() == {}
+        for patron in ("patron1", "patron2", "patron1"):
+            DelegatedPatronIdentifier.get_one_or_create(
+                db.session, library, patron, adobe, "id"
+            )
+        DelegatedPatronIdentifier.get_one_or_create(
+            db.session, library, "patron3", "other type", "id"
+        )
+
+        # Looking up an existing identifier didn't change the count, and
+        # identifiers of other types are counted separately.
+        assert counts() == {library.id: 2}
+        assert DelegatedPatronIdentifierCount.counts(
+            db.session, [library.id], "other type"
+        ) == {library.id: 1}
+
+    def test_reconcile(self, db: DatabaseTransactionFixture):
+        library = db.library()
+        other_library = db.library()
+        adobe = DelegatedPatronIdentifier.ADOBE_ACCOUNT_ID
+        for patron in ("patron1", "patron2"):
+            DelegatedPatronIdentifier.get_one_or_create(
+                db.session, library, patron, adobe, "id"
+            )
+
+        # Nothing to fix.
+        assert DelegatedPatronIdentifierCount.reconcile(db.session) == []
+
+        # The counts drift: one is too high and one is missing entirely.
+        DelegatedPatronIdentifierCount.increment(db.session, library.id, adobe, 3)
+        db.session.add(
+            DelegatedPatronIdentifier(
+                library=other_library, patron_identifier="p", type=adobe
+            )
+        )
+        db.session.flush()
+
+        changes = DelegatedPatronIdentifierCount.reconcile(db.session)
+        assert sorted(changes) == sorted(
+            [(library.id, adobe, 5, 2), (other_library.id, adobe, 0, 1)]
+        )
+        assert DelegatedPatronIdentifierCount.counts(
+            db.session, [library.id, other_library.id], adobe
+        ) == {library.id: 2, other_library.id: 1}
@@ -0,0 +1,73 @@
+from palace.registry.sqlalchemy.model.document_fingerprint import DocumentFingerprint
+from tests.fixtures.database import DatabaseTransactionFixture
+from tests.utils import mock_response
+
+
+class TestDocumentFingerprint:
+    def test_record(self, db: DatabaseTransactionFixture):
+        library = db.library()
+        kind = DocumentFingerprint.AUTHENTICATION_DOCUMENT
+        assert DocumentFingerprint.for_library(library, kind) is None
+
+        response = mock_response(
+            200,
+            "a document",
+            headers={"ETag": '"v1"', "Last-Modified": "Fri, 16 Oct 2026"},
+        )
+        fingerprint = DocumentFingerprint.record(
+            library, kind, "http://library/auth", response
+        )
+        db.session.flush()
+        assert fingerprint.library == library
+        assert fingerprint.url == "http://library/auth"
+        assert fingerprint.etag == '"v1"'
+        assert fingerprint.last_modified == "Fri, 16 Oct 2026"
+        assert fingerprint.content_hash == DocumentFingerprint.hash(b"a document")
+        assert fingerprint.conditional_headers() == {
+            "If-None-Match": '"v1"',
+            "If-Modified-Since": "Fri, 16 Oct 2026",
+        }
+
+        assert DocumentFingerprint.for_library(library, kind) == fingerprint
+        assert (
+            DocumentFingerprint.for_library(library, kind, "http://library/auth")
+            == fingerprint
+        )
+        # The fingerprint isn't used for a document at some other URL.
+        assert DocumentFingerprint.for_library(library, kind, "http://other/") is None
+
+        # Recording a new version of the document updates the same
+        # fingerprint.
+        response = mock_response(200, "a new document")
+        assert (
+            DocumentFingerprint.record(library, kind, "http://other/", response)
+            == fingerprint
+        )
+        assert fingerprint.url == "http://other/"
+        assert fingerprint.etag is None
+        assert fingerprint.conditional_headers() == {}
+        assert [fingerprint] == library.document_fingerprints
+
+    def test_unchanged(self, db: DatabaseTransactionFixture):
+        library = db.library()
+        fingerprint = DocumentFingerprint.record(
+            library,
+            DocumentFingerprint.OPDS_ROOT,
+            "http://library/opds",
+            mock_response(200, b"a feed", headers={"ETag": '"v1"'}),
+        )
+
+        # A 304 response means the document hasn't changed. Any new
+        # validators are kept.
+        response = mock_response(304, b"", headers={"ETag": '"v2"'})
+        assert fingerprint.unchanged(response) is True
+        assert fingerprint.etag == '"v2"'
+
+        # So does a response with the same content.
+        assert fingerprint.unchanged(mock_response(200, b"a feed")) is True
+        assert fingerprint.etag == '"v2"'
+
+        # A response with different content means it has changed.
+        response = mock_response(200, b"a new feed", headers={"ETag": '"v3"'})
+        assert fingerprint.unchanged(response) is False
+        assert fingerprint.etag == '"v2"'
@@ -1,4 +1,5 @@
 import random
+import time
 
 import pytest
 
@@ -210,6 +211,100 @@ class TestLibrary:
         for production in (True, False):
             assert feed(production) == []
 
+    def test_availability_counts(self, db: DatabaseTransactionFixture, monkeypatch):
+        from palace.registry.opds import AvailabilityFacet
+
+        Library._availability_counts_cache = None
+        production = db.library(name="production")
+        hidden = db.library(name="hidden")
+        hidden.registry_stage = Library.TESTING_STAGE
+        cancelled = db.library(name="cancelled")
+        cancelled.library_stage = Library.CANCELLED_STAGE
+
+        counts = Library.availability_counts(db.session)
+        assert counts == {
+            AvailabilityFacet.PRODUCTION: 1,
+            AvailabilityFacet.HIDDEN: 1,
+            AvailabilityFacet.ALL: 2,
+        }
+
+        # The counts agree with the filter used to build the feeds.
+        for availability in (
+            frozenset({AvailabilityFacet.PRODUCTION}),
+            frozenset({AvailabilityFacet.HIDDEN}),
+            frozenset({AvailabilityFacet.ALL}),
+            frozenset({AvailabilityFacet.PRODUCTION, AvailabilityFacet.HIDDEN}),
+        ):
+            expect = (
+                db.session.query(Library)
+                .filter(Library._availability_restriction(availability))
+                .count()
+            )
+            assert Library.availability_count(db.session, availability) == expect
+
+        # While nothing changes, the cached counts are reused without
+        # going to the database.
+        version, expires, cached = Library._availability_counts_cache
+        assert version == Library.change_version()
+        nested = db.session.begin_nested()
+        db.session.execute(
+            Library.__table__.update()
+            .where(Library.id == production.id)
+            .values(registry_stage=Library.TESTING_STAGE)
+        )
+        assert Library.availability_counts(db.session) == cached
+
+        # A change made behind the ORM's back, as another process would
+        # make it, is seen once the cached counts expire.
+        now = time.monotonic()
+        monkeypatch.setattr(
+            Library,
+            "_clock",
+            staticmethod(lambda: now + Library.AVAILABILITY_COUNTS_TTL + 1),
+        )
+        counts = Library.availability_counts(db.session)
+        assert counts[AvailabilityFacet.PRODUCTION] == 0
+        nested.rollback()
+        db.session.expire_all()
+        monkeypatch.undo()
+
+        # Changing a library's stage through the ORM invalidates the
+        # cache right away.
+        Library._availability_counts_cache = None
+        assert Library.availability_counts(db.session)[AvailabilityFacet.HIDDEN] == 1
+        version = Library.change_version()
+        production.registry_stage = Library.TESTING_STAGE
+        counts = Library.availability_counts(db.session)
+        assert Library.change_version() > version
+        assert counts[AvailabilityFacet.PRODUCTION] == 0
+        assert counts[AvailabilityFacet.HIDDEN] == 2
+
+        # Changing anything else doesn't.
+        version = Library.change_version()
+        production.description = "A new description"
+        Library.availability_counts(db.session)
+        assert Library.change_version() == version
+
+        # Deleting a library invalidates the cache.
+        db.session.delete(hidden)
+        counts = Library.availability_counts(db.session)
+        assert counts[AvailabilityFacet.ALL] == 1
+
+        # So does adding one.
+        db.library(name="new")
+        counts = Library.availability_counts(db.session)
+        assert counts[AvailabilityFacet.ALL] == 2
+
+        # When a transaction that changed a library is rolled back, counts
+        # taken during the transaction are forgotten.
+        nested = db.session.begin_nested()
+        db.library(name="rolled back")
+        assert Library.availability_counts(db.session)[AvailabilityFacet.ALL] == 3
+        version = Library.change_version()
+        nested.rollback()
+        assert Library.change_version() > version
+        assert Library.availability_counts(db.session)[AvailabilityFacet.ALL] == 2
+
     def test_set_hyperlink(self, db: DatabaseTransactionFixture):
         library = db.library()
 
@@ -0,0 +1,68 @@
+import datetime
+
+from palace.registry.sqlalchemy.model.library import Library
+from palace.registry.sqlalchemy.model.library_refresh import LibraryRefresh
+from palace.registry.util.datetime_helpers import utc_now
+from tests.fixtures.database import DatabaseTransactionFixture
+
+
+class TestLibraryRefresh:
+    def test_backoff(self):
+        m = LibraryRefresh.backoff
+        hour = datetime.timedelta(hours=1)
+        assert m(0) == datetime.timedelta(0)
+        assert m(1) == hour
+        assert m(2) == 2 * hour
+        assert m(4) == 8 * hour
+        assert m(10) == LibraryRefresh.MAX_BACKOFF
+        assert m(1000) == LibraryRefresh.MAX_BACKOFF
+
+    def test_record(self, db: DatabaseTransactionFixture):
+        library = db.library()
+        now = utc_now()
+        uri = "http://example.org/problem"
+
+        # Two failures in a row.
+        refresh = LibraryRefresh.record(library, uri, now=now)
+        db.session.flush()
+        assert library.refresh_record == refresh
+        assert refresh.last_attempt == now
+        assert refresh.last_success is None
+        assert refresh.consecutive_failures == 1
+        assert refresh.last_problem_uri == uri
+        assert refresh.retry_after == now + LibraryRefresh.backoff(1)
+
+        later = now + datetime.timedelta(hours=2)
+        assert LibraryRefresh.record(library, uri, now=later) == refresh
+        assert refresh.consecutive_failures == 2
+        assert refresh.retry_after == later + LibraryRefresh.backoff(2)
+
+        # A success clears the failures.
+        LibraryRefresh.record(library, now=later)
+        assert refresh.last_attempt == later
+        assert refresh.last_success == later
+        assert refresh.consecutive_failures == 0
+        assert refresh.last_problem_uri is None
+        assert refresh.retry_after is None
+
+    def test_stalest_first(self, db: DatabaseTransactionFixture):
+        now = utc_now()
+        hour = datetime.timedelta(hours=1)
+        never = db.library()
+        old = db.library()
+        recent = db.library()
+        waiting = db.library()
+        done_waiting = db.library()
+        LibraryRefresh.record(old, now=now - 10 * hour)
+        LibraryRefresh.record(recent, now=now - hour)
+        LibraryRefresh.record(waiting, "http://problem/", now=now - hour)
+        LibraryRefresh.record(done_waiting, "http://problem/", now=now - 3 * hour)
+        db.session.flush()
+
+        ours = {never, old, recent, waiting, done_waiting}
+        query = db.session.query(Library)
+        ordered = [x for x in LibraryRefresh.stalest_first(query, now=now) if x in ours]
+
+        # Libraries never successfully refreshed come first; the library
+        # that failed an hour ago is still backing off.
+        assert ordered == [never, done_waiting, old, recent]
@@ -8,6 +8,7 @@ from palace.registry.config import Configuration
 from palace.registry.sqlalchemy.model.configuration_setting import ConfigurationSetting
 from palace.registry.sqlalchemy.model.place import Place, PlaceAlias
 from palace.registry.sqlalchemy.util import get_one_or_create
+from palace.registry.util.zipcode_index import ZipCodeIndex
 from tests.fixtures.database import DatabaseTransactionFixture
 
 
@@ -388,6 +389,28 @@ class TestPlace:
         # geographically inside the Place whose method you're calling.
         assert connecticut.lookup_one_through_external_source("Poughkeepsie") is None
 
+    def test_lookup_one_through_external_source_uses_zipcode_index(
+        self, db: DatabaseTransactionFixture, monkeypatch
+    ):
+        new_york = db.new_york_state
+        zip_12601 = db.zip_12601
+        zip_12603 = db.place(
+            "12603", "12603", Place.POSTAL_CODE, None, db.new_york_state
+        )
+        index = ZipCodeIndex({("NY", "Poughkeepsie"): ("12601", "12602", "12603")})
+        monkeypatch.setattr(ZipCodeIndex, "_shared", index)
+
+        # All of Poughkeepsie's ZIP codes are looked up at once, and the
+        # Place for the first one we know about is returned.
+        assert new_york.lookup_one_through_external_source("Poughkeepsie") == zip_12601
+
+        db.session.delete(zip_12601)
+        db.session.flush()
+        assert new_york.lookup_one_through_external_source("Poughkeepsie") == zip_12603
+
+        # City names must match exactly.
+        assert new_york.lookup_one_through_external_source("poughkeepsie") is None
+
     def test_served_by(self, db: DatabaseTransactionFixture):
         zip = db.zip_10018
         nyc = db.new_york_city
@@ -0,0 +1,46 @@
+import datetime
+
+from palace.registry.sqlalchemy.model.registration_job import RegistrationJob
+from palace.registry.sqlalchemy.util import create
+from palace.registry.util.datetime_helpers import utc_now
+from tests.fixtures.database import DatabaseTransactionFixture
+
+
+class TestRegistrationJob:
+    def test_claim(self, db: DatabaseTransactionFixture):
+        job, ignore = create(
+            db.session, RegistrationJob, authentication_url="http://library.org/"
+        )
+        assert job.status == RegistrationJob.PENDING
+        assert job.token
+
+        # Only one worker can claim a pending job.
+        assert RegistrationJob.claim(db.session, job.id) is True
+        assert RegistrationJob.claim(db.session, job.id) is False
+        db.session.refresh(job)
+        assert job.status == RegistrationJob.RUNNING
+        assert job.started_at is not None
+
+        # A job that has been running for too long can be claimed again.
+        job.started_at = utc_now() - RegistrationJob.ABANDONED_AFTER
+        job.started_at -= datetime.timedelta(seconds=1)
+        db.session.flush()
+        assert RegistrationJob.claim(db.session, job.id) is True
+
+        # A finished job can't be claimed.
+        job.finish(201, "application/json", "{}")
+        db.session.flush()
+        assert job.status == RegistrationJob.SUCCEEDED
+        assert job.finished is True
+        assert RegistrationJob.claim(db.session, job.id) is False
+
+        # Nor can a job that doesn't exist.
+        assert RegistrationJob.claim(db.session, -1) is False
+
+    def test_finish(self):
+        job = RegistrationJob()
+        assert job.finished is False
+        job.finish(502, "application/api-problem+json", "{}")
+        assert job.status == RegistrationJob.FAILED
+        assert job.finished is True
+        assert job.finished_at is not None
@@ -4,11 +4,15 @@ from __future__ import annotations
 
 from palace.registry.sqlalchemy.model.admin import Admin
 from palace.registry.sqlalchemy.model.audience import Audience
+from palace.registry.sqlalchemy.model.configuration_setting import ConfigurationSetting
+from palace.registry.sqlalchemy.model.hyperlink import Hyperlink
+from palace.registry.sqlalchemy.model.resource import Resource
 from palace.registry.sqlalchemy.util import (
     create,
     generate_secret,
     get_one,
     get_one_or_create,
+    get_one_or_insert,
 )
 from tests.fixtures.database import DatabaseTransactionFixture
 
@@ -138,6 +142,106 @@ class TestGetOneOrCreate:
         assert result.name == "Test Audience"
 
 
+class TestGetOneOrInsert:
+    """Test the get_one_or_insert() function."""
+
+    def test_get_one_or_insert_creates_new_object(self, db: DatabaseTransactionFixture):
+        """Test that get_one_or_insert() creates a new object and reports it."""
+        resource, created = get_one_or_insert(
+            db.session, Resource, href="http://example.com/"
+        )
+        assert created is True
+        assert resource.id is not None
+        assert resource in db.session
+        assert get_one(db.session, Resource, href="http://example.com/") is resource
+
+    def test_get_one_or_insert_returns_existing_object(
+        self, db: DatabaseTransactionFixture
+    ):
+        """Test that get_one_or_insert() finds an object that already exists."""
+        resource = Resource(href="http://example.com/")
+        db.session.add(resource)
+        db.session.flush()
+
+        result, created = get_one_or_insert(
+            db.session, Resource, href="http://example.com/"
+        )
+        assert result is resource
+        assert created is False
+
+    def test_get_one_or_insert_object_not_in_session(
+        self, db: DatabaseTransactionFixture
+    ):
+        """Test that an existing row the session hasn't loaded becomes an
+        object in the session.
+        """
+        resource = Resource(href="http://example.com/")
+        db.session.add(resource)
+        db.session.flush()
+        resource_id = resource.id
+        db.session.expunge(resource)
+
+        result, created = get_one_or_insert(
+            db.session, Resource, href="http://example.com/"
+        )
+        assert created is False
+        assert result is not resource
+        assert result.id == resource_id
+        assert result.href == "http://example.com/"
+        assert db.session.get(Resource, resource_id) is result
+
+    def test_get_one_or_insert_with_relationship(self, db: DatabaseTransactionFixture):
+        """Test that get_one_or_insert() accepts many-to-one relationships
+        and values only used for creation.
+        """
+        library = db.library()
+        resource, ignore = get_one_or_insert(
+            db.session, Resource, href="http://example.com/"
+        )
+        link, created = get_one_or_insert(
+            db.session,
+            Hyperlink,
+            library=library,
+            rel="help",
+            create_method_kwargs=dict(resource_id=resource.id),
+        )
+        assert created is True
+        assert link.library == library
+        assert link.resource == resource
+
+        link2, created = get_one_or_insert(
+            db.session, Hyperlink, library=library, rel="help"
+        )
+        assert link2 is link
+        assert created is False
+
+    def test_get_one_or_insert_falls_back_to_get_one_or_create(
+        self, db: DatabaseTransactionFixture
+    ):
+        """Test that get_one_or_insert() uses get_one_or_create() when no
+        unique constraint can be used to find the row.
+        """
+        # NULL values never conflict, so the unique constraint on
+        # ConfigurationSetting can't be used for sitewide settings.
+        setting, created = get_one_or_insert(
+            db.session,
+            ConfigurationSetting,
+            library_id=None,
+            external_integration_id=None,
+            key="a setting",
+        )
+        assert created is True
+        setting2, created = get_one_or_insert(
+            db.session,
+            ConfigurationSetting,
+            library_id=None,
+            external_integration_id=None,
+            key="a setting",
+        )
+        assert setting2 is setting
+        assert created is False
+
+
 class TestCreate:
     """Test the create() function."""
 
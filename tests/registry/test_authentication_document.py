@@ -3,6 +3,7 @@ from collections import defaultdict
 from palace.registry.authentication_document import AuthenticationDocument
 from palace.registry.problem_details import INVALID_INTEGRATION_DOCUMENT
 from palace.registry.sqlalchemy.model.audience import Audience
+from palace.registry.sqlalchemy.model.collection_summary import CollectionSummary
 from palace.registry.sqlalchemy.model.place import Place
 from palace.registry.sqlalchemy.model.service_area import ServiceArea
 from palace.registry.util.problem_detail import ProblemDetail
@@ -439,13 +440,16 @@ class TestUpdateServiceAreas:
 
         areas = []
 
-        # This will use those places to create new ServiceAreas,
-        # which will be gathered in the 'areas' array.
+        # This will gather the ServiceAreas the library should have
+        # in the 'areas' array.
         problem = AuthenticationDocument._update_service_areas(
             library, [valid, unknown, ambiguous], ServiceArea.FOCUS, areas
         )
         assert problem is None
+        assert areas == [(p1.id, ServiceArea.FOCUS), (p2.id, ServiceArea.FOCUS)]
 
+        # Those ServiceAreas can then be created.
+        AuthenticationDocument._replace_service_areas(library, set(areas))
         [a1, a2] = sorted(library.service_areas, key=lambda x: x.place_id)
         assert a1.place == p1
         assert a1.type == ServiceArea.FOCUS
@@ -453,8 +457,34 @@ class TestUpdateServiceAreas:
         assert a2.place == p2
         assert a2.type == ServiceArea.FOCUS
 
-        # The ServiceArea IDs were added to the `ids` list.
-        assert {a1, a2} == set(areas)
+    def test_replace_service_areas(self, db: DatabaseTransactionFixture):
+        library = db.library()
+        p1 = db.place()
+        p2 = db.place()
+        p3 = db.place()
+        m = AuthenticationDocument._replace_service_areas
+
+        def areas():
+            return sorted((x.place_id, x.type) for x in library.service_areas)
+
+        m(library, {(p1.id, ServiceArea.FOCUS), (p2.id, ServiceArea.ELIGIBILITY)})
+        assert areas() == sorted(
+            [(p1.id, ServiceArea.FOCUS), (p2.id, ServiceArea.ELIGIBILITY)]
+        )
+        [kept] = [x for x in library.service_areas if x.place_id == p1.id]
+
+        # ServiceAreas that are still wanted are left alone, and the
+        # ones that aren't are deleted rather than orphaned.
+        m(library, {(p1.id, ServiceArea.FOCUS), (p3.id, ServiceArea.FOCUS)})
+        assert areas() == sorted(
+            [(p1.id, ServiceArea.FOCUS), (p3.id, ServiceArea.FOCUS)]
+        )
+        assert kept in library.service_areas
+        assert db.session.query(ServiceArea).count() == 2
+
+        m(library, set())
+        assert library.service_areas == []
+        assert db.session.query(ServiceArea).count() == 0
 
     def test_ambiguous_and_unknown_places_become_problemdetail(
         self, db: DatabaseTransactionFixture
@@ -544,6 +574,90 @@ class TestUpdateServiceAreas:
         assert a2 == ("focus", country1.abbreviated_name)
         assert a3 == ("focus", country3.abbreviated_name)
 
+    def test_update_service_areas_reuses_resolved_places(
+        self, db: DatabaseTransactionFixture
+    ):
+        library = db.library()
+        country1 = db.place(abbreviated_name="C1", type=Place.NATION)
+        country2 = db.place(abbreviated_name="C2", type=Place.NATION)
+        everywhere = AuthenticationDocument.COVERAGE_EVERYWHERE
+        doc_dict = dict(
+            service_area={"C1": everywhere, "C2": everywhere},
+            focus_area={"C2": everywhere},
+        )
+
+        # The first time the library registers, its coverage areas are
+        # resolved, and the places found are remembered.
+        doc = AuthenticationDocument.from_dict(db.session, doc_dict, library=library)
+        assert doc.cached_coverage is None
+        assert doc.update_service_areas(library) is None
+        fingerprint = library.coverage_fingerprint
+        assert fingerprint.coverage_hash == doc.coverage_hash
+        assert fingerprint.eligibility_place_ids == sorted([country1.id, country2.id])
+        assert fingerprint.focus_place_ids == [country2.id]
+
+        def areas():
+            return sorted(
+                (x.type, x.place.abbreviated_name) for x in library.service_areas
+            )
+
+        expect = [("eligibility", "C1"), ("eligibility", "C2"), ("focus", "C2")]
+        assert areas() == expect
+
+        # The next time, the same coverage areas (formatted differently)
+        # aren't resolved again -- this Place class would blow up if
+        # asked to look anything up.
+        class ExplodingPlace:
+            @classmethod
+            def lookup_one_by_name(cls, *args, **kwargs):
+                raise Exception("Coverage areas should not be resolved.")
+
+            default_nation = everywhere = lookup_one_by_name
+
+        same_areas = dict(
+            focus_area={"C2": everywhere},
+            service_area={"C2": everywhere, "C1": everywhere},
+        )
+        doc = AuthenticationDocument.from_dict(
+            db.session, same_areas, ExplodingPlace, library=library
+        )
+        assert doc.cached_coverage == fingerprint
+        assert doc.service_area is None
+
+        # The places found last time are used instead. If the library's
+        # ServiceAreas have changed in the meantime, they're put back.
+        library.service_areas = []
+        assert doc.update_service_areas(library) is None
+        assert areas() == expect
+
+        # If one of the places found last time is gone, they're resolved
+        # again.
+        fingerprint.focus_place_ids = [country2.id + 1000]
+        doc = AuthenticationDocument.from_dict(db.session, same_areas, library=library)
+        assert doc.cached_coverage is None
+        assert doc.update_service_areas(library) is None
+        assert areas() == expect
+        assert fingerprint.focus_place_ids == [country2.id]
+
+        # If the coverage areas change, they're resolved again.
+        doc_dict["focus_area"] = {"C1": everywhere}
+        doc = AuthenticationDocument.from_dict(db.session, doc_dict, library=library)
+        assert doc.cached_coverage is None
+        doc.update_service_areas(library)
+        assert areas() == [
+            ("eligibility", "C1"),
+            ("eligibility", "C2"),
+            ("focus", "C1"),
+        ]
+        assert fingerprint.coverage_hash == doc.coverage_hash
+        assert fingerprint.focus_place_ids == [country1.id]
+
+        # Coverage areas that can't be resolved aren't remembered.
+        doc_dict["focus_area"] = {"Nowhere": everywhere}
+        doc = AuthenticationDocument.from_dict(db.session, doc_dict, library=library)
+        assert isinstance(doc.update_service_areas(library), ProblemDetail)
+        assert fingerprint.coverage_hash != doc.coverage_hash
+
     def test_service_area_registered_as_focus_area_if_no_focus_area(
         self, db: DatabaseTransactionFixture
     ):
@@ -690,6 +804,30 @@ class TestUpdateCollectionSize:
         # Now both collections have been removed.
         assert self.library.collections == []
 
+    def test_collections_are_updated_in_place(self, db: DatabaseTransactionFixture):
+        library = db.library()
+        m = AuthenticationDocument._update_collection_size
+        m(library, dict(eng=100, spa=10))
+        [english] = [x for x in library.collections if x.language == "eng"]
+
+        # A collection whose size changes keeps its CollectionSummary.
+        m(library, dict(eng=200, spa=10, fre=5))
+        assert [("eng", 200), ("fre", 5), ("spa", 10)] == sorted(
+            (x.language, x.size) for x in library.collections
+        )
+        assert english in library.collections
+        assert english.size == 200
+
+        # Collections in the same language are combined, and so are
+        # collections in unknown languages. Collections that are no
+        # longer mentioned are deleted.
+        m(library, {"eng": 1, "English": 2, "mmmmm": 3, "nnnnn": 4})
+        assert [(None, 7), ("eng", 2)] == sorted(
+            ((x.language, x.size) for x in library.collections),
+            key=lambda x: x[0] or "",
+        )
+        assert db.session.query(CollectionSummary).count() == 2
+
     def test_single_collection(self, db: DatabaseTransactionFixture):
         self.library = db.library()
 
@@ -2,24 +2,29 @@ from __future__ import annotations
 
 import base64
 import datetime
+import gzip
 import json
 import random
+import threading
 from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from smtplib import SMTPException
 from typing import Any
-from urllib.parse import unquote
+from urllib.parse import quote, unquote
 
 import flask
 import pytest
 from Crypto.Cipher import PKCS1_OAEP
 from Crypto.PublicKey import RSA
 from flask import Flask, Response, session
+from sqlalchemy.orm import Session
 from werkzeug.datastructures import ImmutableMultiDict, MultiDict
 
 from palace.registry.authentication_document import AuthenticationDocument
 from palace.registry.config import Configuration
 from palace.registry.controller import (
+    OPDS_CATALOG_REGISTRATION_MEDIA_TYPE,
     AdobeVendorIDController,
     BaseController,
     CoverageController,
@@ -28,19 +33,24 @@ from palace.registry.controller import (
     ValidationController,
 )
 from palace.registry.emailer import Emailer, EmailTemplate
+from palace.registry.export import NDJSON_MEDIA_TYPE
 from palace.registry.opds import OPDSCatalog, OrderFacet
-from palace.registry.pagination import Pagination
+from palace.registry.pagination import KeysetPagination, Pagination
 from palace.registry.problem_details import (
+    AUTHENTICATION_FAILURE,
     ERROR_RETRIEVING_DOCUMENT,
     INTEGRATION_DOCUMENT_NOT_FOUND,
     INTEGRATION_ERROR,
     INVALID_CREDENTIALS,
+    INVALID_INPUT,
     INVALID_INTEGRATION_DOCUMENT,
     LIBRARY_NOT_FOUND,
     NO_AUTH_URL,
+    REGISTRATION_JOB_NOT_FOUND,
     TIMEOUT,
     UNABLE_TO_NOTIFY,
 )
+from palace.registry.registration_jobs import RegistrationWorkerPool
 from palace.registry.sqlalchemy.model.configuration_setting import ConfigurationSetting
 from palace.registry.sqlalchemy.model.delegated_patron_identifier import (
     DelegatedPatronIdentifier,
@@ -49,6 +59,7 @@ from palace.registry.sqlalchemy.model.external_integration import ExternalIntegr
 from palace.registry.sqlalchemy.model.hyperlink import Hyperlink
 from palace.registry.sqlalchemy.model.library import Library
 from palace.registry.sqlalchemy.model.place import Place
+from palace.registry.sqlalchemy.model.registration_job import RegistrationJob
 from palace.registry.sqlalchemy.model.resource import Validation
 from palace.registry.sqlalchemy.model.service_area import ServiceArea
 from palace.registry.sqlalchemy.util import create, get_one, get_one_or_create
@@ -64,7 +75,7 @@ from tests.fixtures.controller import (
     MockLibraryRegistry,
 )
 from tests.fixtures.database import DatabaseTransactionFixture
-from tests.testing import DummyHTTPClient
+from tests.testing import DeferredExecutor, DummyHTTPClient, InlineExecutor
 
 
 class TestLibraryRegistryAnnotator:
@@ -222,6 +233,9 @@ def registry_controller_fixture(
         controller = LibraryRegistryController(
             fixture.library_registry, emailer_class=MockEmailer
         )
+        # DummyHTTPClient hands out responses in the order they were
+        # queued, so documents must be fetched one at a time.
+        controller.registrar_executor = InlineExecutor()
 
         # A registration form that's valid for most of the tests
         # in this class.
@@ -418,6 +432,64 @@ class TestLibraryRegistryController:
         self._is_library(nypl, libraries[2])
         self._is_library(in_testing, libraries[3], False)
 
+    def test_libraries_matches_library_details(
+        self, registry_controller_fixture: LibraryRegistryControllerFixture
+    ):
+        fixture = registry_controller_fixture
+        nypl = fixture.db.nypl
+        ks = fixture.db.kansas_state_library
+        nypl.pls_id.value = "12345"
+        DelegatedPatronIdentifier.get_one_or_create(
+            fixture.db.session,
+            nypl,
+            fixture.db.fresh_str(),
+            DelegatedPatronIdentifier.ADOBE_ACCOUNT_ID,
+            None,
+        )
+
+        # The listing is built without loading any Library objects, but
+        # it says exactly what library_details says about each library.
+        libraries = fixture.controller.libraries()["libraries"]
+        assert libraries == [
+            fixture.controller.library_details(
+                library.internal_urn.split("uuid:")[1], library
+            )
+            for library in (ks, nypl)
+        ]
+
+    def test_libraries_query_parameters(
+        self, registry_controller_fixture: LibraryRegistryControllerFixture
+    ):
+        fixture = registry_controller_fixture
+        ct = fixture.db.connecticut_state_library
+        ks = fixture.db.kansas_state_library
+        nypl = fixture.db.nypl
+
+        def names(response):
+            return [library["basic_info"]["name"] for library in response["libraries"]]
+
+        with fixture.app.test_request_context("/?q=state"):
+            response = fixture.controller.libraries()
+        assert names(response) == [ct.name, ks.name]
+        assert "pagination" not in response
+
+        with fixture.app.test_request_context("/?order=name-desc&size=20"):
+            response = fixture.controller.libraries()
+        assert names(response) == [nypl.name, ks.name, ct.name]
+        assert response["pagination"] == dict(
+            offset=0, size=20, total=3, has_next=False
+        )
+
+        with fixture.app.test_request_context("/?offset=2&size=20"):
+            response = fixture.controller.libraries()
+        assert names(response) == [nypl.name]
+        assert response["pagination"]["total"] == 3
+
+        with fixture.app.test_request_context("/?order=nonsense"):
+            response = fixture.controller.libraries()
+        assert isinstance(response, ProblemDetail)
+        assert response.uri == INVALID_INPUT.uri
+
     @pytest.mark.parametrize(
         "production_only, expected_count",
         [
@@ -2172,6 +2244,200 @@ class TestLibraryRegistryController:
                 == library.shared_secret
             )
 
+    def test_register_async(
+        self,
+        registry_controller_fixture: LibraryRegistryControllerFixture,
+        rsa_key_pair: RSA.RsaKey,
+    ):
+        fixture = registry_controller_fixture
+        executor = DeferredExecutor()
+        fixture.controller.registration_workers = RegistrationWorkerPool(
+            fixture.controller.run_registration_job, executor=executor
+        )
+        auth_document = self._auth_document(rsa_key_pair)
+        fixture.http_client.queue_response(
+            200, content=json.dumps(auth_document), url=auth_document["id"]
+        )
+        self.queue_opds_success(fixture)
+
+        # The client asks for the registration to be processed in the
+        # background.
+        with fixture.app.test_request_context(
+            "/", method="POST", headers={"Prefer": "respond-async"}
+        ):
+            flask.request.form = ImmutableMultiDict(
+                [
+                    ("url", "http://circmanager.org/authentication.opds"),
+                    ("contact", "mailto:me@library.org"),
+                ]
+            )
+            response = fixture.controller.register(do_get=fixture.http_client.do_get)
+
+        # The registry accepted the request without contacting the library.
+        assert response.status_code == 202
+        assert response.headers["Preference-Applied"] == "respond-async"
+        assert fixture.http_client.requests == []
+        status = json.loads(response.data)
+        assert status["status"] == RegistrationJob.PENDING
+        assert status["authentication_url"] == auth_document["id"]
+        [job] = fixture.db.session.query(RegistrationJob).all()
+        status_url = response.headers["Location"]
+        assert status_url.endswith("/register/jobs/" + job.token)
+        assert status["links"][0]["href"] == status_url
+
+        # Until the job runs, asking about it gets the same answer.
+        with fixture.app.test_request_context("/"):
+            response = fixture.controller.registration_job(job.token)
+        assert response.status_code == 202
+        assert response.headers["Retry-After"] == "5"
+
+        # Once the job has run, the library is registered...
+        [finished] = executor.run_all()
+        assert finished.status == RegistrationJob.SUCCEEDED
+        library = get_one(fixture.db.session, Library, name="A Library")
+        assert library.authentication_url == auth_document["id"]
+        assert fixture.http_client.requests == [
+            "http://circmanager.org/authentication.opds",
+            "http://circmanager.org/feed/",
+        ]
+
+        # ...and the status URL gives the response the library would have
+        # gotten if it had waited.
+        with fixture.app.test_request_context("/"):
+            response = fixture.controller.registration_job(job.token)
+        assert response.status_code == 201
+        assert response.headers["Content-Type"] == OPDS_CATALOG_REGISTRATION_MEDIA_TYPE
+        catalog = json.loads(response.data)
+        assert catalog["metadata"]["short_name"] == library.short_name
+
+        # A finished job isn't run again.
+        with fixture.app.test_request_context("/"):
+            assert fixture.controller.run_registration_job(job.id) is None
+
+    def test_worker_session(
+        self, registry_controller_fixture: LibraryRegistryControllerFixture
+    ):
+        # A worker session is bound to the app's engine, found when the
+        # controller was created; the worker thread doesn't touch the
+        # app's scoped session.
+        controller = registry_controller_fixture.controller
+        engine = registry_controller_fixture.db.session.get_bind().engine
+        app_session, controller._db = controller._db, None
+        try:
+            session = controller.worker_session()
+        finally:
+            controller._db = app_session
+        assert session.get_bind() is engine
+        session.close()
+
+    def test_register_async_in_worker_thread(
+        self,
+        registry_controller_fixture: LibraryRegistryControllerFixture,
+        rsa_key_pair: RSA.RsaKey,
+    ):
+        fixture = registry_controller_fixture
+        go = threading.Event()
+        sessions = []
+
+        def session_factory():
+            # Don't let the job start until the request is over. The job's
+            # session shares the test's connection, so they mustn't use it
+            # at the same time.
+            go.wait(5)
+            session = Session(bind=fixture.db.session.connection())
+            sessions.append((session, threading.current_thread()))
+            return session
+
+        executor = ThreadPoolExecutor(1, thread_name_prefix="registration")
+        fixture.controller.registration_workers = RegistrationWorkerPool(
+            fixture.controller.run_registration_job,
+            executor=executor,
+            session_factory=session_factory,
+        )
+        auth_document = self._auth_document(rsa_key_pair)
+        fixture.http_client.queue_response(
+            200, content=json.dumps(auth_document), url=auth_document["id"]
+        )
+        self.queue_opds_success(fixture)
+
+        with fixture.app.test_request_context(
+            "/", method="POST", headers={"Prefer": "respond-async"}
+        ):
+            flask.request.form = ImmutableMultiDict(
+                [("url", "http://circmanager.org/authentication.opds")]
+            )
+            response = fixture.controller.register(do_get=fixture.http_client.do_get)
+        assert response.status_code == 202
+
+        go.set()
+        executor.shutdown(wait=True)
+
+        # The job ran on a worker thread, in a session of its own that was
+        # closed when it was done.
+        [(session, thread)] = sessions
+        assert thread is not threading.current_thread()
+        assert thread.name.startswith("registration")
+        assert session.identity_map.keys() == set()
+
+        # The library was registered, and the job's outcome was committed.
+        fixture.db.session.expire_all()
+        [job] = fixture.db.session.query(RegistrationJob).all()
+        assert job.status == RegistrationJob.SUCCEEDED
+        assert job.status_code == 201
+        library = get_one(fixture.db.session, Library, name="A Library")
+        assert library.authentication_url == auth_document["id"]
+
+        # Links in the stored response were built for the URL the
+        # registration request was sent to.
+        catalog = json.loads(job.response)
+        hrefs = [
+            link["href"]
+            for link in catalog["links"]
+            if link["rel"] in (OPDSCatalog.ELIGIBILITY_REL, OPDSCatalog.FOCUS_REL)
+        ]
+        assert len(hrefs) == 2
+        assert all(href.startswith("http://localhost/library/") for href in hrefs)
+
+    def test_register_async_failure(
+        self, registry_controller_fixture: LibraryRegistryControllerFixture
+    ):
+        fixture = registry_controller_fixture
+        executor = DeferredExecutor()
+        fixture.controller.registration_workers = RegistrationWorkerPool(
+            fixture.controller.run_registration_job, executor=executor
+        )
+
+        # A request that's invalid on its face is rejected right away.
+        with fixture.app.test_request_context(
+            "/",
+            method="POST",
+            headers={"Prefer": "respond-async", "Authorization": "Bearer nope"},
+        ):
+            flask.request.form = ImmutableMultiDict([("url", "http://a.org/")])
+            response = fixture.controller.register()
+        assert response.title == AUTHENTICATION_FAILURE.title
+        assert executor.calls == []
+
+        # A registration that fails later is reported at the status URL.
+        fixture.http_client.queue_response(401)
+        with fixture.app.test_request_context(
+            "/", method="POST", headers={"Prefer": "respond-async"}
+        ):
+            flask.request.form = ImmutableMultiDict([("url", "http://a.org/")])
+            response = fixture.controller.register(do_get=fixture.http_client.do_get)
+        assert response.status_code == 202
+        [job] = executor.run_all()
+        assert job.status == RegistrationJob.FAILED
+
+        with fixture.app.test_request_context("/"):
+            response = fixture.controller.registration_job(job.token)
+        assert response.status_code == job.status_code
+        assert response.headers["Content-Type"] == ProblemDetail.JSON_MEDIA_TYPE
+
+        with fixture.app.test_request_context("/"):
+            response = fixture.controller.registration_job("no-such-job")
+        assert response == REGISTRATION_JOB_NOT_FOUND
+
     def test_register_hyperlinks_and_emails(
         self,
         registry_controller_fixture: LibraryRegistryControllerFixture,
@@ -2508,6 +2774,234 @@ class TestLibraryRegistryController:
                         entry["metadata"][key], "%Y-%m-%dT%H:%M:%SZ"
                     )
 
+    def test_libraries_changes(
+        self, registry_controller_fixture: LibraryRegistryControllerFixture
+    ):
+        fixture = registry_controller_fixture
+        base_time = utc_now() - datetime.timedelta(days=100)
+        for i, library in enumerate(fixture.db.session.query(Library)):
+            library.timestamp = base_time + datetime.timedelta(minutes=i)
+
+        changed = []
+        for i in range(25):
+            library = fixture.db.library(name=f"Changed {i:02d}")
+            changed.append(library)
+        cancelled = changed[3]
+        cancelled.library_stage = Library.CANCELLED_STAGE
+        hidden = changed[7]
+        hidden.registry_stage = Library.TESTING_STAGE
+        fixture.db.session.flush()
+        since_time = base_time + datetime.timedelta(days=1)
+        for i, library in enumerate(changed):
+            # Several libraries share each timestamp, so the cursor
+            # must break ties by ID.
+            library.timestamp = since_time + datetime.timedelta(minutes=1 + i // 3)
+        fixture.db.session.flush()
+
+        def get(url):
+            with fixture.app.test_request_context(url):
+                response = fixture.controller.libraries_changes()
+                assert response.status == "200 OK"
+                return json.loads(response.data)
+
+        since = since_time.isoformat().replace("+00:00", "Z")
+        seen = []
+        catalog = get(f"/libraries/changes?since={since}&size=20")
+        while True:
+            seen.extend(catalog["catalogs"])
+            links = {link["rel"]: link["href"] for link in catalog["links"]}
+            assert OPDSCatalog.PALACE_RESUME_REL in links
+            if "next" not in links:
+                break
+            assert links["next"] == links[OPDSCatalog.PALACE_RESUME_REL]
+            catalog = get(links["next"])
+
+        # Every library that changed shows up exactly once, in order.
+        assert [entry["metadata"]["id"] for entry in seen] == [
+            library.internal_urn for library in changed
+        ]
+
+        # The cancelled library and the one that's no longer in production
+        # are tombstones; the others are complete entries.
+        for library, entry in zip(changed, seen):
+            removed = entry["metadata"].get(OPDSCatalog.PALACE_PROPERTIES_REMOVED)
+            if library in (cancelled, hidden):
+                assert removed is True
+                assert "links" not in entry
+            else:
+                assert removed is None
+                assert entry["links"]
+
+        # Resuming from the last page finds nothing new.
+        catalog = get(links[OPDSCatalog.PALACE_RESUME_REL])
+        assert catalog["catalogs"] == []
+
+        # With a wider availability filter, the hidden library is a full entry.
+        catalog = get(f"/libraries/changes?since={since}&availability=all&size=100")
+        by_id = {entry["metadata"]["id"]: entry for entry in catalog["catalogs"]}
+        assert OPDSCatalog.PALACE_PROPERTIES_REMOVED not in (
+            by_id[hidden.internal_urn]["metadata"]
+        )
+        assert (
+            by_id[cancelled.internal_urn]["metadata"][
+                OPDSCatalog.PALACE_PROPERTIES_REMOVED
+            ]
+            is True
+        )
+
+    def test_libraries_changes_late_commit(
+        self, registry_controller_fixture: LibraryRegistryControllerFixture
+    ):
+        # A change committed after a client got its cursor, but stamped
+        # with a time before the cursor, is not missed.
+        fixture = registry_controller_fixture
+        now = utc_now()
+        for library in fixture.db.session.query(Library):
+            library.timestamp = now - datetime.timedelta(days=1)
+        early = fixture.db.library(name="Early")
+        late = fixture.db.library(name="Late")
+        fixture.db.session.flush()
+        early.timestamp = now - datetime.timedelta(minutes=2)
+        late.timestamp = None
+        fixture.db.session.flush()
+
+        def get(url):
+            with fixture.app.test_request_context(url):
+                response = fixture.controller.libraries_changes()
+                assert response.status == "200 OK"
+                catalog = json.loads(response.data)
+            ids = [entry["metadata"]["id"] for entry in catalog["catalogs"]]
+            links = {link["rel"]: link["href"] for link in catalog["links"]}
+            return ids, links[OPDSCatalog.PALACE_RESUME_REL]
+
+        since = (now - datetime.timedelta(hours=1)).isoformat()
+        ids, resume = get(f"/libraries/changes?since={quote(since)}")
+        assert ids == [early.internal_urn]
+
+        # Now the other library's change is committed. Its timestamp was
+        # set when it was written, before the cursor was issued.
+        late.timestamp = now - datetime.timedelta(minutes=3)
+        fixture.db.session.flush()
+
+        # Resuming from the cursor finds it. The library that was on the
+        # last page is seen again too.
+        ids, resume = get(resume)
+        assert ids == [late.internal_urn, early.internal_urn]
+
+        # A cursor issued longer ago than the safety window doesn't
+        # look back that far.
+        cursor = KeysetPagination.cursor(
+            early.timestamp,
+            early.id,
+            early.timestamp + KeysetPagination.SAFETY_WINDOW,
+        )
+        ids, resume = get(f"/libraries/changes?since={quote(cursor)}")
+        assert ids == []
+
+    def test_libraries_changes_null_timestamp(
+        self, registry_controller_fixture: LibraryRegistryControllerFixture
+    ):
+        # A library with no timestamp is left out of the feed rather than
+        # breaking the cursor for the page it would have ended.
+        fixture = registry_controller_fixture
+        library = fixture.db.library(name="No timestamp")
+        fixture.db.session.flush()
+        library.timestamp = None
+        fixture.db.session.flush()
+
+        with fixture.app.test_request_context("/libraries/changes?size=100"):
+            response = fixture.controller.libraries_changes()
+        assert response.status == "200 OK"
+        catalog = json.loads(response.data)
+        ids = [entry["metadata"]["id"] for entry in catalog["catalogs"]]
+        assert ids
+        assert library.internal_urn not in ids
+        last = (
+            fixture.db.session.query(Library)
+            .filter(Library.internal_urn == ids[-1])
+            .one()
+        )
+        links = {link["rel"]: link["href"] for link in catalog["links"]}
+        assert KeysetPagination.cursor(last.timestamp, last.id) in unquote(
+            links[OPDSCatalog.PALACE_RESUME_REL]
+        )
+
+    def test_libraries_changes_bad_since(
+        self, registry_controller_fixture: LibraryRegistryControllerFixture
+    ):
+        fixture = registry_controller_fixture
+        with fixture.app.test_request_context("/libraries/changes?since=yesterday"):
+            response = fixture.controller.libraries_changes()
+        assert isinstance(response, ProblemDetail)
+        assert response.status_code == 400
+        assert "yesterday" in str(response.detail)
+
+    def test_libraries_export(
+        self, registry_controller_fixture: LibraryRegistryControllerFixture
+    ):
+        fixture = registry_controller_fixture
+        hidden = fixture.db.library(
+            name="Hidden library", registry_stage=Library.TESTING_STAGE
+        )
+        fixture.db.library(
+            name="Cancelled library", library_stage=Library.CANCELLED_STAGE
+        )
+        expect = {
+            library.internal_urn
+            for library in fixture.db.session.query(Library).filter(
+                Library._feed_restriction(production=False)
+            )
+        }
+        assert hidden.internal_urn in expect
+
+        with fixture.app.test_request_context("/libraries/export.ndjson"):
+            response = fixture.controller.libraries_export()
+            assert response.status == "200 OK"
+            assert response.mimetype == NDJSON_MEDIA_TYPE
+            assert "Content-Encoding" not in response.headers
+            lines = response.get_data(as_text=True).splitlines()
+        entries = [json.loads(line) for line in lines]
+        assert {entry["metadata"]["id"] for entry in entries} == expect
+        assert len(entries) == len(expect)
+
+        # The availability filter works as it does for the other feeds.
+        with fixture.app.test_request_context(
+            "/libraries/export.ndjson?availability=hidden"
+        ):
+            response = fixture.controller.libraries_export()
+            [line] = response.get_data(as_text=True).splitlines()
+        assert json.loads(line)["metadata"]["id"] == hidden.internal_urn
+
+        # The client can ask for the export to be gzipped.
+        with fixture.app.test_request_context(
+            "/libraries/export.ndjson?include=service_areas,collection_summaries",
+            headers={"Accept-Encoding": "gzip, deflate"},
+        ):
+            response = fixture.controller.libraries_export()
+            assert response.headers["Content-Encoding"] == "gzip"
+            data = gzip.decompress(response.get_data())
+        entries = [json.loads(line) for line in data.decode("utf8").splitlines()]
+        assert {entry["metadata"]["id"] for entry in entries} == expect
+        for entry in entries:
+            assert "collection_summaries" in entry["metadata"]
+
+        # A client that refuses gzip doesn't get it.
+        with fixture.app.test_request_context(
+            "/libraries/export.ndjson",
+            headers={"Accept-Encoding": "gzip;q=0, identity"},
+        ):
+            response = fixture.controller.libraries_export()
+            assert "Content-Encoding" not in response.headers
+            assert response.get_data(as_text=True).splitlines()
+
+        with fixture.app.test_request_context(
+            "/libraries/export.ndjson?include=patrons"
+        ):
+            response = fixture.controller.libraries_export()
+        assert isinstance(response, ProblemDetail)
+        assert response.status_code == 400
+        assert "patrons" in str(response.detail)
+
     def test_libraries_opds_crawlable_pagination(
         self, registry_controller_fixture: LibraryRegistryControllerFixture
     ):
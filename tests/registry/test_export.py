@@ -0,0 +1,69 @@
+import gzip
+import json
+
+from palace.registry.export import LibraryExporter, gzip_chunks
+from palace.registry.opds import AvailabilityFacet, OrderFacet
+from palace.registry.sqlalchemy.model.collection_summary import CollectionSummary
+from palace.registry.sqlalchemy.model.library import Library
+from tests.fixtures.database import DatabaseTransactionFixture
+
+
+def mock_url_for(route, uuid, **kwargs):
+    return f"http://{route}/{uuid}"
+
+
+class TestLibraryExporter:
+    def test_lines(self, db: DatabaseTransactionFixture):
+        production = db.library(name="Production")
+        hidden = db.library(name="Hidden", registry_stage=Library.TESTING_STAGE)
+        db.library(name="Cancelled", library_stage=Library.CANCELLED_STAGE)
+
+        exporter = LibraryExporter(db.session, order=OrderFacet.NAME, batch_size=1)
+        lines = list(exporter.lines(mock_url_for))
+
+        # Every non-cancelled library gets exactly one line.
+        assert all(line.endswith(b"\n") and line.count(b"\n") == 1 for line in lines)
+        entries = [json.loads(line) for line in lines]
+        assert [entry["metadata"]["id"] for entry in entries] == [
+            hidden.internal_urn,
+            production.internal_urn,
+        ]
+        assert f"http://library_eligibility/{hidden.internal_urn}" in [
+            link["href"] for link in entries[0]["links"]
+        ]
+        for entry in entries:
+            assert "schema:areaServed" not in entry["metadata"]
+            assert LibraryExporter.COLLECTION_SUMMARIES_KEY not in entry["metadata"]
+
+        exporter = LibraryExporter(
+            db.session, availability=frozenset({AvailabilityFacet.PRODUCTION})
+        )
+        [entry] = exporter.entries(mock_url_for)
+        assert entry["metadata"]["id"] == production.internal_urn
+
+    def test_optional_parts(self, db: DatabaseTransactionFixture):
+        nypl = db.nypl
+        CollectionSummary.set(nypl, "Spanish", 100)
+        CollectionSummary.set(nypl, "English", 2000)
+
+        exporter = LibraryExporter(
+            db.session,
+            include_service_areas=True,
+            include_collection_summaries=True,
+        )
+        [entry] = exporter.entries(mock_url_for)
+        assert entry["metadata"]["schema:areaServed"] == nypl.service_area_name
+        assert entry["metadata"][LibraryExporter.COLLECTION_SUMMARIES_KEY] == [
+            dict(language="eng", size=2000),
+            dict(language="spa", size=100),
+        ]
+
+
+class TestGzipChunks:
+    def test_round_trip(self):
+        chunks = ["first line\n", b"second line\n", "", "third line\n"]
+        compressed = b"".join(gzip_chunks(chunks))
+        assert gzip.decompress(compressed) == b"first line\nsecond line\nthird line\n"
+
+    def test_empty(self):
+        assert gzip.decompress(b"".join(gzip_chunks([]))) == b""
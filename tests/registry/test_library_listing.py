@@ -0,0 +1,148 @@
+import datetime
+from types import SimpleNamespace
+
+from palace.registry.library_listing import (
+    NOT_VALIDATED,
+    AdminLibraryListing,
+    email_from_href,
+)
+from palace.registry.opds import OrderFacet
+from palace.registry.pagination import Pagination
+from palace.registry.sqlalchemy.model.hyperlink import Hyperlink
+from palace.registry.sqlalchemy.model.library import Library
+from palace.registry.sqlalchemy.model.place import Place
+from palace.registry.sqlalchemy.model.resource import Validation
+from tests.fixtures.database import DatabaseTransactionFixture
+
+
+def test_email_from_href():
+    assert email_from_href("mailto:help@library.org") == "help@library.org"
+    assert email_from_href("https://library.org/help") is None
+    assert email_from_href("") is None
+    assert email_from_href(None) is None
+
+
+class TestAdminLibraryListing:
+    def test_library_details(self):
+        # A row of LIBRARY_COLUMNS is turned into the same dict
+        # LibraryRegistryController.library_details would build.
+        timestamp = datetime.datetime(2024, 1, 2, tzinfo=datetime.UTC)
+        row = SimpleNamespace(
+            id=1,
+            name="A Library",
+            short_name="AL",
+            description="Description",
+            timestamp=timestamp,
+            internal_urn="urn:uuid:1234",
+            online_registration=False,
+            authentication_url="https://al.org/auth",
+            opds_url="https://al.org/",
+            web_url=None,
+            library_stage=Library.PRODUCTION_STAGE,
+            registry_stage=Library.TESTING_STAGE,
+        )
+
+        hyperlinks = {
+            Hyperlink.INTEGRATION_CONTACT_REL: ("mailto:contact@al.org", timestamp),
+            Hyperlink.HELP_REL: ("https://al.org/help", NOT_VALIDATED),
+        }
+        areas = dict(focus=["Everywhere"], service=[])
+        details = AdminLibraryListing.library_details(row, hyperlinks, "pls", 7, areas)
+        assert details == dict(
+            uuid="1234",
+            basic_info=dict(
+                name="A Library",
+                short_name="AL",
+                description="Description",
+                timestamp=timestamp,
+                internal_urn="urn:uuid:1234",
+                online_registration="False",
+                pls_id="pls",
+                number_of_patrons="7",
+            ),
+            urls_and_contact=dict(
+                contact_email="contact@al.org",
+                contact_validated=timestamp,
+                help_email=None,
+                help_validated=NOT_VALIDATED,
+                copyright_email=None,
+                copyright_validated=NOT_VALIDATED,
+                authentication_url="https://al.org/auth",
+                opds_url="https://al.org/",
+                web_url=None,
+                help_url="https://al.org/help",
+            ),
+            areas=areas,
+            stages=dict(
+                library_stage=Library.PRODUCTION_STAGE,
+                registry_stage=Library.TESTING_STAGE,
+            ),
+        )
+
+        # With no hyperlinks or areas, everything is empty or unvalidated.
+        details = AdminLibraryListing.library_details(row, {}, None, 0, None)
+        assert details["areas"] == dict(focus=[], service=[])
+        assert details["urls_and_contact"]["help_url"] is None
+        assert details["urls_and_contact"]["contact_validated"] == NOT_VALIDATED
+
+    def test_details(self, db: DatabaseTransactionFixture):
+        new_york = db.new_york_state
+        zip = db.zip_10018
+        library = db.library(
+            name="Listed", eligibility_areas=[new_york], focus_areas=[zip]
+        )
+        library.pls_id.value = "12345"
+        contact, ignore = library.set_hyperlink(
+            Hyperlink.INTEGRATION_CONTACT_REL, "mailto:contact@library.org"
+        )
+        contact.resource.validation = Validation()
+        db.library(name="Testing", registry_stage=Library.TESTING_STAGE)
+
+        details, has_next = AdminLibraryListing(db.session).details()
+        assert has_next is False
+        [listed] = details
+        assert listed["basic_info"]["name"] == "Listed"
+        assert listed["basic_info"]["pls_id"] == "12345"
+        assert listed["areas"] == dict(focus=["10018"], service=["New York"])
+        assert (
+            listed["urls_and_contact"]["contact_validated"]
+            == contact.resource.validation.started_at
+        )
+
+        details, has_next = AdminLibraryListing(db.session, live=False).details()
+        assert [d["basic_info"]["name"] for d in details] == ["Listed", "Testing"]
+
+    def test_search_order_and_pagination(self, db: DatabaseTransactionFixture):
+        names = ["Apple%", "Banana", "cherry", "Date"]
+        for name in names:
+            db.library(name=name)
+
+        def listed(**kwargs):
+            details, has_next = AdminLibraryListing(db.session, **kwargs).details()
+            return [d["basic_info"]["name"] for d in details], has_next
+
+        # The search is case-insensitive, and special characters in it
+        # don't act as wildcards.
+        assert listed(search="CHERRY") == (["cherry"], False)
+        assert listed(search="%") == (["Apple%"], False)
+
+        assert listed(order=OrderFacet.NAME_DESC)[0] == list(reversed(names))
+
+        page = Pagination(offset=0, size=3)
+        assert listed(order=OrderFacet.NAME, pagination=page) == (names[:3], True)
+        assert listed(order=OrderFacet.NAME, pagination=page.next_page) == (
+            names[3:],
+            False,
+        )
+        assert AdminLibraryListing(db.session, pagination=page).count() == 4
+        assert AdminLibraryListing(db.session, search="an").count() == 1
+
+    def test_human_friendly_place_names(self, db: DatabaseTransactionFixture):
+        # Place names are built from columns just as Place.human_friendly_name
+        # builds them from objects.
+        everywhere = db.place(type=Place.EVERYWHERE)
+        kansas = db.kansas_state
+        city = db.place(type=Place.CITY, external_name="Lawrence", parent=kansas)
+        library = db.library(eligibility_areas=[everywhere, city])
+        areas = AdminLibraryListing(db.session).areas([library.id])
+        assert areas[library.id]["service"] == ["Everywhere", "Lawrence, KS"]
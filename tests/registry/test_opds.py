@@ -90,11 +90,16 @@ class TestAddFacets:
 
     BASE_URL = "https://registry.example.org/libraries/crawlable"
 
-    def _make_catalog(self, order=None, availability=None):
+    def _make_catalog(self, order=None, availability=None, availability_counts=None):
         """Build a minimal catalog dict and run _add_facets on it."""
         catalog = OPDSCatalog.__new__(OPDSCatalog)
         catalog.catalog = {"metadata": {}, "links": [], "catalogs": []}
-        catalog._add_facets(self.BASE_URL, order, availability)
+        catalog._add_facets(
+            self.BASE_URL,
+            order,
+            availability,
+            availability_counts=availability_counts,
+        )
         return catalog.catalog
 
     def test_facets_structure(self):
@@ -117,6 +122,32 @@ class TestAddFacets:
         # Three values: production, hidden, all
         assert len(cat["facets"][1]["links"]) == 3
 
+    def test_availability_facet_number_of_items(self):
+        """Availability links carry numberOfItems only when counts are known."""
+        cat = self._make_catalog()
+        for link in cat["facets"][1]["links"]:
+            assert "numberOfItems" not in link.get("properties", {})
+
+        counts = {
+            AvailabilityFacet.PRODUCTION: 3,
+            AvailabilityFacet.HIDDEN: 2,
+            AvailabilityFacet.ALL: 5,
+        }
+        cat = self._make_catalog(availability_counts=counts)
+        by_title = {
+            link["title"]: link["properties"]["numberOfItems"]
+            for link in cat["facets"][1]["links"]
+        }
+        assert by_title == {
+            "Production": 3,
+            "Hidden": 2,
+            "All: Production and Hidden": 5,
+        }
+
+        # Sort facets are not counted.
+        for link in cat["facets"][0]["links"]:
+            assert "numberOfItems" not in link.get("properties", {})
+
     @pytest.mark.parametrize(
         "order, availability, expected_active_order, expected_active_avail_label",
         [
@@ -388,12 +419,18 @@ class TestAddFacets:
 
 
 class TestOPDSCatalog:
-    def test_strftime_format(self):
-        """_strftime produces dates in the expected ISO 8601 format: YYYY-MM-DDTHH:MM:SSZ."""
-        aware = datetime.datetime(2024, 3, 15, 10, 30, 0, tzinfo=datetime.UTC)
-        result = OPDSCatalog._strftime(aware)
-        # Raises ValueError if the format doesn't match exactly.
-        datetime.datetime.strptime(result, "%Y-%m-%dT%H:%M:%SZ")
+    def test_timestamps_serialized_in_feed_format(self):
+        """Timestamps come out in the expected ISO 8601 format: YYYY-MM-DDTHH:MM:SSZ."""
+        catalog = OPDSCatalog.__new__(OPDSCatalog)
+        eastern = datetime.timezone(datetime.timedelta(hours=-5))
+        catalog.catalog = {
+            "metadata": {
+                "modified": datetime.datetime(2024, 3, 15, 5, 30, 0, 12, tzinfo=eastern)
+            }
+        }
+        parsed = json.loads(str(catalog))
+        assert parsed["metadata"]["modified"] == "2024-03-15T10:30:00Z"
+        assert bytes(catalog) == str(catalog).encode("utf8")
 
     def mock_url_for(self, route, uuid, **kwargs):
         """A simple replacement for url_for that doesn't require an
@@ -515,6 +552,35 @@ class TestOPDSCatalog:
         assert m(db.session, [1, 2]) is True
         assert m(db.session, [1]) is False
 
+    def test_tombstones(self, db: DatabaseTransactionFixture):
+        l1 = db.library("The New York Public Library")
+        l2 = db.library("Brooklyn Public Library")
+
+        catalog = OPDSCatalog(
+            db.session,
+            "Changes",
+            "http://url/",
+            [l1, l2],
+            url_for=self.mock_url_for,
+            tombstones={l2.id},
+        )
+        entry, tombstone = json.loads(str(catalog))["catalogs"]
+
+        assert entry["metadata"]["id"] == l1.internal_urn
+        assert entry["links"]
+        assert OPDSCatalog.PALACE_PROPERTIES_REMOVED not in entry["metadata"]
+
+        modified = l2.timestamp.strftime(OPDSCatalog.TIME_FORMAT)
+        assert tombstone == {
+            "metadata": {
+                "id": l2.internal_urn,
+                "title": l2.name,
+                "modified": modified,
+                "updated": modified,
+                OPDSCatalog.PALACE_PROPERTIES_REMOVED: True,
+            }
+        }
+
     def test_library_catalog(self, db: DatabaseTransactionFixture):
         class Mock(OPDSCatalog):
             """An OPDSCatalog that instruments calls to _hyperlink_args."""
@@ -567,9 +633,9 @@ class TestOPDSCatalog:
 
         # The library's updated timestamp is published as 'modified'
         # and also (for backwards compatibility) as 'updated'.
-        timestamp = OPDSCatalog._strftime(library.timestamp)
+        # The serializer takes care of formatting it.
         for key in ("modified", "updated"):
-            assert metadata[key] == timestamp
+            assert metadata[key] == library.timestamp
 
         # If the library's service area is easy to explain in human-friendly
         # terms, it is explained in 'schema:areaServed'.
@@ -1,10 +1,14 @@
 """Tests for pagination module."""
 
+import datetime
+
 import flask
 import pytest
 from flask import Flask
+from sqlalchemy.orm import Query
 
-from palace.registry.pagination import Pagination
+from palace.registry.pagination import KeysetPagination, Pagination
+from palace.registry.sqlalchemy.model.library import Library
 
 
 class TestPagination:
@@ -166,3 +170,148 @@ class TestPagination:
         assert "offset=50" in repr_str
         assert "size=25" in repr_str
         assert "total_count=200" in repr_str
+
+
+class TestKeysetPagination:
+    """Tests for KeysetPagination class."""
+
+    @pytest.fixture
+    def app(self):
+        app = Flask(__name__)
+        app.config["TESTING"] = True
+        return app
+
+    def test_from_request_defaults(self, app):
+        with app.test_request_context("/"):
+            p = KeysetPagination.from_request(flask.request)
+        assert p.since is None
+        assert p.after_id is None
+        assert p.size == Pagination.DEFAULT_SIZE
+
+    @pytest.mark.parametrize(
+        "since, expected_since, expected_after_id",
+        [
+            pytest.param(
+                "2024-03-01T12:30:00Z",
+                datetime.datetime(2024, 3, 1, 12, 30, tzinfo=datetime.UTC),
+                None,
+                id="timestamp",
+            ),
+            pytest.param(
+                "2024-03-01T12:30:00",
+                datetime.datetime(2024, 3, 1, 12, 30, tzinfo=datetime.UTC),
+                None,
+                id="naive-timestamp-is-utc",
+            ),
+            pytest.param(
+                "2024-03-01T12:30:00.000123Z,42",
+                datetime.datetime(2024, 3, 1, 12, 30, 0, 123, tzinfo=datetime.UTC),
+                42,
+                id="cursor",
+            ),
+        ],
+    )
+    def test_from_request_since(self, app, since, expected_since, expected_after_id):
+        with app.test_request_context("/", query_string={"since": since, "size": 30}):
+            p = KeysetPagination.from_request(flask.request)
+        assert p.since == expected_since
+        assert p.after_id == expected_after_id
+        assert p.issued_at is None
+        assert p.size == 30
+
+    @pytest.mark.parametrize(
+        "since",
+        [
+            pytest.param("yesterday", id="not-a-timestamp"),
+            pytest.param("2024-03-01T12:30:00Z,abc", id="bad-id"),
+            pytest.param("2024-03-01T12:30:00Z,1,later", id="bad-issued-at"),
+            pytest.param("2024-03-01T12:30:00Z,1,2024-03-01T12:30:00Z,1", id="extra"),
+        ],
+    )
+    def test_from_request_invalid_since(self, app, since):
+        with app.test_request_context("/", query_string={"since": since}):
+            with pytest.raises(ValueError):
+                KeysetPagination.from_request(flask.request)
+
+    def test_cursor_round_trip(self):
+        eastern = datetime.timezone(datetime.timedelta(hours=-5))
+        timestamp = datetime.datetime(2024, 3, 1, 7, 30, 0, 5, tzinfo=eastern)
+        cursor = KeysetPagination.cursor(timestamp, 17)
+        assert cursor == "2024-03-01T12:30:00.000005Z,17"
+        assert KeysetPagination.parse_since(cursor) == (timestamp, 17, None)
+
+        # A cursor can say when it was issued.
+        issued_at = datetime.datetime(2024, 3, 1, 12, 35, tzinfo=datetime.UTC)
+        cursor = KeysetPagination.cursor(timestamp, 17, issued_at)
+        assert cursor == "2024-03-01T12:30:00.000005Z,17,2024-03-01T12:35:00Z"
+        assert KeysetPagination.parse_since(cursor) == (timestamp, 17, issued_at)
+
+    def test_modify_query(self):
+        def where_clause(p):
+            query = p.modify_query(Query(Library), Library.timestamp, Library.id)
+            return str(query.statement.compile()).split("WHERE")[-1]
+
+        assert "libraries.timestamp IS NOT NULL" in where_clause(KeysetPagination())
+        since = datetime.datetime(2024, 3, 1, tzinfo=datetime.UTC)
+        assert "libraries.timestamp >" in where_clause(KeysetPagination(since=since))
+        assert "(libraries.timestamp, libraries.id) >" in where_clause(
+            KeysetPagination(since=since, after_id=3)
+        )
+
+    def test_reread_query(self):
+        def reread(p):
+            query = p.reread_query(Query(Library), Library.timestamp, Library.id)
+            if query is None:
+                return None
+            return query.statement.compile().params
+
+        since = datetime.datetime(2024, 3, 1, tzinfo=datetime.UTC)
+        window = KeysetPagination.SAFETY_WINDOW
+
+        # Nothing is read again for the start of the feed, or for a
+        # timestamp the client picked.
+        assert reread(KeysetPagination()) is None
+        assert reread(KeysetPagination(since=since)) is None
+
+        # Resuming from a cursor that was just issued reads again the
+        # items modified in the window before it was issued.
+        issued_at = since + datetime.timedelta(minutes=1)
+        params = reread(KeysetPagination(since=since, after_id=3, issued_at=issued_at))
+        assert params["timestamp_1"] == issued_at - window
+        assert (params["param_1"], params["param_2"]) == (since, 3)
+
+        # A cursor that doesn't say when it was issued is assumed to have
+        # been issued at the time it points to.
+        params = reread(KeysetPagination(since=since, after_id=3))
+        assert params["timestamp_1"] == since - window
+
+        # For a cursor issued longer ago than that, there's nothing to
+        # read again.
+        issued_at = since + window
+        assert (
+            reread(KeysetPagination(since=since, after_id=3, issued_at=issued_at))
+            is None
+        )
+
+    def test_next_cursor(self):
+        since = datetime.datetime(2024, 3, 1, tzinfo=datetime.UTC)
+        now = datetime.datetime(2024, 3, 2, tzinfo=datetime.UTC)
+        later = datetime.datetime(2024, 3, 1, 12, tzinfo=datetime.UTC)
+
+        # The next page starts after the last new item, from a cursor
+        # issued when this page was requested.
+        p = KeysetPagination(since=since, requested_at=now)
+        assert p.next_cursor(later, 5) == KeysetPagination.cursor(later, 5, now)
+
+        # If there was nothing new, a cursor keeps its place but is
+        # issued again.
+        p = KeysetPagination(since=since, after_id=3, requested_at=now)
+        assert p.next_cursor() == KeysetPagination.cursor(since, 3, now)
+
+        # A timestamp the client picked stays as it is.
+        assert KeysetPagination(since=since).next_cursor() is None
+
+    def test_page_loaded(self):
+        p = KeysetPagination(size=3)
+        assert p.page_loaded([1, 2, 3, 4]) == ([1, 2, 3], True)
+        assert p.page_loaded([1, 2, 3]) == ([1, 2, 3], False)
@@ -1,16 +1,24 @@
 import base64
 import json
+import threading
 from io import BytesIO
 from unittest.mock import MagicMock, patch
 
+import pytest
+
 from palace.registry.authentication_document import AuthenticationDocument
 from palace.registry.opds import OPDSCatalog
-from palace.registry.problem_details import INVALID_CONTACT_URI, NO_AUTH_URL
+from palace.registry.problem_details import (
+    INVALID_CONTACT_URI,
+    INVALID_INTEGRATION_DOCUMENT,
+    NO_AUTH_URL,
+)
 from palace.registry.registrar import LibraryRegistrar, VerifyLinkRegexes
+from palace.registry.sqlalchemy.model.document_fingerprint import DocumentFingerprint
 from palace.registry.sqlalchemy.model.library import Library
 from palace.registry.util.problem_detail import ProblemDetail
 from tests.fixtures.database import DatabaseTransactionFixture
-from tests.testing import DummyHTTPResponse
+from tests.testing import DummyHTTPResponse, InlineExecutor
 from tests.utils import mock_response
 
 
@@ -25,8 +33,9 @@ class TestRegistrar:
         class Mock(LibraryRegistrar):
             RETURN_VALUE = NO_AUTH_URL
 
-            def register(self, library, library_stage):
+            def register(self, library, library_stage, auth_response=None):
                 self.called_with = (library, library_stage)
+                self.auth_response = auth_response
                 return self.RETURN_VALUE
 
         library = db.library()
@@ -43,6 +52,127 @@ class TestRegistrar:
         result = registrar.reregister(library)
         assert result is None
 
+        # The authentication document was fetched by register() itself.
+        assert registrar.auth_response is None
+
+    def test_reregister_unchanged(self, db: DatabaseTransactionFixture):
+        class Mock(LibraryRegistrar):
+            register_calls = []
+
+            def register(self, library, library_stage, auth_response=None):
+                self.register_calls.append(auth_response)
+                return object(), []
+
+        library = db.library()
+        library.authentication_url = "http://library/auth"
+        auth_document = b'{"id": "http://library/auth"}'
+        opds_feed = b"<feed/>"
+        DocumentFingerprint.record(
+            library,
+            DocumentFingerprint.AUTHENTICATION_DOCUMENT,
+            library.authentication_url,
+            mock_response(200, auth_document, headers={"ETag": '"v1"'}),
+        )
+        opds_fingerprint = DocumentFingerprint.record(
+            library,
+            DocumentFingerprint.OPDS_ROOT,
+            "http://library/opds",
+            mock_response(
+                200, opds_feed, headers={"Last-Modified": "Fri, 16 Oct 2026"}
+            ),
+        )
+
+        # The library's server says neither document has changed.
+        do_get = MagicMock(
+            side_effect=[mock_response(304, b""), mock_response(304, b"")]
+        )
+        registrar = Mock(db.session, do_get=do_get)
+        assert registrar.reregister(library) is None
+
+        # Registration didn't happen at all.
+        assert registrar.register_calls == []
+
+        # The requests were conditional.
+        [auth_call, opds_call] = do_get.call_args_list
+        assert auth_call.args == ("http://library/auth",)
+        assert auth_call.kwargs["headers"] == {
+            "Cache-Control": "no-cache",
+            "If-None-Match": '"v1"',
+        }
+        assert opds_call.args == ("http://library/opds",)
+        assert opds_call.kwargs["headers"] == {
+            "Cache-Control": "no-cache",
+            "If-Modified-Since": "Fri, 16 Oct 2026",
+        }
+
+        # A server that ignores the conditions, but sends the same
+        # documents, is also recognized as having no changes.
+        do_get = MagicMock(
+            side_effect=[
+                mock_response(200, auth_document),
+                mock_response(200, opds_feed),
+            ]
+        )
+        registrar = Mock(db.session, do_get=do_get)
+        assert registrar.reregister(library) is None
+        assert registrar.register_calls == []
+
+        # If the OPDS feed has changed, it's checked again.
+        do_get = MagicMock(
+            side_effect=[
+                mock_response(304, b""),
+                mock_response(
+                    200,
+                    b"<feed>new</feed>",
+                    headers={"Content-Type": OPDSCatalog.OPDS_1_TYPE},
+                    url="http://library/opds",
+                ),
+            ]
+        )
+        registrar = Mock(db.session, do_get=do_get)
+        with patch.object(
+            LibraryRegistrar, "opds_response_links_to_auth_document"
+        ) as links:
+            links.return_value = False
+            problem = registrar.reregister(library)
+        assert problem.uri == INVALID_INTEGRATION_DOCUMENT.uri
+        assert (
+            problem.detail
+            == "OPDS root document at http://library/opds does not link back to authentication document http://library/auth"
+        )
+        assert registrar.register_calls == []
+
+        # If it still links to the authentication document, the new
+        # version is remembered.
+        do_get.side_effect = [
+            mock_response(304, b""),
+            mock_response(
+                200,
+                b"<feed>new</feed>",
+                headers={"Content-Type": OPDSCatalog.OPDS_1_TYPE, "ETag": '"v2"'},
+                url="http://library/opds",
+            ),
+        ]
+        with patch.object(
+            LibraryRegistrar, "opds_response_links_to_auth_document"
+        ) as links:
+            links.return_value = True
+            assert registrar.reregister(library) is None
+        assert registrar.register_calls == []
+        assert opds_fingerprint.etag == '"v2"'
+        assert opds_fingerprint.content_hash == DocumentFingerprint.hash(
+            b"<feed>new</feed>"
+        )
+
+        # If the authentication document has changed, the library is
+        # registered again, using the response that was just received.
+        new_auth_response = mock_response(200, b'{"id": "http://library/auth/2"}')
+        do_get = MagicMock(return_value=new_auth_response)
+        registrar = Mock(db.session, do_get=do_get)
+        assert registrar.reregister(library) is None
+        assert registrar.register_calls == [new_auth_response]
+        do_get.assert_called_once()
+
     def test_opds_response_links(self):
         """Test the opds_response_links method.
 
@@ -336,7 +466,7 @@ class TestRegistrar:
         registrar.do_get = MagicMock(
             return_value=mock_response(200, small_png, stream=True)
         )
-        mock_logo_store.write.return_value = "http://localhost/logo"
+        mock_logo_store.write_image.return_value = "http://localhost/logo"
 
         with patch(
             "palace.registry.registrar.LibraryRegistrar.opds_response_links_to_auth_document"
@@ -345,11 +475,11 @@ class TestRegistrar:
             registrar.register(library, Library.TESTING_STAGE)
 
         assert registrar._make_request.call_count == 2
-        assert mock_logo_store.write.call_count == 1
+        assert mock_logo_store.write_image.call_count == 1
 
-        args = mock_logo_store.write.call_args
+        args = mock_logo_store.write_image.call_args
         assert args[0][0] == library
-        assert type(args[0][1]) == BytesIO
+        assert args[0][1] == small_png
 
         assert library.logo_url == "http://localhost/logo"
 
@@ -372,3 +502,84 @@ class TestRegistrar:
         )
 
         assert response == mock_get.return_value
+
+    def test__fetch_all(self):
+        registrar = LibraryRegistrar(object(), executor=InlineExecutor())
+
+        # A single call is made on the calling thread.
+        [result] = registrar._fetch_all([threading.current_thread])
+        assert result == threading.current_thread()
+
+        # Several calls are handed to the Executor, and their results
+        # come back in the order the calls were given.
+        registrar.executor = MagicMock(wraps=registrar.executor)
+        assert registrar._fetch_all([lambda: 1, lambda: 2, lambda: 3]) == [1, 2, 3]
+        assert registrar.executor.submit.call_count == 3
+
+        # An exception raised by a call is raised again.
+        def explode():
+            raise ValueError("oops")
+
+        with pytest.raises(ValueError, match="oops"):
+            registrar._fetch_all([lambda: 1, explode])
+
+    def test__fetch_all_is_concurrent(self):
+        # By default, the calls are made at the same time, on threads
+        # from a pool shared by every LibraryRegistrar.
+        registrar = LibraryRegistrar(object())
+        assert registrar.executor is LibraryRegistrar.shared_executor()
+
+        # Neither call can return until both of them have started.
+        barrier = threading.Barrier(2, timeout=5)
+        assert registrar._fetch_all([barrier.wait, barrier.wait]) in ([0, 1], [1, 0])
+
+    def test__fetch_logo(self):
+        small_png = base64.b64decode(
+            b"iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+        )
+        do_get = MagicMock(return_value=mock_response(200, small_png, stream=True))
+        registrar = LibraryRegistrar(object(), do_get=do_get)
+        data = registrar._fetch_logo(
+            "http://auth", "http://library/logo.png", "/logo.png"
+        )
+        do_get.assert_called_once_with("http://library/logo.png", stream=True)
+        assert data == small_png
+
+        # If the image can't be retrieved, a ProblemDetail is returned instead.
+        for response in (
+            mock_response(500, b"error", stream=True),
+            INVALID_INTEGRATION_DOCUMENT,
+        ):
+            do_get.return_value = response
+            problem = registrar._fetch_logo(
+                "http://auth", "http://library/logo.png", "/logo.png"
+            )
+            assert isinstance(problem, ProblemDetail)
+            assert problem.uri == INVALID_INTEGRATION_DOCUMENT.uri
+            assert problem.detail == "Could not read logo image /logo.png"
+
+        # An image that's too big is rejected, whether or not the server
+        # says how big it is up front.
+        registrar.MAX_LOGO_SIZE = 10
+        for headers in ({}, {"Content-Length": "11"}):
+            do_get.return_value = mock_response(
+                200, b"x" * 11, headers=headers, stream=True
+            )
+            problem = registrar._fetch_logo(
+                "http://auth", "http://library/logo.png", "/logo.png"
+            )
+            assert isinstance(problem, ProblemDetail)
+            assert problem.uri == INVALID_INTEGRATION_DOCUMENT.uri
+            assert problem.detail == "Logo image /logo.png is larger than 10 bytes"
+
+        do_get.return_value = mock_response(200, b"x" * 10, stream=True)
+        assert (
+            registrar._fetch_logo("http://auth", "http://library/logo.png", "/logo")
+            == b"x" * 10
+        )
+
+    def test__read_at_most(self):
+        m = LibraryRegistrar._read_at_most
+        assert m(BytesIO(b"abcdef"), 6, chunk_size=4) == b"abcdef"
+        assert m(BytesIO(b"abcdefg"), 6, chunk_size=4) is None
+        assert m(BytesIO(b""), 6) == b""
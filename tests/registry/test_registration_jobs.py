@@ -0,0 +1,131 @@
+import threading
+
+import flask
+from werkzeug.datastructures import Headers
+
+from palace.registry.registration_jobs import (
+    RegistrationRequest,
+    RegistrationWorkerPool,
+    prefers_async,
+)
+from palace.registry.sqlalchemy.model.registration_job import RegistrationJob
+from tests.testing import DeferredExecutor
+
+
+class MockSession:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_prefers_async():
+    assert prefers_async(Headers([("Prefer", "respond-async")])) is True
+    assert prefers_async(Headers([("Prefer", "wait=10, Respond-Async")])) is True
+    assert prefers_async(Headers([("Prefer", "return=minimal")])) is False
+    assert prefers_async(Headers()) is False
+
+
+def test_registration_request_round_trip():
+    request = RegistrationRequest(
+        authentication_url="http://library.org/auth",
+        contact="mailto:me@library.org",
+        library_stage="testing",
+        library_id=5,
+        reset_shared_secret=True,
+    )
+    assert request.elevated_permissions is True
+    job = RegistrationJob(**request.job_fields())
+    assert RegistrationRequest.from_job(job) == request
+
+    assert RegistrationRequest("http://library.org/auth").elevated_permissions is False
+
+
+class TestRegistrationWorkerPool:
+    def test_run_with_own_session(self):
+        app = flask.Flask(__name__)
+        app.add_url_rule("/register/jobs/<token>", "registration_job")
+        seen = []
+        sessions = []
+
+        def session_factory():
+            session = MockSession()
+            sessions.append(session)
+            return session
+
+        def run_job(job_id, _db, url_for, **kwargs):
+            # The job runs in an application context, not a request
+            # context, and builds URLs for the URL the request was sent to.
+            assert flask.has_app_context()
+            assert not flask.has_request_context()
+            seen.append(
+                (job_id, _db, url_for("registration_job", token="x", _external=True))
+            )
+            return "done"
+
+        executor = DeferredExecutor()
+        pool = RegistrationWorkerPool(
+            run_job, executor=executor, session_factory=session_factory
+        )
+        assert pool.submit(app, 7, "https://registry.org/base/") is True
+
+        # Nothing happens until the executor gets around to the job.
+        assert seen == []
+        assert executor.run_all() == ["done"]
+        [session] = sessions
+        assert seen == [(7, session, "https://registry.org/base/register/jobs/x")]
+        assert session.closed is True
+
+    def test_run_in_threads(self):
+        app = flask.Flask(__name__)
+        sessions = []
+        lock = threading.Lock()
+
+        def session_factory():
+            session = MockSession()
+            with lock:
+                sessions.append(session)
+            return session
+
+        started = threading.Barrier(3, timeout=5)
+        seen = []
+
+        def run_job(job_id, _db, url_for, **kwargs):
+            # All three jobs run at the same time.
+            started.wait()
+            with lock:
+                seen.append((job_id, _db, threading.current_thread().name))
+
+        pool = RegistrationWorkerPool(
+            run_job, max_workers=3, session_factory=session_factory
+        )
+        for job_id in range(3):
+            assert pool.submit(app, job_id, "http://registry.org/") is True
+        pool.shutdown(wait=True)
+
+        # Each job ran on a worker thread with a session of its own, which
+        # was closed when the job was done.
+        assert sorted(job_id for job_id, _, _ in seen) == [0, 1, 2]
+        assert len({id(_db) for _, _db, _ in seen}) == 3
+        assert all(name.startswith("registration") for _, _, name in seen)
+        assert len(sessions) == 3
+        assert all(session.closed for session in sessions)
+
+    def test_crashing_job(self):
+        app = flask.Flask(__name__)
+
+        def run_job(job_id, **kwargs):
+            raise Exception("oops")
+
+        # The exception is logged, not raised into the executor, and the
+        # job's session is still closed.
+        session = MockSession()
+        pool = RegistrationWorkerPool(run_job, session_factory=lambda: session)
+        assert pool.run(app, 1, "http://registry.org/") is None
+        assert session.closed is True
+
+    def test_no_workers(self):
+        pool = RegistrationWorkerPool(lambda job_id: None, max_workers=0)
+        assert pool.executor is None
+        assert pool.submit(flask.Flask(__name__), 1, "http://registry.org/") is False
+        pool.shutdown()
@@ -1,3 +1,4 @@
+import flask
 import pytest
 from flask import url_for
 
@@ -6,7 +7,11 @@ from palace.registry.controller import (
     OPENSEARCH_MEDIA_TYPE,
 )
 from palace.registry.opds import OPDSCatalog
-from palace.registry.route_links import RouteLinkRegistry
+from palace.registry.route_links import (
+    RouteLinkRegistry,
+    ScopedURLCache,
+    URLTemplateCache,
+)
 
 
 class TestRouteLinkRegistry:
@@ -127,6 +132,141 @@ class TestRouteLinkRegistry:
         )
         assert link["href"] == "http://example.com/%7Bfoo%7D"
 
+    def test_links_cached_per_host(self):
+        registry = RouteLinkRegistry()
+
+        @registry.register(rel="test")
+        def my_route():
+            pass
+
+        calls = []
+
+        def url_for(endpoint, **kwargs):
+            calls.append(endpoint)
+            return flask.request.host_url + endpoint
+
+        app = flask.Flask(__name__)
+        for host in ("a.example.com", "a.example.com", "b.example.com"):
+            with app.test_request_context("/", base_url=f"https://{host}"):
+                [link] = list(registry.links(url_for))
+                assert link["href"] == f"https://{host}/my_route"
+
+        # url_for was called once for each host.
+        assert calls == ["my_route", "my_route"]
+
+        # Only a few hosts are remembered.
+        for i in range(ScopedURLCache.MAX_SCOPES * 2):
+            with app.test_request_context("/", base_url=f"https://host{i}.example"):
+                list(registry.links(url_for))
+        assert len(registry._hrefs) == ScopedURLCache.MAX_SCOPES
+
+        # Outside of a request nothing is cached.
+        count = len(calls)
+        list(registry.links(lambda endpoint, **kw: "http://example.com/"))
+        list(registry.links(url_for=self._make_url_for()))
+        assert len(calls) == count
+
+
+class TestScopedURLCache:
+    def test_least_recently_used_scope_is_forgotten(self):
+        cache = ScopedURLCache(max_scopes=2)
+        cache.for_scope("a")["route"] = "a-url"
+        cache.for_scope("b")["route"] = "b-url"
+        assert cache.for_scope("a") == {"route": "a-url"}
+
+        # "b" was used least recently, so it makes way for "c".
+        cache.for_scope("c")
+        assert len(cache) == 2
+        assert cache.for_scope("a") == {"route": "a-url"}
+        assert cache.for_scope("b") == {}
+
+
+class TestURLTemplateCache:
+    @pytest.fixture
+    def app(self):
+        app = flask.Flask(__name__)
+        app.add_url_rule("/library/<uuid>/focus", "library_focus")
+        return app
+
+    @pytest.mark.parametrize(
+        "value",
+        [
+            pytest.param("urn:uuid:8f9a-77b2", id="urn"),
+            pytest.param("a b/c?d#e%f{}~\u00e9", id="needs-quoting"),
+        ],
+    )
+    def test_url_for_matches_flask(self, app, value):
+        cache = URLTemplateCache()
+        with app.test_request_context("/", base_url="https://registry.example.org"):
+            for _ in range(2):
+                assert cache.url_for(
+                    flask.url_for, "library_focus", "uuid", value, _external=True
+                ) == flask.url_for("library_focus", uuid=value, _external=True)
+
+    def test_url_for_resolves_once_per_host(self, app):
+        cache = URLTemplateCache()
+        calls = []
+
+        def url_for(endpoint, **kwargs):
+            calls.append(kwargs["uuid"])
+            return flask.url_for(endpoint, **kwargs)
+
+        for host in ("a.example.com", "a.example.com", "b.example.com"):
+            with app.test_request_context("/", base_url=f"http://{host}"):
+                for uuid in ("1", "2"):
+                    assert (
+                        cache.url_for(url_for, "library_focus", "uuid", uuid)
+                        == f"/library/{uuid}/focus"
+                    )
+                    assert (
+                        cache.url_for(
+                            url_for, "library_focus", "uuid", uuid, _external=True
+                        )
+                        == f"http://{host}/library/{uuid}/focus"
+                    )
+
+        # Each distinct set of url_for arguments was resolved once per host,
+        # using a placeholder rather than a real uuid.
+        assert calls == [URLTemplateCache.PLACEHOLDER] * 4
+
+    def test_hosts_are_bounded(self, app):
+        """A client can't grow the cache by making up Host headers."""
+        cache = URLTemplateCache()
+        for i in range(ScopedURLCache.MAX_SCOPES * 3):
+            with app.test_request_context("/", base_url=f"http://host{i}.example"):
+                assert cache.url_for(
+                    flask.url_for, "library_focus", "uuid", "x", _external=True
+                ) == (f"http://host{i}.example/library/x/focus")
+        assert len(cache._templates) == ScopedURLCache.MAX_SCOPES
+
+    def test_url_for_without_template(self, app):
+        """A url_for that drops the variable is called every time."""
+        cache = URLTemplateCache()
+        calls = []
+
+        def url_for(endpoint, **kwargs):
+            calls.append(kwargs)
+            return "http://example.com/"
+
+        with app.test_request_context("/"):
+            for _ in range(2):
+                assert (
+                    cache.url_for(url_for, "library_focus", "uuid", "x")
+                    == "http://example.com/"
+                )
+        assert calls == [
+            {"uuid": URLTemplateCache.PLACEHOLDER},
+            {"uuid": "x"},
+            {"uuid": "x"},
+        ]
+
+    def test_url_for_outside_request(self):
+        cache = URLTemplateCache()
+        url_for = lambda endpoint, uuid: f"http://{endpoint}/{uuid}"
+        assert cache.url_for(url_for, "library_focus", "uuid", "x") == (
+            "http://library_focus/x"
+        )
+
 
 class TestRouteLinkRegistryApp:
     """Verifies that endpoint names registered in the app's route_links resolve correctly."""
@@ -1,10 +1,21 @@
-from io import StringIO
-
+import datetime
+import gzip
+import json
+import threading
+import time
+from collections import Counter
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+
+import flask
 import pytest
 
 from palace.registry.config import Configuration
 from palace.registry.emailer import Emailer
-from palace.registry.problem_details import INVALID_INTEGRATION_DOCUMENT
+from palace.registry.problem_details import (
+    INTEGRATION_ERROR,
+    INVALID_INTEGRATION_DOCUMENT,
+)
 from palace.registry.registrar import LibraryRegistrar
 from palace.registry.scripts import (
     AddLibraryScript,
@@ -12,24 +23,73 @@ from palace.registry.scripts import (
     ConfigureIntegrationScript,
     ConfigureSiteScript,
     ConfigureVendorIDScript,
+    ExportLibrariesScript,
+    HostConcurrencyLimiter,
     LibraryScript,
     LoadPlacesScript,
+    ReconcilePatronCountsScript,
     RegistrationRefreshScript,
+    RunRegistrationJobsScript,
+    Script,
     SearchLibraryScript,
     SearchPlacesScript,
     SetCoverageAreaScript,
     ShowIntegrationsScript,
 )
 from palace.registry.sqlalchemy.model.configuration_setting import ConfigurationSetting
+from palace.registry.sqlalchemy.model.coverage_fingerprint import CoverageFingerprint
+from palace.registry.sqlalchemy.model.delegated_patron_identifier import (
+    DelegatedPatronIdentifier,
+    DelegatedPatronIdentifierCount,
+)
 from palace.registry.sqlalchemy.model.external_integration import ExternalIntegration
 from palace.registry.sqlalchemy.model.library import Library
+from palace.registry.sqlalchemy.model.library_refresh import LibraryRefresh
 from palace.registry.sqlalchemy.model.place import Place
+from palace.registry.sqlalchemy.model.registration_job import RegistrationJob
 from palace.registry.sqlalchemy.model.service_area import ServiceArea
 from palace.registry.sqlalchemy.util import create, get_one
+from palace.registry.util.datetime_helpers import utc_now
 from tests.fixtures.database import DatabaseTransactionFixture
 from tests.testing import MockPlace
 
 
+class TestScript:
+    def test_batched(self, db: DatabaseTransactionFixture):
+        libraries = [db.library(name=f"Library {i}") for i in range(5)]
+        names = [x.name for x in libraries]
+        kept_name = names[0]
+        db.session.commit()
+        db.session.expunge_all()
+
+        # An object loaded before the iteration stays in the session.
+        kept = db.session.query(Library).filter(Library.name == kept_name).one()
+
+        script = Script(db.session)
+        query = (
+            db.session.query(Library)
+            .filter(Library.name.in_(names))
+            .order_by(Library.name.desc())
+        )
+        seen = []
+        identity_map_sizes = []
+        for library in script.batched(query, batch_size=2):
+            seen.append(library)
+            identity_map_sizes.append(len(db.session.identity_map))
+
+        # The objects come out in the query's order.
+        assert [x.name for x in seen] == sorted(names, reverse=True)
+
+        # No more than one batch was in the session at a time, and each
+        # batch was expunged once it was done with.
+        assert max(identity_map_sizes) <= 3
+        assert all(x not in db.session for x in seen if x is not kept)
+        assert kept in db.session
+
+        # Anything that isn't a query is iterated over as it is.
+        assert list(script.batched([1, 2, 3])) == [1, 2, 3]
+
+
 class TestLibraryScript:
     def test_libraries(self, db: DatabaseTransactionFixture):
 
@@ -78,6 +138,8 @@ class TestLoadPlacesScript:
 {"type": "Point", "coordinates": [-88.053375, 30.506987]}
 {"parent_id": "01", "name": "Montgomery", "full_name": null, "aliases": [], "type": "city", "abbreviated_name": null, "id": "0151000"}
 {"type": "Point", "coordinates": [-86.034128, 32.302979]}"""
+        library = db.library()
+        CoverageFingerprint.record(library, "a hash")
         script = LoadPlacesScript(db.session)
 
         # Run the script...
@@ -92,6 +154,10 @@ class TestLoadPlacesScript:
         }
         assert {x.external_id for x in places} == {"US", "01", "0151000"}
 
+        # Coverage areas may resolve differently now, so how they were
+        # resolved before has been forgotten.
+        assert db.session.query(CoverageFingerprint).count() == 0
+
 
 class TestSearchPlacesScript:
     def test_run(self, db: DatabaseTransactionFixture):
@@ -172,6 +238,85 @@ class TestSearchLibraryScript:
         assert actual_output == f"{nypl.name}: {nypl.opds_url}\n"
 
 
+class TestReconcilePatronCountsScript:
+    def test_run(self, db: DatabaseTransactionFixture):
+        library = db.library()
+        adobe = DelegatedPatronIdentifier.ADOBE_ACCOUNT_ID
+        DelegatedPatronIdentifier.get_one_or_create(
+            db.session, library, "patron", adobe, "id"
+        )
+        DelegatedPatronIdentifierCount.increment(db.session, library.id, adobe)
+
+        def counts():
+            return DelegatedPatronIdentifierCount.counts(
+                db.session, [library.id], adobe
+            )
+
+        # A dry run reports the wrong count but leaves it alone.
+        output = StringIO()
+        changes = ReconcilePatronCountsScript(db.session).run(
+            ["--dry-run"], stdout=output
+        )
+        assert changes == [(library.id, adobe, 2, 1)]
+        assert f"Library {library.id}, {adobe}: 2 -> 1" in output.getvalue()
+        assert counts() == {library.id: 2}
+
+        ReconcilePatronCountsScript(db.session).run([], stdout=StringIO())
+        assert counts() == {library.id: 1}
+
+
+class TestExportLibrariesScript:
+    @pytest.fixture
+    def app(self):
+        app = flask.Flask(__name__)
+        app.add_url_rule("/library/<uuid>/eligibility", "library_eligibility")
+        app.add_url_rule("/library/<uuid>/focus", "library_focus")
+        return app
+
+    def test_run(self, db: DatabaseTransactionFixture, app):
+        production = db.library(name="Production")
+        hidden = db.library(name="Hidden", registry_stage=Library.TESTING_STAGE)
+        ConfigurationSetting.sitewide(db.session, Configuration.BASE_URL).value = (
+            "https://registry.example.org/"
+        )
+
+        output = BytesIO()
+        script = ExportLibrariesScript(db.session, app=app)
+        script.run(cmd_args=["--order", "name"], output=output)
+        entries = [json.loads(line) for line in output.getvalue().splitlines()]
+        assert [entry["metadata"]["id"] for entry in entries] == [
+            hidden.internal_urn,
+            production.internal_urn,
+        ]
+
+        # Links to the registry's own endpoints use the configured base URL.
+        focus_url = (
+            f"https://registry.example.org/library/{production.internal_urn}/focus"
+        )
+        assert focus_url in [link["href"] for link in entries[1]["links"]]
+
+        output = BytesIO()
+        script.run(
+            cmd_args=[
+                "--gzip",
+                "--availability=production",
+                "--include",
+                "collection_summaries",
+                "--base-url",
+                "http://localhost/",
+            ],
+            output=output,
+        )
+        [line] = gzip.decompress(output.getvalue()).splitlines()
+        entry = json.loads(line)
+        assert entry["metadata"]["id"] == production.internal_urn
+        assert entry["metadata"]["collection_summaries"] == []
+        assert any(
+            link["href"].startswith("http://localhost/library/")
+            for link in entry["links"]
+        )
+
+
 class TestConfigureSiteScript:
     def test_settings(self, db: DatabaseTransactionFixture):
         script = ConfigureSiteScript()
@@ -385,6 +530,317 @@ class TestRegistrationRefreshScript:
         assert isinstance(registrar, LibraryRegistrar)
         assert registrar._db == db.session
 
+    def test_run_concurrently(self, db: DatabaseTransactionFixture):
+        libraries = {
+            i: SimpleNamespace(
+                id=i,
+                name=f"Library {i}",
+                authentication_url=f"https://{host}/library{i}/authentication",
+                refresh_record=None,
+            )
+            for i, host in enumerate(["a.org"] * 4 + ["b.org"] * 2 + ["c.org"])
+        }
+
+        class MockSession:
+            def __init__(self):
+                self.committed = self.rolled_back = 0
+                self.closed = False
+
+            def get(self, model, id):
+                return libraries[id]
+
+            def commit(self):
+                self.committed += 1
+
+            def rollback(self):
+                self.rolled_back += 1
+
+            def close(self):
+                self.closed = True
+
+        lock = threading.Lock()
+        running = Counter()
+        most_running = Counter()
+
+        executors = set()
+
+        class MockRegistrar:
+            def __init__(self, _db, executor):
+                self._db = _db
+                executors.add(executor)
+
+            def reregister(self, library):
+                host = HostConcurrencyLimiter.host(library.authentication_url)
+                with lock:
+                    running[host] += 1
+                    most_running[host] = max(most_running[host], running[host])
+                time.sleep(0.01)
+                with lock:
+                    running[host] -= 1
+                if library.id == 5:
+                    return INVALID_INTEGRATION_DOCUMENT
+                if library.id == 6:
+                    raise Exception("crash")
+                return None
+
+        sessions = []
+
+        class MockScript(RegistrationRefreshScript):
+            def libraries(self, library_name):
+                return list(libraries.values())
+
+            def worker_session(self):
+                session = MockSession()
+                sessions.append(session)
+                return session
+
+            def registrar_for(self, _db, executor=None):
+                return MockRegistrar(_db, executor)
+
+        script = MockScript(db.session)
+        result = script.run(cmd_args=["--concurrency=4", "--per-host-limit=1"])
+
+        # Every library was refreshed; one failed and one crashed.
+        assert result == (5, 2)
+
+        # No more than one library on any host was refreshed at once.
+        assert most_running["a.org"] == 1
+        assert most_running["b.org"] == 1
+
+        # Each worker had its own session. Failures were rolled back,
+        # and then every outcome was recorded and committed.
+        assert 1 <= len(sessions) <= 4
+        assert sum(x.committed for x in sessions) == 7
+        assert sum(x.rolled_back for x in sessions) == 2
+        assert all(x.closed for x in sessions)
+        assert libraries[0].refresh_record.consecutive_failures == 0
+        assert libraries[5].refresh_record.consecutive_failures == 1
+        assert (
+            libraries[5].refresh_record.last_problem_uri
+            == INVALID_INTEGRATION_DOCUMENT.uri
+        )
+        assert libraries[6].refresh_record.last_problem_uri == INTEGRATION_ERROR.uri
+
+        # Linked documents were fetched by a pool as big as the pool of
+        # workers, not by the registrar's shared pool.
+        [executor] = executors
+        assert executor is not LibraryRegistrar.shared_executor()
+        assert executor._max_workers == 4
+
+    def test_run_rolls_back_failure(self):
+        # When a refresh fails, whatever it changed is rolled back before
+        # the failure is recorded and committed.
+        libraries = [
+            SimpleNamespace(
+                id=i,
+                name=f"Library {i}",
+                authentication_url=f"https://library{i}.org/authentication",
+                refresh_record=None,
+            )
+            for i in range(2)
+        ]
+
+        class MockSession:
+            # Commits save the library names; rollbacks restore them.
+            def __init__(self):
+                self.committed = {}
+                self.calls = []
+                self.commit()
+
+            def commit(self):
+                self.calls.append("commit")
+                self.committed = {x.id: x.name for x in libraries}
+
+            def rollback(self):
+                self.calls.append("rollback")
+                for library in libraries:
+                    library.name = self.committed[library.id]
+
+        class MockRegistrar:
+            def reregister(self, library):
+                library.name = "Changed"
+                if library.id == 1:
+                    return INVALID_INTEGRATION_DOCUMENT
+
+        class MockScript(RegistrationRefreshScript):
+            def libraries(self, library_name):
+                return libraries
+
+            @property
+            def registrar(self):
+                return MockRegistrar()
+
+        session = MockSession()
+        script = MockScript(session)
+        assert script.run(cmd_args=[]) == (1, 1)
+
+        # The successful refresh's change was committed; the failed one's
+        # was rolled back.
+        assert session.committed == {0: "Changed", 1: "Library 1"}
+        assert session.calls == ["commit", "commit", "rollback", "commit"]
+
+        # Both outcomes were still recorded.
+        assert libraries[0].refresh_record.consecutive_failures == 0
+        assert libraries[1].refresh_record.consecutive_failures == 1
+        assert (
+            libraries[1].refresh_record.last_problem_uri
+            == INVALID_INTEGRATION_DOCUMENT.uri
+        )
+
+    def test_run_with_budget(self, db: DatabaseTransactionFixture):
+        library1 = db.library()
+        library2 = db.library()
+        library3 = db.library()
+        reregistered = []
+
+        class MockRegistrar:
+            def reregister(self, library):
+                reregistered.append(library)
+                if library is library2:
+                    return INVALID_INTEGRATION_DOCUMENT
+
+        class MockScript(RegistrationRefreshScript):
+            now = 0
+
+            def clock(self):
+                # Each look at the clock takes ten seconds.
+                self.now += 10
+                return self.now
+
+            def libraries_by_staleness(self):
+                return [library1, library2, library3]
+
+            @property
+            def registrar(self):
+                return MockRegistrar()
+
+        # The budget is used up before the third library is started.
+        script = MockScript(db.session)
+        assert script.run(cmd_args=["--budget=25"]) == (1, 1)
+        assert reregistered == [library1, library2]
+
+        # The outcome of each refresh was recorded.
+        assert library1.refresh_record.last_success is not None
+        assert library2.refresh_record.consecutive_failures == 1
+        assert library2.refresh_record.retry_after is not None
+        assert library3.refresh_record is None
+
+        # Worker threads don't start any libraries once the budget is
+        # used up either.
+        reregistered.clear()
+        script.worker_session = lambda: SimpleNamespace(close=lambda: None)
+        result = script.refresh_concurrently(
+            [library1, library2, library3], 2, 1, deadline=script.now
+        )
+        assert result == (0, 0)
+        assert reregistered == []
+
+    def test_libraries_by_staleness(self, db: DatabaseTransactionFixture):
+        stale = db.library()
+        fresh = db.library()
+        LibraryRefresh.record(fresh)
+        LibraryRefresh.record(stale, now=utc_now() - datetime.timedelta(days=1))
+        script = RegistrationRefreshScript(db.session)
+        ordered = [x for x in script.libraries_by_staleness() if x in (stale, fresh)]
+        assert ordered == [stale, fresh]
+
+
+class TestHostConcurrencyLimiter:
+    def test_host(self):
+        m = HostConcurrencyLimiter.host
+        assert m("https://Library.org:8080/auth") == "library.org"
+        assert m(None) == ""
+
+    def test_interleave(self):
+        urls = [
+            "http://a/1",
+            "http://a/2",
+            "http://a/3",
+            "http://b/1",
+            "http://c/1",
+            "http://b/2",
+        ]
+        assert HostConcurrencyLimiter.interleave(urls, lambda x: x) == [
+            "http://a/1",
+            "http://b/1",
+            "http://c/1",
+            "http://a/2",
+            "http://b/2",
+            "http://a/3",
+        ]
+
+    def test_hold(self):
+        limiter = HostConcurrencyLimiter(2)
+        lock = threading.Lock()
+        running = []
+        most_running = []
+
+        def work(url):
+            with limiter.hold(url):
+                with lock:
+                    running.append(url)
+                    most_running.append(len(running))
+                time.sleep(0.01)
+                with lock:
+                    running.remove(url)
+
+        threads = [
+            threading.Thread(target=work, args=(f"http://a/{i}",)) for i in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert max(most_running) == 2
+
+
+class TestRunRegistrationJobsScript:
+    def test_run(self, db: DatabaseTransactionFixture):
+        ConfigurationSetting.sitewide(db.session, Configuration.BASE_URL).value = (
+            "http://registry.org/"
+        )
+        pending, ignore = create(
+            db.session,
+            RegistrationJob,
+            authentication_url="http://a.org/",
+            base_url="http://elsewhere.org/",
+        )
+        no_base_url, ignore = create(
+            db.session, RegistrationJob, authentication_url="http://b.org/"
+        )
+        finished, ignore = create(
+            db.session, RegistrationJob, authentication_url="http://c.org/"
+        )
+        finished.finish(200, "application/json", "{}")
+
+        ran = []
+
+        class MockController:
+            def run_registration_job(self, job_id, _db, url_for):
+                ran.append((job_id, _db, url_for("registration_job", token="t")))
+
+        sessions = []
+
+        class MockScript(RunRegistrationJobsScript):
+            def worker_session(self):
+                session = SimpleNamespace(close=lambda: None)
+                sessions.append(session)
+                return session
+
+        app = flask.Flask(__name__)
+        app.add_url_rule("/register/jobs/<token>", "registration_job")
+        app.library_registry = SimpleNamespace(registry_controller=MockController())
+        count = MockScript(db.session, app=app).run([])
+
+        # Each unfinished job was run in a session of its own, building
+        # URLs for the URL the registration was sent to, or the site's
+        # base URL.
+        assert count == 2
+        assert ran == [
+            (pending.id, sessions[0], "http://elsewhere.org/register/jobs/t"),
+            (no_base_url.id, sessions[1], "http://registry.org/register/jobs/t"),
+        ]
+
 
 class TestSetCoverageAreaScript:
     def test_argument_parsing(self, db: DatabaseTransactionFixture):
@@ -509,6 +965,7 @@ class TestConfigureVendorIDScript:
             "--node-value=abc12",
             "--delegate=http://server1/AdobeAuth/",
             "--delegate=http://server2/AdobeAuth/",
+            "--local-first",
         ]
         script = ConfigureVendorIDScript(db.session)
         script.do_run(db.session, cmd_args=cmd_args)
@@ -527,6 +984,7 @@ class TestConfigureVendorIDScript:
         assert integration.setting(
             Configuration.ADOBE_VENDOR_ID_DELEGATE_URL
         ).json_value == ["http://server1/AdobeAuth/", "http://server2/AdobeAuth/"]
+        assert Configuration.vendor_id_local_first(db.session) is True
 
         # It's okay to configure without a delegate.
         cmd_args = [
@@ -551,6 +1009,7 @@ class TestConfigureVendorIDScript:
             integration.setting(Configuration.ADOBE_VENDOR_ID_DELEGATE_URL).json_value
             == []
         )
+        assert Configuration.vendor_id_local_first(db.session) is False
 
         # The script won't run if --node-value or --delegate have obviously
         # wrong values.
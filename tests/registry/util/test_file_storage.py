@@ -3,17 +3,28 @@ import io
 import os
 from unittest.mock import MagicMock, patch
 
+import pytest
 import requests
+from botocore.exceptions import ClientError
+from PIL import Image
 
 from palace.registry.config import Configuration
 from palace.registry.util.file_storage import (
     FileObject,
+    FileStorage,
+    InvalidImage,
     LibraryLogoStore,
     S3FileStorage,
 )
 from tests.fixtures.database import DatabaseTransactionFixture
 
 
+def image_data(size, mode="RGB", format="PNG"):
+    buffer = io.BytesIO()
+    Image.new(mode, size).save(buffer, format=format)
+    return buffer.getvalue()
+
+
 class TestS3FileStorage:
     def test_config(self):
         with patch.dict(
@@ -27,6 +38,36 @@ class TestS3FileStorage:
 
         assert storage.client._endpoint.host == "http://localhost"
 
+    def test_metadata(self):
+        with patch.dict(
+            os.environ,
+            {
+                Configuration.AWS_S3_BUCKET_NAME: "bucket",
+                Configuration.AWS_S3_ENDPOINT_URL: "http://localhost",
+            },
+        ):
+            storage = S3FileStorage()
+        storage.client = MagicMock()
+
+        storage.client.head_object.return_value = {"Metadata": {"key": "value"}}
+        assert storage.metadata("a-file") == {"key": "value"}
+        storage.client.head_object.assert_called_once_with(
+            Key="a-file", Bucket="bucket"
+        )
+
+        # There's no metadata for a file that doesn't exist.
+        storage.client.head_object.side_effect = ClientError(
+            {"Error": {"Code": "404"}}, "HeadObject"
+        )
+        assert storage.metadata("a-file") is None
+
+        # Other errors are not handled.
+        storage.client.head_object.side_effect = ClientError(
+            {"Error": {"Code": "403"}}, "HeadObject"
+        )
+        with pytest.raises(ClientError):
+            storage.metadata("a-file")
+
     def test_write_and_delete(self):
         """Test the writing to the storage.
         This will require an accessible MiniO, it does not mock the interface.
@@ -89,6 +130,88 @@ class TestLibraryLogoStore:
         response = requests.get(path2)
         assert response.content == b"differentdata..."
 
+    def test_write_image(self, db: DatabaseTransactionFixture):
+        library = db.library()
+        path = LibraryLogoStore.logo_path(library, "png")
+        storage = MagicMock()
+        storage.file_object.return_value = FileObject(path, "bucket", "s3")
+        storage.write.return_value = FileObject(path, "bucket", "s3")
+        storage.get_link.return_value = "http://bucket/logo.png"
+        data = image_data((10, 10))
+        source_hash = LibraryLogoStore.source_hash(data)
+
+        with patch.object(FileStorage, "default_storage", storage):
+            # There's no logo yet, so one is made and uploaded.
+            storage.metadata.return_value = None
+            assert (
+                LibraryLogoStore.write_image(library, data) == "http://bucket/logo.png"
+            )
+            [call] = storage.write.call_args_list
+            assert call.args[0] == path
+            assert call.args[1].read().startswith(b"\x89PNG")
+            assert call.kwargs["content_type"] == "image/png"
+            assert call.kwargs["metadata"] == {
+                LibraryLogoStore.SOURCE_HASH_KEY: source_hash
+            }
+
+            # Any logo left at a path used before logos were always
+            # PNGs is deleted.
+            assert [x.args for x in storage.delete.call_args_list] == [
+                (LibraryLogoStore.logo_path(library, "jpg"),),
+                (LibraryLogoStore.logo_path(library, "jpeg"),),
+            ]
+
+            # The stored logo was made from this image, so it's not
+            # uploaded again.
+            storage.write.reset_mock()
+            storage.delete.reset_mock()
+            storage.metadata.return_value = {
+                LibraryLogoStore.SOURCE_HASH_KEY: source_hash
+            }
+            assert (
+                LibraryLogoStore.write_image(library, data) == "http://bucket/logo.png"
+            )
+            assert storage.write.call_count == 0
+            assert storage.delete.call_count == 0
+            storage.metadata.assert_called_with(path)
+
+            # A different image replaces it.
+            other = image_data((20, 20))
+            LibraryLogoStore.write_image(library, other)
+            [call] = storage.write.call_args_list
+            assert call.kwargs["metadata"] == {
+                LibraryLogoStore.SOURCE_HASH_KEY: LibraryLogoStore.source_hash(other)
+            }
+
+    def test_thumbnail(self):
+        # A large image is scaled down, keeping its proportions.
+        thumbnail = Image.open(LibraryLogoStore.thumbnail(image_data((1200, 600))))
+        assert thumbnail.format == "PNG"
+        assert thumbnail.size == (300, 150)
+
+        # A small image keeps its size.
+        thumbnail = Image.open(LibraryLogoStore.thumbnail(image_data((30, 60))))
+        assert thumbnail.size == (30, 60)
+
+        # Images are converted to a mode that can be stored as a PNG.
+        cmyk = image_data((400, 400), mode="CMYK", format="JPEG")
+        thumbnail = Image.open(LibraryLogoStore.thumbnail(cmyk))
+        assert thumbnail.format == "PNG"
+        assert thumbnail.mode == "RGBA"
+        assert thumbnail.size == (300, 300)
+
+        with pytest.raises(InvalidImage):
+            LibraryLogoStore.thumbnail(b"not an image")
+
+    def test_source_hash(self):
+        # The hash depends on the image and on the version of the
+        # process that made the logo.
+        hash1 = LibraryLogoStore.source_hash(b"image")
+        assert hash1 == LibraryLogoStore.source_hash(b"image")
+        assert hash1 != LibraryLogoStore.source_hash(b"other image")
+        with patch.object(LibraryLogoStore, "PIPELINE_VERSION", "2"):
+            assert hash1 != LibraryLogoStore.source_hash(b"image")
+
     def test_logo_path(self, db: DatabaseTransactionFixture):
         library = db.library()
         # internal urn has the format urn:uuid:xxx, we only put
@@ -98,19 +221,17 @@ class TestLibraryLogoStore:
             == f"logo/{library.internal_urn.split(':', 2)[2]}.jpeg"
         )
 
-    @patch("palace.registry.util.file_storage.LibraryLogoStore.write")
+    @patch("palace.registry.util.file_storage.LibraryLogoStore.write_image")
     def test_write_from_b64(
-        self, mock_write: MagicMock, db: DatabaseTransactionFixture
+        self, mock_write_image: MagicMock, db: DatabaseTransactionFixture
     ):
         library = db.library()
         encoded = base64.b64encode(b"someimagedata")
         data = f"data:image/png;base64,{encoded.decode()}"
         LibraryLogoStore.write_from_b64(library, data)
 
-        args = mock_write.call_args_list[0]
-        assert args[0][0] == library
-        assert args[0][1].read() == b"someimagedata"
-        assert args[1]["format"] == "image/png"
+        # An encoded image goes through the same process as a linked image.
+        mock_write_image.assert_called_once_with(library, b"someimagedata")
 
     @patch("palace.registry.util.file_storage.LibraryLogoStore.write")
     def test_write_from_b64_no_match(
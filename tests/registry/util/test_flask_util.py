@@ -3,10 +3,11 @@ import ipaddress
 import re
 
 import pytest
-from flask import Flask, Response, request
+from flask import Flask, Response, jsonify, request
 
 from palace.registry.util.flask_util import (
     IPV4_REGEX,
+    RegistryJSONProvider,
     deprecated,
     is_public_ipv4_address,
     originating_ip,
@@ -312,3 +313,40 @@ class TestDeprecated:
         naive = datetime.datetime(2025, 6, 1)
         with pytest.raises(ValueError, match="timezone-aware"):
             deprecated(**{kwarg: naive})
+
+
+class TestRegistryJSONProvider:
+    def test_jsonify(self, generic_app_obj):
+        """jsonify output is the same as with Flask's default provider."""
+        document = dict(
+            name="Bibliothèque 📚",
+            timestamp=datetime.datetime(2024, 3, 15, 10, 30, tzinfo=datetime.UTC),
+            numbers=[3, 2, 1],
+        )
+        with generic_app_obj.app_context():
+            expected = jsonify(**document)
+            generic_app_obj.json = RegistryJSONProvider(generic_app_obj)
+            actual = jsonify(**document)
+
+        assert actual.mimetype == expected.mimetype
+        assert actual.get_data() == expected.get_data()
+        assert actual.json["timestamp"] == "Fri, 15 Mar 2024 10:30:00 GMT"
+        # Keys are sorted and non-ASCII characters escaped, as Flask does
+        # by default.
+        assert actual.get_data().index(b"name") < actual.get_data().index(b"numbers")
+        assert b"Biblioth\\u00e8que \\ud83d\\udcda" in actual.get_data()
+
+    def test_jsonify_debug(self, generic_app_obj):
+        """In debug mode jsonify output is pretty-printed, as Flask does."""
+        generic_app_obj.debug = True
+        with generic_app_obj.app_context():
+            expected = jsonify(a=1)
+            generic_app_obj.json = RegistryJSONProvider(generic_app_obj)
+            actual = jsonify(a=1)
+        assert actual.get_data() == expected.get_data() == b'{\n  "a": 1\n}\n'
+
+    def test_dumps(self, generic_app_obj):
+        # dumps() is Flask's own.
+        provider = RegistryJSONProvider(generic_app_obj)
+        assert provider.dumps({"b": 1, "a": "é"}) == '{"a": "\\u00e9", "b": 1}'
+        assert provider.dumps({"a": 1}, indent=2) == '{\n  "a": 1\n}'
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from palace.registry.util.http_client import (
+    ConnectionStats,
+    DNSCache,
+    HTTPClient,
+    HTTPClientSettings,
+)
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # Status codes to send, one per request, before falling back to 200.
+    statuses: list[int] = []
+
+    def do_GET(self):
+        status = self.statuses.pop(0) if self.statuses else 200
+        body = self.path.encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Set-Cookie", "session=abc")
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    KeepAliveHandler.statuses = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def server_url(server, path="/"):
+    host, port = server.server_address
+    return f"http://{host}:{port}{path}"
+
+
+class TestHTTPClientSettings:
+    def test_from_environment(self, monkeypatch):
+        # With nothing in the environment, the defaults are used.
+        for name in (
+            HTTPClientSettings.POOL_CONNECTIONS_ENVIRONMENT_VARIABLE,
+            HTTPClientSettings.POOL_MAXSIZE_ENVIRONMENT_VARIABLE,
+            HTTPClientSettings.RETRIES_ENVIRONMENT_VARIABLE,
+            HTTPClientSettings.BACKOFF_FACTOR_ENVIRONMENT_VARIABLE,
+            HTTPClientSettings.DNS_CACHE_TTL_ENVIRONMENT_VARIABLE,
+        ):
+            monkeypatch.delenv(name, raising=False)
+        assert HTTPClientSettings.from_environment() == HTTPClientSettings()
+
+        monkeypatch.setenv(HTTPClientSettings.POOL_MAXSIZE_ENVIRONMENT_VARIABLE, "20")
+        monkeypatch.setenv(HTTPClientSettings.RETRIES_ENVIRONMENT_VARIABLE, "0")
+        monkeypatch.setenv(
+            HTTPClientSettings.BACKOFF_FACTOR_ENVIRONMENT_VARIABLE, "0.1"
+        )
+        # An invalid value is ignored.
+        monkeypatch.setenv(
+            HTTPClientSettings.DNS_CACHE_TTL_ENVIRONMENT_VARIABLE, "forever"
+        )
+        settings = HTTPClientSettings.from_environment()
+        assert settings.pool_maxsize == 20
+        assert settings.retries == 0
+        assert settings.backoff_factor == 0.1
+        assert settings.dns_cache_ttl == HTTPClientSettings().dns_cache_ttl
+
+    def test_retry(self):
+        retry = HTTPClientSettings(retries=3, backoff_factor=2).retry()
+        assert retry.connect == 3
+        assert retry.status == 3
+        assert retry.backoff_factor == 2
+
+        # A request that has been sent is not retried because it timed out.
+        assert retry.read == 0
+        assert retry.raise_on_status is False
+        assert 503 in retry.status_forcelist
+
+
+class TestDNSCache:
+    def test_resolve(self, monkeypatch):
+        lookups = []
+
+        def getaddrinfo(host, port, type=0):
+            lookups.append(host)
+            return [(socket.AF_INET, type, 6, "", (f"10.0.0.{len(lookups)}", port))]
+
+        monkeypatch.setattr(socket, "getaddrinfo", getaddrinfo)
+        now = [0.0]
+        cache = DNSCache(ttl=60, clock=lambda: now[0])
+
+        assert cache.resolve("example.com", 443) == "10.0.0.1"
+        assert cache.resolve("example.com", 443) == "10.0.0.1"
+        assert lookups == ["example.com"]
+
+        # Once the TTL has passed, the name is looked up again.
+        now[0] = 61
+        assert cache.resolve("example.com", 443) == "10.0.0.2"
+
+        # A forgotten name is looked up again.
+        cache.forget("example.com", 443)
+        assert cache.resolve("example.com", 443) == "10.0.0.3"
+
+        # Addresses don't need to be looked up.
+        assert cache.resolve("127.0.0.1", 80) is None
+        assert cache.resolve("::1", 80) is None
+        assert len(lookups) == 3
+
+    def test_resolve_failure(self, monkeypatch):
+        def getaddrinfo(*args, **kwargs):
+            raise socket.gaierror("no such host")
+
+        monkeypatch.setattr(socket, "getaddrinfo", getaddrinfo)
+        assert DNSCache(ttl=60).resolve("nowhere.invalid", 80) is None
+
+
+class TestConnectionStats:
+    def test_reused(self):
+        stats = ConnectionStats()
+        for i in range(3):
+            stats.count_request()
+        stats.count_connection()
+        assert stats.as_dict() == dict(requests=3, connections=1, reused=2)
+
+
+class TestHTTPClient:
+    def test_connections_are_reused(self, server):
+        client = HTTPClient()
+        for path in ("/a", "/b", "/c"):
+            response = client.get(server_url(server, path))
+            assert response.status_code == 200
+            assert response.content == path.encode("utf8")
+        response = client.post(server_url(server, "/d"), data=b"payload")
+        assert response.content == b"/d"
+
+        assert client.stats.as_dict() == dict(requests=4, connections=1, reused=3)
+        client.close()
+
+    def test_dns_cache_used_for_new_connections(self, server, monkeypatch):
+        client = HTTPClient()
+        resolved = []
+        resolve = client.dns_cache.resolve
+
+        def record(host, port):
+            resolved.append(host)
+            return resolve(host, port)
+
+        monkeypatch.setattr(client.dns_cache, "resolve", record)
+        port = server.server_address[1]
+        response = client.get(f"http://localhost:{port}/")
+        assert response.status_code == 200
+        assert resolved == ["localhost"]
+        client.close()
+
+    def test_cookies_are_not_kept(self, server):
+        client = HTTPClient()
+        client.get(server_url(server))
+        assert len(client.session.cookies) == 0
+        client.close()
+
+    def test_retries(self, server):
+        KeepAliveHandler.statuses = [503, 503, 200]
+        client = HTTPClient(HTTPClientSettings(retries=2, backoff_factor=0))
+        response = client.get(server_url(server))
+        assert response.status_code == 200
+        assert client.stats.requests == 1
+
+        # Once the retries run out, the last response is returned.
+        KeepAliveHandler.statuses = [503, 503, 503]
+        response = client.get(server_url(server))
+        assert response.status_code == 503
+        client.close()
+
+    def test_session_per_thread(self):
+        client = HTTPClient()
+        session = client.session
+        assert client.session is session
+
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(client.session))
+        thread.start()
+        thread.join()
+        assert sessions[0] is not session
+
+        # Every thread's session uses the same adapter.
+        assert session.get_adapter("https://a.org/") is client.adapter
+        assert sessions[0].get_adapter("http://b.org/") is client.adapter
+        client.close()
+
+    def test_connections_are_shared_between_threads(self, server):
+        client = HTTPClient()
+        for path in ("/a", "/b", "/c"):
+            thread = threading.Thread(
+                target=client.get, args=(server_url(server, path),)
+            )
+            thread.start()
+            thread.join()
+
+        # Each request came from a different thread, but they all used
+        # the same connection.
+        assert client.stats.as_dict() == dict(requests=3, connections=1, reused=2)
+
+        # Once it's closed, the client opens a new connection.
+        client.close()
+        assert client.get(server_url(server)).status_code == 200
+        assert client.stats.connections == 2
+        client.close()
+
+    def test_shared(self):
+        assert HTTPClient.shared() is HTTPClient.shared()
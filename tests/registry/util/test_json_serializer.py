@@ -0,0 +1,82 @@
+import datetime
+import json
+
+import pytest
+from flask_babel import lazy_gettext
+
+from palace.registry.util import json_serializer
+from palace.registry.util.json_serializer import (
+    JSONSerializer,
+    OrjsonSerializer,
+    feed_default,
+    make_serializer,
+)
+
+serializer_classes = [pytest.param(JSONSerializer, id="json")]
+if json_serializer.orjson is not None:
+    serializer_classes.append(pytest.param(OrjsonSerializer, id="orjson"))
+
+
+class TestJSONSerializer:
+    @pytest.mark.parametrize("serializer_class", serializer_classes)
+    def test_dumps(self, serializer_class):
+        serializer = serializer_class()
+        eastern = datetime.timezone(datetime.timedelta(hours=-5))
+        document = {
+            "title": "Bibliothèque",
+            "modified": datetime.datetime(2024, 3, 15, 5, 30, 0, 12, tzinfo=eastern),
+            "naive": datetime.datetime(2024, 3, 15, 10, 30),
+            "date": datetime.date(2024, 3, 15),
+            "count": 3,
+            "links": [{"href": "http://example.com/"}],
+        }
+        data = serializer.dumps(document)
+        assert isinstance(data, bytes)
+        assert json.loads(data) == {
+            "title": "Bibliothèque",
+            "modified": "2024-03-15T10:30:00Z",
+            "naive": "2024-03-15T10:30:00Z",
+            "date": "2024-03-15",
+            "count": 3,
+            "links": [{"href": "http://example.com/"}],
+        }
+        assert serializer.loads(data) == json.loads(data)
+
+    @pytest.mark.parametrize("serializer_class", serializer_classes)
+    def test_sort_keys_and_default(self, serializer_class):
+        serializer = serializer_class(default=lambda obj: "converted", sort_keys=True)
+        data = serializer.dumps({"b": object(), "a": 1})
+        assert data == b'{"a":1,"b":"converted"}'
+
+    @pytest.mark.parametrize("serializer_class", serializer_classes)
+    def test_ensure_ascii(self, serializer_class):
+        document = {"title": "Bibliothèque 📚\x7f", "count": 3}
+        assert serializer_class().dumps(document) == json.dumps(
+            document, ensure_ascii=False, separators=(",", ":")
+        ).encode("utf8")
+        data = serializer_class(ensure_ascii=True).dumps(document)
+        assert data == json.dumps(document, separators=(",", ":")).encode("ascii")
+        assert data == b'{"title":"Biblioth\\u00e8que \\ud83d\\udcda\\u007f","count":3}'
+
+    @pytest.mark.parametrize("serializer_class", serializer_classes)
+    def test_unserializable(self, serializer_class):
+        with pytest.raises(TypeError):
+            serializer_class().dumps({"a": object()})
+
+    def test_feed_default_lazy_string(self):
+        assert feed_default(lazy_gettext("Hello")) == "Hello"
+
+    def test_make_serializer(self):
+        serializer = make_serializer()
+        if json_serializer.orjson is None:
+            assert type(serializer) == JSONSerializer
+        else:
+            assert isinstance(serializer, OrjsonSerializer)
+
+    def test_module_functions_use_configured_serializer(self, monkeypatch):
+        class Mock(JSONSerializer):
+            def dumps(self, obj):
+                return b"mock"
+
+        monkeypatch.setattr(json_serializer, "serializer", Mock())
+        assert json_serializer.dumps({}) == b"mock"
@@ -0,0 +1,60 @@
+import sqlite3
+
+from palace.registry.util.zipcode_index import ZipCodeIndex
+
+
+def make_database(path):
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE simple_zipcode"
+        " (zipcode TEXT, zipcode_type TEXT, major_city TEXT, state TEXT)"
+    )
+    connection.executemany(
+        "INSERT INTO simple_zipcode VALUES (?, ?, ?, ?)",
+        [
+            ("12603", "STANDARD", "Poughkeepsie", "NY"),
+            ("12601", "STANDARD", "Poughkeepsie", "NY"),
+            ("12602", "PO BOX", "Poughkeepsie", "NY"),
+            ("12498", "STANDARD", "Woodstock", "NY"),
+            ("06281", "STANDARD", "Woodstock", "ct"),
+            ("00000", "STANDARD", None, "NY"),
+        ],
+    )
+    connection.commit()
+    connection.close()
+
+
+class TestZipCodeIndex:
+    def test_from_database(self, tmp_path):
+        path = tmp_path / "simple_db.sqlite"
+        make_database(path)
+        index = ZipCodeIndex.from_database(path)
+        assert len(index) == 3
+
+        # ZIP codes come back in order, and only standard ZIP codes are
+        # included.
+        assert index.zip_codes("NY", "Poughkeepsie") == ("12601", "12603")
+
+        # Cities are looked up within a state.
+        assert index.zip_codes("NY", "Woodstock") == ("12498",)
+        assert index.zip_codes("ct", "Woodstock") == ("06281",)
+
+        # City names must match exactly.
+        assert index.zip_codes("NY", "poughkeepsie") == ()
+        assert index.zip_codes("NY", "Nowhere") == ()
+        assert index.zip_codes(None, "Poughkeepsie") == ()
+
+    def test_shared(self, tmp_path, monkeypatch):
+        path = tmp_path / "simple_db.sqlite"
+        make_database(path)
+        monkeypatch.setattr(ZipCodeIndex, "_shared", None)
+        monkeypatch.setattr(
+            ZipCodeIndex, "database_path", classmethod(lambda cls: path)
+        )
+
+        index = ZipCodeIndex.shared()
+        assert index.zip_codes("NY", "Woodstock") == ("12498",)
+
+        # The index is only loaded once.
+        path.unlink()
+        assert ZipCodeIndex.shared() is index
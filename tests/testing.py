@@ -1,5 +1,6 @@
 import json
 import os
+from concurrent.futures import Executor, Future
 from datetime import datetime, timedelta
 from io import BytesIO
 
@@ -603,3 +604,31 @@ class MockPlace:
     @classmethod
     def everywhere(cls, _db):
         return cls.EVERYWHERE
+
+
+class InlineExecutor(Executor):
+    """An Executor that runs each job as soon as it's submitted, on the
+    calling thread, so that jobs run in a predictable order.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        future: Future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class DeferredExecutor:
+    """An Executor that holds on to jobs until it's told to run them."""
+
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.calls.append((fn, args, kwargs))
+
+    def run_all(self):
+        calls, self.calls = self.calls, []
+        return [fn(*args, **kwargs) for fn, args, kwargs in calls]